@@ -72,6 +72,7 @@ Ce module permet de gérer les inventaires de stock avec :
         'views/depreciation_report_views.xml',
         'views/lot_tracking_views.xml',  # Définit action_stock_lot_expiring
         'views/inventory_dashboard_views.xml',  # Dashboard moderne OWL
+        'views/job_queue_views.xml',
         'reports/inventory_report.xml',
         # Menus (AVANT les wizards pour que menu_stockex_reporting existe)
         'views/menus.xml',
@@ -88,6 +89,7 @@ Ce module permet de gérer les inventaires de stock avec :
         'wizards/warehouse_valuation_export_wizard_views.xml',
         'wizards/stock_valuation_date_wizard_views.xml',
         'wizards/initial_stock_wizard_views.xml',
+        'wizards/variance_daily_rebuild_wizard_views.xml',
         # Vues complémentaires
         'views/mobile_templates.xml',
     ],
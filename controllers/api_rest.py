@@ -7,65 +7,328 @@ Fournit des endpoints REST pour l'accès externe aux fonctionnalités d'inventai
 Endpoints disponibles:
 - GET    /api/stockex/inventories - Liste des inventaires
 - GET    /api/stockex/inventories/<id> - Détail d'un inventaire
+- GET    /api/stockex/inventories/<id>/lines - Lignes d'un inventaire (curseur, NDJSON/CSV)
+- GET    /api/stockex/inventories/<id>/validation - Progression de la validation
 - POST   /api/stockex/inventories - Créer un inventaire
 - PUT    /api/stockex/inventories/<id> - Modifier un inventaire
 - DELETE /api/stockex/inventories/<id> - Supprimer un inventaire
 - GET    /api/stockex/products - Liste des produits
 - GET    /api/stockex/locations - Liste des emplacements
+- GET    /api/stockex/kpis - KPIs globaux
+- GET    /api/stockex/metrics - Métriques des appels API (gestionnaires)
 """
 
+import base64
+import csv
+import gzip
+import hashlib
+import io
 import json
 import logging
 import time
-from odoo import http
+from werkzeug.http import http_date
+from odoo import api, fields, http
 from odoo.http import request, Response
 from odoo.addons.stockex.tools.jwt_auth import stockex_jwt_auth
 from odoo.addons.stockex.tools.api_monitoring import stockex_api_monitoring
 
 _logger = logging.getLogger(__name__)
 
+# Champs des lignes d'inventaire exportés par l'API (lus par search_read)
+LINE_EXPORT_FIELDS = [
+    'product_id', 'location_id', 'theoretical_qty', 'product_qty', 'difference',
+    'standard_price', 'difference_value', 'adjustment_state', 'adjustment_move_id',
+]
+# Clés exposées par les listes → champs ORM à lire (projection fields=)
+INVENTORY_API_FIELDS = {
+    'id': [],
+    'name': ['name'],
+    'date': ['date'],
+    'location_id': ['location_id'],
+    'location_name': ['location_id'],
+    'state': ['state'],
+    'state_display': ['state'],
+    'total_lines': [],
+    'total_difference_value': [],
+    'user_id': ['user_id'],
+    'user_name': ['user_id'],
+}
+PRODUCT_API_FIELDS = {
+    'id': [],
+    'code': ['default_code'],
+    'name': ['name'],
+    'category_id': ['categ_id'],
+    'category_name': ['categ_id'],
+    'uom_id': ['uom_id'],
+    'uom_name': ['uom_id'],
+    'standard_price': ['standard_price'],
+    'barcode': ['barcode'],
+}
+LINE_EXPORT_COLUMNS = [
+    'id', 'product_id', 'product_code', 'product_name', 'location_id', 'theoretical_qty',
+    'real_qty', 'difference', 'standard_price', 'difference_value', 'adjustment_state',
+    'adjustment_move_id',
+]
+
 
 class StockexAPIController(http.Controller):
     """Contrôleur API REST pour Stockex."""
     
+    # Taille de page des lignes (JSON) et des lectures du flux NDJSON/CSV
+    _line_page_size = 500
+    _line_stream_page_size = 2000
+    # Corps JSON compressés en gzip à partir de cette taille (octets)
+    _gzip_min_size = 1024
+    
     def _get_user_from_token(self, token):
         """Valide le token API et retourne l'utilisateur."""
         return stockex_jwt_auth.get_user_from_token(token)
     
-    def _json_response(self, data, status=200, endpoint=None, start_time=None):
-        """Retourne une réponse JSON formatée."""
-        # Monitoring
-        if start_time and endpoint:
-            response_time = time.time() - start_time
-            client_ip = request.httprequest.remote_addr
-            stockex_api_monitoring.log_api_call(
-                endpoint=endpoint,
-                method=request.httprequest.method,
-                user_id=request.env.user.id,
-                ip_address=client_ip,
-                status_code=status,
-                response_time=response_time,
-                request_data=dict(request.params)
+    def _get_cors_headers(self):
+        return {
+            'Access-Control-Allow-Origin': request.httprequest.headers.get('Origin', 'http://localhost:8069'),
+            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match, If-Modified-Since',
+            'Access-Control-Allow-Credentials': 'true',
+        }
+    
+    def _get_validator(self, sources, *extra):
+        """Validateur HTTP (ETag faible, Last-Modified) des données d'une réponse.
+        
+        Une agrégation max(write_date) + count par (modèle, domaine) : toute
+        création, modification ou suppression dans le domaine change l'ETag,
+        sans lire ni sérialiser les enregistrements.
+        
+        Args:
+            sources: liste de (modèle, domaine) lus par la réponse
+            extra: autres valeurs dont dépend la réponse (ex: date du jour)
+        
+        Returns:
+            tuple (ETag, date de dernière modification ou None)
+        """
+        parts = [request.httprequest.full_path, request.env.uid, request.env.company.id, request.env.lang]
+        parts += [str(value) for value in extra]
+        last_modified = None
+        for model, domain in sources:
+            [(max_write_date, count)] = request.env[model]._read_group(
+                domain, aggregates=['write_date:max', '__count']
             )
+            parts += [model, count, max_write_date]
+            if max_write_date and (not last_modified or max_write_date > last_modified):
+                last_modified = max_write_date
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+        return f'W/"{digest}"', last_modified
+    
+    def _is_not_modified(self, etag, last_modified):
+        """Vrai si la copie du client (If-None-Match / If-Modified-Since) est à jour."""
+        if_none_match = request.httprequest.headers.get('If-None-Match')
+        if if_none_match:
+            # Comparaison faible : W/"x" et "x" désignent la même représentation
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            return '*' in tags or etag.removeprefix('W/') in tags
+        if_modified_since = request.httprequest.if_modified_since
+        if if_modified_since and last_modified:
+            return last_modified.replace(microsecond=0) <= if_modified_since.replace(tzinfo=None)
+        return False
+    
+    def _get_cache_headers(self, etag, last_modified):
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache', 'Vary': 'Accept-Encoding'}
+        if last_modified:
+            headers['Last-Modified'] = http_date(last_modified)
+        return headers
+    
+    def _log_api_call(self, status, start_time, endpoint=None, bytes_out=0):
+        """Mesure de l'appel : ajout au tampon du monitoring, sans écriture en base."""
+        if not start_time:
+            return
+        url_rule = request.httprequest.url_rule
+        stockex_api_monitoring.log_api_call(
+            endpoint=endpoint or (url_rule.rule if url_rule else request.httprequest.path),
+            method=request.httprequest.method,
+            status_code=status,
+            response_time=time.time() - start_time,
+            bytes_out=bytes_out,
+        )
+    
+    def _not_modified_response(self, etag, last_modified, start_time=None):
+        """Réponse 304 : le corps n'est ni construit ni sérialisé."""
+        headers = self._get_cors_headers()
+        headers.update(self._get_cache_headers(etag, last_modified))
+        self._log_api_call(304, start_time)
+        return Response(status=304, headers=headers)
+    
+    def _json_response(self, data, status=200, endpoint=None, start_time=None, etag=None, last_modified=None):
+        """Retourne une réponse JSON formatée.
+        
+        Avec un ETag (voir _get_validator), la réponse porte les en-têtes de
+        revalidation ; les corps volumineux sont compressés en gzip si le
+        client l'accepte. Avec start_time, l'appel est mesuré par le
+        monitoring (endpoint par défaut : motif de la route).
+        """
+        headers = self._get_cors_headers()
+        if etag:
+            headers.update(self._get_cache_headers(etag, last_modified))
+        
+        body = json.dumps(data, default=str, ensure_ascii=False).encode('utf-8')
+        if len(body) >= self._gzip_min_size and 'gzip' in (request.httprequest.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body, compresslevel=6)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+        
+        # Monitoring
+        self._log_api_call(status, start_time, endpoint, len(body))
         
         return Response(
-            json.dumps(data, default=str, ensure_ascii=False),
+            body,
             status=status,
             mimetype='application/json',
-            headers={
-                'Access-Control-Allow-Origin': request.httprequest.headers.get('Origin', 'http://localhost:8069'),
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-                'Access-Control-Allow-Credentials': 'true',
-            }
+            headers=headers,
+        )
+    
+    def _get_projection(self, params, available):
+        """Clés demandées par fields=a,b (toutes par défaut, id toujours inclus).
+        
+        Returns:
+            tuple (clés de sortie, champs ORM à lire)
+        """
+        requested = [key.strip() for key in (params.get('fields') or '').split(',') if key.strip()]
+        unknown = [key for key in requested if key not in available]
+        if unknown:
+            raise ValueError(f"Champs inconnus: {', '.join(unknown)}")
+        keys = ['id'] + [key for key in (requested or available) if key != 'id']
+        return keys, sorted({name for key in keys for name in available[key]})
+    
+    def _encode_cursor(self, values):
+        """Curseur opaque de pagination (valeurs de tri du dernier élément)."""
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+    
+    def _decode_cursor(self, cursor):
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            raise ValueError("Curseur invalide")
+    
+    def _get_page_limit(self, params):
+        # Limiter la pagination à 1000 enregistrements max
+        return max(1, min(int(params.get('limit', 100)), 1000))
+    
+    def _get_inventory_data(self, env, inventory, include_lines=True):
+        """Détail d'un inventaire ; nombre de lignes et écart total en une agrégation.
+        
+        Avec include_lines, la première page de lignes seulement : la suite
+        via /lines?after_id=<lines_next_cursor>.
+        """
+        [(count, value)] = env['stockex.stock.inventory.line']._read_group(
+            [('inventory_id', '=', inventory.id)], aggregates=['__count', 'difference_value:sum'],
+        )
+        data = {
+            'id': inventory.id,
+            'name': inventory.name,
+            'date': inventory.date.isoformat() if inventory.date else None,
+            'location_id': inventory.location_id.id,
+            'location_name': inventory.location_id.complete_name,
+            'state': inventory.state,
+            'state_display': dict(inventory._fields['state'].selection).get(inventory.state),
+            'total_lines': count,
+            'total_difference_value': value or 0.0,
+            'user_id': inventory.user_id.id,
+            'user_name': inventory.user_id.name,
+            'company_id': inventory.company_id.id,
+            'company_name': inventory.company_id.name,
+            'validation_progress': inventory.validation_progress,
+            'validation_job_state': inventory.validation_job_state or None,
+        }
+        if include_lines:
+            limit = self._line_page_size
+            data['lines'] = self._read_lines_page(env, inventory.id, 0, limit)
+            data['lines_next_cursor'] = data['lines'][-1]['id'] if len(data['lines']) == limit else None
+        return data
+    
+    def _read_lines_page(self, env, inventory_id, after_id=0, limit=500):
+        """Page de lignes d'inventaire d'id supérieur à after_id (pagination par clé).
+        
+        Une lecture groupée des lignes et une des produits par page, quelle
+        que soit la position de la page (pas d'OFFSET).
+        
+        Returns:
+            list de dicts (clés LINE_EXPORT_COLUMNS), triés par id
+        """
+        lines = env['stockex.stock.inventory.line'].search_read(
+            [('inventory_id', '=', inventory_id), ('id', '>', after_id)],
+            LINE_EXPORT_FIELDS,
+            order='id',
+            limit=limit,
         )
+        product_ids = list({line['product_id'][0] for line in lines if line['product_id']})
+        products = {
+            product['id']: product
+            for product in env['product.product'].with_context(active_test=False).search_read(
+                [('id', 'in', product_ids)], ['default_code', 'name']
+            )
+        }
+        rows = []
+        for line in lines:
+            product = products.get(line['product_id'][0], {}) if line['product_id'] else {}
+            rows.append({
+                'id': line['id'],
+                'product_id': product.get('id'),
+                'product_code': product.get('default_code') or None,
+                'product_name': product.get('name'),
+                'location_id': line['location_id'][0] if line['location_id'] else None,
+                'theoretical_qty': line['theoretical_qty'],
+                'real_qty': line['product_qty'],
+                'difference': line['difference'],
+                'standard_price': line['standard_price'],
+                'difference_value': line['difference_value'],
+                'adjustment_state': line['adjustment_state'] or None,
+                'adjustment_move_id': line['adjustment_move_id'][0] if line['adjustment_move_id'] else None,
+            })
+        return rows
+    
+    def _stream_lines(self, inventory_id, after_id, fmt, page_size):
+        """Générateur NDJSON/CSV des lignes, page par page.
+        
+        La réponse est écrite après la fin de la requête : le générateur ouvre
+        son propre curseur. Les pages sont lues dans une même transaction
+        (instantané cohérent) et le cache est vidé entre deux pages, la
+        mémoire du worker reste donc bornée par la taille d'une page.
+        """
+        registry = request.env.registry
+        uid, context = request.env.uid, dict(request.env.context)
+        
+        def generate():
+            with registry.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                if fmt == 'csv':
+                    buffer = io.StringIO()
+                    writer = csv.DictWriter(buffer, fieldnames=LINE_EXPORT_COLUMNS)
+                    writer.writeheader()
+                    yield buffer.getvalue().encode('utf-8')
+                last_id = after_id
+                while True:
+                    rows = self._read_lines_page(env, inventory_id, last_id, page_size)
+                    if fmt == 'csv':
+                        buffer = io.StringIO()
+                        writer = csv.DictWriter(buffer, fieldnames=LINE_EXPORT_COLUMNS)
+                        writer.writerows(rows)
+                        chunk = buffer.getvalue()
+                    else:
+                        chunk = ''.join(json.dumps(row, default=str, ensure_ascii=False) + '\n' for row in rows)
+                    if chunk:
+                        yield chunk.encode('utf-8')
+                    if len(rows) < page_size:
+                        break
+                    last_id = rows[-1]['id']
+                    env.invalidate_all()
+        
+        return generate()
     
-    def _error_response(self, message, status=400):
+    def _error_response(self, message, status=400, start_time=None):
         """Retourne une réponse d'erreur JSON."""
         return self._json_response({
             'error': True,
             'message': message
-        }, status=status)
+        }, status=status, start_time=start_time)
     
     # ========== INVENTAIRES ==========
     
@@ -78,13 +341,16 @@ class StockexAPIController(http.Controller):
             - location_id: Filtrer par emplacement
             - date_from: Date début (YYYY-MM-DD)
             - date_to: Date fin (YYYY-MM-DD)
-            - limit: Nombre max de résultats (défaut: 100)
-            - offset: Décalage pour pagination (défaut: 0)
+            - limit: Nombre max de résultats (défaut: 100, max: 1000)
+            - cursor: Curseur de la page suivante (next_cursor de la page précédente)
+            - offset: Décalage (ancienne pagination, ignoré si cursor est fourni)
+            - with_total: Inclure le nombre total de résultats (true/false, défaut: false)
+            - fields: Clés à renvoyer, séparées par des virgules (défaut: toutes)
         """
         start_time = time.time()
-        endpoint = '/api/stockex/inventories'
         
         try:
+            Inventory = request.env['stockex.stock.inventory']
             domain = []
             
             if params.get('state'):
@@ -99,105 +365,204 @@ class StockexAPIController(http.Controller):
             if params.get('date_to'):
                 domain.append(('date', '<=', params['date_to']))
             
-            limit = int(params.get('limit', 100))
-            # Limiter la pagination à 1000 enregistrements max
-            if limit > 1000:
-                limit = 1000
-            offset = int(params.get('offset', 0))
-            
-            inventories = request.env['stockex.stock.inventory'].search(
-                domain,
-                limit=limit,
-                offset=offset,
-                order='date desc'
-            )
+            limit = self._get_page_limit(params)
+            offset = 0
+            keys, read_fields = self._get_projection(params, INVENTORY_API_FIELDS)
+            
+            # Pagination par clé sur (date desc, id desc) : coût constant quelle que soit la page
+            page_domain = list(domain)
+            if params.get('cursor'):
+                last_date, last_id = self._decode_cursor(params['cursor'])
+                page_domain += ['|', ('date', '<', last_date), '&', ('date', '=', last_date), ('id', '<', last_id)]
+            else:
+                offset = int(params.get('offset', 0))
+            
+            inventories = Inventory.search(page_domain, limit=limit, offset=offset, order='date desc, id desc')
+            # Le curseur a besoin de la date même si elle n'est pas demandée
+            records = {record['id']: record for record in inventories.read(sorted(set(read_fields) | {'date'}))}
+            
+            totals = {}
+            if {'total_lines', 'total_difference_value'} & set(keys):
+                totals = {
+                    inventory.id: (count, value)
+                    for inventory, count, value in request.env['stockex.stock.inventory.line']._read_group(
+                        [('inventory_id', 'in', inventories.ids)],
+                        ['inventory_id'],
+                        ['__count', 'difference_value:sum'],
+                    )
+                }
+            states = dict(Inventory._fields['state'].selection)
+            
+            rows = []
+            for inventory_id in inventories.ids:
+                record = records[inventory_id]
+                count, value = totals.get(inventory_id, (0, 0.0))
+                row = {
+                    'id': inventory_id,
+                    'name': record.get('name'),
+                    'date': record['date'].isoformat() if record['date'] else None,
+                    'location_id': record['location_id'][0] if record.get('location_id') else None,
+                    'location_name': record['location_id'][1] if record.get('location_id') else None,
+                    'state': record.get('state'),
+                    'state_display': states.get(record.get('state')),
+                    'total_lines': count,
+                    'total_difference_value': value or 0.0,
+                    'user_id': record['user_id'][0] if record.get('user_id') else None,
+                    'user_name': record['user_id'][1] if record.get('user_id') else None,
+                }
+                rows.append({key: row[key] for key in keys})
+            
+            next_cursor = None
+            if len(inventories) == limit:
+                last = records[inventories.ids[-1]]
+                next_cursor = self._encode_cursor([last['date'].isoformat(), last['id']])
             
             data = {
-                'total': request.env['stockex.stock.inventory'].search_count(domain),
                 'limit': limit,
-                'offset': offset,
-                'inventories': [{
-                    'id': inv.id,
-                    'name': inv.name,
-                    'date': inv.date.isoformat() if inv.date else None,
-                    'location_id': inv.location_id.id,
-                    'location_name': inv.location_id.complete_name,
-                    'state': inv.state,
-                    'state_display': dict(inv._fields['state'].selection).get(inv.state),
-                    'total_lines': len(inv.inventory_line_ids),
-                    'total_difference_value': inv.total_difference_value,
-                    'user_id': inv.user_id.id,
-                    'user_name': inv.user_id.name,
-                } for inv in inventories]
+                'next_cursor': next_cursor,
+                'inventories': rows,
             }
+            if offset:
+                data['offset'] = offset
+            if params.get('with_total', 'false').lower() == 'true':
+                data['total'] = Inventory.search_count(domain)
             
-            return self._json_response(data, endpoint=endpoint, start_time=start_time)
+            return self._json_response(data, start_time=start_time)
             
+        except ValueError as e:
+            return self._error_response(str(e), status=400, start_time=start_time)
         except Exception as e:
             _logger.error(f"Erreur API list_inventories: {str(e)}", exc_info=True)
-            response_time = time.time() - start_time
-            client_ip = request.httprequest.remote_addr
-            stockex_api_monitoring.log_api_call(
-                endpoint=endpoint,
-                method='GET',
-                user_id=request.env.user.id,
-                ip_address=client_ip,
-                status_code=500,
-                response_time=response_time,
-                request_data=params
-            )
-            return self._error_response(str(e), status=500)
+            return self._error_response(str(e), status=500, start_time=start_time)
     
     @http.route('/api/stockex/inventories/<int:inventory_id>', type='http', auth='user', methods=['GET'], csrf=False)
     def get_inventory(self, inventory_id, **params):
         """Récupère les détails d'un inventaire spécifique.
         
         Params:
-            - include_lines: Inclure les lignes (true/false, défaut: true)
+            - include_lines: Inclure la première page de lignes (true/false, défaut: true)
         """
+        start_time = time.time()
+        
         try:
             inventory = request.env['stockex.stock.inventory'].browse(inventory_id)
             
             if not inventory.exists():
-                return self._error_response("Inventaire introuvable", status=404)
+                return self._error_response("Inventaire introuvable", status=404, start_time=start_time)
             
             include_lines = params.get('include_lines', 'true').lower() == 'true'
+            data = self._get_inventory_data(request.env, inventory, include_lines)
+            return self._json_response(data, start_time=start_time)
+            
+        except Exception as e:
+            _logger.error(f"Erreur API get_inventory: {str(e)}", exc_info=True)
+            return self._error_response(str(e), status=500, start_time=start_time)
+    
+    @http.route('/api/stockex/inventories/<int:inventory_id>/lines', type='http', auth='user', methods=['GET'], csrf=False)
+    def get_inventory_lines(self, inventory_id, **params):
+        """Lignes d'un inventaire, paginées par clé (id croissant).
+        
+        Params:
+            - after_id: Curseur, id de la dernière ligne reçue (défaut: 0)
+            - limit: Taille de page en JSON (défaut: 500, max: 5000)
+            - format: json (page + next_cursor), ndjson ou csv (flux de
+              toutes les lignes après le curseur)
+        """
+        start_time = time.time()
+        
+        try:
+            inventory = request.env['stockex.stock.inventory'].browse(inventory_id)
+            
+            if not inventory.exists():
+                return self._error_response("Inventaire introuvable", status=404, start_time=start_time)
+            
+            inventory.check_access('read')
+            after_id = int(params.get('after_id') or 0)
+            fmt = params.get('format', 'json')
+            
+            if fmt in ('ndjson', 'csv'):
+                mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+                headers = {'Cache-Control': 'no-store'}
+                if fmt == 'csv':
+                    headers['Content-Disposition'] = f'attachment; filename="inventory_{inventory.id}_lines.csv"'
+                # Flux : durée jusqu'au premier octet, taille inconnue
+                self._log_api_call(200, start_time)
+                return Response(
+                    self._stream_lines(inventory.id, after_id, fmt, self._line_stream_page_size),
+                    mimetype=mimetype,
+                    headers=headers,
+                    direct_passthrough=True,
+                )
+            if fmt != 'json':
+                return self._error_response(f"Format inconnu: {fmt}", status=400, start_time=start_time)
+            
+            limit = max(1, min(int(params.get('limit') or self._line_page_size), 5000))
+            lines = self._read_lines_page(request.env, inventory.id, after_id, limit)
+            data = {
+                'inventory_id': inventory.id,
+                'after_id': after_id,
+                'limit': limit,
+                'count': len(lines),
+                'next_cursor': lines[-1]['id'] if len(lines) == limit else None,
+                'lines': lines,
+            }
+            
+            return self._json_response(data, start_time=start_time)
+            
+        except Exception as e:
+            _logger.error(f"Erreur API get_inventory_lines: {str(e)}", exc_info=True)
+            return self._error_response(str(e), status=500, start_time=start_time)
+    
+    @http.route('/api/stockex/inventories/<int:inventory_id>/validation', type='http', auth='user', methods=['GET'], csrf=False)
+    def get_inventory_validation(self, inventory_id, **params):
+        """Progression de la validation d'un inventaire (à interroger périodiquement).
+        
+        Retourne le pourcentage de lignes traitées, le nombre de lignes par
+        statut d'ajustement, le curseur de reprise et l'état de la tâche de fond.
+        """
+        start_time = time.time()
+        
+        try:
+            inventory = request.env['stockex.stock.inventory'].browse(inventory_id)
+            
+            if not inventory.exists():
+                return self._error_response("Inventaire introuvable", status=404, start_time=start_time)
+            
+            inventory.check_access('read')
+            request.env.cr.execute("""
+                SELECT COALESCE(adjustment_state, 'pending'), COUNT(*)
+                FROM stockex_stock_inventory_line
+                WHERE inventory_id = %s
+                GROUP BY 1
+            """, [inventory.id])
+            counts = dict(request.env.cr.fetchall())
+            job = inventory.validation_job_id
             
             data = {
                 'id': inventory.id,
-                'name': inventory.name,
-                'date': inventory.date.isoformat() if inventory.date else None,
-                'location_id': inventory.location_id.id,
-                'location_name': inventory.location_id.complete_name,
                 'state': inventory.state,
-                'state_display': dict(inventory._fields['state'].selection).get(inventory.state),
-                'total_lines': len(inventory.inventory_line_ids),
-                'total_difference_value': inventory.total_difference_value,
-                'user_id': inventory.user_id.id,
-                'user_name': inventory.user_id.name,
-                'company_id': inventory.company_id.id,
-                'company_name': inventory.company_id.name,
+                'progress': round(inventory.validation_progress, 2),
+                'cursor': inventory.validation_cursor,
+                'lines': {
+                    'total': sum(counts.values()),
+                    'pending': counts.get('pending', 0),
+                    'done': counts.get('done', 0),
+                    'skipped': counts.get('skipped', 0),
+                    'error': counts.get('error', 0),
+                },
+                'job': {
+                    'id': job.id,
+                    'state': job.state,
+                    'attempts': job.attempts,
+                    'heartbeat': job.heartbeat.isoformat() if job.heartbeat else None,
+                } if job else None,
             }
             
-            if include_lines:
-                data['lines'] = [{
-                    'id': line.id,
-                    'product_id': line.product_id.id,
-                    'product_code': line.product_id.default_code,
-                    'product_name': line.product_id.name,
-                    'theoretical_qty': line.theoretical_qty,
-                    'real_qty': line.real_qty,
-                    'difference': line.difference,
-                    'standard_price': line.standard_price,
-                    'difference_value': line.difference_value,
-                    'state': line.state,
-                } for line in inventory.inventory_line_ids]
-            
-            return self._json_response(data)
+            return self._json_response(data, start_time=start_time)
             
         except Exception as e:
-            _logger.error(f"Erreur API get_inventory: {str(e)}", exc_info=True)
-            return self._error_response(str(e), status=500)
+            _logger.error(f"Erreur API get_inventory_validation: {str(e)}", exc_info=True)
+            return self._error_response(str(e), status=500, start_time=start_time)
     
     @http.route('/api/stockex/inventories', type='jsonrpc', auth='user', methods=['POST'], csrf=False)
     def create_inventory(self, **params):
@@ -251,15 +616,21 @@ class StockexAPIController(http.Controller):
     
     @http.route('/api/stockex/products', type='http', auth='user', methods=['GET'], csrf=False)
     def list_products(self, **params):
-        """Liste les produits stockables.
+        """Liste les produits stockables, par id croissant.
         
         Params:
             - search: Recherche par nom ou code
             - category_id: Filtrer par catégorie
-            - limit: Nombre max (défaut: 100)
+            - limit: Nombre max (défaut: 100, max: 1000)
+            - cursor: Curseur de la page suivante (next_cursor de la page précédente)
+            - with_total: Inclure le nombre total de résultats (true/false, défaut: false)
+            - fields: Clés à renvoyer, séparées par des virgules (défaut: toutes)
         """
+        start_time = time.time()
+        
         try:
-            domain = [('type', '=', 'product')]
+            Product = request.env['product.product']
+            domain = [('is_storable', '=', True)]
             
             if params.get('search'):
                 search = params['search']
@@ -270,33 +641,61 @@ class StockexAPIController(http.Controller):
             if params.get('category_id'):
                 domain.append(('categ_id', '=', int(params['category_id'])))
             
-            limit = int(params.get('limit', 100))
-            # Limiter la pagination à 1000 enregistrements max
-            if limit > 1000:
-                limit = 1000
+            limit = self._get_page_limit(params)
+            keys, read_fields = self._get_projection(params, PRODUCT_API_FIELDS)
+            
+            # Pagination par clé sur l'id : pas d'OFFSET sur un catalogue volumineux
+            page_domain = list(domain)
+            if params.get('cursor'):
+                [last_id] = self._decode_cursor(params['cursor'])
+                page_domain.append(('id', '>', last_id))
+            
+            etag, last_modified = self._get_validator([('product.product', page_domain)])
+            if self._is_not_modified(etag, last_modified):
+                return self._not_modified_response(etag, last_modified, start_time)
+            
+            products = Product.search(page_domain, limit=limit, order='id')
+            records = products.read(read_fields) if read_fields else [{'id': product_id} for product_id in products.ids]
+            
+            # Nom court des catégories (read() renvoie le nom complet)
+            categories = {}
+            if 'category_name' in keys:
+                category_ids = {record['categ_id'][0] for record in records if record.get('categ_id')}
+                categories = {
+                    category['id']: category['name']
+                    for category in request.env['product.category'].browse(category_ids).read(['name'])
+                }
             
-            products = request.env['product.product'].search(domain, limit=limit)
+            rows = []
+            for record in records:
+                row = {
+                    'id': record['id'],
+                    'code': record.get('default_code') or None,
+                    'name': record.get('name'),
+                    'category_id': record['categ_id'][0] if record.get('categ_id') else None,
+                    'category_name': categories.get(record['categ_id'][0]) if record.get('categ_id') else None,
+                    'uom_id': record['uom_id'][0] if record.get('uom_id') else None,
+                    'uom_name': record['uom_id'][1] if record.get('uom_id') else None,
+                    'standard_price': record.get('standard_price'),
+                    'barcode': record.get('barcode') or None,
+                }
+                rows.append({key: row[key] for key in keys})
             
             data = {
-                'total': request.env['product.product'].search_count(domain),
-                'products': [{
-                    'id': p.id,
-                    'code': p.default_code,
-                    'name': p.name,
-                    'category_id': p.categ_id.id,
-                    'category_name': p.categ_id.name,
-                    'uom_id': p.uom_id.id,
-                    'uom_name': p.uom_id.name,
-                    'standard_price': p.standard_price,
-                    'barcode': p.barcode,
-                } for p in products]
+                'limit': limit,
+                'next_cursor': self._encode_cursor([products.ids[-1]]) if len(products) == limit else None,
+                'products': rows,
             }
+            if params.get('with_total', 'false').lower() == 'true':
+                data['total'] = Product.search_count(domain)
             
-            return self._json_response(data)
+            return self._json_response(data, start_time=start_time, etag=etag, last_modified=last_modified)
             
+        except ValueError as e:
+            return self._error_response(str(e), status=400, start_time=start_time)
         except Exception as e:
             _logger.error(f"Erreur API list_products: {str(e)}", exc_info=True)
-            return self._error_response(str(e), status=500)
+            return self._error_response(str(e), status=500, start_time=start_time)
     
     # ========== EMPLACEMENTS ==========
     
@@ -307,6 +706,8 @@ class StockexAPIController(http.Controller):
         Params:
             - warehouse_id: Filtrer par entrepôt
         """
+        start_time = time.time()
+        
         try:
             domain = [('usage', '=', 'internal')]
             
@@ -314,6 +715,10 @@ class StockexAPIController(http.Controller):
                 warehouse = request.env['stock.warehouse'].browse(int(params['warehouse_id']))
                 domain.append(('id', 'child_of', warehouse.view_location_id.id))
             
+            etag, last_modified = self._get_validator([('stock.location', domain)])
+            if self._is_not_modified(etag, last_modified):
+                return self._not_modified_response(etag, last_modified, start_time)
+            
             locations = request.env['stock.location'].search(domain)
             
             data = {
@@ -327,11 +732,11 @@ class StockexAPIController(http.Controller):
                 } for loc in locations]
             }
             
-            return self._json_response(data)
+            return self._json_response(data, start_time=start_time, etag=etag, last_modified=last_modified)
             
         except Exception as e:
             _logger.error(f"Erreur API list_locations: {str(e)}", exc_info=True)
-            return self._error_response(str(e), status=500)
+            return self._error_response(str(e), status=500, start_time=start_time)
     
     # ========== KPIs & ANALYTICS ==========
     
@@ -340,35 +745,90 @@ class StockexAPIController(http.Controller):
         """Récupère les KPIs globaux du module.
         
         Params:
-            - period: Période (today, week, month, year)
+            - period: Période des écarts (30d, ytd, 12m, all) - défaut: 30d
+            - valuation_method: standard ou economic - défaut: standard
+            - warehouse_id: Limiter à un entrepôt
+            - company_id: Limiter à une société (défaut: sociétés actives)
+        
+        La valeur du stock suit la règle de valorisation configurée.
         """
+        start_time = time.time()
+        
         try:
-            # Calculer les KPIs directement sans le dashboard
-            inventory_model = request.env['stockex.stock.inventory']
-            
-            # Compter les inventaires
-            total_inventories = inventory_model.search_count([])
-            total_inventories_done = inventory_model.search_count([('state', '=', 'done')])
-            
-            # Calculer valeur stock actuelle via stock.quant
-            quants = request.env['stock.quant'].search([
-                ('quantity', '>', 0),
-                ('location_id.usage', '=', 'internal')
-            ])
-            current_stock_value = sum(q.quantity * q.product_id.standard_price for q in quants)
-            
-            # Récupération KPIs
-            kpis = {
-                'total_inventories': total_inventories,
-                'total_inventories_done': total_inventories_done,
-                'total_products': len(quants.mapped('product_id')),
-                'total_quantity': sum(quants.mapped('quantity')),
-                'total_value': current_stock_value,
-                'current_stock_value': current_stock_value,
-            }
+            warehouse_id = int(params['warehouse_id']) if params.get('warehouse_id') else None
+            company_ids = request.env.companies.ids
+            if params.get('company_id'):
+                company_ids = [int(params['company_id'])]
+                if company_ids[0] not in request.env.user.company_ids.ids:
+                    return self._error_response("Société non autorisée", status=403, start_time=start_time)
+            
+            # Données lues par les KPIs ; les périodes glissantes dépendent du jour
+            quant_domain = [('quantity', '>', 0), ('location_id.usage', '=', 'internal')]
+            etag, last_modified = self._get_validator([
+                ('stockex.stock.inventory', []),
+                ('stock.quant', quant_domain),
+                ('product.product', []),
+                ('stockex.variance.daily', []),
+            ], fields.Date.context_today(request.env.user))
+            if self._is_not_modified(etag, last_modified):
+                return self._not_modified_response(etag, last_modified, start_time)
+            
+            # Agrégats SQL et cache court (voir stockex.inventory.dashboard.get_api_kpis)
+            kpis = request.env['stockex.inventory.dashboard'].get_api_kpis(
+                period=params.get('period', '30d'),
+                valuation_method=params.get('valuation_method', 'standard'),
+                warehouse_id=warehouse_id,
+                company_ids=company_ids,
+                # Le cache ne sert jamais un corps plus ancien que l'ETag envoyé
+                cache_version=etag,
+            )
             
-            return self._json_response(kpis)
+            return self._json_response(kpis, start_time=start_time, etag=etag, last_modified=last_modified)
             
+        except ValueError as e:
+            return self._error_response(str(e), status=400, start_time=start_time)
         except Exception as e:
             _logger.error(f"Erreur API get_kpis: {str(e)}", exc_info=True)
+            return self._error_response(str(e), status=500, start_time=start_time)
+    
+    # ========== MONITORING ==========
+    
+    @http.route('/api/stockex/metrics', type='http', auth='user', methods=['GET'], csrf=False)
+    def get_metrics(self, **params):
+        """Métriques agrégées des appels API (réservé aux gestionnaires).
+        
+        Params:
+            - minutes: Fenêtre d'analyse en minutes (défaut: 60, max: 10080)
+            - endpoint: Limiter à un endpoint (motif de la route)
+            - group: endpoint (défaut) ou minute
+        
+        Les appels des dernières secondes, encore en mémoire dans les
+        workers, ne sont pas inclus (voir pending pour le worker courant).
+        """
+        try:
+            if not request.env.user.has_group('stockex.group_stockex_manager'):
+                return self._error_response("Accès réservé aux gestionnaires", status=403)
+            
+            minutes = min(max(int(params.get('minutes') or 60), 1), 10080)
+            group = params.get('group', 'endpoint')
+            if group not in ('endpoint', 'minute'):
+                return self._error_response(f"Regroupement inconnu: {group}", status=400)
+            
+            data = {
+                'minutes': minutes,
+                'group': group,
+                'pending': stockex_api_monitoring.pending_count(),
+                'rows': request.env['stockex.api.metric']._get_summary(
+                    minutes=minutes,
+                    endpoint=params.get('endpoint'),
+                    group=group,
+                ),
+            }
+            
+            return self._json_response(data)
+            
+        except ValueError as e:
+            return self._error_response(str(e), status=400)
+        except Exception as e:
+            _logger.error(f"Erreur API get_metrics: {str(e)}", exc_info=True)
             return self._error_response(str(e), status=500)
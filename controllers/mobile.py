@@ -12,6 +12,8 @@ Features:
 - Synchronisation automatique
 """
 
+import base64
+import gzip
 import json
 import logging
 import os
@@ -109,91 +111,65 @@ class StockexMobileController(http.Controller):
     
     @http.route('/api/mobile/inventories/sync', type='jsonrpc', auth='user', methods=['POST'], csrf=False)
     def sync_inventories(self, **params):
-        """Synchronise les inventaires locaux (offline) vers serveur.
+        """Synchronisation différentielle entre l'appareil (offline) et le serveur.
         
         Body JSON:
         {
-            "inventories": [
-                {
-                    "local_id": "temp-123",
-                    "location_id": 8,
-                    "date": "2025-10-28",
-                    "lines": [
-                        {
-                            "product_id": 42,
-                            "product_qty": 100,
-                            "standard_price": 1000
-                        }
-                    ]
-                }
+            "device_id": "a1b2c3",
+            "change_token": "2025-10-28 08:00:00",
+            "operations": [
+                {"op": "inventory", "seq": 1, "local_id": "temp-123", "location_id": 8, "date": "2025-10-28"},
+                {"op": "line", "seq": 2, "local_id": "temp-123-1", "inventory_local_id": "temp-123",
+                 "product_id": 42, "product_qty": 100}
             ]
         }
+        
+        L'ancien format "inventories" (inventaires avec leurs lignes) reste
+        accepté : il est converti en opérations d'identifiants locaux stables,
+        un renvoi après coupure réseau ne crée donc pas de doublon.
+        
+        Réponse : correspondances local_id → server_id, erreurs, last_seq
+        (dernière opération appliquée), nouveau change_token et changements
+        serveur depuis le change_token reçu, suppressions comprises
+        (changes.deleted ; changes.reset si une resynchronisation complète
+        est nécessaire).
         """
         try:
-            inventories_data = params.get('inventories', [])
-            if not inventories_data:
-                return {
-                    'success': False,
-                    'error': 'Aucun inventaire à synchroniser',
-                }
+            device_id = params.get('device_id') or f"user-{request.env.uid}"
+            inventories_data = params.get('inventories') or []
+            operations = list(params.get('operations') or []) + self._inventories_to_operations(inventories_data)
             
-            synced = []
-            errors = []
-            
-            for inv_data in inventories_data:
-                try:
-                    # Valider les données requises
-                    if not inv_data.get('location_id'):
-                        raise ValueError("location_id requis")
-                    
-                    # Créer l'inventaire sur le serveur
-                    inventory_vals = {
-                        'location_id': inv_data['location_id'],
-                        'date': inv_data.get('date') or fields.Date.today(),
-                        'state': 'draft',
-                    }
-                    
-                    inventory = request.env['stockex.stock.inventory'].create(inventory_vals)
-                    _logger.info(f"✅ Inventaire créé: {inventory.name} (ID: {inventory.id})")
-                    
-                    # Créer les lignes
-                    lines_created = 0
-                    for line_data in inv_data.get('lines', []):
-                        if not line_data.get('product_id'):
-                            continue
-                            
-                        request.env['stockex.stock.inventory.line'].create({
-                            'inventory_id': inventory.id,
-                            'product_id': line_data['product_id'],
-                            'product_qty': line_data.get('product_qty', 0) or line_data.get('real_qty', 0),
-                            'standard_price': line_data.get('standard_price', 0),
-                        })
-                        lines_created += 1
-                    
-                    _logger.info(f"✅ {lines_created} lignes créées pour {inventory.name}")
-                    
-                    synced.append({
-                        'local_id': inv_data.get('local_id'),
-                        'server_id': inventory.id,
-                        'name': inventory.name,
-                        'lines_count': lines_created,
-                    })
-                    
-                except Exception as e:
-                    error_msg = str(e)
-                    _logger.error(f"❌ Erreur sync inventaire {inv_data.get('local_id')}: {error_msg}", exc_info=True)
-                    errors.append({
-                        'local_id': inv_data.get('local_id'),
-                        'error': error_msg,
-                    })
+            Sync = request.env['stockex.mobile.sync']
+            change_token = Sync._new_token()
+            result = Sync._apply_operations(device_id, operations)
+            changes = Sync._get_changes(device_id, params.get('change_token'))
+            
+            # Réponse de l'ancien format : un élément par inventaire synchronisé
+            lines_count = {}
+            for applied in result['applied']:
+                if applied['op'] == 'line':
+                    op_inventory = applied.get('inventory_local_id')
+                    lines_count[op_inventory] = lines_count.get(op_inventory, 0) + 1
+            synced = [{
+                'local_id': applied['local_id'],
+                'server_id': applied['server_id'],
+                'name': applied['name'],
+                'lines_count': lines_count.get(applied['local_id'], 0),
+            } for applied in result['applied'] if applied['op'] == 'inventory']
+            
+            _logger.info(f"✅ Sync mobile {device_id}: {len(result['applied'])} opération(s), {len(result['errors'])} erreur(s)")
             
             return {
                 'success': True,
+                'applied': result['applied'],
+                'errors': result['errors'],
+                'last_seq': result['last_seq'],
+                'change_token': change_token,
+                'changes': changes,
                 'synced': synced,
-                'errors': errors,
                 'total': len(inventories_data),
                 'synced_count': len(synced),
-                'error_count': len(errors),
+                'error_count': len(result['errors']),
             }
             
         except Exception as e:
@@ -203,6 +179,34 @@ class StockexMobileController(http.Controller):
                 'error': str(e),
             }
     
+    @staticmethod
+    def _inventories_to_operations(inventories_data):
+        """Convertit l'ancien format de synchronisation en opérations idempotentes.
+        
+        Les lignes sans local_id reçoivent un identifiant dérivé de leur
+        inventaire et de leur position, identique à chaque renvoi.
+        """
+        operations = []
+        for inv_data in inventories_data:
+            local_id = inv_data.get('local_id')
+            operations.append({
+                'op': 'inventory',
+                'local_id': local_id,
+                'location_id': inv_data.get('location_id'),
+                'date': inv_data.get('date'),
+            })
+            for index, line_data in enumerate(inv_data.get('lines', [])):
+                if not line_data.get('product_id'):
+                    continue
+                operations.append({
+                    'op': 'line',
+                    'local_id': line_data.get('local_id') or f"{local_id}/{index}",
+                    'inventory_local_id': local_id,
+                    'product_id': line_data['product_id'],
+                    'product_qty': line_data.get('product_qty', 0) or line_data.get('real_qty', 0),
+                })
+        return operations
+    
     @http.route('/api/mobile/products/search', type='jsonrpc', auth='user', methods=['POST'])
     def mobile_search_product(self, **params):
         """Recherche produit par code-barres ou référence.
@@ -253,6 +257,43 @@ class StockexMobileController(http.Controller):
             _logger.error(f"Erreur recherche produit: {str(e)}", exc_info=True)
             return {'error': True, 'message': str(e)}
     
+    @http.route('/api/mobile/catalog', type='http', auth='user', methods=['GET'])
+    def mobile_catalog(self, warehouse_id=None, since=None, **kwargs):
+        """Catalogue produits hors ligne (JSON Lines compressé gzip).
+        
+        Query params:
+            warehouse_id: limite aux produits en stock dans l'entrepôt
+            since: version déjà connue du client (différentiel)
+        
+        En-tête If-None-Match : 304 si le catalogue n'a pas changé, sans
+        construire ni lire le catalogue (seule sa version est calculée).
+        """
+        warehouse = request.env['stock.warehouse']
+        if warehouse_id:
+            warehouse = warehouse.browse(int(warehouse_id)).exists()
+            if not warehouse:
+                return Response(status=404)
+        
+        Catalog = request.env['stockex.mobile.catalog']
+        company = request.env.company
+        version = Catalog._get_version(company, warehouse)
+        etag = Catalog._get_etag(company, warehouse, version)
+        headers = {
+            'ETag': etag,
+            'Cache-Control': 'private, no-cache',
+            'X-Catalog-Version': version,
+            'Vary': 'Accept-Encoding',
+        }
+        if etag in (request.httprequest.headers.get('If-None-Match') or ''):
+            return Response(status=304, headers=headers)
+        
+        version, etag, content = Catalog._export(company, warehouse, since, version=version)
+        if 'gzip' in (request.httprequest.headers.get('Accept-Encoding') or ''):
+            headers['Content-Encoding'] = 'gzip'
+        else:
+            content = gzip.decompress(content)
+        return Response(content, content_type='application/x-ndjson; charset=utf-8', headers=headers)
+    
     @http.route('/api/mobile/inventory/add-line', type='jsonrpc', auth='user', methods=['POST'])
     def mobile_add_line(self, **params):
         """Ajoute une ligne à un inventaire mobile.
@@ -296,7 +337,12 @@ class StockexMobileController(http.Controller):
                     'real_qty': real_qty,
                 })
             
-            # TODO: Gérer photo_data si fourni
+            # Photo optionnelle : compressée une seule fois par contenu (cache des photos)
+            photo_data = params.get('photo_data')
+            if photo_data:
+                raw = base64.b64decode(photo_data.split(',', 1)[-1])
+                photo = request.env['stockex.photo.cache']._get_variant(raw)
+                line.write({'image_1': base64.b64encode(photo)})
             
             return {
                 'success': True,
@@ -313,6 +359,44 @@ class StockexMobileController(http.Controller):
             _logger.error(f"Erreur ajout ligne: {str(e)}", exc_info=True)
             return {'error': True, 'message': str(e)}
     
+    @http.route('/api/mobile/inventory/lines/batch', type='jsonrpc', auth='user', methods=['POST'])
+    def mobile_add_lines_batch(self, **params):
+        """Applique un paquet de scans sur un inventaire mobile, en une transaction.
+        
+        Body JSON:
+        {
+            "inventory_id": 42,
+            "mode": "last",  (ou "sum" : cumul des quantités scannées)
+            "scans": [
+                {"ref": "s-1", "product_id": 89, "location_id": 8, "qty": 3, "scanned_at": "2025-01-15T10:00:00Z"},
+                ...
+            ]
+        }
+        
+        "ref" doit être unique par appareil (préfixe de l'appareil) : en mode
+        "sum", un scan dont la référence a déjà été appliquée n'est pas recompté.
+        """
+        try:
+            inventory_id = params.get('inventory_id')
+            scans = params.get('scans') or []
+            
+            if not inventory_id:
+                return {'error': True, 'message': 'inventory_id requis'}
+            
+            inventory = request.env['stockex.stock.inventory'].browse(int(inventory_id))
+            
+            if not inventory.exists():
+                return {'error': True, 'message': 'Inventaire introuvable'}
+            
+            result = request.env['stockex.mobile.sync']._upsert_scans(
+                inventory, scans, mode=params.get('mode') or 'last'
+            )
+            return dict(result, success=True)
+            
+        except Exception as e:
+            _logger.error(f"Erreur ajout lignes groupé: {str(e)}", exc_info=True)
+            return {'error': True, 'message': str(e)}
+    
     @http.route('/api/mobile/inventory/<int:inventory_id>/lines', type='jsonrpc', auth='user', methods=['GET'])
     def mobile_get_lines(self, inventory_id, **params):
         """Récupère les lignes d'un inventaire pour affichage mobile."""
@@ -11,17 +11,27 @@ from . import minio_storage
 from . import models
 from . import eneo_region
 from . import account_move
+from . import res_users
+from . import photo_cache
 from . import kobo_config
 from . import stock_location
 from . import product_category
 from . import product_category_auto_config
 from . import res_config_settings
+from . import job_queue
+from . import import_engine
+from . import mobile_sync
+from . import mobile_catalog
+from . import api_metric
+# product_snapshot doit être avant les vues SQL qui joignent sa table
+from . import product_snapshot
 from . import depreciation_report
 from . import kobo_submission
 from . import cycle_count
 from . import inventory_comparison
 from . import inventory_summary
 from . import inventory_dashboard
+from . import variance_daily
 from . import variance_report
 from . import stock_accounting
 from . import stock_analysis
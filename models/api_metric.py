@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Métriques de l'API REST, agrégées par endpoint et par minute.
+
+Les lignes sont écrites en différé par le monitoring de l'API
+(tools/api_monitoring.py) : une ligne par worker, endpoint, méthode et
+minute. Les lectures les regroupent pour repérer les endpoints chargés.
+"""
+
+import logging
+from datetime import timedelta
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+class StockexApiMetric(models.Model):
+    """Appels d'un endpoint de l'API sur une minute, pour un worker."""
+    _name = 'stockex.api.metric'
+    _description = 'Métrique API StockEx'
+    _order = 'minute desc, endpoint'
+    _rec_name = 'endpoint'
+
+    minute = fields.Datetime(
+        string='Minute',
+        required=True,
+        readonly=True,
+        index=True
+    )
+    endpoint = fields.Char(
+        string='Endpoint',
+        required=True,
+        readonly=True,
+        index=True
+    )
+    method = fields.Char(
+        string='Méthode',
+        readonly=True
+    )
+    call_count = fields.Integer(
+        string='Appels',
+        readonly=True
+    )
+    error_count = fields.Integer(
+        string='Erreurs',
+        readonly=True,
+        help='Réponses en erreur (code HTTP 4xx ou 5xx)'
+    )
+    server_error_count = fields.Integer(
+        string='Erreurs serveur',
+        readonly=True,
+        help='Réponses en erreur serveur (code HTTP 5xx)'
+    )
+    latency_p50 = fields.Float(
+        string='Latence p50 (ms)',
+        digits=(16, 1),
+        readonly=True
+    )
+    latency_p95 = fields.Float(
+        string='Latence p95 (ms)',
+        digits=(16, 1),
+        readonly=True
+    )
+    latency_p99 = fields.Float(
+        string='Latence p99 (ms)',
+        digits=(16, 1),
+        readonly=True
+    )
+    latency_max = fields.Float(
+        string='Latence max (ms)',
+        digits=(16, 1),
+        readonly=True
+    )
+    bytes_out = fields.Integer(
+        string='Octets envoyés',
+        readonly=True
+    )
+    worker_pid = fields.Integer(
+        string='Worker',
+        readonly=True
+    )
+
+    @api.model
+    def _get_summary(self, minutes=60, endpoint=None, group='endpoint'):
+        """Agrégats des dernières minutes, par endpoint ou par minute.
+
+        Les percentiles de plusieurs lignes (workers, minutes) sont des
+        moyennes pondérées par le nombre d'appels : une approximation, les
+        latences individuelles n'étant pas conservées.
+
+        Returns:
+            list de dicts (key, calls, errors, server_errors, error_rate,
+            latency_p50, latency_p95, latency_p99, latency_max, bytes_out,
+            calls_per_minute), par nombre d'appels décroissant (par endpoint)
+            ou par minute croissante
+        """
+        domain = [('minute', '>=', fields.Datetime.now() - timedelta(minutes=minutes))]
+        if endpoint:
+            domain.append(('endpoint', '=', endpoint))
+        groups = {}
+        for metric in self.search_read(domain, [
+            'minute', 'endpoint', 'method', 'call_count', 'error_count', 'server_error_count',
+            'latency_p50', 'latency_p95', 'latency_p99', 'latency_max', 'bytes_out',
+        ]):
+            if group == 'minute':
+                key = fields.Datetime.to_string(metric['minute'])
+            else:
+                key = f"{metric['method']} {metric['endpoint']}"
+            totals = groups.setdefault(key, {
+                'key': key, 'calls': 0, 'errors': 0, 'server_errors': 0, 'bytes_out': 0,
+                'latency_p50': 0.0, 'latency_p95': 0.0, 'latency_p99': 0.0, 'latency_max': 0.0,
+            })
+            calls = metric['call_count']
+            totals['calls'] += calls
+            totals['errors'] += metric['error_count']
+            totals['server_errors'] += metric['server_error_count']
+            totals['bytes_out'] += metric['bytes_out']
+            for name in ('latency_p50', 'latency_p95', 'latency_p99'):
+                totals[name] += metric[name] * calls
+            totals['latency_max'] = max(totals['latency_max'], metric['latency_max'])
+
+        rows = list(groups.values())
+        for row in rows:
+            calls = row['calls'] or 1
+            for name in ('latency_p50', 'latency_p95', 'latency_p99'):
+                row[name] = round(row[name] / calls, 1)
+            row['error_rate'] = round(row['errors'] * 100.0 / calls, 2)
+            row['calls_per_minute'] = round(row['calls'] / minutes, 2) if group != 'minute' else row['calls']
+        if group == 'minute':
+            return sorted(rows, key=lambda row: row['key'])
+        return sorted(rows, key=lambda row: row['calls'], reverse=True)
+
+    @api.autovacuum
+    def _gc_api_metrics(self):
+        """Supprime les métriques plus anciennes que stockex.api_metric_retention_days (30 jours)."""
+        days = int(self.env['ir.config_parameter'].sudo().get_param('stockex.api_metric_retention_days', '30'))
+        old = self.sudo().search([('minute', '<', fields.Datetime.now() - timedelta(days=days))])
+        if old:
+            old.unlink()
+            _logger.info(f"🧹 {len(old)} métrique(s) API supprimée(s)")
@@ -1,7 +1,165 @@
 # -*- coding: utf-8 -*-
 
+import logging
+
 from odoo import models, fields, api
-from datetime import datetime
+
+_logger = logging.getLogger(__name__)
+
+
+class StockDepreciationEngine(models.AbstractModel):
+    """Moteur de décote selon rotation, partagé par la valorisation et les vues SQL.
+    
+    Les seuils (stockex.depreciation_*) et les catégories actif / lent / mort
+    sont définis ici une seule fois:
+    - Stock actif: dernier mouvement il y a au plus N jours → 0% décote
+    - Rotation lente: dernier mouvement il y a au plus M jours → taux lent
+    - Stock mort: au-delà de M jours ou aucun mouvement → taux stock mort
+    """
+    _name = 'stockex.depreciation.engine'
+    _description = 'Moteur de Décote du Stock'
+    
+    _PARAM_DEFAULTS = {
+        'active_days': ('stockex.depreciation_active_days', 365),
+        'slow_days': ('stockex.depreciation_slow_days', 1095),
+        'slow_rate': ('stockex.depreciation_slow_rate', 40.0),
+        'dead_rate': ('stockex.depreciation_dead_rate', 100.0),
+    }
+    
+    @api.model
+    def _get_params(self):
+        """Lit les seuils de décote une seule fois.
+        
+        Returns:
+            dict: {'active_days', 'slow_days', 'slow_rate', 'dead_rate'}
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        params = {}
+        for name, (key, default) in self._PARAM_DEFAULTS.items():
+            value = ICP.get_param(key, default)
+            try:
+                # float() d'abord : accepte '365.0' ou ' 365 ' pour un nombre de jours
+                params[name] = type(default)(float(str(value).strip() or default))
+            except (TypeError, ValueError):
+                _logger.warning(f"⚠️ Paramètre {key} invalide ({value!r}), valeur par défaut {default} utilisée")
+                params[name] = default
+        return params
+    
+    @api.model
+    def _get_last_move_dates(self, product_ids):
+        """Retourne la date du dernier mouvement réalisé de chaque produit.
+        
+        Une seule agrégation MAX(date) GROUP BY product_id pour N produits.
+        
+        Returns:
+            dict: {product_id: date} (produits sans mouvement absents)
+        """
+        if not product_ids:
+            return {}
+        self.env.cr.execute("""
+            SELECT product_id, MAX(date)
+            FROM stock_move
+            WHERE state = 'done' AND product_id IN %s
+            GROUP BY product_id
+        """, (tuple(product_ids),))
+        return {product_id: fields.Date.to_date(last_date) for product_id, last_date in self.env.cr.fetchall()}
+    
+    @api.model
+    def _get_bucket(self, days_since_move, params):
+        """Catégorie de rotation ('active', 'slow', 'dead') pour un nombre de jours."""
+        if days_since_move is None:
+            return 'dead'
+        if days_since_move <= params['active_days']:
+            return 'active'
+        if days_since_move <= params['slow_days']:
+            return 'slow'
+        return 'dead'
+    
+    @api.model
+    def _get_rate(self, bucket, params):
+        """Taux de décote (%) d'une catégorie de rotation."""
+        return {
+            'active': 0.0,
+            'slow': params['slow_rate'],
+            'dead': params['dead_rate'],
+        }[bucket]
+    
+    @api.model
+    def _get_coefficients(self, products, params=None):
+        """Retourne les coefficients de décote d'un ensemble de produits.
+        
+        Args:
+            products: recordset product.product
+            params: seuils déjà lus via _get_params (optionnel)
+        
+        Returns:
+            dict: {product_id: coefficient} (1.0 = pas de décote, 0.0 = 100%)
+        """
+        product_ids = list(set(products.ids))
+        if not product_ids:
+            return {}
+        params = params or self._get_params()
+        last_dates = self._get_last_move_dates(product_ids)
+        today = fields.Date.today()
+        
+        coefficients = {}
+        for product_id in product_ids:
+            last_date = last_dates.get(product_id)
+            days = (today - last_date).days if last_date else None
+            rate = self._get_rate(self._get_bucket(days, params), params)
+            coefficients[product_id] = 1.0 - (rate / 100.0)
+        return coefficients
+    
+    # ------------------------------------------------------------------
+    # Fragments SQL pour les vues (mêmes règles que ci-dessus)
+    # ------------------------------------------------------------------
+    
+    @api.model
+    def _sql_params(self, alias='dep'):
+        """Sous-requête d'une ligne exposant les seuils lus dans ir_config_parameter.
+        
+        Même lecture que _get_params : espaces ignorés, décimales acceptées
+        (tronquées pour un nombre de jours), valeur non numérique remplacée
+        par le défaut. Les vues lisent ainsi les paramètres à jour sans
+        qu'une saisie invalide fasse échouer la requête.
+        """
+        value = "btrim(value, ' ' || chr(9) || chr(10) || chr(13))"
+        number = r"'^[+-]?([0-9]+([.][0-9]*)?|[.][0-9]+)([eE][+-]?[0-9]+)?$'"
+        columns = []
+        for name, (key, default) in self._PARAM_DEFAULTS.items():
+            parsed = f"MAX(CASE WHEN key = '{key}' AND {value} ~ {number} THEN {value}::NUMERIC END)"
+            if isinstance(default, int):
+                columns.append(f"COALESCE(trunc({parsed}), {default})::INTEGER AS {name}")
+            else:
+                columns.append(f"COALESCE({parsed}, {default})::FLOAT AS {name}")
+        keys = ', '.join(f"'{key}'" for key, _default in self._PARAM_DEFAULTS.values())
+        return f"(SELECT {', '.join(columns)} FROM ir_config_parameter WHERE key IN ({keys})) {alias}"
+    
+    @api.model
+    def _sql_last_moves(self, by_company=False):
+        """Sous-requête (product_id[, company_id], last_move_date) des derniers mouvements réalisés."""
+        group = 'product_id, company_id' if by_company else 'product_id'
+        return f"(SELECT {group}, MAX(date) AS last_move_date FROM stock_move WHERE state = 'done' GROUP BY {group})"
+    
+    @api.model
+    def _sql_bucket(self, days_expr, alias='dep'):
+        """Expression CASE donnant la catégorie de rotation pour un nombre de jours."""
+        return f"""CASE
+            WHEN {days_expr} IS NULL THEN 'dead'
+            WHEN {days_expr} <= {alias}.active_days THEN 'active'
+            WHEN {days_expr} <= {alias}.slow_days THEN 'slow'
+            ELSE 'dead'
+        END"""
+    
+    @api.model
+    def _sql_rate(self, bucket_expr, alias='dep'):
+        """Expression CASE donnant le taux de décote (%) d'une catégorie de rotation."""
+        return f"""CASE {bucket_expr}
+            WHEN 'active' THEN 0.0
+            WHEN 'slow' THEN {alias}.slow_rate
+            ELSE {alias}.dead_rate
+        END"""
+
 
 class StockDepreciationReport(models.Model):
     _name = 'stockex.depreciation.report'
@@ -25,8 +183,14 @@ class StockDepreciationReport(models.Model):
     company_id = fields.Many2one('res.company', string='Société', readonly=True)
     
     def init(self):
-        """Créer la vue SQL pour le rapport."""
-        self.env.cr.execute("""
+        """Créer la vue SQL pour le rapport.
+        
+        Coût, dernier mouvement et décote proviennent de stockex.product.snapshot
+        (catégories définies par stockex.depreciation.engine).
+        """
+        engine = self.env['stockex.depreciation.engine']
+        rate = "rot.depreciation_rate / 100.0"
+        self.env.cr.execute(f"""
             CREATE OR REPLACE VIEW stockex_depreciation_report AS (
                 SELECT 
                     ROW_NUMBER() OVER (ORDER BY sq.product_id) as id,
@@ -34,82 +198,32 @@ class StockDepreciationReport(models.Model):
                     pp.default_code as default_code,
                     pt.categ_id as category_id,
                     sq.quantity as quantity_on_hand,
-                    sm.date::date as last_move_date,
-                    CASE 
-                        WHEN sm.date IS NOT NULL 
-                        THEN CURRENT_DATE - sm.date::date
-                        ELSE NULL
-                    END as days_since_move,
-                    CASE 
-                        WHEN sm.date IS NULL THEN 
-                            CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_dead_rate') AS FLOAT)
-                        WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_active_days') AS INTEGER) THEN 
-                            0.0
-                        WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_slow_days') AS INTEGER) THEN 
-                            CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_slow_rate') AS FLOAT)
-                        ELSE 
-                            CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_dead_rate') AS FLOAT)
-                    END as depreciation_rate,
+                    snap.last_move_date as last_move_date,
+                    CURRENT_DATE - snap.last_move_date as days_since_move,
+                    rot.depreciation_rate as depreciation_rate,
                     CASE 
-                        WHEN sm.date IS NULL THEN 
-                            'Stock Mort (aucun mouvement)'
-                        WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_active_days') AS INTEGER) THEN 
-                            'Stock Actif'
-                        WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_slow_days') AS INTEGER) THEN 
-                            'Rotation Lente'
-                        ELSE 
-                            'Stock Mort'
+                        WHEN snap.last_move_date IS NULL THEN 'Stock Mort (aucun mouvement)'
+                        WHEN rot.bucket = 'active' THEN 'Stock Actif'
+                        WHEN rot.bucket = 'slow' THEN 'Rotation Lente'
+                        ELSE 'Stock Mort'
                     END as depreciation_category,
-                    COALESCE(CAST(pp.standard_price AS NUMERIC), 0.0) as base_price,
-                    COALESCE(CAST(pp.standard_price AS NUMERIC), 0.0) * (1.0 - 
-                        CASE 
-                            WHEN sm.date IS NULL THEN 
-                                CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_dead_rate') AS FLOAT) / 100.0
-                            WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_active_days') AS INTEGER) THEN 
-                                0.0
-                            WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_slow_days') AS INTEGER) THEN 
-                                CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_slow_rate') AS FLOAT) / 100.0
-                            ELSE 
-                                CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_dead_rate') AS FLOAT) / 100.0
-                        END
-                    ) as depreciated_price,
-                    sq.quantity * COALESCE(CAST(pp.standard_price AS NUMERIC), 0.0) as base_value,
-                    sq.quantity * COALESCE(CAST(pp.standard_price AS NUMERIC), 0.0) * (1.0 - 
-                        CASE 
-                            WHEN sm.date IS NULL THEN 
-                                CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_dead_rate') AS FLOAT) / 100.0
-                            WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_active_days') AS INTEGER) THEN 
-                                0.0
-                            WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_slow_days') AS INTEGER) THEN 
-                                CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_slow_rate') AS FLOAT) / 100.0
-                            ELSE 
-                                CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_dead_rate') AS FLOAT) / 100.0
-                        END
-                    ) as depreciated_value,
-                    sq.quantity * COALESCE(CAST(pp.standard_price AS NUMERIC), 0.0) * 
-                        CASE 
-                            WHEN sm.date IS NULL THEN 
-                                CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_dead_rate') AS FLOAT) / 100.0
-                            WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_active_days') AS INTEGER) THEN 
-                                0.0
-                            WHEN CURRENT_DATE - sm.date::date <= CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_slow_days') AS INTEGER) THEN 
-                                CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_slow_rate') AS FLOAT) / 100.0
-                            ELSE 
-                                CAST((SELECT value FROM ir_config_parameter WHERE key = 'stockex.depreciation_dead_rate') AS FLOAT) / 100.0
-                        END as value_loss,
+                    COALESCE(snap.standard_price, 0.0) as base_price,
+                    COALESCE(snap.standard_price, 0.0) * (1.0 - {rate}) as depreciated_price,
+                    sq.quantity * COALESCE(snap.standard_price, 0.0) as base_value,
+                    sq.quantity * COALESCE(snap.standard_price, 0.0) * (1.0 - {rate}) as depreciated_value,
+                    sq.quantity * COALESCE(snap.standard_price, 0.0) * {rate} as value_loss,
                     sq.company_id as company_id
                 FROM stock_quant sq
                 JOIN product_product pp ON pp.id = sq.product_id
                 JOIN product_template pt ON pt.id = pp.product_tmpl_id
                 JOIN stock_location sl ON sl.id = sq.location_id
-                LEFT JOIN LATERAL (
-                    SELECT date
-                    FROM stock_move sm2
-                    WHERE sm2.product_id = sq.product_id
-                    AND sm2.state = 'done'
-                    ORDER BY date DESC
-                    LIMIT 1
-                ) sm ON TRUE
+                LEFT JOIN stockex_product_snapshot snap
+                    ON snap.product_id = sq.product_id AND snap.company_id = sq.company_id
+                CROSS JOIN {engine._sql_params('dep')}
+                CROSS JOIN LATERAL (
+                    SELECT COALESCE(snap.rotation_status, 'dead') AS bucket,
+                           COALESCE(snap.depreciation_rate, dep.dead_rate) AS depreciation_rate
+                ) rot
                 WHERE sq.quantity > 0
                 AND sl.usage = 'internal'
             )
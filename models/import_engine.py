@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+Moteur d'import en masse partagé par les assistants Excel/CSV.
+
+Les assistants analysent d'abord toutes les lignes du fichier (une passe),
+puis résolvent d'un coup produits, catégories, entrepôts, emplacements et
+quants avec des requêtes IN, créent les données manquantes par lots et
+insèrent les lignes d'inventaire avec create(vals_list) par paquets. Le
+nombre de requêtes dépend du nombre de valeurs distinctes, plus du nombre
+de lignes du fichier.
+
+Les fichiers Excel sont lus en flux (ExcelRowSource) et traités par paquets
+de stockex.import_batch_size lignes : la mémoire utilisée reste bornée, même
+pour plusieurs centaines de milliers de lignes.
+"""
+
+import binascii
+import logging
+import os
+import tempfile
+import zlib
+from contextlib import contextmanager
+
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+
+class ExcelRowSource:
+    """Feuille Excel lue en flux, ligne à ligne.
+
+    Les lignes sont restituées sous forme de couples (numéro de ligne Excel,
+    dict en-tête → valeur), une à une ou par paquets : seul le paquet courant
+    est en mémoire, quelle que soit la taille du fichier.
+    """
+
+    def __init__(self, worksheet, columns=None, empty_value='', skip_empty=True):
+        self.worksheet = worksheet
+        self.headers = list(next(worksheet.iter_rows(min_row=1, max_row=1, values_only=True), ()))
+        self.columns = set(columns) if columns else None
+        self.empty_value = empty_value
+        self.skip_empty = skip_empty
+
+    @property
+    def estimated_rows(self):
+        """Nombre de lignes de données d'après les dimensions de la feuille (sans lecture)."""
+        return max((self.worksheet.max_row or 1) - 1, 0)
+
+    def rows(self, limit=None, where=None):
+        """Itère sur les lignes de données, au plus limit lignes.
+
+        Args:
+            where: filtre optionnel where(numéro de ligne, dict de la ligne)
+        """
+        keep = [
+            (idx, header) for idx, header in enumerate(self.headers)
+            if header is not None and (self.columns is None or header in self.columns)
+        ]
+        count = 0
+        for row_number, row in enumerate(self.worksheet.iter_rows(min_row=2, values_only=True), start=2):
+            if limit is not None and count >= limit:
+                break
+            if self.skip_empty and not any(row):  # Ignorer les lignes vides
+                continue
+            values = {
+                header: row[idx] if idx < len(row) and row[idx] is not None else self.empty_value
+                for idx, header in keep
+            }
+            if where is not None and not where(row_number, values):
+                continue
+            yield row_number, values
+            count += 1
+
+    def chunks(self, size, limit=None, where=None):
+        """Itère sur les lignes par paquets de size lignes."""
+        chunk = []
+        for item in self.rows(limit, where):
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+class ImportEngine(models.AbstractModel):
+    """Résolution et création en masse pour les imports d'inventaire."""
+    _name = 'stockex.import.engine'
+    _description = 'Moteur d\'Import en Masse'
+
+    # Nombre de lignes lues pour une prévisualisation
+    _preview_rows = 100
+
+    @api.model
+    def _get_batch_size(self):
+        """Taille des paquets de création (paramètre stockex.import_batch_size)."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        return max(1, int(ICP.get_param('stockex.import_batch_size', '1000') or 1000))
+
+    @api.model
+    def _shard_index(self, key, shard_count):
+        """Lot (0..shard_count-1) d'une clé, stable d'un processus à l'autre (CRC32)."""
+        return zlib.crc32(str(key or '').encode('utf-8')) % max(1, shard_count)
+
+    @api.model
+    def _chunks(self, items, size=None):
+        """Découpe une liste en paquets de taille size."""
+        items = list(items)
+        size = size or self._get_batch_size()
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
+    @api.model
+    def _create_batched(self, model, vals_list, keys=None):
+        """Crée les enregistrements par paquets, avec repli unitaire en cas d'échec.
+
+        Args:
+            model: nom du modèle
+            vals_list: liste de dicts de création
+            keys: clés associées à chaque dict (pour le rapport d'erreurs)
+
+        Returns:
+            tuple (dict {clé: enregistrement}, dict {clé: message d'erreur})
+        """
+        Model = self.env[model]
+        keys = list(keys) if keys is not None else list(range(len(vals_list)))
+        pairs = list(zip(keys, vals_list))
+        created, errors = {}, {}
+        for batch in self._chunks(pairs):
+            try:
+                with self.env.cr.savepoint():
+                    records = Model.create([vals for _key, vals in batch])
+                created.update(zip([key for key, _vals in batch], records))
+            except Exception as batch_error:
+                _logger.warning(f"⚠️ Création groupée {model} en échec ({batch_error}), reprise unitaire")
+                for key, vals in batch:
+                    try:
+                        with self.env.cr.savepoint():
+                            created[key] = Model.create(vals)
+                    except Exception as e:
+                        errors[key] = str(e)
+        return created, errors
+
+    # ------------------------------------------------------------------
+    # Lecture des fichiers
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _binary_to_path(self, record, field_name):
+        """Chemin local du fichier d'un champ binaire, sans copie en mémoire si possible.
+
+        Le fichier du filestore est ouvert directement ; à défaut, le base64 est
+        décodé par morceaux dans un fichier temporaire.
+
+        Un assistant reconstruit par une tâche de fond (voir
+        stockex.job._build_wizard) lit son fichier dans la pièce jointe de
+        la tâche.
+
+        Returns:
+            tuple (chemin, chemin du fichier temporaire à supprimer ou None)
+        """
+        job_attachment_id = (record.env.context.get('stockex_job_files') or {}).get(field_name)
+        attachment = self.env['ir.attachment']
+        if job_attachment_id:
+            attachment = attachment.sudo().browse(job_attachment_id).exists()
+            if not attachment:
+                raise UserError(f"Fichier de la tâche introuvable (pièce jointe {job_attachment_id})")
+        elif record._fields[field_name].attachment:
+            attachment = attachment.sudo().search([
+                ('res_model', '=', record._name),
+                ('res_id', '=', record.id),
+                ('res_field', '=', field_name),
+            ], limit=1)
+        if attachment.store_fname:
+            path = attachment._full_path(attachment.store_fname)
+            if os.path.isfile(path):
+                return path, None
+
+        if job_attachment_id:
+            data = attachment.datas or b''
+        else:
+            data = record.with_context(bin_size=False)[field_name] or b''
+        if isinstance(data, str):
+            data = data.encode()
+        if b'\n' in data or b'\r' in data:
+            data = b''.join(data.split())
+        fd, tmp_path = tempfile.mkstemp(prefix='stockex_import_', suffix='.xlsx')
+        step = 4 * 256 * 1024  # Multiple de 4 : chaque morceau se décode seul
+        view = memoryview(data)
+        with os.fdopen(fd, 'wb') as tmp:
+            for i in range(0, len(view), step):
+                tmp.write(binascii.a2b_base64(view[i:i + step]))
+        return tmp_path, tmp_path
+
+    @api.model
+    @contextmanager
+    def _open_excel(self, record, field_name, sheet_name=None, strict=False, first_sheet=False,
+                    columns=None, empty_value='', skip_empty=True):
+        """Ouvre le fichier Excel d'un champ binaire en lecture seule et en flux.
+
+        Args:
+            sheet_name: feuille à lire (à défaut la feuille active, ou la première si first_sheet)
+            strict: lever une erreur si sheet_name n'existe pas
+            columns: en-têtes à conserver (tous par défaut)
+
+        Yields:
+            ExcelRowSource
+        """
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise UserError(
+                "Le module 'openpyxl' n'est pas installé.\n"
+                "Installez-le avec: pip install openpyxl"
+            )
+
+        path, tmp_path = self._binary_to_path(record, field_name)
+        workbook = None
+        try:
+            try:
+                workbook = load_workbook(path, read_only=True, data_only=True)
+            except Exception as e:
+                raise UserError(f"Erreur lors de la lecture du fichier Excel : {str(e)}")
+
+            if sheet_name and sheet_name in workbook.sheetnames:
+                worksheet = workbook[sheet_name]
+            elif sheet_name and strict:
+                raise UserError(
+                    f"La feuille '{sheet_name}' n'existe pas dans le fichier.\n"
+                    f"Feuilles disponibles : {', '.join(workbook.sheetnames)}\n\n"
+                    f"💡 Conseil: Cochez 'Détecter automatiquement' pour utiliser la première feuille."
+                )
+            else:
+                worksheet = workbook.worksheets[0] if first_sheet else workbook.active
+            _logger.info(f"📄 Lecture en flux de la feuille '{worksheet.title}'")
+
+            yield ExcelRowSource(worksheet, columns=columns, empty_value=empty_value, skip_empty=skip_empty)
+        finally:
+            if workbook is not None:
+                workbook.close()
+            if tmp_path:
+                os.unlink(tmp_path)
+
+    # ------------------------------------------------------------------
+    # Résolution des données de référence
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _map_categories(self, names, create=False):
+        """Catégories par nom, créées par lot si demandé.
+
+        Returns:
+            dict {nom: product.category}
+        """
+        names = {str(name).strip() for name in names if name and str(name).strip()}
+        if not names:
+            return {}
+        result = {}
+        for category in self.env['product.category'].search([('name', 'in', list(names))], order='id'):
+            result.setdefault(category.name, category)
+        missing = sorted(names - set(result))
+        if missing and create:
+            created, errors = self._create_batched('product.category', [{'name': name} for name in missing], missing)
+            result.update(created)
+            for name, error in errors.items():
+                _logger.warning(f"⚠️ Catégorie '{name}' non créée: {error}")
+            if created:
+                _logger.info(f"📁 {len(created)} catégorie(s) créée(s)")
+        return result
+
+    @api.model
+    def _map_warehouses(self, specs, company=None, create=False):
+        """Entrepôts par clé, recherchés par code ou nom en une requête.
+
+        Args:
+            specs: dict {clé: {'name': ..., 'code': ..., 'vals': valeurs de création}}
+            company: restreint la recherche à la société (et aux entrepôts sans société)
+            create: créer les entrepôts introuvables (un savepoint chacun)
+
+        Returns:
+            dict {clé: stock.warehouse}
+        """
+        specs = {key: spec for key, spec in specs.items() if key and (spec.get('name') or spec.get('code'))}
+        if not specs:
+            return {}
+        names = [spec['name'] for spec in specs.values() if spec.get('name')]
+        codes = [spec['code'] for spec in specs.values() if spec.get('code')]
+        domain = ['|', ('name', 'in', names), ('code', 'in', codes)]
+        if company:
+            domain.append(('company_id', 'in', [company.id, False]))
+        by_code, by_name = {}, {}
+        for warehouse in self.env['stock.warehouse'].search(domain, order='id'):
+            by_code.setdefault(warehouse.code, warehouse)
+            by_name.setdefault(warehouse.name, warehouse)
+
+        result = {}
+        for key, spec in specs.items():
+            warehouse = by_code.get(spec.get('code')) or by_name.get(spec.get('name'))
+            if warehouse:
+                result[key] = warehouse
+            elif create:
+                # La création d'un entrepôt génère emplacements, routes et types d'opération :
+                # un savepoint par entrepôt pour n'écarter que ceux en erreur
+                vals = dict(spec.get('vals') or {'name': spec.get('name') or spec.get('code'), 'code': spec.get('code')})
+                if company:
+                    vals.setdefault('company_id', company.id)
+                try:
+                    with self.env.cr.savepoint():
+                        warehouse = self.env['stock.warehouse'].create(vals)
+                    result[key] = by_code[warehouse.code] = by_name[warehouse.name] = warehouse
+                    _logger.info(f"✅ Entrepôt créé: {warehouse.name} (code: {warehouse.code})")
+                except Exception as e:
+                    _logger.warning(f"⚠️ Erreur création entrepôt {vals.get('name')}: {e}")
+        return result
+
+    @api.model
+    def _map_child_locations(self, pairs, create=False):
+        """Emplacements enfants par (emplacement parent, nom), créés par lot si demandé.
+
+        Returns:
+            dict {(parent_id, nom): stock.location}
+        """
+        pairs = {(parent.id, str(name).strip()): parent for parent, name in pairs if parent and name and str(name).strip()}
+        if not pairs:
+            return {}
+        result = {}
+        locations = self.env['stock.location'].search([
+            ('location_id', 'in', list({key[0] for key in pairs})),
+            ('name', 'in', list({key[1] for key in pairs})),
+        ], order='id')
+        for location in locations:
+            result.setdefault((location.location_id.id, location.name), location)
+        missing = [key for key in pairs if key not in result]
+        if missing and create:
+            vals_list = [{
+                'name': name,
+                'location_id': parent_id,
+                'usage': 'internal',
+                'company_id': pairs[(parent_id, name)].company_id.id,
+            } for parent_id, name in missing]
+            created, errors = self._create_batched('stock.location', vals_list, missing)
+            result.update(created)
+            for key, error in errors.items():
+                _logger.warning(f"⚠️ Emplacement '{key[1]}' non créé: {error}")
+            if created:
+                _logger.info(f"✅ {len(created)} emplacement(s) enfant(s) créé(s)")
+        return result
+
+    @api.model
+    def _map_products(self, specs, create=False):
+        """Produits par code article, créés par lots si demandé.
+
+        Args:
+            specs: dict {code: valeurs de création du produit}
+
+        Returns:
+            tuple (dict {code: product.product}, dict {code: message d'erreur})
+        """
+        codes = [code for code in specs if code]
+        result, errors = {}, {}
+        Product = self.env['product.product']
+        for batch in self._chunks(codes):
+            for product in Product.search([('default_code', 'in', batch)], order='id'):
+                result.setdefault(product.default_code, product)
+        missing = [code for code in codes if code not in result]
+        if missing and create:
+            created, errors = self._create_batched('product.product', [specs[code] for code in missing], missing)
+            result.update(created)
+            if created:
+                _logger.info(f"📦 {len(created)} produit(s) créé(s)")
+        return result, errors
+
+    @api.model
+    def _map_quants(self, pairs, company):
+        """Quants des couples (produit, emplacement) exacts, en une requête.
+
+        Returns:
+            dict {(product_id, location_id): {'id', 'quantity', 'available'}}
+            où available = quantité - quantité réservée
+        """
+        pairs = list({(p, l) for p, l in pairs if p and l})
+        if not pairs:
+            return {}
+        self.env['stock.quant'].flush_model(['product_id', 'location_id', 'company_id', 'quantity', 'reserved_quantity'])
+        self.env.cr.execute("""
+            SELECT q.product_id, q.location_id, MIN(q.id),
+                   SUM(q.quantity), SUM(q.quantity - q.reserved_quantity)
+            FROM stock_quant q
+            JOIN unnest(%s::int[], %s::int[]) AS k(product_id, location_id)
+                ON k.product_id = q.product_id AND k.location_id = q.location_id
+            WHERE q.company_id = %s
+            GROUP BY q.product_id, q.location_id
+        """, [[p[0] for p in pairs], [p[1] for p in pairs], company.id])
+        return {
+            (product_id, location_id): {'id': quant_id, 'quantity': quantity, 'available': available}
+            for product_id, location_id, quant_id, quantity, available in self.env.cr.fetchall()
+        }
+
+    # ------------------------------------------------------------------
+    # Mises à jour groupées
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _write_grouped(self, records_values, field_name):
+        """Écrit field_name sur chaque enregistrement, un write par valeur distincte.
+
+        Args:
+            records_values: dict {enregistrement: valeur} (id pour un Many2one)
+        """
+        by_value = {}
+        for record, value in records_values.items():
+            current = record[field_name]
+            if isinstance(current, models.BaseModel):
+                current = current.id
+            if current != value:
+                by_value[value] = by_value.get(value, record.browse()) | record
+        for value, records in by_value.items():
+            records.write({field_name: value})
+        return sum(len(records) for records in by_value.values())
+
+    @api.model
+    def _ensure_storable(self, products):
+        """Passe les produits en type Biens (consu) avec suivi d'inventaire, en une écriture."""
+        pp_fields = self.env['product.product']._fields
+        vals = {'type': 'consu'}
+        if 'is_storable' in pp_fields:
+            vals['is_storable'] = True
+        to_fix = products.filtered(
+            lambda p: p.type != 'consu' or ('is_storable' in pp_fields and not p.is_storable)
+        )
+        if to_fix:
+            to_fix.sudo().write(vals)
+            _logger.info(f"✅ {len(to_fix)} produit(s) convertis en Biens avec suivi d'inventaire")
+        return to_fix
+
+    # ------------------------------------------------------------------
+    # Lignes d'inventaire
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _create_inventory_lines(self, vals_list, row_numbers=None):
+        """Crée les lignes d'inventaire par paquets (create(vals_list)).
+
+        Args:
+            vals_list: liste de dicts de création de stockex.stock.inventory.line
+            row_numbers: numéro de ligne du fichier de chaque dict (rapport d'erreurs)
+
+        Returns:
+            tuple (stockex.stock.inventory.line créées, liste de messages d'erreur)
+        """
+        row_numbers = row_numbers or list(range(2, len(vals_list) + 2))
+        created, errors = self._create_batched('stockex.stock.inventory.line', vals_list, row_numbers)
+        lines = self.env['stockex.stock.inventory.line'].concat(*created.values())
+        messages = [f"Ligne {row}: {error}" for row, error in sorted(errors.items())]
+        _logger.info(f"✅ {len(lines)} ligne(s) d'inventaire créée(s), {len(messages)} erreur(s)")
+        return lines, messages
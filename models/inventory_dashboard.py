@@ -2,18 +2,33 @@
 
 from odoo import models, fields, api, tools
 from odoo.tools import date_utils
+from odoo.tools.lru import LRU
+from odoo.modules.registry import Registry
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
+import copy
 import logging
+import time
 
 _logger = logging.getLogger(__name__)
 
+# Cache des résultats de get_dashboard_data, propre au worker.
+# Chaque clé contient l'utilisateur (règles d'accès) et la version du cache,
+# valeur de la séquence stockex_dashboard_cache_seq, avancée dès qu'un
+# inventaire entre dans l'état Validé ou Annulé ou en sort : les autres
+# workers voient la nouvelle version et ignorent leurs anciennes entrées.
+_dashboard_cache = LRU(64)
+
 
 class InventoryDashboard(models.Model):
     _name = 'stockex.inventory.dashboard'
     _description = 'Dashboard Inventaire Stock-INV'
     _rec_name = 'id'
     
+    def init(self):
+        # Version du cache : une séquence avance sans verrou ni écriture de ligne
+        self.env.cr.execute("CREATE SEQUENCE IF NOT EXISTS stockex_dashboard_cache_seq")
+    
     @api.model
     def get_dashboard_data(self, period='30d', valuation_method='standard', warehouse_ids=None, region_ids=None):
         """
@@ -24,10 +39,171 @@ class InventoryDashboard(models.Model):
         :param warehouse_ids: Liste d'IDs entrepôts (None = tous)
         :param region_ids: Liste d'IDs régions (None = toutes)
         :return: dict avec toutes les métriques dashboard
+        
+        Le résultat est mis en cache (durée stockex.dashboard_cache_ttl) par
+        utilisateur, période, méthode, entrepôts, régions et sociétés ; le
+        cache est invalidé dès qu'un inventaire entre dans l'état Validé ou
+        Annulé ou en sort. Chaque appel reçoit sa propre copie du résultat.
         """
         date_from, date_to = self._get_period_dates(period)
         
+        ICP = self.env['ir.config_parameter'].sudo()
+        ttl = int(ICP.get_param('stockex.dashboard_cache_ttl', '300'))
+        cache_key = (
+            self.env.cr.dbname,
+            self._get_cache_version(),
+            self.env.uid,
+            tuple(self.env.companies.ids),
+            period, date_from, date_to, valuation_method,
+            tuple(sorted(warehouse_ids or ())),
+            tuple(sorted(region_ids or ())),
+        )
+        if ttl > 0:
+            cached = _dashboard_cache.get(cache_key)
+            if cached and cached[0] > time.monotonic():
+                return copy.deepcopy(cached[1])
+        
         # Construire le domaine de filtrage
+        domain = self._get_dashboard_domain(date_from, date_to, warehouse_ids, region_ids)
+        filters = self._get_dashboard_filters(date_from, date_to, warehouse_ids, region_ids)
+        
+        # KPI, graphiques et tableau entrepôts : table de faits stockex.variance.daily.
+        # Top écarts et alertes restent calculés ligne à ligne (prix chargés une seule fois).
+        inventories = self.env['stockex.stock.inventory'].search(domain)
+        price_cache = self._preload_product_prices(inventories, valuation_method)
+        
+        data = {
+            'period': period,
+            'date_from': date_from.strftime('%Y-%m-%d') if date_from else None,
+            'date_to': date_to.strftime('%Y-%m-%d') if date_to else None,
+            'valuation_method': valuation_method,
+            'kpis': self._compute_kpis(filters, inventories, valuation_method),
+            'charts': self._compute_charts(filters, valuation_method),
+            'warehouse_table': self._compute_warehouse_table(filters, valuation_method),
+            'top_variances': self._compute_top_variances(inventories, valuation_method, price_cache, limit=10),
+            'uninventoried_warehouses': self._compute_uninventoried_warehouses(domain, valuation_method, date_from, date_to),
+            'intelligent_alerts': self._compute_intelligent_alerts(inventories, valuation_method, price_cache),
+        }
+        if ttl > 0:
+            _dashboard_cache[cache_key] = (time.monotonic() + ttl, copy.deepcopy(data))
+        return data
+    
+    @api.model
+    def get_api_kpis(self, period='30d', valuation_method='standard', warehouse_id=None, company_ids=None,
+                     cache_version=None):
+        """KPIs globaux de l'API REST (/api/stockex/kpis).
+        
+        Uniquement des agrégats SQL : aucun quant ni inventaire n'est chargé.
+        Le résultat est mis en cache quelques secondes (stockex.api_kpi_cache_ttl,
+        60 par défaut) ; la validation d'un inventaire invalide le cache.
+        
+        :param period: période des écarts ('30d', 'ytd', '12m', 'all')
+        :param valuation_method: méthode des écarts ('standard' ou 'economic')
+        :param warehouse_id: ID entrepôt (None = tous)
+        :param company_ids: IDs sociétés (None = sociétés actives)
+        :param cache_version: validateur des données sources (ex: ETag de l'API),
+            une nouvelle valeur ignore les entrées en cache
+        """
+        date_from, date_to = self._get_period_dates(period)
+        company_ids = sorted(company_ids or self.env.companies.ids)
+        
+        ICP = self.env['ir.config_parameter'].sudo()
+        ttl = int(ICP.get_param('stockex.api_kpi_cache_ttl', '60'))
+        cache_key = (
+            'api_kpis',
+            self.env.cr.dbname,
+            self._get_cache_version(),
+            self.env.uid,
+            tuple(company_ids), warehouse_id,
+            period, date_from, date_to, valuation_method, cache_version,
+        )
+        if ttl > 0:
+            cached = _dashboard_cache.get(cache_key)
+            if cached and cached[0] > time.monotonic():
+                return copy.deepcopy(cached[1])
+        
+        # Inventaires par état, en une agrégation
+        inventory_domain = [('company_id', 'in', company_ids)]
+        if warehouse_id:
+            inventory_domain.append(('warehouse_id', '=', warehouse_id))
+        counts = dict(self.env['stockex.stock.inventory']._read_group(inventory_domain, ['state'], ['__count']))
+        
+        warehouse = self.env['stock.warehouse'].browse(warehouse_id) if warehouse_id else None
+        stock = self._compute_stock_totals(company_ids, warehouse)
+        
+        # Écarts des inventaires validés sur la période (table de faits journalière)
+        filters = self._get_dashboard_filters(date_from, date_to, [warehouse_id] if warehouse_id else None)
+        filters['company_ids'] = company_ids
+        totals = self.env['stockex.variance.daily']._aggregate(filters, valuation_method)
+        totals = totals[0] if totals else {}
+        
+        data = {
+            'total_inventories': sum(counts.values()),
+            'total_inventories_done': counts.get('done', 0),
+            'total_products': stock['products'],
+            'total_quantity': stock['quantity'],
+            'total_value': stock['value'],
+            'current_stock_value': stock['value'],
+            'stock_valuation_rule': ICP.get_param('stockex.valuation_rule', 'standard'),
+            'variance': {
+                'period': period,
+                'date_from': date_from.isoformat() if date_from else None,
+                'date_to': date_to.isoformat() if date_to else None,
+                'valuation_method': valuation_method,
+                'lines': totals.get('lines', 0),
+                'lines_with_variance': totals.get('lines_variance', 0),
+                'value_theoretical': totals.get('value_theo', 0.0),
+                'value_inventoried': totals.get('value_real', 0.0),
+                'value_variance': totals.get('variance_value', 0.0),
+                'variance_positive': totals.get('variance_positive', 0.0),
+                'variance_negative': totals.get('variance_negative', 0.0),
+            },
+        }
+        if ttl > 0:
+            _dashboard_cache[cache_key] = (time.monotonic() + ttl, copy.deepcopy(data))
+        return data
+    
+    @api.model
+    def _compute_stock_totals(self, company_ids, warehouse=None):
+        """Stock interne positif : produits distincts, quantité et valeur.
+        
+        Les quantités sont agrégées par (société, produit) en une requête, puis
+        valorisées selon la règle configurée (stockex.valuation_rule) avec
+        _get_valuation_prices, une série de lectures groupées par société.
+        """
+        self.env['stock.quant'].flush_model(['product_id', 'location_id', 'company_id', 'quantity'])
+        self.env['stock.location'].flush_model(['usage', 'parent_path'])
+        where = ["sl.usage = 'internal'", "sq.quantity > 0", "sq.company_id = ANY(%s)"]
+        params = [list(company_ids)]
+        if warehouse:
+            where.append("sl.parent_path LIKE %s")
+            params.append(f"{warehouse.view_location_id.parent_path}%")
+        self.env.cr.execute(f"""
+            SELECT sq.company_id, sq.product_id, SUM(sq.quantity)
+            FROM stock_quant sq
+            JOIN stock_location sl ON sl.id = sq.location_id
+            WHERE {' AND '.join(where)}
+            GROUP BY sq.company_id, sq.product_id
+        """, params)
+        quantities_by_company = {}
+        for company_id, product_id, quantity in self.env.cr.fetchall():
+            quantities_by_company.setdefault(company_id, {})[product_id] = quantity
+        
+        Inventory = self.env['stockex.stock.inventory']
+        products, total_quantity, total_value = set(), 0.0, 0.0
+        for company_id, quantities in quantities_by_company.items():
+            prices = Inventory._get_valuation_prices(
+                self.env['product.product'].browse(list(quantities)),
+                company=self.env['res.company'].browse(company_id),
+            )
+            total_value += sum(quantity * prices.get(product_id, 0.0) for product_id, quantity in quantities.items())
+            total_quantity += sum(quantities.values())
+            products.update(quantities)
+        return {'products': len(products), 'quantity': total_quantity, 'value': total_value}
+    
+    @api.model
+    def _get_dashboard_domain(self, date_from, date_to, warehouse_ids=None, region_ids=None):
+        """Domaine des inventaires validés couverts par le dashboard."""
         domain = [('state', '=', 'done')]
         if date_from:
             domain.append(('date', '>=', date_from))
@@ -37,20 +213,47 @@ class InventoryDashboard(models.Model):
             domain.append(('warehouse_id', 'in', warehouse_ids))
         if region_ids:
             domain.append(('warehouse_id.eneo_region_id', 'in', region_ids))
-        
+        return domain
+    
+    @api.model
+    def _get_dashboard_filters(self, date_from, date_to, warehouse_ids=None, region_ids=None):
+        """Filtres de la table de faits équivalents à _get_dashboard_domain."""
         return {
-            'period': period,
-            'date_from': date_from.strftime('%Y-%m-%d') if date_from else None,
-            'date_to': date_to.strftime('%Y-%m-%d') if date_to else None,
-            'valuation_method': valuation_method,
-            'kpis': self._compute_kpis(domain, valuation_method),
-            'charts': self._compute_charts(domain, valuation_method),
-            'warehouse_table': self._compute_warehouse_table(domain, valuation_method),
-            'top_variances': self._compute_top_variances(domain, valuation_method, limit=10),
-            'uninventoried_warehouses': self._compute_uninventoried_warehouses(domain, valuation_method, date_from, date_to),
-            'intelligent_alerts': self._compute_intelligent_alerts(domain, valuation_method),
+            'date_from': date_from,
+            'date_to': date_to,
+            'warehouse_ids': warehouse_ids or [],
+            'region_ids': region_ids or [],
+            'company_ids': self.env.companies.ids,
         }
     
+    @api.model
+    def _get_cache_version(self):
+        """Version courante du cache (commune à tous les workers)."""
+        self.env.cr.execute("SELECT last_value FROM stockex_dashboard_cache_seq")
+        return self.env.cr.fetchone()[0]
+    
+    @api.model
+    def _invalidate_dashboard_cache(self):
+        """Invalide le cache du dashboard dans tous les workers (nouvelle version).
+        
+        La séquence avance tout de suite puis de nouveau après le commit : un
+        worker qui aurait recalculé entre-temps sans voir les modifications
+        non encore validées ne garde pas ce résultat.
+        """
+        self.env.cr.execute("SELECT nextval('stockex_dashboard_cache_seq')")
+        _dashboard_cache.clear()
+        
+        postcommit = self.env.cr.postcommit
+        if not postcommit.data.get('stockex_dashboard_cache'):
+            postcommit.data['stockex_dashboard_cache'] = True
+            dbname = self.env.cr.dbname
+            
+            @postcommit.add
+            def bump_version():
+                with Registry(dbname).cursor() as cr:
+                    cr.execute("SELECT nextval('stockex_dashboard_cache_seq')")
+                _dashboard_cache.clear()
+    
     @api.model
     def _get_period_dates(self, period):
         """Calcule la plage de dates pour la période donnée."""
@@ -92,15 +295,11 @@ class InventoryDashboard(models.Model):
             return {}
         
         # Extraire tous les product_ids uniques
-        product_ids = set()
-        for inv in inventories:
-            for line in inv.line_ids:
-                product_ids.add(line.product_id.id)
+        product_ids = inventories.line_ids.product_id.ids
         
         if not product_ids:
             return {}
         
-        product_ids = list(product_ids)
         price_cache = {}
         
         # Récupérer la société et devise depuis le premier inventaire
@@ -170,11 +369,8 @@ class InventoryDashboard(models.Model):
         return price_cache
     
     @api.model
-    def _compute_kpis(self, domain, valuation_method):
-        """Calcule les KPI principaux."""
-        Inventory = self.env['stockex.stock.inventory']
-        inventories = Inventory.search(domain)
-        
+    def _compute_kpis(self, filters, inventories, valuation_method):
+        """Calcule les KPI principaux (totaux lus dans stockex.variance.daily)."""
         if not inventories:
             return {
                 'total_inventories': 0,
@@ -189,44 +385,33 @@ class InventoryDashboard(models.Model):
                 'products_unclassified': 0,
             }
         
-        # 🚀 OPTIMISATION: Précharger tous les prix en une seule fois
-        price_cache = self._preload_product_prices(inventories, valuation_method)
-        
-        # Calcul avec la méthode de valorisation choisie
-        total_value_real = 0
-        total_value_theo = 0
-        total_lines = 0
-        lines_with_variance = 0
-        products_set = set()
-        
-        for inv in inventories:
-            for line in inv.line_ids:
-                products_set.add(line.product_id.id)
-                total_lines += 1
-                
-                # 🚀 Utiliser le cache au lieu de requêtes répétées
-                price = price_cache.get(line.product_id.id, 0.0)
-                
-                total_value_real += line.product_qty * price
-                total_value_theo += line.theoretical_qty * price
-                
-                if line.difference != 0:
-                    lines_with_variance += 1
+        totals = self.env['stockex.variance.daily']._aggregate(filters, valuation_method)
+        totals = totals[0] if totals else {}
+        total_lines = totals.get('lines', 0)
+        lines_with_variance = totals.get('lines_variance', 0)
+        total_value_real = totals.get('value_real', 0.0)
+        total_value_theo = totals.get('value_theo', 0.0)
         
         value_variance = total_value_real - total_value_theo
         variance_rate = (abs(value_variance) / total_value_theo * 100) if total_value_theo > 0 else 0
         accuracy_rate = ((total_lines - lines_with_variance) / total_lines * 100) if total_lines > 0 else 0
         
-        # Produits non classés (sans catégorie)
-        products_unclassified = self.env['product.product'].search_count([
-            ('id', 'in', list(products_set)),
-            ('categ_id', '=', False)
-        ])
+        # Produits distincts et produits non classés (sans catégorie) en une requête
+        self.env['stockex.stock.inventory.line'].flush_model(['inventory_id', 'product_id'])
+        self.env.cr.execute("""
+            SELECT COUNT(DISTINCT line.product_id),
+                   COUNT(DISTINCT line.product_id) FILTER (WHERE pt.categ_id IS NULL)
+            FROM stockex_stock_inventory_line line
+            JOIN product_product pp ON pp.id = line.product_id
+            JOIN product_template pt ON pt.id = pp.product_tmpl_id
+            WHERE line.inventory_id = ANY(%s)
+        """, [inventories.ids])
+        total_products, products_unclassified = self.env.cr.fetchone()
         
         return {
             'total_inventories': len(inventories),
             'total_lines': total_lines,
-            'total_products': len(products_set),
+            'total_products': total_products,
             'value_inventoried': total_value_real,
             'value_theoretical': total_value_theo,
             'value_variance': value_variance,
@@ -237,38 +422,29 @@ class InventoryDashboard(models.Model):
         }
     
     @api.model
-    def _compute_charts(self, domain, valuation_method):
-        """🚀 Calcule les données pour les graphiques (optimisé avec cache)."""
-        Inventory = self.env['stockex.stock.inventory']
-        inventories = Inventory.search(domain)
-        
-        # 🚀 Précharger les prix une seule fois pour tous les graphiques
-        price_cache = self._preload_product_prices(inventories, valuation_method)
-        
+    def _compute_charts(self, filters, valuation_method):
+        """🚀 Calcule les données pour les graphiques (table de faits stockex.variance.daily)."""
         return {
-            'evolution': self._chart_evolution(inventories, valuation_method, price_cache),
-            'warehouse_performance': self._chart_warehouse_performance(inventories, valuation_method, price_cache),
-            'category_distribution': self._chart_category_distribution(inventories, valuation_method, price_cache),
-            'region_heatmap': self._chart_region_heatmap(inventories, valuation_method, price_cache),
-            'warehouse_distribution': self._chart_warehouse_distribution(inventories, valuation_method, price_cache),
-            'variance_trend': self._chart_variance_trend(inventories, valuation_method, price_cache),
+            'evolution': self._chart_evolution(filters, valuation_method),
+            'warehouse_performance': self._chart_warehouse_performance(filters, valuation_method),
+            'category_distribution': self._chart_category_distribution(filters, valuation_method),
+            'region_heatmap': self._chart_region_heatmap(filters, valuation_method),
+            'warehouse_distribution': self._chart_warehouse_distribution(filters, valuation_method),
+            'variance_trend': self._chart_variance_trend(filters, valuation_method),
         }
     
     @api.model
-    def _chart_evolution(self, inventories, valuation_method, price_cache):
-        """🚀 Graphique : Évolution temporelle (optimisé)."""
-        data_by_month = {}
-        for inv in inventories:
-            month_key = inv.date.strftime('%Y-%m')
-            if month_key not in data_by_month:
-                data_by_month[month_key] = {'value': 0, 'label': inv.date.strftime('%B %Y')}
-            
-            for line in inv.line_ids:
-                price = price_cache.get(line.product_id.id, 0.0)
-                data_by_month[month_key]['value'] += line.product_qty * price
+    def _month_label(self, month_key):
+        """Libellé '%B %Y' d'un mois 'YYYY-MM' (identique à date.strftime)."""
+        return datetime.strptime(month_key, '%Y-%m').strftime('%B %Y')
+    
+    @api.model
+    def _chart_evolution(self, filters, valuation_method):
+        """🚀 Graphique : Évolution temporelle (faits agrégés par mois)."""
+        rows = self.env['stockex.variance.daily']._aggregate(filters, valuation_method, group='month')
         
-        labels = [v['label'] for v in data_by_month.values()]
-        values = [v['value'] for v in data_by_month.values()]
+        labels = [self._month_label(row['key']) for row in rows]
+        values = [row['value_real'] for row in rows]
         
         return {
             'labels': labels,
@@ -282,22 +458,16 @@ class InventoryDashboard(models.Model):
         }
     
     @api.model
-    def _chart_warehouse_performance(self, inventories, valuation_method, price_cache):
-        """🚀 Graphique : Écarts par entrepôt avec distinction positif/négatif (optimisé)."""
-        warehouse_data = {}
-        for inv in inventories:
-            wh_name = inv.warehouse_id.name if inv.warehouse_id else 'Non défini'
-            if wh_name not in warehouse_data:
-                warehouse_data[wh_name] = {'variance_positive': 0, 'variance_negative': 0}
-            
-            for line in inv.line_ids:
-                price = price_cache.get(line.product_id.id, 0.0)
-                variance_value = line.difference * price
-                
-                if variance_value > 0:
-                    warehouse_data[wh_name]['variance_positive'] += variance_value
-                else:
-                    warehouse_data[wh_name]['variance_negative'] += abs(variance_value)
+    def _chart_warehouse_performance(self, filters, valuation_method):
+        """🚀 Graphique : Écarts par entrepôt avec distinction positif/négatif (faits agrégés)."""
+        rows = self.env['stockex.variance.daily']._aggregate(filters, valuation_method, group='warehouse_name')
+        warehouse_data = {
+            row['key']: {
+                'variance_positive': row['variance_positive'],
+                'variance_negative': row['variance_negative'],
+            }
+            for row in rows
+        }
         
         # Trier par écart total (positif + négatif)
         sorted_warehouses = sorted(
@@ -327,17 +497,10 @@ class InventoryDashboard(models.Model):
         }
     
     @api.model
-    def _chart_category_distribution(self, inventories, valuation_method, price_cache):
-        """🚀 Graphique : Répartition par catégorie produit (optimisé)."""
-        category_data = {}
-        for inv in inventories:
-            for line in inv.line_ids:
-                categ_name = line.product_id.categ_id.name if line.product_id.categ_id else 'Non classé'
-                if categ_name not in category_data:
-                    category_data[categ_name] = 0
-                
-                price = price_cache.get(line.product_id.id, 0.0)
-                category_data[categ_name] += line.product_qty * price
+    def _chart_category_distribution(self, filters, valuation_method):
+        """🚀 Graphique : Répartition par catégorie produit (faits agrégés)."""
+        rows = self.env['stockex.variance.daily']._aggregate(filters, valuation_method, group='category_name')
+        category_data = {row['key']: row['value_real'] for row in rows}
         
         # Trier et limiter aux top 10
         sorted_categories = sorted(category_data.items(), key=lambda x: x[1], reverse=True)[:10]
@@ -362,19 +525,13 @@ class InventoryDashboard(models.Model):
         }
     
     @api.model
-    def _chart_region_heatmap(self, inventories, valuation_method, price_cache):
-        """🔥 Graphique : Heatmap par région électrique avec dégradé de couleurs (optimisé)."""
-        region_data = {}
-        for inv in inventories:
-            region_name = inv.warehouse_id.eneo_region_id.name if inv.warehouse_id and inv.warehouse_id.eneo_region_id else 'Non défini'
-            if region_name not in region_data:
-                region_data[region_name] = {'variance': 0, 'count': 0}
-            
-            for line in inv.line_ids:
-                price = price_cache.get(line.product_id.id, 0.0)
-                variance_value = line.difference * price
-                region_data[region_name]['variance'] += abs(variance_value)
-                region_data[region_name]['count'] += 1
+    def _chart_region_heatmap(self, filters, valuation_method):
+        """🔥 Graphique : Heatmap par région électrique avec dégradé de couleurs (faits agrégés)."""
+        rows = self.env['stockex.variance.daily']._aggregate(filters, valuation_method, group='region_name')
+        region_data = {
+            row['key']: {'variance': row['variance_abs'], 'count': row['lines']}
+            for row in rows
+        }
         
         labels = list(region_data.keys())
         values = [data['variance'] for data in region_data.values()]
@@ -427,26 +584,18 @@ class InventoryDashboard(models.Model):
         }
     
     @api.model
-    def _chart_warehouse_distribution(self, inventories, valuation_method, price_cache):
-        """🚀 Graphique : Répartition valeur par entrepôt (optimisé)."""
-        warehouse_data = {}
-        for inv in inventories:
-            wh_id = inv.warehouse_id.id if inv.warehouse_id else False
-            wh_name = inv.warehouse_id.name if inv.warehouse_id else 'Non défini'
-            if wh_id not in warehouse_data:
-                warehouse_data[wh_id] = {
-                    'name': wh_name,
-                    'value_theoretical': 0,
-                    'value_inventoried': 0,
-                    'variance_value': 0
-                }
-            
-            for line in inv.line_ids:
-                price = price_cache.get(line.product_id.id, 0.0)
-                
-                warehouse_data[wh_id]['value_theoretical'] += line.theoretical_qty * price
-                warehouse_data[wh_id]['value_inventoried'] += line.product_qty * price
-                warehouse_data[wh_id]['variance_value'] += line.difference * price
+    def _chart_warehouse_distribution(self, filters, valuation_method):
+        """🚀 Graphique : Répartition valeur par entrepôt (faits agrégés)."""
+        rows = self.env['stockex.variance.daily']._aggregate(filters, valuation_method, group='warehouse')
+        warehouse_data = {
+            row['key'] or False: {
+                'name': row['label'] or 'Non défini',
+                'value_theoretical': row['value_theo'],
+                'value_inventoried': row['value_real'],
+                'variance_value': row['variance_value'],
+            }
+            for row in rows
+        }
         
         labels = [data['name'] for data in warehouse_data.values()]
         warehouse_ids = list(warehouse_data.keys())
@@ -477,25 +626,18 @@ class InventoryDashboard(models.Model):
         }
     
     @api.model
-    def _chart_variance_trend(self, inventories, valuation_method, price_cache):
-        """🚀 Graphique : Tendance des écarts dans le temps (optimisé)."""
-        data_by_month = {}
-        for inv in inventories:
-            month_key = inv.date.strftime('%Y-%m')
-            if month_key not in data_by_month:
-                data_by_month[month_key] = {
-                    'label': inv.date.strftime('%B %Y'),
-                    'variance': 0,
-                    'lines': 0,
-                    'lines_variance': 0
-                }
-            
-            for line in inv.line_ids:
-                data_by_month[month_key]['lines'] += 1
-                if line.difference != 0:
-                    data_by_month[month_key]['lines_variance'] += 1
-                    price = price_cache.get(line.product_id.id, 0.0)
-                    data_by_month[month_key]['variance'] += abs(line.difference * price)
+    def _chart_variance_trend(self, filters, valuation_method):
+        """🚀 Graphique : Tendance des écarts dans le temps (faits agrégés par mois)."""
+        rows = self.env['stockex.variance.daily']._aggregate(filters, valuation_method, group='month')
+        data_by_month = {
+            row['key']: {
+                'label': self._month_label(row['key']),
+                'variance': row['variance_abs'],
+                'lines': row['lines'],
+                'lines_variance': row['lines_variance'],
+            }
+            for row in rows
+        }
         
         labels = [v['label'] for v in data_by_month.values()]
         variance_values = [v['variance'] for v in data_by_month.values()]
@@ -529,50 +671,24 @@ class InventoryDashboard(models.Model):
         }
     
     @api.model
-    def _compute_warehouse_table(self, domain, valuation_method):
-        """🚀 Tableau : Répartition détaillée par entrepôt (optimisé)."""
-        Inventory = self.env['stockex.stock.inventory']
-        inventories = Inventory.search(domain)
-        
-        # 🚀 Précharger les prix
-        price_cache = self._preload_product_prices(inventories, valuation_method)
-        
-        warehouse_data = {}
-        for inv in inventories:
-            wh_id = inv.warehouse_id.id if inv.warehouse_id else False
-            wh_name = inv.warehouse_id.name if inv.warehouse_id else 'Non défini'
-            
-            if wh_id not in warehouse_data:
-                warehouse_data[wh_id] = {
-                    'id': wh_id,
-                    'name': wh_name,
-                    'qty_theo': 0,
-                    'qty_real': 0,
-                    'qty_variance': 0,
-                    'value_theo': 0,
-                    'value_real': 0,
-                    'value_variance': 0,
-                    'lines': 0,
-                    'lines_variance': 0,
-                }
-            
-            for line in inv.line_ids:
-                price = price_cache.get(line.product_id.id, 0.0)
-                
-                warehouse_data[wh_id]['qty_theo'] += line.theoretical_qty
-                warehouse_data[wh_id]['qty_real'] += line.product_qty
-                warehouse_data[wh_id]['qty_variance'] += line.difference
-                warehouse_data[wh_id]['value_theo'] += line.theoretical_qty * price
-                warehouse_data[wh_id]['value_real'] += line.product_qty * price
-                warehouse_data[wh_id]['value_variance'] += line.difference * price
-                warehouse_data[wh_id]['lines'] += 1
-                
-                if line.difference != 0:
-                    warehouse_data[wh_id]['lines_variance'] += 1
-        
-        # Ajouter le statut basé sur le taux d'écart
+    def _compute_warehouse_table(self, filters, valuation_method):
+        """🚀 Tableau : Répartition détaillée par entrepôt (faits agrégés)."""
         rows = []
-        for data in warehouse_data.values():
+        for row in self.env['stockex.variance.daily']._aggregate(filters, valuation_method, group='warehouse'):
+            data = {
+                'id': row['key'] or False,
+                'name': row['label'] or 'Non défini',
+                'qty_theo': row['qty_theo'],
+                'qty_real': row['qty_real'],
+                'qty_variance': row['qty_variance'],
+                'value_theo': row['value_theo'],
+                'value_real': row['value_real'],
+                'value_variance': row['variance_value'],
+                'lines': row['lines'],
+                'lines_variance': row['lines_variance'],
+            }
+            
+            # Ajouter le statut basé sur le taux d'écart
             variance_rate = (data['lines_variance'] / data['lines'] * 100) if data['lines'] > 0 else 0
             
             if variance_rate < 5:
@@ -599,14 +715,8 @@ class InventoryDashboard(models.Model):
         return rows
     
     @api.model
-    def _compute_top_variances(self, domain, valuation_method, limit=10):
+    def _compute_top_variances(self, inventories, valuation_method, price_cache, limit=10):
         """🚀 Top N des plus gros écarts (optimisé)."""
-        Inventory = self.env['stockex.stock.inventory']
-        inventories = Inventory.search(domain)
-        
-        # 🚀 Précharger les prix
-        price_cache = self._preload_product_prices(inventories, valuation_method)
-        
         variances = []
         for inv in inventories:
             for line in inv.line_ids:
@@ -646,17 +756,8 @@ class InventoryDashboard(models.Model):
         
         # Récupérer les données
         date_from, date_to = self._get_period_dates(period)
-        domain = [('state', '=', 'done')]
-        if date_from:
-            domain.append(('date', '>=', date_from))
-        if date_to:
-            domain.append(('date', '<=', date_to))
-        if warehouse_ids:
-            domain.append(('warehouse_id', 'in', warehouse_ids))
-        if region_ids:
-            domain.append(('warehouse_id.region_id', 'in', region_ids))
-        
-        table_data = self._compute_warehouse_table(domain, valuation_method)
+        filters = self._get_dashboard_filters(date_from, date_to, warehouse_ids, region_ids)
+        table_data = self._compute_warehouse_table(filters, valuation_method)
         
         # Créer le workbook
         wb = Workbook()
@@ -823,7 +924,7 @@ class InventoryDashboard(models.Model):
         }
     
     @api.model
-    def _compute_intelligent_alerts(self, domain, valuation_method):
+    def _compute_intelligent_alerts(self, inventories, valuation_method, price_cache):
         """🚨 Calcule les alertes intelligentes et anomalies.
         
         Returns:
@@ -839,9 +940,6 @@ class InventoryDashboard(models.Model):
                 'alert_details': liste des alertes pour affichage,
             }
         """
-        Inventory = self.env['stockex.stock.inventory']
-        inventories = Inventory.search(domain)
-        
         if not inventories:
             return {
                 'total_alerts': 0,
@@ -855,9 +953,6 @@ class InventoryDashboard(models.Model):
                 'alert_details': [],
             }
         
-        # Précharger les prix
-        price_cache = self._preload_product_prices(inventories, valuation_method)
-        
         alerts = []
         alerts_by_type = {
             'significant_variances': 0,
@@ -954,3 +1049,16 @@ class InventoryDashboard(models.Model):
             'alerts_by_type': alerts_by_type,
             'alert_details': alert_details,
         }
+
+
+class StockInventory(models.Model):
+    _inherit = 'stockex.stock.inventory'
+    
+    def write(self, vals):
+        """Invalide le cache du dashboard quand un inventaire entre dans l'état
+        Validé ou Annulé ou en sort (ex: retour en brouillon)."""
+        leaving = 'state' in vals and any(state in ('done', 'cancel') for state in self.mapped('state'))
+        res = super().write(vals)
+        if leaving or vals.get('state') in ('done', 'cancel'):
+            self.env['stockex.inventory.dashboard']._invalidate_dashboard_cache()
+        return res
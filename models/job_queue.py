@@ -0,0 +1,592 @@
+# -*- coding: utf-8 -*-
+"""
+File de tâches de fond persistante.
+
+Les traitements longs (validation de gros inventaires, synchronisation Kobo,
+imports Excel, nettoyage) sont enregistrés dans stockex.job puis exécutés par
+le cron « Stockex: Exécution des Tâches de Fond ». Chaque tâche survit au
+redémarrage des workers : une tâche « En cours » dont le signe de vie a expiré
+est remise en attente et reprend depuis son dernier point de contrôle.
+
+Une tâche en cours est vivante tant que son worker détient le verrou
+consultatif PostgreSQL de la tâche, pris sur une connexion dédiée : un lot
+plus long que stockex.job_stale_minutes n'est donc jamais relancé en double.
+
+Les tâches posées sur un assistant (TransientModel) ne dépendent pas de
+l'enregistrement, que le nettoyage des modèles transitoires peut supprimer :
+les valeurs de l'assistant sont copiées dans les arguments de la tâche et
+ses fichiers dans des pièces jointes de la tâche, puis l'assistant est
+reconstruit en mémoire à l'exécution.
+
+Les tâches terminées, échouées ou annulées depuis plus de
+stockex.job_retention_days (30 jours) sont supprimées par le nettoyage
+automatique, avec les fichiers d'entrée qu'aucune autre tâche n'utilise.
+
+Parallélisme : les tâches d'un même processus Odoo partagent le GIL, les
+traitements Python (lecture Excel, préparation des lots) n'y avancent donc
+pas en parallèle. En mode multi-processus (--workers), chaque passage du cron
+n'exécute que stockex.job_threads_per_worker tâche(s) dans son processus et
+relance le cron pour les suivantes, qui sont prises par les autres workers
+cron : prévoir --max-cron-threads au moins égal à stockex.job_max_parallel.
+"""
+
+import base64
+import json
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from odoo import models, fields, api, SUPERUSER_ID
+from odoo.exceptions import UserError
+from odoo.modules.registry import Registry
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# Préfixe obligatoire des méthodes exécutables par la file
+JOB_METHOD_PREFIX = '_job_'
+
+# Espace de noms des verrous consultatifs (pg_advisory_*(JOB_LOCK_NAMESPACE, job_id))
+JOB_LOCK_NAMESPACE = 0x53544b58
+
+# Préfixe des threads d'exécution (comptés par processus)
+JOB_THREAD_PREFIX = 'stockex-job-'
+
+
+class StockexJob(models.Model):
+    """Tâche de fond StockEx exécutée par le cron de la file."""
+    _name = 'stockex.job'
+    _description = 'Tâche de Fond StockEx'
+    _order = 'priority, id'
+
+    name = fields.Char(
+        string='Nom',
+        required=True,
+        readonly=True
+    )
+    job_type = fields.Selection(
+        selection=[
+            ('inventory_validation', 'Validation d\'inventaire'),
+            ('kobo_sync', 'Synchronisation Kobo'),
+            ('kobo_photos', 'Photos Kobo'),
+            ('excel_import', 'Import Excel'),
+            ('initial_stock_import', 'Import du stock initial'),
+            ('cleanup', 'Nettoyage des données'),
+        ],
+        string='Type',
+        required=True,
+        readonly=True,
+        index=True
+    )
+    state = fields.Selection(
+        selection=[
+            ('pending', 'En attente'),
+            ('running', 'En cours'),
+            ('done', 'Terminée'),
+            ('failed', 'Échouée'),
+            ('cancelled', 'Annulée'),
+        ],
+        string='État',
+        default='pending',
+        required=True,
+        readonly=True,
+        index=True
+    )
+    res_model = fields.Char(
+        string='Modèle',
+        required=True,
+        readonly=True
+    )
+    res_id = fields.Integer(
+        string='ID Enregistrement',
+        required=True,
+        readonly=True
+    )
+    method = fields.Char(
+        string='Méthode',
+        required=True,
+        readonly=True,
+        help='Méthode appelée sur l\'enregistrement (préfixe _job_ obligatoire)'
+    )
+    args = fields.Text(
+        string='Arguments (JSON)',
+        readonly=True,
+        default='{}'
+    )
+    priority = fields.Integer(
+        string='Priorité',
+        default=10,
+        help='Les tâches de plus petite priorité sont exécutées en premier'
+    )
+    attempts = fields.Integer(
+        string='Tentatives',
+        default=0,
+        readonly=True
+    )
+    max_attempts = fields.Integer(
+        string='Tentatives Max',
+        default=3
+    )
+    progress_done = fields.Integer(
+        string='Traités',
+        default=0,
+        readonly=True
+    )
+    progress_total = fields.Integer(
+        string='Total',
+        default=0,
+        readonly=True
+    )
+    progress = fields.Float(
+        string='Progression (%)',
+        compute='_compute_progress'
+    )
+    checkpoint = fields.Integer(
+        string='Point de Contrôle',
+        default=0,
+        readonly=True,
+        help='Position de reprise validée en base (ex. dernière ligne d\'inventaire ajustée)'
+    )
+    user_id = fields.Many2one(
+        comodel_name='res.users',
+        string='Demandé par',
+        default=lambda self: self.env.user,
+        readonly=True
+    )
+    company_id = fields.Many2one(
+        comodel_name='res.company',
+        string='Société',
+        default=lambda self: self.env.company,
+        readonly=True
+    )
+    date_started = fields.Datetime(
+        string='Démarrée le',
+        readonly=True
+    )
+    date_finished = fields.Datetime(
+        string='Terminée le',
+        readonly=True
+    )
+    heartbeat = fields.Datetime(
+        string='Dernier Signe de Vie',
+        readonly=True
+    )
+    worker = fields.Char(
+        string='Worker',
+        readonly=True
+    )
+    result = fields.Text(
+        string='Résultat',
+        readonly=True,
+        help='Résultat JSON enregistré par la tâche (ex: compteurs d\'un lot d\'import)'
+    )
+    exc_info = fields.Text(
+        string='Erreur',
+        readonly=True
+    )
+
+    @api.depends('progress_done', 'progress_total', 'state')
+    def _compute_progress(self):
+        for job in self:
+            if job.state == 'done':
+                job.progress = 100.0
+            elif job.progress_total:
+                job.progress = min(100.0, job.progress_done * 100.0 / job.progress_total)
+            else:
+                job.progress = 0.0
+
+    # ------------------------------------------------------------------
+    # Mise en file
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _enqueue(self, record, method, job_type, name=None, args=None,
+                 total=0, priority=10, max_attempts=3):
+        """Enregistre une tâche de fond sur un enregistrement.
+
+        Args:
+            record: enregistrement (singleton) sur lequel appeler la méthode
+            method: nom de la méthode, appelée avec job=<stockex.job> et **args
+            job_type: valeur de la sélection job_type
+            args: dict d'arguments JSON-sérialisables
+
+        Returns:
+            stockex.job créé
+        """
+        record.ensure_one()
+        if not method.startswith(JOB_METHOD_PREFIX) or not hasattr(record, method):
+            raise UserError(f"Méthode de tâche invalide : {record._name}.{method}")
+        args = dict(args or {})
+        files = {}
+        if record._transient:
+            # L'assistant peut être supprimé avant l'exécution : copier ses entrées
+            args['_wizard'], files = self._get_wizard_snapshot(record)
+        job = self.sudo().create({
+            'name': name or f"{record.display_name} - {method}",
+            'job_type': job_type,
+            'res_model': record._name,
+            'res_id': self._get_res_id(record),
+            'method': method,
+            'args': json.dumps(args, default=str),
+            'progress_total': total,
+            'priority': priority,
+            'max_attempts': max_attempts,
+            'user_id': self.env.user.id,
+            'company_id': self.env.company.id,
+        })
+        # Fichiers copiés pour la première tâche de l'assistant : rattachés à celle-ci
+        self.env['ir.attachment'].sudo().browse(list(files.values())).filtered(
+            lambda attachment: not attachment.res_id
+        ).write({'res_id': job.id})
+        _logger.info(f"📥 Tâche {job.id} mise en file: {job.name}")
+        return job
+
+    @api.model
+    def _get_res_id(self, record):
+        """Identifiant de l'enregistrement d'une tâche, y compris un assistant reconstruit."""
+        if isinstance(record.id, int):
+            return record.id
+        return record._origin.id or record.env.context.get('stockex_job_res_id') or 0
+
+    @api.model
+    def _get_wizard_snapshot(self, wizard):
+        """Valeurs d'un assistant et copies persistantes de ses fichiers.
+
+        Returns:
+            tuple (dict {'values', 'files'} sérialisable en JSON,
+                   dict {champ: id ir.attachment})
+        """
+        Attachment = self.env['ir.attachment'].sudo()
+        # Assistant déjà reconstruit par une tâche : ses fichiers sont connus
+        files = dict(wizard.env.context.get('stockex_job_files') or {})
+        values = {}
+        for name, field in wizard._fields.items():
+            if field.automatic or not field.store or field.type in ('one2many', 'many2many'):
+                continue
+            value = wizard[name]
+            if field.type == 'binary':
+                if name in files or not value:
+                    continue
+                # Une copie par assistant et par champ, partagée par toutes ses tâches
+                source = Attachment.search([
+                    ('res_model', '=', wizard._name),
+                    ('res_id', '=', wizard.id),
+                    ('res_field', '=', name),
+                ], limit=1)
+                copy_name = f"stockex-job-input:{wizard._name}:{wizard.id}:{name}"
+                attachment = Attachment.search([('res_model', '=', self._name), ('name', '=', copy_name)], limit=1)
+                if not attachment:
+                    attachment = Attachment.create({
+                        'name': copy_name,
+                        'res_model': self._name,
+                        'raw': source.raw if source else base64.b64decode(wizard.with_context(bin_size=False)[name]),
+                    })
+                files[name] = attachment.id
+            elif field.type == 'many2one':
+                values[name] = value.id
+            else:
+                values[name] = field.convert_to_write(value, wizard)
+        return {'values': values, 'files': files}, files
+
+    def _build_wizard(self, Model, snapshot):
+        """Assistant reconstruit en mémoire (non enregistré) depuis son instantané.
+
+        Les champs binaires portent un marqueur ; le fichier est lu dans la
+        pièce jointe de la tâche (contexte stockex_job_files, voir
+        stockex.import.engine._binary_to_path).
+        """
+        self.ensure_one()
+        files = snapshot.get('files', {})
+        values = dict(snapshot.get('values', {}))
+        for name, attachment_id in files.items():
+            values[name] = f"stockex-job-file:{attachment_id}"
+        return Model.with_context(stockex_job_files=files, stockex_job_res_id=self.res_id).new(values)
+
+    @api.model
+    def _find_active(self, record, method):
+        """Tâche en attente ou en cours pour (enregistrement, méthode), s'il y en a une."""
+        return self.sudo().search([
+            ('res_model', '=', record._name),
+            ('res_id', '=', self._get_res_id(record)),
+            ('method', '=', method),
+            ('state', 'in', ('pending', 'running')),
+        ], limit=1)
+
+    # ------------------------------------------------------------------
+    # API utilisée par les méthodes de tâche
+    # ------------------------------------------------------------------
+
+    def _update_progress(self, done=None, total=None, checkpoint=None):
+        """Met à jour la progression et le signe de vie.
+
+        Écrit dans la transaction courante : le point de contrôle est donc
+        validé en même temps que le lot qu'il décrit.
+        """
+        self.ensure_one()
+        vals = {'heartbeat': fields.Datetime.now()}
+        if done is not None:
+            vals['progress_done'] = done
+        if total is not None:
+            vals['progress_total'] = total
+        if checkpoint is not None:
+            vals['checkpoint'] = checkpoint
+        self.sudo().write(vals)
+
+    # ------------------------------------------------------------------
+    # Actions utilisateur
+    # ------------------------------------------------------------------
+
+    def action_cancel(self):
+        """Annule les tâches en attente (les tâches en cours vont à leur terme)."""
+        self.filtered(lambda j: j.state == 'pending').write({
+            'state': 'cancelled',
+            'date_finished': fields.Datetime.now(),
+        })
+        return True
+
+    def action_retry(self):
+        """Remet en attente des tâches échouées ou annulées (reprise au point de contrôle)."""
+        self.filtered(lambda j: j.state in ('failed', 'cancelled')).write({
+            'state': 'pending',
+            'attempts': 0,
+            'exc_info': False,
+            'date_finished': False,
+        })
+        return True
+
+    # ------------------------------------------------------------------
+    # Exécution (cron)
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _get_runner_params(self):
+        """Paramètres du cron.
+
+        threads_per_worker vaut 0 par défaut : une tâche par processus en mode
+        multi-processus, toutes les tâches dans le processus unique sinon.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        max_parallel = max(1, int(ICP.get_param('stockex.job_max_parallel', '4') or 4))
+        threads_per_worker = int(ICP.get_param('stockex.job_threads_per_worker', '0') or 0)
+        if threads_per_worker <= 0:
+            threads_per_worker = 1 if config['workers'] else max_parallel
+        return {
+            'max_parallel': max_parallel,
+            'threads_per_worker': threads_per_worker,
+            'stale_minutes': max(1, int(ICP.get_param('stockex.job_stale_minutes', '15'))),
+        }
+
+    @api.model
+    def _requeue_stale_jobs(self, stale_minutes):
+        """Remet en attente les tâches « En cours » dont le worker a disparu.
+
+        Une tâche est orpheline si son signe de vie a expiré et que plus aucune
+        connexion ne détient son verrou consultatif (worker arrêté ou tué).
+        Le CASE garantit que le verrou n'est testé que pour les tâches expirées.
+        """
+        limit = fields.Datetime.now() - timedelta(minutes=stale_minutes)
+        self.flush_model()
+        self.env.cr.execute("""
+            UPDATE stockex_job
+               SET state = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END,
+                   exc_info = COALESCE(exc_info, '') || %s,
+                   write_date = (now() at time zone 'UTC')
+             WHERE state = 'running'
+               AND CASE WHEN COALESCE(heartbeat, date_started, create_date) < %s
+                        THEN pg_try_advisory_xact_lock(%s, id)
+                        ELSE FALSE END
+         RETURNING id, state
+        """, ["\nWorker perdu : tâche reprise depuis son point de contrôle.\n", limit, JOB_LOCK_NAMESPACE])
+        requeued = self.env.cr.fetchall()
+        if requeued:
+            _logger.warning(f"♻️ {len(requeued)} tâche(s) orpheline(s) remise(s) en file: {requeued}")
+            self.invalidate_model()
+        return requeued
+
+    @api.model
+    def _claim_jobs(self, limit):
+        """Réserve jusqu'à `limit` tâches en attente.
+
+        FOR UPDATE SKIP LOCKED : deux workers qui exécutent le cron en même
+        temps ne peuvent pas réserver la même tâche.
+        """
+        if limit <= 0:
+            return []
+        self.flush_model()
+        self.env.cr.execute("""
+            UPDATE stockex_job
+               SET state = 'running',
+                   attempts = attempts + 1,
+                   date_started = (now() at time zone 'UTC'),
+                   heartbeat = (now() at time zone 'UTC'),
+                   worker = %s,
+                   write_date = (now() at time zone 'UTC')
+             WHERE id IN (
+                SELECT id FROM stockex_job
+                 WHERE state = 'pending'
+                 ORDER BY priority, id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+             )
+         RETURNING id
+        """, [f"{socket.gethostname()}:{os.getpid()}", limit])
+        job_ids = [row[0] for row in self.env.cr.fetchall()]
+        self.invalidate_model()
+        return job_ids
+
+    @api.model
+    def _cron_run_jobs(self):
+        """Boucle du cron : récupère les orphelines, réserve et exécute les tâches.
+
+        Au plus stockex.job_max_parallel tâches tournent en même temps, tous
+        workers confondus, et au plus threads_per_worker dans ce processus ;
+        chacune dispose de son propre curseur et de son propre thread. S'il
+        reste des tâches en attente, le cron est relancé aussitôt pour qu'un
+        autre worker cron les prenne (voir la note sur le GIL en tête de
+        module). Le cron n'attend pas la fin des tâches : une tâche longue
+        n'est pas bornée par la limite de temps du cron, et si le worker
+        s'arrête, elle reprend plus tard depuis son point de contrôle.
+        """
+        params = self._get_runner_params()
+        self._requeue_stale_jobs(params['stale_minutes'])
+
+        self.env.cr.execute("SELECT COUNT(*) FROM stockex_job WHERE state = 'running'")
+        running = self.env.cr.fetchone()[0]
+        local = sum(1 for thread in threading.enumerate() if thread.name.startswith(JOB_THREAD_PREFIX))
+        job_ids = self._claim_jobs(min(params['max_parallel'] - running, params['threads_per_worker'] - local))
+        # Rendre la réservation visible avant de lancer les tâches
+        self.env.cr.commit()
+        if not job_ids:
+            return True
+
+        if running + len(job_ids) < params['max_parallel'] and self.search_count([('state', '=', 'pending')], limit=1):
+            cron = self.env.ref('stockex.ir_cron_job_runner', raise_if_not_found=False)
+            if cron:
+                cron.sudo()._trigger()
+                self.env.cr.commit()
+
+        dbname = self.env.cr.dbname
+        for job_id in job_ids:
+            thread = threading.Thread(
+                target=self._run_job_in_new_cursor,
+                args=(dbname, job_id),
+                name=f"{JOB_THREAD_PREFIX}{job_id}",
+                daemon=True,
+            )
+            thread.start()
+        return True
+
+    @staticmethod
+    def _run_job_in_new_cursor(dbname, job_id):
+        """Exécute une tâche réservée dans son propre curseur.
+
+        Une seconde connexion détient le verrou consultatif de la tâche
+        pendant toute son exécution : il tient lieu de signe de vie, quelle
+        que soit la durée des lots, et disparaît avec le worker.
+        """
+        threading.current_thread().dbname = dbname
+        registry = Registry(dbname)
+        with registry.cursor() as lock_cr:
+            lock_cr.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", [JOB_LOCK_NAMESPACE, job_id])
+            if not lock_cr.fetchone()[0]:
+                _logger.warning(f"⚠️ Tâche {job_id} déjà exécutée par un autre worker")
+                return
+            with registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env['stockex.job'].browse(job_id)._perform()
+
+    def _perform(self):
+        """Appelle la méthode de la tâche puis enregistre son issue.
+
+        La méthode peut valider (commit) ses propres lots ; en cas d'erreur,
+        seule la transaction en cours est annulée et la tâche repart plus
+        tard de son dernier point de contrôle, dans la limite de max_attempts.
+        
+        La méthode s'exécute avec les droits de l'utilisateur qui a demandé
+        la tâche (règles d'accès et règles d'enregistrement comprises).
+        """
+        self.ensure_one()
+        cr = self.env.cr
+        job_id = self.id
+        _logger.info(f"▶️ Tâche {job_id} démarrée: {self.name} (tentative {self.attempts}/{self.max_attempts})")
+        try:
+            if not self.method.startswith(JOB_METHOD_PREFIX):
+                raise UserError(f"Méthode de tâche invalide : {self.method}")
+            kwargs = json.loads(self.args or '{}')
+            Model = self.env[self.res_model].with_user(self.user_id or SUPERUSER_ID)
+            if self.company_id:
+                Model = Model.with_company(self.company_id)
+            snapshot = kwargs.pop('_wizard', None)
+            if snapshot is not None:
+                record = self._build_wizard(Model, snapshot)
+            else:
+                record = Model.browse(self.res_id).exists()
+                if not record:
+                    raise UserError(f"Enregistrement introuvable : {self.res_model}({self.res_id})")
+            record = record.with_context(stockex_job_id=job_id)
+            getattr(record, self.method)(job=self, **kwargs)
+            self.write({
+                'state': 'done',
+                'date_finished': fields.Datetime.now(),
+                'heartbeat': fields.Datetime.now(),
+                'exc_info': False,
+            })
+            cr.commit()
+            _logger.info(f"✅ Tâche {job_id} terminée")
+        except Exception as e:
+            cr.rollback()
+            self.invalidate_model()
+            job = self.browse(job_id)
+            retry = job.attempts < job.max_attempts
+            job.write({
+                'state': 'pending' if retry else 'failed',
+                'exc_info': traceback.format_exc(),
+                'date_finished': False if retry else fields.Datetime.now(),
+            })
+            cr.commit()
+            _logger.error(
+                f"❌ Tâche {job_id} en échec ({'nouvelle tentative' if retry else 'abandon'}): {e}",
+                exc_info=True
+            )
+
+    # ------------------------------------------------------------------
+    # Nettoyage
+    # ------------------------------------------------------------------
+
+    def _get_input_files(self):
+        """Identifiants des pièces jointes d'entrée de la tâche ({champ: id})."""
+        self.ensure_one()
+        return json.loads(self.args or '{}').get('_wizard', {}).get('files', {})
+
+    @api.autovacuum
+    def _gc_jobs(self):
+        """Supprime les tâches finies depuis plus de stockex.job_retention_days (30 jours).
+
+        Un fichier d'entrée est partagé par toutes les tâches d'un assistant :
+        encore utilisé par une tâche conservée, il est rattaché à celle-ci.
+        """
+        days = int(self.env['ir.config_parameter'].sudo().get_param('stockex.job_retention_days', '30') or 30)
+        old = self.sudo().search([
+            ('state', 'in', ('done', 'failed', 'cancelled')),
+            ('date_finished', '<', fields.Datetime.now() - timedelta(days=days)),
+        ])
+        if not old:
+            return
+        Attachment = self.env['ir.attachment'].sudo()
+        attachment_ids = set(Attachment.search([('res_model', '=', self._name), ('res_id', 'in', old.ids)]).ids)
+        for job in old:
+            attachment_ids.update(job._get_input_files().values())
+        if attachment_ids:
+            kept = self.sudo().search([('id', 'not in', old.ids), ('res_model', 'in', list(set(old.mapped('res_model'))))])
+            for job in kept:
+                shared = attachment_ids.intersection(job._get_input_files().values())
+                if shared:
+                    Attachment.browse(list(shared)).write({'res_id': job.id})
+                    attachment_ids -= shared
+        Attachment.browse(list(attachment_ids)).exists().unlink()
+        count = len(old)
+        old.unlink()
+        _logger.info(f"🧹 {count} tâche(s) de fond supprimée(s), {len(attachment_ids)} fichier(s) d'entrée")
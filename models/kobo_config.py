@@ -1,18 +1,153 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from odoo import models, fields, api
 from odoo.exceptions import UserError
 
+from .photo_cache import PHOTO_EXTENSIONS, compress_photo, photo_checksum
+
 _logger = logging.getLogger(__name__)
 
 
+class KoboSubmissionPager:
+    """Lecture paginée des soumissions d'un formulaire Kobo (API v2).
+    
+    Les soumissions sont demandées triées par _id croissant, page par page,
+    en suivant le lien « next » renvoyé par l'API (ou à défaut les paramètres
+    start/limit). Chaque page est rendue dès sa réception : l'appelant peut la
+    traiter et enregistrer le plus grand _id comme curseur de reprise.
+    """
+    
+    def __init__(self, base_url, form_id, session, page_size=500, timeout=60):
+        self.base_url = (base_url or '').rstrip('/')
+        self.form_id = (form_id or '').strip()
+        self.session = session
+        self.page_size = page_size
+        self.timeout = timeout
+    
+    @property
+    def data_url(self):
+        return f"{self.base_url}/api/v2/assets/{self.form_id}/data/"
+    
+    def _params(self, start_after=0, query=None, limit=None):
+        query = dict(query or {})
+        if start_after:
+            query['_id'] = {'$gt': start_after}
+        params = {
+            'format': 'json',
+            'limit': limit or self.page_size,
+            'sort': json.dumps({'_id': 1}),
+        }
+        if query:
+            params['query'] = json.dumps(query)
+        return params
+    
+    def _get_page(self, url, params=None):
+        """Lit une page de l'API ; UserError si la réponse n'est pas un JSON valide."""
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        if response.status_code != 200:
+            raise UserError(
+                f"Erreur lors de la récupération des données:\n"
+                f"Code: {response.status_code}\n"
+                f"Message: {(response.text or '')[:300]}"
+            )
+        # Tolérance aux réponses non-JSON (HTML du DRF)
+        try:
+            return response.json()
+        except ValueError:
+            ct = response.headers.get('Content-Type') or 'n/a'
+            preview = (response.text or '')[:300].strip()
+            raise UserError(
+                "Réponse non-JSON de l'API Kobo.\n"
+                f"Content-Type: {ct}\n"
+                f"URL testée: {response.url or url}\n"
+                "Vérifiez l'UID, le token et que l'API renvoie bien du JSON (?format=json).\n"
+                f"Aperçu: {preview}"
+            )
+    
+    def count(self, start_after=0, query=None):
+        """Nombre de soumissions correspondantes, lu sur une page d'un seul élément."""
+        data = self._get_page(self.data_url, self._params(start_after, query, limit=1))
+        return data.get('count', len(data.get('results') or []))
+    
+    def pages(self, start_after=0, query=None):
+        """Itère sur les pages de soumissions d'_id supérieur à start_after.
+        
+        Yields:
+            liste des soumissions d'une page (jamais vide)
+        """
+        url = self.data_url
+        params = self._params(start_after, query)
+        start = 0
+        last_id = start_after or 0
+        while url:
+            data = self._get_page(url, params)
+            results = data.get('results') or []
+            if not results:
+                return
+            page_last_id = max(submission.get('_id') or 0 for submission in results)
+            if page_last_id and page_last_id <= last_id:
+                # Serveur qui ignore la pagination : la page a déjà été lue
+                _logger.warning(f"⚠️ Pagination Kobo sans progression (_id {page_last_id}), arrêt de la lecture")
+                return
+            last_id = max(last_id, page_last_id)
+            yield results
+            
+            if data.get('next'):
+                url, params = data['next'], None
+            elif len(results) >= self.page_size and params is not None:
+                start += len(results)
+                params = dict(params, start=start)
+            else:
+                url = None
+
+
+def fetch_photo(session, url, timeout=60):
+    """Télécharge une photo Kobo.
+    
+    Fonction sans accès à la base : appelée depuis les threads de téléchargement.
+    
+    Returns:
+        octets de la photo, ou None si erreur
+    """
+    try:
+        response = session.get(url, timeout=timeout)
+        if response.status_code != 200:
+            _logger.warning(f"Erreur téléchargement {url}: {response.status_code}")
+            return None
+        return response.content
+    except Exception as e:
+        _logger.error(f"Erreur lors du téléchargement de {url}: {e}")
+        return None
+
+
+def try_compress_photo(content, filename, max_dimension=1600, quality=90):
+    """compress_photo tolérant : None si le format n'est pas une image gérée ou en cas d'erreur."""
+    if not filename.lower().endswith(PHOTO_EXTENSIONS):
+        return None
+    try:
+        compressed = compress_photo(content, max_dimension, quality)
+    except Exception as e:
+        _logger.warning(f"Impossible de compresser {filename}: {e}")
+        return None
+    _logger.info(f"Image compressée: {filename} ({len(content) / 1024:.1f}KB → {len(compressed) / 1024:.1f}KB)")
+    return compressed
+
+
 class KoboCollectConfig(models.Model):
     """Configuration pour l'intégration Kobo Collect."""
     _name = 'stockex.kobo.config'
     _description = 'Configuration Kobo Collect'
     _order = 'id desc'
     
+    # Taille des pages lues sur l'API Kobo
+    _submission_page_size = 500
+    # Téléchargements de photos simultanés et taille des paquets écrits ensemble
+    _photo_workers = 8
+    _photo_batch_size = 50
+    
     name = fields.Char(
         string='Nom de la Configuration',
         required=True,
@@ -238,6 +373,15 @@ class KoboCollectConfig(models.Model):
         help='ID de la dernière soumission importée'
     )
     
+    import_inventory_id = fields.Many2one(
+        comodel_name='stockex.stock.inventory',
+        string='Inventaire en Cours d\'Import',
+        readonly=True,
+        ondelete='set null',
+        help='Inventaire rempli par un import interrompu : le prochain import '
+             '« Nouvelles soumissions » y ajoute les pages suivantes'
+    )
+    
     submissions_count = fields.Integer(
         string='Nombre de Soumissions',
         compute='_compute_submissions_count',
@@ -506,32 +650,229 @@ class KoboCollectConfig(models.Model):
                 }
             }
     
+    def _get_kobo_session(self, pool_size=None):
+        """Session HTTP authentifiée, connexions persistantes (keep-alive) et réutilisées."""
+        self.ensure_one()
+        try:
+            import requests
+            from requests.adapters import HTTPAdapter
+        except ImportError:
+            raise UserError(
+                "Le module 'requests' n'est pas installé.\n"
+                "Installez-le avec : pip3 install requests"
+            )
+        session = requests.Session()
+        session.headers.update({
+            'Authorization': f'Token {self.api_token}',
+            'Accept': 'application/json',
+        })
+        if pool_size:
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        return session
+    
+    def _get_submission_pager(self, page_size=None):
+        """Lecteur paginé des soumissions du formulaire (session HTTP authentifiée)."""
+        self.ensure_one()
+        return KoboSubmissionPager(
+            self.kobo_url, self.form_id, self._get_kobo_session(),
+            page_size=page_size or self._submission_page_size,
+        )
+    
+    def _enqueue_photo_download(self, inventory, photos):
+        """Met en file le téléchargement des photos de lignes d'inventaire importées.
+        
+        Args:
+            inventory: stockex.stock.inventory des lignes
+            photos: liste de dicts {line_id, field, filename, url}
+        """
+        self.ensure_one()
+        return self.env['stockex.job'].with_company(self.company_id)._enqueue(
+            self, '_job_download_photos',
+            job_type='kobo_photos',
+            name=f"Photos Kobo - {inventory.name}",
+            args={'inventory_id': inventory.id, 'photos': photos},
+            total=len(photos),
+        )
+    
+    def _job_download_photos(self, job, inventory_id, photos):
+        """Tâche de fond : télécharge, compresse et intègre les photos des lignes.
+        
+        Les photos sont traitées par paquets : téléchargement et compression en
+        parallèle (threads partageant une session HTTP), photos déjà connues
+        reprises du cache (voir _get_photos), puis écriture groupée des pièces
+        jointes et commit avec point de contrôle pour la reprise.
+        """
+        self.ensure_one()
+        workers = max(1, self._photo_workers)
+        attached = 0
+        missing = 0
+        
+        session = self._get_kobo_session(pool_size=workers)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for start in range(job.checkpoint, len(photos), self._photo_batch_size):
+                    batch = photos[start:start + self._photo_batch_size]
+                    written = self._write_line_photos(batch, self._get_photos(batch, session, executor))
+                    attached += written
+                    missing += len(batch) - written
+                    job._update_progress(done=start + len(batch), checkpoint=start + len(batch))
+                    self.env.cr.commit()
+        finally:
+            session.close()
+        
+        _logger.info(f"📷 Photos Kobo: {attached} intégrée(s), {missing} non disponible(s)")
+        inventory = self.env['stockex.stock.inventory'].browse(inventory_id).exists()
+        if inventory:
+            message = f"📷 Photos Kobo : {attached} photo(s) intégrée(s)"
+            if missing:
+                message += f", {missing} non disponible(s)"
+            inventory.message_post(body=message)
+    
+    def _get_photos(self, photos, session, executor):
+        """Contenu final (compressé si demandé) d'un paquet de photos, via le cache.
+        
+        1. URL déjà connue du cache : aucun téléchargement.
+        2. Sinon téléchargement (threads) ; photo d'origine déjà connue par son
+           empreinte SHA-256 : aucune compression.
+        3. Sinon compression (threads) et enregistrement de la variante.
+        
+        Returns:
+            octets de chaque photo (None si indisponible), dans l'ordre de photos
+        """
+        Cache = self.env['stockex.photo.cache']
+        if self.compress_photos:
+            max_size = self.photo_max_size or 1600
+            quality = max(70, min(95, self.photo_quality or 90))  # Limiter entre 70-95
+        else:
+            max_size = quality = 0
+        
+        contents = Cache._lookup_urls([photo['url'] for photo in photos], max_size, quality)
+        filenames = {photo['url']: photo['filename'] for photo in photos if photo['url'] not in contents}
+        if filenames:
+            _logger.info(f"📷 {len(photos) - len(filenames)} photo(s) reprise(s) du cache, {len(filenames)} à télécharger")
+            downloaded = {
+                url: content
+                for url, content in zip(filenames, executor.map(lambda url: fetch_photo(session, url), filenames))
+                if content
+            }
+            checksums = {url: photo_checksum(content) for url, content in downloaded.items()}
+            known = Cache._lookup_checksums(checksums.values(), max_size, quality)
+            
+            # Une compression par photo d'origine inconnue, même si plusieurs URL la partagent
+            originals = {}
+            for url, checksum in checksums.items():
+                if checksum not in known:
+                    originals.setdefault(checksum, url)
+            variants = dict(zip(originals, executor.map(
+                lambda url: try_compress_photo(downloaded[url], filenames[url], max_size, quality) if max_size else downloaded[url],
+                originals.values(),
+            )))
+            Cache._store([{
+                'checksum': checksum,
+                'content': variant,
+                'original_size': len(downloaded[originals[checksum]]),
+                'source_url': originals[checksum],
+            } for checksum, variant in variants.items() if variant], max_size, quality)
+            
+            for url, checksum in checksums.items():
+                # Photo non compressible : photo d'origine conservée
+                contents[url] = known.get(checksum) or variants.get(checksum) or downloaded[url]
+        
+        return [contents.get(photo['url']) for photo in photos]
+    
+    def _write_line_photos(self, photos, contents):
+        """Écrit les photos téléchargées sur les lignes, en une création groupée de pièces jointes.
+        
+        Args:
+            photos: dicts {line_id, field, ...}
+            contents: octets de chaque photo (None si indisponible), même ordre
+        
+        Returns:
+            nombre de photos écrites
+        """
+        line_model = 'stockex.stock.inventory.line'
+        lines = self.env[line_model].browse({photo['line_id'] for photo in photos}).exists()
+        values = {
+            (photo['line_id'], photo['field']): content
+            for photo, content in zip(photos, contents)
+            if content and photo['line_id'] in lines.ids
+        }
+        if not values:
+            return 0
+        
+        # Champs binaires attachment=True : une pièce jointe par (ligne, champ)
+        Attachment = self.env['ir.attachment'].sudo()
+        Attachment.search([
+            ('res_model', '=', line_model),
+            ('res_field', 'in', list({field for _line_id, field in values})),
+            ('res_id', 'in', lines.ids),
+        ]).filtered(lambda att: (att.res_id, att.res_field) in values).unlink()
+        Attachment.create([{
+            'name': field,
+            'res_model': line_model,
+            'res_field': field,
+            'res_id': line_id,
+            'type': 'binary',
+            'raw': content,
+        } for (line_id, field), content in values.items()])
+        lines.invalidate_recordset([field for _line_id, field in values])
+        return len(values)
+    
     @api.model
     def _cron_auto_sync(self):
-        """Méthode appelée par le cron pour synchronisation automatique."""
+        """Méthode appelée par le cron : met en file une synchronisation par configuration.
+        
+        L'import lui-même est exécuté par la file de tâches (stockex.job), une
+        configuration déjà en attente ou en cours n'étant pas remise en file.
+        """
+        Job = self.env['stockex.job']
         configs = self.search([('active', '=', True), ('auto_import', '=', True)])
         for config in configs:
-            try:
-                # Créer un wizard et lancer l'import
-                wizard = self.env['stockex.import.kobo.wizard'].create({
-                    'name': f'Import Auto Kobo - {fields.Date.today()}',
-                    'date': fields.Date.today(),
-                    'config_id': config.id,
-                    'company_id': config.company_id.id,
-                    'import_mode': 'all',
-                    'auto_validate': config.auto_validate,
-                })
-                
-                wizard.action_import()
-                _logger.info(f"Synchronisation automatique Kobo réussie: {config.name}")
-                
-                # Envoyer notification Telegram si activé
-                config._send_telegram_notification("Synchronisation automatique", "réussie")
-                
-            except Exception as e:
-                _logger.error(f"Erreur synchronisation auto Kobo {config.name}: {e}", exc_info=True)
-                # Envoyer notification d'erreur Telegram si activé
-                config._send_telegram_notification("Synchronisation automatique", f"échouée: {str(e)}")
+            if Job._find_active(config, '_job_sync'):
+                _logger.info(f"Synchronisation Kobo déjà en file: {config.name}")
+                continue
+            Job.with_company(config.company_id)._enqueue(
+                config, '_job_sync',
+                job_type='kobo_sync',
+                name=f'Import Auto Kobo - {config.name}',
+                max_attempts=1,
+            )
+    
+    def _job_sync(self, job):
+        """Tâche de fond : synchronisation automatique d'une configuration Kobo.
+        
+        Seules les soumissions postérieures au curseur last_submission_id
+        sont lues ; un import interrompu reprend dans son inventaire.
+        """
+        self.ensure_one()
+        try:
+            if not self.import_inventory_id and not self._get_submission_pager().count(self.last_submission_id or 0):
+                _logger.info(f"Synchronisation automatique Kobo: aucune nouvelle soumission ({self.name})")
+                return
+            
+            # Créer un wizard et lancer l'import
+            wizard = self.env['stockex.import.kobo.wizard'].create({
+                'name': f'Import Auto Kobo - {fields.Date.today()}',
+                'date': fields.Date.today(),
+                'config_id': self.id,
+                'company_id': self.company_id.id,
+                'import_mode': 'new_only',
+                'auto_validate': self.auto_validate,
+            })
+            
+            wizard.action_import()
+            _logger.info(f"Synchronisation automatique Kobo réussie: {self.name}")
+            
+            # Envoyer notification Telegram si activé
+            self._send_telegram_notification("Synchronisation automatique", "réussie")
+            
+        except Exception as e:
+            _logger.error(f"Erreur synchronisation auto Kobo {self.name}: {e}", exc_info=True)
+            # Envoyer notification d'erreur Telegram si activé
+            self._send_telegram_notification("Synchronisation automatique", f"échouée: {str(e)}")
+            raise
     
     def action_manual_sync(self):
         """Synchronisation manuelle avec KoboToolbox."""
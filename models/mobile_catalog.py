@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Catalogue produits hors ligne du scanner mobile.
+
+Le catalogue d'une société (ou des produits présents dans un entrepôt) est
+exporté en JSON Lines compressé gzip : une ligne d'en-tête (version,
+colonnes) puis une ligne par produit, sous forme de liste de valeurs dans
+l'ordre des colonnes. La version est la date de dernière modification des
+produits du périmètre : un client qui connaît une version ne télécharge que
+les produits modifiés depuis (les produits archivés y figurent avec
+active=false, pour suppression côté client).
+"""
+
+import gzip
+import json
+import logging
+from datetime import datetime, timedelta
+
+from odoo import models, api
+from odoo.tools.lru import LRU
+
+_logger = logging.getLogger(__name__)
+
+# Exports déjà compressés, propres au worker. La clé contient la version du
+# catalogue : toute modification de produit rend les anciennes entrées inutiles.
+_catalog_cache = LRU(16)
+
+CATALOG_COLUMNS = ['id', 'barcode', 'default_code', 'name', 'uom', 'price', 'active']
+
+# Version : horodatage de la dernière modification, à la microseconde
+VERSION_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+class MobileCatalog(models.AbstractModel):
+    """Export versionné du catalogue produits pour l'application mobile."""
+    _name = 'stockex.mobile.catalog'
+    _description = 'Catalogue Mobile StockEx'
+
+    # Recouvrement du différentiel : une transaction démarrée avant la version
+    # mais validée après reste incluse dans le différentiel suivant
+    _since_margin = timedelta(seconds=30)
+
+    @api.model
+    def _get_product_ids_in_warehouse(self, warehouse):
+        """Produits ayant du stock (quants) dans l'arborescence de l'entrepôt."""
+        self.env['stock.quant'].flush_model(['product_id', 'location_id'])
+        self.env.cr.execute("""
+            SELECT DISTINCT sq.product_id
+              FROM stock_quant sq
+              JOIN stock_location sl ON sl.id = sq.location_id
+             WHERE sl.parent_path LIKE %s
+        """, [f"{warehouse.view_location_id.parent_path}%"])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _get_domain(self, company, warehouse=None, since=None, include_archived=False):
+        domain = [('company_id', 'in', [False, company.id])]
+        if warehouse:
+            domain.append(('id', 'in', self._get_product_ids_in_warehouse(warehouse)))
+        if since:
+            since -= self._since_margin
+            # Produit ou modèle modifié depuis la version (prix, nom, code-barres, archivage)
+            domain += ['|', ('write_date', '>=', since), ('product_tmpl_id.write_date', '>=', since)]
+        elif not include_archived:
+            domain.append(('active', '=', True))
+        return domain
+
+    @api.model
+    def _get_version(self, company, warehouse=None):
+        """Version du catalogue : date de dernière modification d'un produit du périmètre."""
+        Product = self.env['product.product'].with_context(active_test=False)
+        domain = self._get_domain(company, warehouse, include_archived=True)
+        [(product_write,)] = Product._read_group(domain, aggregates=['write_date:max'])
+        [(template_write,)] = self.env['product.template'].with_context(active_test=False)._read_group(
+            [('product_variant_ids', 'any', domain)], aggregates=['write_date:max'],
+        )
+        last_write = max(filter(None, (product_write, template_write)), default=None)
+        return last_write.strftime(VERSION_FORMAT) if last_write else '0'
+
+    @api.model
+    def _get_rows(self, company, warehouse=None, since=None):
+        """Lignes du catalogue, dans l'ordre de CATALOG_COLUMNS."""
+        Product = self.env['product.product'].with_company(company).with_context(active_test=False)
+        products = Product.search_fetch(
+            self._get_domain(company, warehouse, since),
+            ['barcode', 'default_code', 'name', 'uom_id', 'standard_price', 'active'],
+            order='id',
+        )
+        uom_names = {uom.id: uom.name for uom in products.uom_id}
+        return [[
+            product.id,
+            product.barcode or None,
+            product.default_code or None,
+            product.name,
+            uom_names.get(product.uom_id.id),
+            product.standard_price,
+            product.active,
+        ] for product in products]
+
+    @api.model
+    def _parse_version(self, version):
+        """Date de modification correspondant à une version, None si invalide."""
+        try:
+            return datetime.strptime(version, VERSION_FORMAT)
+        except (TypeError, ValueError):
+            return None
+
+    @api.model
+    def _get_etag(self, company, warehouse, version):
+        """ETag faible du catalogue pour une version.
+
+        L'ETag identifie l'état du catalogue : un client à jour (complet ou
+        différentiel) reçoit un 304 tant qu'aucun produit n'a changé.
+        """
+        return f'W/"catalog-{company.id}-{warehouse.id if warehouse else 0}-{version}"'
+
+    @api.model
+    def _export(self, company, warehouse=None, since=None, version=None):
+        """Catalogue complet, ou différentiel depuis la version since.
+
+        Args:
+            version: version courante si déjà lue par l'appelant (_get_version)
+
+        Returns:
+            tuple (version, ETag faible, contenu JSON Lines compressé gzip)
+        """
+        version = version or self._get_version(company, warehouse)
+        since_date = self._parse_version(since) if since else None
+        since = since if since_date else None
+        etag = self._get_etag(company, warehouse, version)
+
+        cache_key = (self.env.cr.dbname, company.id, warehouse.id if warehouse else 0, version, since)
+        cached = _catalog_cache.get(cache_key)
+        if cached:
+            return version, etag, cached
+
+        rows = self._get_rows(company, warehouse, since_date)
+        header = {
+            'version': version,
+            'since': since,
+            'full': not since,
+            'company_id': company.id,
+            'warehouse_id': warehouse.id if warehouse else None,
+            'columns': CATALOG_COLUMNS,
+            'count': len(rows),
+        }
+        lines = [json.dumps(header, ensure_ascii=False)]
+        lines += [json.dumps(row, ensure_ascii=False, separators=(',', ':')) for row in rows]
+        # mtime=0 : contenu identique pour une même version (ETag stable)
+        content = gzip.compress('\n'.join(lines).encode('utf-8'), compresslevel=6, mtime=0)
+        _catalog_cache[cache_key] = content
+        _logger.info(f"📦 Catalogue mobile {company.name}: {len(rows)} produit(s), {len(content) / 1024:.1f} KB")
+        return version, etag, content
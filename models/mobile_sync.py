@@ -0,0 +1,602 @@
+# -*- coding: utf-8 -*-
+"""
+Synchronisation différentielle de l'application mobile (PWA hors ligne).
+
+Montant : l'appareil envoie des opérations numérotées (seq croissant) portant
+l'identifiant local des enregistrements créés hors ligne. Elles sont
+appliquées en masse et de façon idempotente : un enregistrement est retrouvé
+par sa référence mobile (appareil:identifiant local) et une opération déjà
+appliquée (seq déjà vu pour l'appareil) n'est pas rejouée. Un envoi répété
+après une coupure réseau ne duplique donc rien.
+
+Scans groupés : pendant un comptage, l'appareil envoie ses scans par paquets
+(produit, emplacement, quantité, horodatage) appliqués en une transaction,
+avec une seule passe de résolution des conflits par (produit, emplacement).
+Les horodatages des scans (heure de l'appareil) ne sont comparés qu'entre eux ;
+en mode cumul, un scan déjà appliqué (même référence) n'est pas recompté.
+
+Descendant : le serveur renvoie un jeton de changement et uniquement les
+inventaires et lignes modifiés depuis le jeton précédent de l'appareil, ainsi
+que les identifiants des inventaires et lignes supprimés depuis (marques de
+suppression, conservées stockex.mobile_tombstone_days jours). Un jeton plus
+ancien que cette rétention entraîne une resynchronisation complète.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+
+class StockexMobileDevice(models.Model):
+    """Appareil mobile synchronisé : dernière opération appliquée."""
+    _name = 'stockex.mobile.device'
+    _description = 'Appareil Mobile StockEx'
+    _order = 'last_sync desc, id desc'
+
+    device_id = fields.Char(
+        string='Identifiant appareil',
+        required=True,
+        readonly=True,
+        index=True
+    )
+    user_id = fields.Many2one(
+        comodel_name='res.users',
+        string='Utilisateur',
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+        index=True
+    )
+    last_seq = fields.Integer(
+        string='Dernière opération',
+        readonly=True,
+        help='Numéro de la dernière opération appliquée pour cet appareil'
+    )
+    last_sync = fields.Datetime(
+        string='Dernière synchronisation',
+        readonly=True
+    )
+
+    _device_user_uniq = models.UniqueIndex("(device_id, user_id)")
+
+    @api.model
+    def _get_device(self, device_id):
+        """Appareil de l'utilisateur courant, créé à la première synchronisation."""
+        device = self.sudo().search([
+            ('device_id', '=', device_id),
+            ('user_id', '=', self.env.uid),
+        ], limit=1)
+        if not device:
+            device = self.sudo().create({'device_id': device_id, 'user_id': self.env.uid})
+        return device
+
+
+class StockexMobileTombstone(models.Model):
+    """Marque de suppression d'un inventaire ou d'une ligne, pour la synchro descendante."""
+    _name = 'stockex.mobile.tombstone'
+    _description = 'Suppression Synchronisée StockEx'
+    _order = 'date desc, id desc'
+
+    res_model = fields.Char(
+        string='Modèle',
+        required=True,
+        readonly=True
+    )
+    res_id = fields.Integer(
+        string='ID Enregistrement',
+        required=True,
+        readonly=True
+    )
+    user_id = fields.Many2one(
+        comodel_name='res.users',
+        string='Responsable',
+        readonly=True,
+        ondelete='cascade',
+        index=True
+    )
+    date = fields.Datetime(
+        string='Supprimé le',
+        required=True,
+        readonly=True,
+        default=fields.Datetime.now,
+        index=True
+    )
+
+    @api.model
+    def _record(self, records, users):
+        """Enregistre la suppression de records (users : responsable de chacun, dans le même ordre)."""
+        self.sudo().create([
+            {'res_model': record._name, 'res_id': record.id, 'user_id': user.id}
+            for record, user in zip(records, users)
+        ])
+
+    @api.model
+    def _get_retention(self):
+        days = int(self.env['ir.config_parameter'].sudo().get_param('stockex.mobile_tombstone_days', '30') or 30)
+        return timedelta(days=max(1, days))
+
+    @api.autovacuum
+    def _gc_tombstones(self):
+        """Supprime les marques plus anciennes que stockex.mobile_tombstone_days (30 jours)."""
+        old = self.sudo().search([('date', '<', fields.Datetime.now() - self._get_retention())])
+        if old:
+            old.unlink()
+            _logger.info(f"🧹 {len(old)} marque(s) de suppression mobile supprimée(s)")
+
+
+class StockexMobileScan(models.Model):
+    """Référence d'un scan appliqué en mode cumul (un renvoi n'est pas recompté)."""
+    _name = 'stockex.mobile.scan'
+    _description = 'Scan Mobile Appliqué StockEx'
+    _order = 'id desc'
+
+    inventory_id = fields.Many2one(
+        comodel_name='stockex.stock.inventory',
+        string='Inventaire',
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+        index=True
+    )
+    ref = fields.Char(
+        string='Référence',
+        required=True,
+        readonly=True
+    )
+
+    _inventory_ref_uniq = models.UniqueIndex("(inventory_id, ref)")
+
+    @api.autovacuum
+    def _gc_applied_scans(self):
+        """Supprime les références des inventaires qui ne sont plus modifiables."""
+        done = self.sudo().search([('inventory_id.state', 'not in', ('draft', 'in_progress'))])
+        if done:
+            done.unlink()
+            _logger.info(f"🧹 {len(done)} référence(s) de scan mobile supprimée(s)")
+
+
+class MobileSync(models.AbstractModel):
+    """Application des opérations mobiles et calcul des changements descendants."""
+    _name = 'stockex.mobile.sync'
+    _description = 'Synchronisation Mobile StockEx'
+
+    # Recouvrement du jeton : une transaction démarrée avant le jeton mais
+    # validée après reste visible à la synchronisation suivante
+    _token_margin = timedelta(seconds=30)
+
+    @api.model
+    def _ref(self, device_id, local_id):
+        return f"{device_id}:{local_id}"
+
+    # ------------------------------------------------------------------
+    # Montant : opérations de l'appareil
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _apply_operations(self, device_id, operations):
+        """Applique en masse les opérations d'un appareil.
+
+        Args:
+            device_id: identifiant de l'appareil
+            operations: dicts {op: 'inventory'|'line', seq, local_id, ...}
+                - inventory : location_id, date, name (optionnel)
+                - line : inventory_local_id ou inventory_id, product_id,
+                  product_qty, location_id (optionnel)
+
+        Returns:
+            dict {applied: [{seq, op, local_id, server_id}], errors: [...], last_seq}
+
+        last_seq avance au-delà des opérations en échec : celles-ci figurent
+        dans errors, et un renvoi recrée l'enregistrement s'il n'existe pas.
+        """
+        device = self.env['stockex.mobile.device']._get_device(device_id)
+        last_seq = device.last_seq
+        # Ordre de saisie sur l'appareil : la dernière valeur d'une ligne l'emporte
+        operations = sorted(operations, key=lambda op: int(op.get('seq') or 0))
+        result = {'applied': [], 'errors': []}
+
+        # Une opération déjà vue n'est pas rejouée : seule sa correspondance est renvoyée
+        def is_new(op):
+            return not op.get('seq') or int(op['seq']) > last_seq
+
+        inventory_ops = [op for op in operations if op.get('op', 'inventory') == 'inventory']
+        line_ops = [op for op in operations if op.get('op') == 'line']
+        inventories = self._upsert_inventories(device_id, inventory_ops, is_new, result)
+        self._upsert_lines(device_id, line_ops, inventories, is_new, result)
+
+        seqs = [int(op['seq']) for op in operations if op.get('seq')]
+        result['last_seq'] = max(seqs + [last_seq])
+        device.write({'last_seq': result['last_seq'], 'last_sync': fields.Datetime.now()})
+        return result
+
+    @api.model
+    def _upsert_inventories(self, device_id, operations, is_new, result):
+        """Crée ou met à jour les inventaires, retrouvés par référence mobile.
+
+        Returns:
+            dict {référence mobile: stockex.stock.inventory}
+        """
+        Inventory = self.env['stockex.stock.inventory']
+        engine = self.env['stockex.import.engine']
+        ops = {}
+        for op in operations:
+            if not op.get('local_id'):
+                result['errors'].append({'seq': op.get('seq'), 'local_id': None, 'error': 'local_id requis'})
+                continue
+            ops[self._ref(device_id, op['local_id'])] = op
+
+        inventories = {
+            inventory.mobile_ref: inventory
+            for inventory in Inventory.search([('mobile_ref', 'in', list(ops))])
+        }
+        to_create = []
+        for ref, op in ops.items():
+            vals = {key: op[key] for key in ('location_id', 'date', 'name') if op.get(key)}
+            if ref in inventories:
+                inventory = inventories[ref]
+                if is_new(op) and vals and inventory.state in ('draft', 'in_progress'):
+                    inventory.write(vals)
+            elif not op.get('location_id'):
+                result['errors'].append({'seq': op.get('seq'), 'local_id': op['local_id'], 'error': 'location_id requis'})
+            else:
+                vals.setdefault('date', fields.Date.today())
+                to_create.append((ref, dict(vals, mobile_ref=ref, state='draft')))
+
+        created, errors = engine._create_batched(
+            Inventory._name, [vals for _ref, vals in to_create], [ref for ref, _vals in to_create]
+        )
+        inventories.update(created)
+        if created:
+            _logger.info(f"✅ {len(created)} inventaire(s) mobile(s) créé(s)")
+
+        for ref, op in ops.items():
+            if ref in errors:
+                result['errors'].append({'seq': op.get('seq'), 'local_id': op['local_id'], 'error': errors[ref]})
+            elif ref in inventories:
+                result['applied'].append({
+                    'seq': op.get('seq'),
+                    'op': 'inventory',
+                    'local_id': op['local_id'],
+                    'server_id': inventories[ref].id,
+                    'name': inventories[ref].name,
+                })
+        return inventories
+
+    @api.model
+    def _upsert_lines(self, device_id, operations, inventories, is_new, result):
+        """Crée ou met à jour les lignes, retrouvées par référence mobile."""
+        Line = self.env['stockex.stock.inventory.line']
+        engine = self.env['stockex.import.engine']
+
+        # Inventaires cibles : créés par l'appareil (identifiant local) ou déjà sur le serveur
+        inventory_ids = {op['inventory_id'] for op in operations if op.get('inventory_id')}
+        server_inventories = {
+            inventory.id: inventory
+            for inventory in self.env['stockex.stock.inventory'].browse(inventory_ids).exists()
+        }
+        missing_refs = {
+            self._ref(device_id, op['inventory_local_id'])
+            for op in operations if op.get('inventory_local_id')
+        } - set(inventories)
+        if missing_refs:
+            inventories = dict(inventories)
+            inventories.update({
+                inventory.mobile_ref: inventory
+                for inventory in self.env['stockex.stock.inventory'].search([('mobile_ref', 'in', list(missing_refs))])
+            })
+
+        ops = {}
+        for op in operations:
+            if not op.get('local_id') or not op.get('product_id'):
+                result['errors'].append({'seq': op.get('seq'), 'local_id': op.get('local_id'), 'error': 'local_id et product_id requis'})
+                continue
+            if op.get('inventory_local_id'):
+                inventory = inventories.get(self._ref(device_id, op['inventory_local_id']))
+            else:
+                inventory = server_inventories.get(op.get('inventory_id'))
+            if not inventory:
+                result['errors'].append({'seq': op.get('seq'), 'local_id': op['local_id'], 'error': 'Inventaire introuvable'})
+                continue
+            ops[self._ref(device_id, op['local_id'])] = (op, inventory)
+
+        lines = {line.mobile_ref: line for line in Line.search([('mobile_ref', 'in', list(ops))])}
+        quantities = {}
+        to_create = []
+        for ref, (op, inventory) in ops.items():
+            # Opération déjà vue : rejouée seulement si sa ligne n'existe pas
+            # (création en échec lors d'un envoi précédent, signalée en erreur)
+            if not is_new(op) and ref in lines:
+                continue
+            if inventory.state not in ('draft', 'in_progress'):
+                result['errors'].append({'seq': op.get('seq'), 'local_id': op['local_id'], 'error': f"Inventaire {inventory.name} non modifiable"})
+                continue
+            quantity = op.get('product_qty', 0) or 0
+            if ref in lines:
+                quantities[lines[ref]] = quantity
+            else:
+                to_create.append((ref, {
+                    'inventory_id': inventory.id,
+                    'product_id': op['product_id'],
+                    'location_id': op.get('location_id') or inventory.location_id.id,
+                    'product_qty': quantity,
+                    'mobile_ref': ref,
+                }))
+
+        engine._write_grouped(quantities, 'product_qty')
+        created, errors = engine._create_batched(
+            Line._name, [vals for _ref, vals in to_create], [ref for ref, _vals in to_create]
+        )
+        lines.update(created)
+
+        for ref, (op, _inventory) in ops.items():
+            if ref in errors:
+                result['errors'].append({'seq': op.get('seq'), 'local_id': op['local_id'], 'error': errors[ref]})
+            elif ref in lines:
+                result['applied'].append({
+                    'seq': op.get('seq'),
+                    'op': 'line',
+                    'local_id': op['local_id'],
+                    'inventory_local_id': op.get('inventory_local_id'),
+                    'server_id': lines[ref].id,
+                })
+
+    # ------------------------------------------------------------------
+    # Scans groupés
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _parse_scanned_at(self, value):
+        """Horodatage d'un scan (ISO 8601 ou millisecondes epoch) en datetime UTC naïf."""
+        if not value:
+            return None
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value / 1000, timezone.utc).replace(tzinfo=None)
+        scanned_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        if scanned_at.tzinfo:
+            scanned_at = scanned_at.astimezone(timezone.utc).replace(tzinfo=None)
+        return scanned_at
+
+    @api.model
+    def _upsert_scans(self, inventory, scans, mode='last'):
+        """Applique un paquet de scans sur un inventaire, en une transaction.
+
+        Les scans d'un même couple (produit, emplacement) sont résolus en une
+        seule passe :
+            - last : la quantité du scan le plus récent l'emporte ; un paquet
+              dont le dernier scan est antérieur au dernier scan appliqué à
+              la ligne (mobile_scanned_at, heure appareil) est ignoré (stale)
+            - sum : les quantités scannées s'ajoutent à la quantité comptée ;
+              un scan dont la référence a déjà été appliquée sur l'inventaire
+              est ignoré (duplicate)
+
+        Args:
+            inventory: stockex.stock.inventory brouillon ou en cours
+            scans: dicts {product_id, qty, location_id (optionnel, défaut :
+                emplacement de l'inventaire), scanned_at (optionnel), ref (optionnel)}
+            mode: 'last' ou 'sum'
+
+        Returns:
+            dict {results: [{index, ref, status, line_id, product_qty}], created,
+            updated, errors} ; status : created, updated, merged (scan
+            remplacé par un plus récent du paquet), stale, duplicate ou error
+        """
+        if mode not in ('last', 'sum'):
+            raise UserError(f"Mode de résolution inconnu : {mode}")
+        if inventory.state not in ('draft', 'in_progress'):
+            raise UserError(f"Inventaire {inventory.name} non modifiable")
+
+        Line = self.env['stockex.stock.inventory.line']
+        engine = self.env['stockex.import.engine']
+        results = [{'index': index, 'ref': scan.get('ref')} for index, scan in enumerate(scans)]
+
+        # Validation et regroupement par (produit, emplacement)
+        parsed = []
+        for index, scan in enumerate(scans):
+            try:
+                parsed.append((index, {
+                    'product_id': int(scan['product_id']),
+                    'location_id': int(scan.get('location_id') or 0) or inventory.location_id.id or False,
+                    'qty': float(scan.get('qty', scan.get('product_qty')) or 0.0),
+                    'scanned_at': self._parse_scanned_at(scan.get('scanned_at')),
+                    'ref': str(scan['ref']) if scan.get('ref') else None,
+                }))
+            except (KeyError, TypeError, ValueError) as e:
+                results[index].update(status='error', error=f"Scan invalide : {e}")
+        known_products = set(self.env['product.product'].browse(
+            list({scan['product_id'] for _index, scan in parsed})
+        ).exists().ids)
+        # Cumul : références déjà appliquées sur l'inventaire (renvoi après coupure)
+        applied_refs = set()
+        if mode == 'sum':
+            applied_refs = set(self.env['stockex.mobile.scan'].sudo().search([
+                ('inventory_id', '=', inventory.id),
+                ('ref', 'in', [scan['ref'] for _index, scan in parsed if scan['ref']]),
+            ]).mapped('ref'))
+        groups, duplicates = {}, []
+        for index, scan in parsed:
+            if scan['product_id'] not in known_products:
+                results[index].update(status='error', error='Produit introuvable')
+                continue
+            key = (scan['product_id'], scan['location_id'])
+            if mode == 'sum' and scan['ref']:
+                if scan['ref'] in applied_refs:
+                    duplicates.append((index, key))
+                    continue
+                applied_refs.add(scan['ref'])
+            groups.setdefault(key, []).append((index, scan))
+
+        lines = {}
+        for line in Line.search([
+            ('inventory_id', '=', inventory.id),
+            ('product_id', 'in', list({product_id for product_id, _location_id in groups})),
+        ]):
+            lines.setdefault((line.product_id.id, line.location_id.id or False), line)
+
+        # Une passe de résolution par (produit, emplacement)
+        quantities, scanned, to_create, statuses = {}, {}, [], {}
+        for key, group in groups.items():
+            # Ordre de scan, puis ordre d'envoi pour les scans sans horodatage
+            group.sort(key=lambda item: (item[1]['scanned_at'] or datetime.min, item[0]))
+            line = lines.get(key)
+            last_scan = group[-1][1]
+            scanned_at = max(filter(None, [scan['scanned_at'] for _index, scan in group]), default=None)
+            if mode == 'sum':
+                qty = (line.product_qty if line else 0.0) + sum(scan['qty'] for _index, scan in group)
+            elif (line and last_scan['scanned_at'] and line.mobile_scanned_at
+                    and last_scan['scanned_at'] < line.mobile_scanned_at):
+                statuses[key] = 'stale'
+                continue
+            else:
+                qty = last_scan['qty']
+            if line:
+                quantities[line] = qty
+                if scanned_at and (not line.mobile_scanned_at or scanned_at > line.mobile_scanned_at):
+                    scanned[line] = scanned_at
+                statuses[key] = 'updated'
+            else:
+                to_create.append((key, {
+                    'inventory_id': inventory.id,
+                    'product_id': key[0],
+                    'location_id': key[1],
+                    'product_qty': qty,
+                    'mobile_scanned_at': scanned_at,
+                }))
+                statuses[key] = 'created'
+
+        engine._write_grouped(quantities, 'product_qty')
+        engine._write_grouped(scanned, 'mobile_scanned_at')
+        created, errors = engine._create_batched(
+            Line._name, [vals for _key, vals in to_create], [key for key, _vals in to_create]
+        )
+        lines.update(created)
+
+        if mode == 'sum':
+            self.env['stockex.mobile.scan'].sudo().create([
+                {'inventory_id': inventory.id, 'ref': scan['ref']}
+                for key, group in groups.items() if key not in errors
+                for _index, scan in group if scan['ref']
+            ])
+
+        for key, group in groups.items():
+            line = lines.get(key)
+            for position, (index, _scan) in enumerate(group):
+                if key in errors:
+                    results[index].update(status='error', error=errors[key])
+                    continue
+                status = statuses[key]
+                if mode == 'last' and status != 'stale' and position < len(group) - 1:
+                    status = 'merged'
+                results[index].update(status=status, line_id=line.id, product_qty=line.product_qty)
+        for index, key in duplicates:
+            line = lines.get(key)
+            results[index].update(status='duplicate', line_id=line.id if line else None,
+                                  product_qty=line.product_qty if line else None)
+
+        summary = {
+            'results': results,
+            'created': len(created),
+            'updated': len(quantities),
+            'errors': sum(1 for result in results if result['status'] == 'error'),
+        }
+        _logger.info(
+            f"📱 {len(scans)} scan(s) sur {inventory.name}: "
+            f"{summary['created']} ligne(s) créée(s), {summary['updated']} mise(s) à jour, {summary['errors']} erreur(s)"
+        )
+        return summary
+
+    # ------------------------------------------------------------------
+    # Descendant : changements depuis le dernier jeton
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _new_token(self):
+        """Jeton de changement : horodatage de début de la transaction courante."""
+        return fields.Datetime.to_string(self.env.cr.now())
+
+    @api.model
+    def _get_changes(self, device_id, token=None):
+        """Inventaires et lignes de l'utilisateur modifiés ou supprimés depuis le jeton.
+
+        Sans jeton (première synchronisation), ou avec un jeton plus ancien
+        que la rétention des marques de suppression, renvoie les inventaires
+        en cours (brouillon ou en cours) et leurs lignes, avec reset=True :
+        l'appareil remplace alors ses données par celles-ci.
+
+        L'appareil retire les lignes d'un inventaire supprimé avec celui-ci,
+        qu'elles figurent ou non dans deleted['lines'].
+
+        Returns:
+            dict {inventories: [...], lines: [...], deleted: {inventories:
+            [ids], lines: [ids]}, reset: bool}
+        """
+        Tombstone = self.env['stockex.mobile.tombstone']
+        since = fields.Datetime.to_datetime(token) - self._token_margin if token else None
+        if since and since < fields.Datetime.now() - Tombstone._get_retention():
+            since = None
+        inventory_domain = [('user_id', '=', self.env.uid)]
+        line_domain = [('inventory_id.user_id', '=', self.env.uid)]
+        deleted = {'inventories': [], 'lines': []}
+        if since:
+            inventory_domain.append(('write_date', '>=', since))
+            line_domain.append(('write_date', '>=', since))
+            tombstones = Tombstone.sudo().search_read(
+                [('user_id', '=', self.env.uid), ('date', '>=', since)], ['res_model', 'res_id']
+            )
+            for tombstone in tombstones:
+                key = 'inventories' if tombstone['res_model'] == 'stockex.stock.inventory' else 'lines'
+                deleted[key].append(tombstone['res_id'])
+        else:
+            inventory_domain.append(('state', 'in', ('draft', 'in_progress')))
+            line_domain.append(('inventory_id.state', 'in', ('draft', 'in_progress')))
+
+        prefix = f"{device_id}:"
+
+        def local_id(record):
+            ref = record.mobile_ref or ''
+            return ref[len(prefix):] if ref.startswith(prefix) else None
+
+        inventories = self.env['stockex.stock.inventory'].search(inventory_domain)
+        lines = self.env['stockex.stock.inventory.line'].search(line_domain)
+        return {
+            'inventories': [{
+                'id': inventory.id,
+                'local_id': local_id(inventory),
+                'name': inventory.name,
+                'date': fields.Date.to_string(inventory.date),
+                'state': inventory.state,
+                'location_id': inventory.location_id.id,
+            } for inventory in inventories],
+            'lines': [{
+                'id': line.id,
+                'local_id': local_id(line),
+                'inventory_id': line.inventory_id.id,
+                'product_id': line.product_id.id,
+                'location_id': line.location_id.id,
+                'product_qty': line.product_qty,
+                'theoretical_qty': line.theoretical_qty,
+            } for line in lines],
+            'deleted': deleted,
+            'reset': not since,
+        }
+
+
+class StockInventory(models.Model):
+    _inherit = 'stockex.stock.inventory'
+
+    def unlink(self):
+        """Garde une marque de suppression pour la synchronisation mobile."""
+        self.env['stockex.mobile.tombstone']._record(self, [inventory.user_id for inventory in self])
+        return super().unlink()
+
+
+class StockInventoryLine(models.Model):
+    _inherit = 'stockex.stock.inventory.line'
+
+    def unlink(self):
+        """Garde une marque de suppression pour la synchronisation mobile."""
+        self.env['stockex.mobile.tombstone']._record(self, [line.inventory_id.user_id for line in self])
+        return super().unlink()
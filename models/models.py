@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import time
 
 from odoo import models, fields, api
 from odoo.exceptions import UserError
 from markupsafe import Markup
 
+from .compat import ODOO_VERSION
+
 _logger = logging.getLogger(__name__)
 
 class ProductTemplate(models.Model):
@@ -454,6 +457,13 @@ class StockInventory(models.Model):
         tracking=True
     )
     description = fields.Text(string='Notes')
+    mobile_ref = fields.Char(
+        string='Référence mobile',
+        readonly=True,
+        copy=False,
+        index=True,
+        help='Appareil et identifiant local (appareil:local_id) de l\'inventaire créé hors ligne'
+    )
     location_id = fields.Many2one(
         comodel_name='stock.location',
         string='Emplacement',
@@ -504,6 +514,28 @@ class StockInventory(models.Model):
         readonly=True,
         tracking=True
     )
+    validation_job_id = fields.Many2one(
+        comodel_name='stockex.job',
+        string='Tâche de validation',
+        readonly=True,
+        copy=False,
+        help='Tâche de fond qui applique les ajustements des gros inventaires'
+    )
+    validation_job_state = fields.Selection(
+        related='validation_job_id.state',
+        string='État de la tâche de validation'
+    )
+    validation_cursor = fields.Integer(
+        string='Curseur de validation',
+        readonly=True,
+        copy=False,
+        help='Dernière ligne (id) dont l\'ajustement est validé en base : une validation relancée reprend après'
+    )
+    validation_progress = fields.Float(
+        string='Progression de la validation (%)',
+        compute='_compute_validation_progress',
+        help='Part des lignes traitées (ajustées, ignorées ou en erreur)'
+    )
     line_ids = fields.One2many(
         comodel_name='stockex.stock.inventory.line',
         inverse_name='inventory_id',
@@ -598,6 +630,7 @@ class StockInventory(models.Model):
 
     
     _name_company_uniq = models.UniqueIndex("(name, company_id)")
+    _mobile_ref_uniq = models.UniqueIndex("(mobile_ref) WHERE mobile_ref IS NOT NULL")
     
     @api.depends('account_move_ids')
     def _compute_account_move_count(self):
@@ -605,6 +638,26 @@ class StockInventory(models.Model):
         for inventory in self:
             inventory.account_move_count = len(inventory.account_move_ids)
     
+    @api.depends('line_ids.adjustment_state')
+    def _compute_validation_progress(self):
+        """Calcule la progression de la validation en une requête pour tout le recordset."""
+        inventory_ids = [inv_id for inv_id in self.ids if isinstance(inv_id, int)]
+        counts = {}
+        if inventory_ids:
+            self.env['stockex.stock.inventory.line'].flush_model(['inventory_id', 'adjustment_state'])
+            self.env.cr.execute("""
+                SELECT inventory_id,
+                       COUNT(*) FILTER (WHERE COALESCE(adjustment_state, 'pending') != 'pending'),
+                       COUNT(*)
+                FROM stockex_stock_inventory_line
+                WHERE inventory_id = ANY(%s)
+                GROUP BY inventory_id
+            """, [inventory_ids])
+            counts = {inv_id: (processed, total) for inv_id, processed, total in self.env.cr.fetchall()}
+        for inventory in self:
+            processed, total = counts.get(inventory.id, (0, 0))
+            inventory.validation_progress = (processed * 100.0 / total) if total else 0.0
+    
     @api.depends('stock_move_ids')
     def _compute_stock_move_count(self):
         """Calcule le nombre de mouvements de stock."""
@@ -840,92 +893,123 @@ class StockInventoryExtension(models.Model):
             product: recordset product.product
             method: 'standard' ou 'economic' (si None, utilise la config système)
         
-        Priorité des sources:
-        1) stock.valuation.layer (référence comptable fiable, convertie en devise société)
-        2) stock.move.price_unit (dernier mouvement réalisé) si méthode économique
-        3) product.standard_price (fallback)
-        
-        Applique éventuellement la décote selon rotation si activée.
+        Délègue à _get_valuation_prices (voir les priorités des sources).
+        Pour valoriser plusieurs produits, appeler directement
+        _get_valuation_prices afin de ne pas multiplier les requêtes.
         """
         self.ensure_one()
         
         if not product:
             return 0.0
         
-        # Cache désactivé (les recordsets Odoo n'acceptent pas d'attributs dynamiques)
+        prices = self._get_valuation_prices(product, company=self.company_id, date=self.date, method=method)
+        return prices.get(product.id, 0.0)
+    
+    @api.model
+    def _get_valuation_prices(self, products, company=None, date=None, method=None):
+        """Retourne les prix de valorisation unitaires d'un ensemble de produits.
+        
+        Args:
+            products: recordset product.product
+            company: res.company (défaut: société courante)
+            date: date de conversion des couches en devise étrangère (défaut: aujourd'hui)
+            method: 'standard' ou 'economic' (si None, utilise la config système)
+        
+        Returns:
+            dict: {product_id: prix unitaire}
+        
+        Priorité des sources (une requête groupée par source, quel que soit
+        le nombre de produits):
+        1) stock.valuation.layer (dernière couche par produit, DISTINCT ON,
+           convertie en devise société)
+        2) stock.move.price_unit (dernier mouvement réalisé) si méthode économique
+        3) product.standard_price (extraction JSONB par société en Odoo 18+,
+           à défaut le prix de la clé '1')
+        
+        Applique éventuellement la décote selon rotation si activée.
+        """
+        product_ids = list(set(products.ids))
+        if not product_ids:
+            return {}
         
         ICP = self.env['ir.config_parameter'].sudo()
-        # Utiliser la méthode passée en paramètre, sinon la config système
         rule = method if method else ICP.get_param('stockex.valuation_rule', 'standard')
-        company = self.company_id
+        apply_depreciation = ICP.get_param('stockex.apply_depreciation', 'False') == 'True'
+        company = company or self.env.company
         company_currency = company.currency_id
         # Utiliser la date d'inventaire pour la conversion, sinon aujourd'hui
-        conv_date = self.date or fields.Date.today()
-        
-        base_price = 0.0
-        
-        # 1) Source prioritaire: stock.valuation.layer
-        try:
-            ValuationLayer = self.env['stock.valuation.layer']
-            layer = ValuationLayer.search([
-                ('product_id', '=', product.id),
-                ('company_id', '=', company.id),
-            ], order='create_date desc', limit=1)
-            if layer:
-                # Déterminer le coût unitaire de la couche
-                unit_cost = getattr(layer, 'unit_cost', 0.0) or 0.0
-                if not unit_cost:
-                    qty = getattr(layer, 'quantity', 0.0) or 0.0
-                    val = getattr(layer, 'value', 0.0) or 0.0
-                    unit_cost = (val / qty) if qty else 0.0
+        conv_date = date or fields.Date.today()
+        
+        cr = self.env.cr
+        prices = dict.fromkeys(product_ids, 0.0)
+        
+        # 1) Source prioritaire: dernière couche de valorisation par produit
+        cr.execute("SELECT to_regclass('stock_valuation_layer')")
+        if cr.fetchone()[0]:
+            cr.execute("""
+                SELECT DISTINCT ON (product_id) product_id, id, unit_cost, quantity, value
+                FROM stock_valuation_layer
+                WHERE product_id IN %s AND company_id = %s
+                ORDER BY product_id, create_date DESC, id DESC
+            """, [tuple(product_ids), company.id])
+            layer_rows = cr.fetchall()
+            layers = self.env['stock.valuation.layer'].browse([row[1] for row in layer_rows])
+            for (product_id, layer_id, unit_cost, quantity, value), layer in zip(layer_rows, layers):
+                unit_cost = unit_cost or 0.0
+                if not unit_cost and quantity:
+                    unit_cost = (value or 0.0) / quantity
                 # Conversion devise si nécessaire
                 source_currency = getattr(layer, 'currency_id', company_currency) or company_currency
-                if source_currency and source_currency != company_currency:
+                if unit_cost and source_currency and source_currency != company_currency:
                     try:
-                        base_price = source_currency._convert(unit_cost, company_currency, company, conv_date)
+                        unit_cost = source_currency._convert(unit_cost, company_currency, company, conv_date)
                     except Exception:
-                        base_price = unit_cost
-                else:
-                    base_price = unit_cost
-        except Exception:
-            # Continuer vers les autres sources
-            pass
+                        pass
+                prices[product_id] = unit_cost
         
         # 2) Règle économique: dernier stock.move.price_unit si rien obtenu
-        if base_price <= 0.0 and rule == 'economic':
-            try:
-                moves = self.env['stock.move'].search([
-                    ('product_id', '=', product.id),
-                    ('company_id', '=', company.id),
-                    ('state', '=', 'done')
-                ], limit=1, order='date desc')
-                if moves and hasattr(moves, 'price_unit') and moves.price_unit:
-                    base_price = moves.price_unit
-            except Exception:
-                pass
-        
-        # 3) Fallback: coût standard du produit
-        if base_price <= 0.0:
-            std_price = product.standard_price or 0.0
-            # En Odoo 19, standard_price peut être un dict JSONB {"company_id": price}
-            if isinstance(std_price, dict):
-                # Récupérer le prix pour la société courante (clé = str(company_id))
-                company_key = str(company.id)
-                std_price = std_price.get(company_key, 0.0) or std_price.get('1', 0.0) or 0.0
-            base_price = std_price
-        
-        # Appliquer décote rotation si activée
-        apply_depreciation = ICP.get_param('stockex.apply_depreciation', 'False') == 'True'
-        if apply_depreciation and base_price > 0:
-            depreciation_coef = self._get_depreciation_coefficient(product)
-            base_price = base_price * depreciation_coef
+        missing_ids = [pid for pid, price in prices.items() if price <= 0.0]
+        if missing_ids and rule == 'economic':
+            cr.execute("""
+                SELECT DISTINCT ON (product_id) product_id, price_unit
+                FROM stock_move
+                WHERE product_id IN %s AND company_id = %s AND state = 'done'
+                ORDER BY product_id, date DESC, id DESC
+            """, [tuple(missing_ids), company.id])
+            for product_id, price_unit in cr.fetchall():
+                if price_unit:
+                    prices[product_id] = price_unit
+        
+        # 3) Fallback: coût standard du produit pour la société
+        missing_ids = [pid for pid, price in prices.items() if price <= 0.0]
+        if missing_ids:
+            if ODOO_VERSION >= 18:
+                # Odoo 18+: standard_price est une colonne JSONB {"company_id": price} ;
+                # sans prix pour la société, reprendre celui de la clé '1'
+                cr.execute("""
+                    SELECT id, COALESCE(
+                        NULLIF((standard_price ->> %s)::numeric, 0),
+                        (standard_price ->> '1')::numeric,
+                        0.0
+                    )
+                    FROM product_product
+                    WHERE id IN %s
+                """, (str(company.id), tuple(missing_ids)))
+                for product_id, std_price in cr.fetchall():
+                    prices[product_id] = float(std_price)
+            else:
+                for product in self.env['product.product'].with_company(company).browse(missing_ids):
+                    prices[product.id] = product.standard_price or 0.0
         
-        # Garde-fou
-        if base_price < 0 or base_price is None:
-            base_price = 0.0
+        # Appliquer décote rotation si activée (une agrégation pour tous les produits)
+        if apply_depreciation:
+            priced = self.env['product.product'].browse([pid for pid, price in prices.items() if price > 0])
+            coefficients = self.env['stockex.depreciation.engine']._get_coefficients(priced)
+            for product_id, coefficient in coefficients.items():
+                prices[product_id] *= coefficient
         
-        # (cache désactivé)
-        return base_price
+        # Garde-fou
+        return {pid: max(price or 0.0, 0.0) for pid, price in prices.items()}
     
     def _get_depreciation_coefficient(self, product):
         """Retourne le coefficient de décote selon la rotation du produit.
@@ -935,59 +1019,15 @@ class StockInventoryExtension(models.Model):
             
         Returns:
             float: Coefficient de décote (1.0 = pas de décote, 0.6 = 40%, 0.0 = 100%)
-            
-        Catégories:
-        - Stock actif: Mouvement dans les N derniers jours → Coefficient 1.0 (0% décote)
-        - Rotation lente: Mouvement entre N et M jours → Coefficient 0.6 (40% décote)
-        - Stock mort: Aucun mouvement depuis plus de M jours → Coefficient 0.0 (100% décote)
-        """
-        self.ensure_one()
         
+        Les catégories (actif, rotation lente, stock mort) sont définies par
+        stockex.depreciation.engine; pour plusieurs produits, utiliser
+        directement engine._get_coefficients.
+        """
         if not product:
             return 1.0
         
-        # Récupérer les paramètres de décote
-        ICP = self.env['ir.config_parameter'].sudo()
-        active_days = int(ICP.get_param('stockex.depreciation_active_days', '365'))
-        slow_days = int(ICP.get_param('stockex.depreciation_slow_days', '1095'))
-        slow_rate = float(ICP.get_param('stockex.depreciation_slow_rate', '40.0'))
-        dead_rate = float(ICP.get_param('stockex.depreciation_dead_rate', '100.0'))
-        
-        # Chercher le dernier mouvement du produit (sortie ou entrée)
-        StockMove = self.env['stock.move']
-        last_move = StockMove.search([
-            ('product_id', '=', product.id),
-            ('state', '=', 'done'),
-        ], limit=1, order='date desc')
-        
-        if not last_move:
-            # Aucun mouvement = stock mort (décote maximale)
-            return 1.0 - (dead_rate / 100.0)
-        
-        # Calculer le nombre de jours depuis le dernier mouvement
-        from datetime import datetime
-        
-        # Convertir last_move.date en date si c'est un datetime
-        if isinstance(last_move.date, datetime):
-            last_move_date = last_move.date.date()
-        else:
-            last_move_date = last_move.date
-        
-        now = datetime.now().date()
-        days_since_last_move = (now - last_move_date).days
-        
-        # Appliquer les règles de décote
-        if days_since_last_move <= active_days:
-            # Stock actif: pas de décote
-            return 1.0
-        
-        elif days_since_last_move <= slow_days:
-            # Rotation lente: décote partielle
-            return 1.0 - (slow_rate / 100.0)
-        
-        else:
-            # Stock mort: décote maximale
-            return 1.0 - (dead_rate / 100.0)
+        return self.env['stockex.depreciation.engine']._get_coefficients(product).get(product.id, 1.0)
     
     @api.depends('line_ids.product_qty','line_ids.theoretical_qty','line_ids.difference','line_ids.product_id')
     def _compute_totals(self):
@@ -1007,9 +1047,11 @@ class StockInventoryExtension(models.Model):
             total_val_real = 0.0
             total_val_theo = 0.0
             
+            # Prix de tous les produits de l'inventaire en une seule passe
+            prices = inv._get_valuation_prices(inv.line_ids.product_id, company=inv.company_id, date=inv.date)
+            
             for line in inv.line_ids:
-                # Utiliser la méthode de valorisation Stockex (source unique: product.standard_price)
-                price = inv._get_product_valuation_price(line.product_id)
+                price = prices.get(line.product_id.id, 0.0)
                 
                 total_val_real += (line.product_qty or 0.0) * price
                 total_val_theo += (line.theoretical_qty or 0.0) * price
@@ -1075,17 +1117,13 @@ class StockInventoryExtension(models.Model):
             ]
             
             quants = StockQuant.search(domain)
+            quants = quants.filtered(lambda q: q.quantity - q.reserved_quantity > 0)
             
             # Calculer la valeur totale selon la règle de valorisation Stockex
+            prices = inv._get_valuation_prices(quants.product_id, company=inv.company_id, date=inv.date)
             for quant in quants:
                 available_qty = quant.quantity - quant.reserved_quantity
-                
-                if available_qty <= 0:
-                    continue
-                
-                # Utiliser la méthode de valorisation Stockex
-                product_price = inv._get_product_valuation_price(quant.product_id)
-                odoo_value += available_qty * product_price
+                odoo_value += available_qty * prices.get(quant.product_id.id, 0.0)
             
             inv.odoo_stock_value = odoo_value
             
@@ -1201,38 +1239,32 @@ class StockInventoryExtension(models.Model):
     
     def action_validate(self):
         """Valide l'inventaire et met à jour les stocks Odoo."""
-        import threading
-        
         for inventory in self:
             if not inventory.line_ids:
                 raise UserError("Impossible de valider un inventaire sans lignes.")
+            if inventory.state != 'approved':
+                raise UserError("Cet inventaire doit être approuvé avant validation.")
             
             total_lines = len(inventory.line_ids)
             
-            # Pour les gros inventaires (> 500 lignes), utiliser traitement asynchrone
+            # Pour les gros inventaires (> 500 lignes), passer par la file de tâches
             if total_lines > 500:
-                _logger.info(f"🚀 Gros inventaire ({total_lines} lignes) → Traitement en thread séparé")
-                
-                # Marquer comme validé immédiatement
-                inventory.write({
-                    'state': 'done',
-                    'validator_id': self.env.user.id,
-                    'validation_date': fields.Datetime.now()
-                })
-                self.env.cr.commit()
-                inventory._notify_telegram(f"✅ Inventaire {inventory.name} validé ({total_lines} lignes). Mise à jour en arrière-plan.")
+                Job = self.env['stockex.job']
+                if Job._find_active(inventory, '_job_validate'):
+                    raise UserError(f"La validation de l'inventaire {inventory.name} est déjà en cours.")
                 
-                # Lancer le traitement dans un thread séparé
-                thread = threading.Thread(
-                    target=inventory._update_odoo_stock_async,
-                    args=(inventory.id, self.env.cr.dbname)
+                job = Job._enqueue(
+                    inventory, '_job_validate',
+                    job_type='inventory_validation',
+                    name=f"Validation {inventory.name}",
+                    total=total_lines,
                 )
-                thread.daemon = True
-                thread.start()
+                inventory.validation_job_id = job
+                _logger.info(f"🚀 Gros inventaire ({total_lines} lignes) → tâche de fond {job.id}")
                 
                 # Message utilisateur
                 inventory.message_post(
-                    body=Markup(f"⏳ Mise à jour de {total_lines} lignes de stock en cours en arrière-plan..."),
+                    body=Markup(f"⏳ Mise à jour de {total_lines} lignes de stock planifiée en arrière-plan (tâche #{job.id})..."),
                     message_type='notification'
                 )
                 
@@ -1240,43 +1272,78 @@ class StockInventoryExtension(models.Model):
                     'type': 'ir.actions.client',
                     'tag': 'display_notification',
                     'params': {
-                        'title': '✅ Inventaire validé',
-                        'message': f'La mise à jour de {total_lines} lignes se fait en arrière-plan. Vous pouvez continuer à travailler.',
-                        'type': 'success',
+                        'title': '⏳ Validation planifiée',
+                        'message': f"La mise à jour de {total_lines} lignes se fait en arrière-plan. L'inventaire passera à l'état Validé une fois les stocks mis à jour.",
+                        'type': 'info',
                         'sticky': True,
                     }
                 }
             else:
                 # Pour petits inventaires (≤ 500 lignes), traitement immédiat
-                if inventory.state != 'approved':
-                    raise UserError("Cet inventaire doit être approuvé avant validation.")
                 moves = inventory._update_odoo_stock()
-                inventory.write({
-                    'state': 'done',
-                    'validator_id': self.env.user.id,
-                    'validation_date': fields.Datetime.now()
-                })
-                if moves:
-                    # Les mouvements de stock générés sont déjà liés via stockex_inventory_id
-                    # Mais il faut aussi lier les écritures comptables si elles existent
-                    account_moves = moves.mapped('account_move_id').filtered(lambda m: m)
-                    if account_moves:
-                        inventory.account_move_ids = [(4, move.id) for move in account_moves]
+                inventory._finalize_validation(moves, self.env.user)
                 inventory._notify_telegram(f"✅ Inventaire {inventory.name} validé ({total_lines} lignes). Stocks mis à jour.")
                 return True
     
-    def _update_odoo_stock(self):
-        """Met à jour les stocks Odoo avec l'API native (stock.move + _update_available_quantity)."""
+    def _finalize_validation(self, moves, validator):
+        """Passe l'inventaire à l'état Validé et lie les écritures comptables des mouvements."""
+        self.ensure_one()
+        self.write({
+            'state': 'done',
+            'validator_id': validator.id,
+            'validation_date': fields.Datetime.now()
+        })
+        if moves:
+            # Les mouvements de stock générés sont déjà liés via stockex_inventory_id
+            # Mais il faut aussi lier les écritures comptables si elles existent
+            account_moves = moves.mapped('account_move_id').filtered(lambda m: m)
+            if account_moves:
+                self.account_move_ids = [(4, move.id) for move in account_moves]
+    
+    def _job_validate(self, job):
+        """Tâche de fond : applique les ajustements puis valide l'inventaire.
+        
+        L'état Validé n'est posé qu'une fois tous les lots traités ; une
+        reprise après interruption repart du point de contrôle de la tâche.
+        """
         self.ensure_one()
+        if self.state == 'done':
+            return
+        _logger.info(f"🚀 Début traitement en tâche de fond pour inventaire {self.name}")
+        moves = self._update_odoo_stock(job=job)
+        # Les mouvements des exécutions précédentes (reprise) sont aussi liés à l'inventaire
+        self._finalize_validation(moves | self.stock_move_ids, job.user_id)
+        self._notify_telegram(f"✅ Inventaire {self.name} validé ({len(self.line_ids)} lignes). Stocks mis à jour en arrière-plan.")
+        _logger.info(f"✅ Traitement en tâche de fond terminé pour inventaire {self.name}")
+    
+    def _update_odoo_stock(self, job=None):
+        """Met à jour les stocks Odoo avec l'API native (stock.move), par lots.
+        
+        Les valeurs de tous les mouvements sont préparées d'abord, puis chaque
+        lot est créé en un seul create(vals_list) et confirmé / réservé /
+        terminé sur le recordset entier. Si un lot échoue, il est rejoué ligne
+        par ligne, chacune dans son propre savepoint, pour n'écarter que les
+        lignes en erreur.
+        
+        Chaque ligne enregistre son statut d'ajustement et son mouvement, et
+        le curseur validation_cursor est validé avec chaque lot : une
+        validation relancée après interruption reprend après le curseur sans
+        recréer les mouvements déjà passés.
         
-        StockMove = self.env['stock.move']
-        StockQuant = self.env['stock.quant']
+        Args:
+            job: stockex.job éventuel, dont la progression est validée avec
+                chaque lot.
+        """
+        self.ensure_one()
+        
+        Line = self.env['stockex.stock.inventory.line']
         moves_created = self.env['stock.move']
         adjusted_count = 0
         errors = []
         skipped_no_data = 0
         skipped_bad_location = 0
         skipped_no_difference = 0
+        started_at = time.monotonic()
         
         # Emplacements virtuels pour ajustements
         inventory_loc = self.env.ref('stock.location_inventory', raise_if_not_found=False)
@@ -1289,93 +1356,108 @@ class StockInventoryExtension(models.Model):
             })
         
         total_lines = len(self.line_ids)
-        batch_size = 50
-        
-        _logger.info(f"🚀 [NATIF] Début mise à jour stocks pour {self.name} - {total_lines} lignes")
-        
-        for batch_num, i in enumerate(range(0, total_lines, batch_size), 1):
-            batch_lines = self.line_ids[i:i + batch_size]
-            batch_start = i + 1
-            batch_end = min(i + batch_size, total_lines)
+        ICP = self.env['ir.config_parameter'].sudo()
+        batch_size = max(1, int(ICP.get_param('stockex.validation_batch_size', '500') or 500))
+        
+        # Reprise : seules les lignes après le curseur et pas encore ajustées sont traitées
+        lines = Line.search([
+            ('inventory_id', '=', self.id),
+            ('id', '>', self.validation_cursor),
+            ('adjustment_state', '!=', 'done'),
+        ], order='id')
+        processed = total_lines - len(lines)
+        if self.validation_cursor:
+            _logger.info(f"♻️ Reprise de {self.name} après la ligne {self.validation_cursor} ({processed} lignes déjà traitées)")
+        
+        _logger.info(f"🚀 [NATIF] Début mise à jour stocks pour {self.name} - {len(lines)}/{total_lines} lignes")
+        
+        # 1) Préparer les valeurs de tous les mouvements
+        pending = []  # [(line, move_vals)]
+        skipped_lines = Line
+        for line in lines:
+            if not line.product_id or not line.location_id:
+                skipped_no_data += 1
+                skipped_lines |= line
+                continue
             
-            _logger.info(f"📦 Lot {batch_num}: lignes {batch_start}-{batch_end}")
+            # Vérifier que l'emplacement est de type interne
+            if line.location_id.usage != 'internal':
+                skipped_bad_location += 1
+                skipped_lines |= line
+                errors.append(f"Emplacement '{line.location_id.name}' non interne")
+                continue
             
-            for line in batch_lines:
-                try:
-                    if not line.product_id or not line.location_id:
-                        skipped_no_data += 1
-                        continue
-                    
-                    # Vérifier que l'emplacement est de type interne
-                    if line.location_id.usage != 'internal':
-                        skipped_bad_location += 1
-                        errors.append(f"Emplacement '{line.location_id.name}' non interne")
-                        continue
-                    
-                    # Calculer la différence à ajuster
-                    difference = line.product_qty - line.theoretical_qty
-                    
-                    if difference == 0:
-                        skipped_no_difference += 1
-                        continue
-                    
-                    # Créer un stock.move pour l'ajustement (API native)
-                    move_vals = {
-                        'name': f'Inventaire {self.name} - {line.product_id.display_name}',
-                        'product_id': line.product_id.id,
-                        'product_uom': line.product_id.uom_id.id,
-                        'product_uom_qty': abs(difference),
-                        'company_id': self.company_id.id,
-                        'date': self.date or fields.Datetime.now(),
-                        'origin': self.name,
-                        'reference': f'Ajustement inventaire {self.name}',
-                        'stockex_inventory_id': self.id,
-                        'stockex_inventory_line_id': line.id,
-                    }
-                    
-                    # Si différence > 0 : entrée (depuis inventory vers location)
-                    # Si différence < 0 : sortie (depuis location vers inventory)
-                    if difference > 0:
-                        move_vals.update({
-                            'location_id': inventory_loc.id,
-                            'location_dest_id': line.location_id.id,
-                        })
-                    else:
-                        move_vals.update({
-                            'location_id': line.location_id.id,
-                            'location_dest_id': inventory_loc.id,
-                        })
-                    
-                    # Créer et valider le mouvement
-                    move = StockMove.create(move_vals)
-                    move._action_confirm()
-                    move._action_assign()
-                    move._action_done()
-                    
-                    moves_created |= move
-                    adjusted_count += 1
-                    
-                    _logger.debug(f"✅ Ajustement {difference:+.2f} pour {line.product_id.default_code} @ {line.location_id.name}")
-                    
-                except Exception as e:
-                    error_msg = f"{line.product_id.default_code or line.product_id.name} @ {line.location_id.name}: {str(e)}"
-                    errors.append(error_msg)
-                    _logger.error(f"❌ Erreur: {error_msg}")
+            # Calculer la différence à ajuster
+            difference = line.product_qty - line.theoretical_qty
             
-            # Commit après chaque lot
+            if difference == 0:
+                skipped_no_difference += 1
+                skipped_lines |= line
+                continue
+            
+            pending.append((line, self._prepare_adjustment_move_vals(line, difference, inventory_loc)))
+        
+        if skipped_lines:
+            skipped_lines.write({'adjustment_state': 'skipped', 'adjustment_move_id': False, 'adjustment_error': False})
+            processed += len(skipped_lines)
+        if job:
+            job._update_progress(done=processed, total=total_lines)
+        self.env.cr.commit()
+        
+        # 2) Créer et valider les mouvements par lots
+        for batch_num, i in enumerate(range(0, len(pending), batch_size), 1):
+            batch = pending[i:i + batch_size]
+            
+            _logger.info(f"📦 Lot {batch_num}: {len(batch)} mouvements")
+            
+            try:
+                with self.env.cr.savepoint():
+                    moves = self._process_adjustment_moves([vals for _line, vals in batch])
+                Line._mark_adjusted(moves)
+                moves_created |= moves
+                adjusted_count += len(moves)
+            except Exception as batch_error:
+                _logger.warning(f"⚠️ Lot {batch_num} en échec ({batch_error}), reprise ligne par ligne")
+                for line, vals in batch:
+                    try:
+                        with self.env.cr.savepoint():
+                            move = self._process_adjustment_moves([vals])
+                        Line._mark_adjusted(move)
+                        moves_created |= move
+                        adjusted_count += 1
+                    except Exception as e:
+                        error_msg = f"{line.product_id.default_code or line.product_id.name} @ {line.location_id.name}: {str(e)}"
+                        errors.append(error_msg)
+                        line.write({'adjustment_state': 'error', 'adjustment_error': str(e)})
+                        _logger.error(f"❌ Erreur: {error_msg}")
+            
+            # Commit après chaque lot, avec le curseur (et la progression de la tâche)
+            processed += len(batch)
+            self.validation_cursor = batch[-1][0].id
+            if job:
+                job._update_progress(done=processed, checkpoint=self.validation_cursor)
             self.env.cr.commit()
-            progress_pct = (batch_end / total_lines) * 100
+            progress_pct = (min(i + batch_size, len(pending)) / len(pending)) * 100
             _logger.info(f"✅ Lot {batch_num} terminé: {adjusted_count} mouvements ({progress_pct:.1f}%)")
         
+        # Toutes les lignes sont traitées : le curseur passe après la dernière
+        if lines:
+            self.validation_cursor = lines[-1].id
+        
+        elapsed = time.monotonic() - started_at
+        throughput = (len(lines) / elapsed) if elapsed > 0 else 0.0
+        
         # Statistiques détaillées
         stats = f"""
 📊 Statistiques (API Native):
 - Total lignes: {total_lines}
+- ♻️ Déjà traitées (reprise): {total_lines - len(lines)}
 - ✅ Mouvements créés: {adjusted_count}
 - ⏭️ Ignorées (pas de différence): {skipped_no_difference}
 - ⚠️ Ignorées (emplacement non interne): {skipped_bad_location}
 - ⚠️ Ignorées (sans données): {skipped_no_data}
 - ❌ Erreurs: {len(errors)}
+- ⏱️ Durée: {elapsed:.1f} s ({throughput:.1f} lignes/s)
 """
         
         # Message de confirmation
@@ -1399,41 +1481,51 @@ class StockInventoryExtension(models.Model):
         
         return moves_created
     
-    @staticmethod
-    def _update_odoo_stock_async(inventory_id, dbname):
-        """Version asynchrone de _update_odoo_stock pour gros inventaires (utilise un nouveau curseur)."""
-        from odoo import api, SUPERUSER_ID
-        from odoo.modules.registry import Registry
+    def _reset_adjustment_tracking(self):
+        """Remet les lignes « à ajuster » et le curseur de validation à zéro (inventaire annulé)."""
+        self.line_ids.write({'adjustment_state': 'pending', 'adjustment_move_id': False, 'adjustment_error': False})
+        self.write({'validation_cursor': 0})
+
+    def _prepare_adjustment_move_vals(self, line, difference, inventory_loc):
+        """Valeurs du stock.move d'ajustement d'une ligne d'inventaire.
         
-        registry = None
-        try:
-            # Créer un nouveau curseur et registry
-            registry = Registry(dbname)
-            with registry.cursor() as new_cr:
-                env = api.Environment(new_cr, SUPERUSER_ID, {})
-                inventory = env['stockex.stock.inventory'].browse(inventory_id)
-                
-                _logger.info(f"🚀 Début traitement asynchrone pour inventaire {inventory.name}")
-                inventory._update_odoo_stock()
-                new_cr.commit()
-                _logger.info(f"✅ Traitement asynchrone terminé pour inventaire {inventory.name}")
-                
-        except Exception as e:
-            _logger.error(f"❌ Erreur traitement asynchrone: {e}", exc_info=True)
-            # Essayer de poster l'erreur dans le chatter
-            if registry:
-                try:
-                    with registry.cursor() as err_cr:
-                        err_env = api.Environment(err_cr, SUPERUSER_ID, {})
-                        inventory = err_env['stockex.stock.inventory'].browse(inventory_id)
-                        inventory.message_post(
-                            body=Markup(f"❌ Erreur lors de la mise à jour des stocks: {str(e)}"),
-                            message_type='notification',
-                            subtype_xmlid='mail.mt_note'
-                        )
-                        err_cr.commit()
-                except Exception as msg_err:
-                    _logger.error(f"❌ Impossible de poster l'erreur: {msg_err}")
+        Si différence > 0 : entrée (depuis inventory vers location)
+        Si différence < 0 : sortie (depuis location vers inventory)
+        """
+        move_vals = {
+            'name': f'Inventaire {self.name} - {line.product_id.display_name}',
+            'product_id': line.product_id.id,
+            'product_uom': line.product_id.uom_id.id,
+            'product_uom_qty': abs(difference),
+            'company_id': self.company_id.id,
+            'date': self.date or fields.Datetime.now(),
+            'origin': self.name,
+            'reference': f'Ajustement inventaire {self.name}',
+            'stockex_inventory_id': self.id,
+            'stockex_inventory_line_id': line.id,
+        }
+        if difference > 0:
+            move_vals.update({
+                'location_id': inventory_loc.id,
+                'location_dest_id': line.location_id.id,
+            })
+        else:
+            move_vals.update({
+                'location_id': line.location_id.id,
+                'location_dest_id': inventory_loc.id,
+            })
+        return move_vals
+    
+    def _process_adjustment_moves(self, vals_list):
+        """Crée puis confirme, réserve et termine un lot de mouvements d'ajustement.
+        
+        Pas de fusion à la confirmation: chaque mouvement reste lié à sa ligne.
+        """
+        moves = self.env['stock.move'].create(vals_list)
+        moves._action_confirm(merge=False)
+        moves._action_assign()
+        moves._action_done()
+        return moves
     
     def action_draft(self):
         """Remet l'inventaire en brouillon."""
@@ -1484,6 +1576,7 @@ class StockInventoryExtension(models.Model):
                 try:
                     moves_to_cancel._action_cancel()
                     inventory.write({'state': 'cancel', 'validator_id': False, 'validation_date': False})
+                    inventory._reset_adjustment_tracking()
                     inventory.message_post(
                         body=Markup(f"❌ Inventaire annulé - {len(moves_to_cancel)} mouvements inversés"),
                         message_type='notification'
@@ -1597,6 +1690,7 @@ class StockInventoryExtension(models.Model):
             
             # 3. Annuler l'inventaire
             inventory.write({'state': 'cancel'})
+            inventory._reset_adjustment_tracking()
             
             # 4. Message dans le chatter
             message_body = f"""
@@ -1957,41 +2051,13 @@ class StockInventoryExtension(models.Model):
                 }
             }
         
-        # Forcer le recalcul pour chaque ligne
-        updated_count = 0
-        price_updated = 0
-        for line in self.line_ids:
-            if not line.product_id or not line.location_id:
-                continue
-            
-            # Récupérer la quantité depuis stock.quant
-            quants = self.env['stock.quant'].search([
-                ('product_id', '=', line.product_id.id),
-                ('location_id', '=', line.location_id.id),
-            ])
-            
-            qty_available = sum(quants.mapped('quantity')) - sum(quants.mapped('reserved_quantity'))
-            
-            # Calculer la différence
-            difference = line.product_qty - qty_available
-            
-            # Forcer l'écriture directe (bypass du compute)
-            self.env.cr.execute("""
-                UPDATE stockex_stock_inventory_line 
-                SET theoretical_qty = %s, difference = %s
-                WHERE id = %s
-            """, (qty_available, difference, line.id))
-            
-            if qty_available > 0:
-                updated_count += 1
-            
-            _logger.info(
-                f"📦 Ligne {line.id}: {line.product_id.name} → "
-                f"Théo: {qty_available}, Réel: {line.product_qty}, Écart: {difference}"
-            )
-        
-        # Invalider le cache pour forcer le rechargement
-        self.line_ids.invalidate_recordset(['theoretical_qty', 'difference', 'difference_display', 'standard_price'])
+        # Recalcul ensemble (une requête), puis propagation aux champs dépendants
+        # (écart, valeur d'écart, totaux de l'inventaire)
+        lines = self.line_ids
+        self.env.add_to_compute(lines._fields['theoretical_qty'], lines)
+        lines.modified(['theoretical_qty'])
+        lines.flush_recordset()
+        lines.invalidate_recordset(['standard_price'])
         
         # Compter les résultats
         lines_with_qty = len([l for l in self.line_ids if l.theoretical_qty > 0])
@@ -2045,6 +2111,8 @@ class StockInventoryLine(models.Model):
     _order = 'product_id, id'
     _rec_name = 'product_id'
     
+    _mobile_ref_uniq = models.UniqueIndex("(mobile_ref) WHERE mobile_ref IS NOT NULL")
+    
     # Champ requis pour le widget badge
     color = fields.Integer(string='Couleur', default=0)
     
@@ -2109,6 +2177,19 @@ class StockInventoryLine(models.Model):
         string='Emplacement',
         index=True
     )
+    mobile_ref = fields.Char(
+        string='Référence mobile',
+        readonly=True,
+        copy=False,
+        index=True,
+        help='Appareil et identifiant local (appareil:local_id) de la ligne saisie hors ligne'
+    )
+    mobile_scanned_at = fields.Datetime(
+        string='Dernier scan mobile',
+        readonly=True,
+        copy=False,
+        help='Horodatage (appareil) du dernier scan appliqué à la ligne'
+    )
     standard_price = fields.Float(
         string='Prix unitaire',
         compute='_compute_standard_price',
@@ -2199,32 +2280,99 @@ class StockInventoryLine(models.Model):
         help='Notes ou observations sur cette ligne d\'inventaire'
     )
     
+    # Suivi de l'ajustement (validation reprenable)
+    adjustment_state = fields.Selection(
+        selection=[
+            ('pending', 'À ajuster'),
+            ('done', 'Ajustée'),
+            ('skipped', 'Ignorée'),
+            ('error', 'Erreur'),
+        ],
+        string='Statut ajustement',
+        default='pending',
+        readonly=True,
+        copy=False,
+        index=True,
+        help='Avancement de l\'ajustement de stock de cette ligne lors de la validation'
+    )
+    adjustment_move_id = fields.Many2one(
+        comodel_name='stock.move',
+        string='Mouvement d\'ajustement',
+        readonly=True,
+        copy=False,
+        index='btree_not_null'
+    )
+    adjustment_error = fields.Text(
+        string='Erreur d\'ajustement',
+        readonly=True,
+        copy=False
+    )
+    
     @api.model_create_multi
     def create(self, vals_list):
         """Auto-remplit location_id depuis l'inventaire parent et product_serial avec le code produit si non fourni."""
+        # Emplacements d'inventaire et codes produits lus en une fois pour tout le lot
+        inventory_locations = {
+            inventory.id: inventory.location_id.id
+            for inventory in self.env['stockex.stock.inventory'].browse(
+                {vals['inventory_id'] for vals in vals_list if vals.get('inventory_id') and not vals.get('location_id')}
+            )
+        }
+        product_codes = {
+            product.id: product.default_code
+            for product in self.env['product.product'].browse(
+                {vals['product_id'] for vals in vals_list if vals.get('product_id') and not vals.get('product_serial')}
+            )
+        }
         for vals in vals_list:
             # Si location_id n'est pas fourni mais inventory_id oui, récupérer l'emplacement de l'inventaire
             if not vals.get('location_id') and vals.get('inventory_id'):
-                inventory = self.env['stockex.stock.inventory'].browse(vals['inventory_id'])
-                if inventory.location_id:
-                    vals['location_id'] = inventory.location_id.id
+                if inventory_locations.get(vals['inventory_id']):
+                    vals['location_id'] = inventory_locations[vals['inventory_id']]
             
             # Si product_serial n'est pas fourni mais product_id oui, remplir avec le code produit
             if not vals.get('product_serial') and vals.get('product_id'):
-                product = self.env['product.product'].browse(vals['product_id'])
-                if product.default_code:
-                    vals['product_serial'] = product.default_code
+                if product_codes.get(vals['product_id']):
+                    vals['product_serial'] = product_codes[vals['product_id']]
         
         return super().create(vals_list)
     
+    @api.model
+    def _mark_adjusted(self, moves):
+        """Marque comme ajustées les lignes des mouvements donnés et les y lie (une requête)."""
+        pairs = [(move.stockex_inventory_line_id.id, move.id) for move in moves if move.stockex_inventory_line_id]
+        if not pairs:
+            return
+        self.env.cr.execute("""
+            UPDATE stockex_stock_inventory_line line
+               SET adjustment_state = 'done',
+                   adjustment_move_id = adj.move_id,
+                   adjustment_error = NULL,
+                   write_uid = %s,
+                   write_date = (now() at time zone 'UTC')
+              FROM unnest(%s::int[], %s::int[]) AS adj(line_id, move_id)
+             WHERE line.id = adj.line_id
+        """, [self.env.uid, [p[0] for p in pairs], [p[1] for p in pairs]])
+        lines = self.browse([p[0] for p in pairs])
+        lines.invalidate_recordset(['adjustment_state', 'adjustment_move_id', 'adjustment_error'])
+        lines.modified(['adjustment_state'])
+    
     @api.depends('product_id')
     def _compute_standard_price(self):
         """Calcule le prix unitaire depuis product.standard_price (source unique de vérité)."""
+        # Résoudre les prix par inventaire (une série de requêtes par inventaire, pas par ligne)
+        prices_by_inventory = {}
+        for inventory in self.inventory_id:
+            inv_lines = self.filtered(lambda l: l.inventory_id == inventory)
+            prices_by_inventory[inventory.id] = inventory._get_valuation_prices(
+                inv_lines.product_id, company=inventory.company_id, date=inventory.date
+            )
+        
         for line in self:
             if line.product_id:
                 # Utiliser la méthode de valorisation de l'inventaire
                 if line.inventory_id:
-                    line.standard_price = line.inventory_id._get_product_valuation_price(line.product_id)
+                    line.standard_price = prices_by_inventory[line.inventory_id.id].get(line.product_id.id, 0.0)
                 else:
                     # Fallback si pas d'inventaire (cas rare)
                     line.standard_price = line.product_id.standard_price or 0.0
@@ -2235,92 +2383,75 @@ class StockInventoryLine(models.Model):
     def _compute_theoretical_qty(self):
         """Calcule la quantité théorique depuis le stock Odoo.
         
-        Cherche dans l'emplacement exact ET ses enfants pour plus de flexibilité.
+        Cherche dans l'emplacement exact ET tout son sous-arbre (parent_path).
         """
-        # Préparer l'ensemble des lignes pertinentes (avec produit et emplacement)
-        lines = self.filtered(lambda l: l.product_id and l.location_id)
-
-        # Initialiser les lignes sans données requises à 0
-        for line in (self - lines):
-            line.theoretical_qty = 0.0
-
-        if not lines:
-            return
-
-        product_ids = list(set(lines.mapped('product_id').ids))
-        
-        # Récupérer tous les emplacements + leurs enfants
-        location_ids = set()
-        for loc in lines.mapped('location_id'):
-            # Ajouter l'emplacement lui-même
-            location_ids.add(loc.id)
-            # Ajouter tous ses enfants (child_ids est récursif dans Odoo)
-            location_ids.update(loc.child_ids.ids)
-        
-        location_ids = list(location_ids)
-        
-        # Récupérer les company_ids des lignes
-        company_ids = list(set(lines.mapped('inventory_id.company_id').ids))
-        if not company_ids:
-            company_ids = [self.env.company.id]
-
-        _logger.info(
-            f"🔍 Calcul theoretical_qty pour {len(lines)} lignes, "
-            f"{len(product_ids)} produits, {len(location_ids)} emplacements (incluant enfants), "
-            f"companies: {company_ids}"
-        )
-
-        # Agréger en une seule requête SQL AVEC FILTRE COMPANY ET EMPLACEMENTS ENFANTS
-        groups = self.env['stock.quant'].read_group(
-            domain=[
-                ('product_id', 'in', product_ids),
-                ('location_id', 'in', location_ids),  # ✅ Inclut les enfants
-                ('company_id', 'in', company_ids),
-            ],
-            fields=['quantity:sum', 'reserved_quantity:sum'],
-            groupby=['product_id', 'location_id'],
-        )
-
-        _logger.info(f"📊 {len(groups)} groupes de stock.quant trouvés")
-
-        # Construire un mapping (product_id, location_id) -> quantity
-        # Inclure les quantités des emplacements enfants
-        qty_map = {}  # (product_id, location_id) -> qty
-        
-        for g in groups:
-            if 'product_id' in g and 'location_id' in g:
-                prod_id = g['product_id'][0] if g['product_id'] else None
-                loc_id = g['location_id'][0] if g['location_id'] else None
-                if prod_id and loc_id:
-                    qty = g.get('quantity_sum', 0.0) or 0.0
-                    reserved = g.get('reserved_quantity_sum', 0.0) or 0.0
-                    available = qty - reserved
-                    
-                    # Ajouter à toutes les lignes dont le location_id correspond
-                    # (soit exact, soit parent de loc_id)
-                    for line in lines:
-                        if line.product_id.id == prod_id:
-                            # Vérifier si loc_id est l'emplacement de la ligne ou un enfant
-                            if (loc_id == line.location_id.id or 
-                                loc_id in line.location_id.child_ids.ids):
-                                key = (line.product_id.id, line.location_id.id)
-                                qty_map[key] = qty_map.get(key, 0.0) + available
-
-        # Appliquer les quantités
+        qty_map = self._get_theoretical_quantities()
+        
         updated_count = 0
-        for line in lines:
-            theo_qty = qty_map.get((line.product_id.id, line.location_id.id), 0.0)
+        for line in self:
+            theo_qty = qty_map.get(line.id, 0.0)
             line.theoretical_qty = theo_qty
             if theo_qty > 0:
                 updated_count += 1
         
         if updated_count > 0:
-            _logger.info(f"✅ {updated_count} lignes avec quantité théorique > 0")
-        else:
+            _logger.info(f"✅ {updated_count}/{len(self)} lignes avec quantité théorique > 0")
+        elif self:
             _logger.warning(
                 f"⚠️ Aucune ligne avec stock trouvée ! "
                 f"Vérifiez que les emplacements correspondent."
             )
+    
+    def _get_theoretical_quantities(self):
+        """Retourne la quantité disponible (quantité - réservée) de chaque ligne.
+        
+        Une seule requête SQL: l'arborescence (parent_path LIKE ...) de
+        chaque emplacement distinct des lignes est résolue une seule fois,
+        puis chaque ligne est jointe aux quants de cette arborescence,
+        filtrés par produit et société de l'inventaire. Fonctionne aussi pour
+        les lignes non encore enregistrées.
+        
+        Returns:
+            dict: {line.id: quantité disponible} (lignes sans stock absentes)
+        """
+        lines = self.filtered(lambda l: l.product_id and l.location_id)
+        if not lines:
+            return {}
+        
+        # Les quants et la hiérarchie doivent être à jour en base avant l'agrégation
+        self.env['stock.quant'].flush_model(['product_id', 'location_id', 'company_id', 'quantity', 'reserved_quantity'])
+        self.env['stock.location'].flush_model(['parent_path'])
+        
+        default_company_id = self.env.company.id
+        indexes, product_ids, location_ids, company_ids = [], [], [], []
+        for idx, line in enumerate(lines):
+            indexes.append(idx)
+            product_ids.append(line.product_id._origin.id)
+            location_ids.append(line.location_id._origin.id)
+            company_ids.append(line.inventory_id.company_id._origin.id or default_company_id)
+        
+        self.env.cr.execute("""
+            WITH k AS (
+                SELECT * FROM unnest(%s::int[], %s::int[], %s::int[], %s::int[])
+                    AS k(idx, product_id, location_id, company_id)
+            ), subtree AS MATERIALIZED (
+                -- Sous-emplacements de chaque emplacement distinct des lignes
+                SELECT root.id AS root_id, loc.id AS location_id
+                FROM stock_location root
+                JOIN stock_location loc ON loc.parent_path LIKE root.parent_path || '%%'
+                WHERE root.id IN (SELECT DISTINCT location_id FROM k)
+            )
+            SELECT k.idx, SUM(q.quantity - q.reserved_quantity)
+            FROM k
+            JOIN subtree ON subtree.root_id = k.location_id
+            JOIN stock_quant q ON q.location_id = subtree.location_id
+                AND q.product_id = k.product_id
+                AND q.company_id = k.company_id
+            GROUP BY k.idx
+        """, (indexes, product_ids, location_ids, company_ids))
+        
+        line_ids = lines._ids
+        return {line_ids[idx]: qty or 0.0 for idx, qty in self.env.cr.fetchall()}
 
     def _inverse_theoretical_qty(self):
         """Méthode inverse pour permettre de forcer la valeur theoretical_qty (pour stock initial)."""
@@ -2427,16 +2558,29 @@ class StockInventoryLine(models.Model):
 
     @api.constrains('product_id', 'inventory_id')
     def _check_product_uniqueness(self):
-        """Vérifie qu'un produit n'apparaît qu'une seule fois par inventaire."""
+        """Vérifie qu'un produit n'apparaît qu'une seule fois par inventaire.
+
+        Un seul regroupement pour toutes les lignes vérifiées (créations en
+        masse) au lieu d'un comptage par ligne.
+        """
+        if not self:
+            return
+        groups = self._read_group(
+            [('inventory_id', 'in', self.inventory_id.ids), ('product_id', 'in', self.product_id.ids)],
+            ['inventory_id', 'product_id', 'location_id'],
+            ['__count'],
+        )
+        by_location, by_product = {}, {}
+        for inventory, product, location, count in groups:
+            by_location[(inventory.id, product.id, location.id)] = count
+            by_product[(inventory.id, product.id)] = by_product.get((inventory.id, product.id), 0) + count
         for line in self:
-            domain = [
-                ('inventory_id', '=', line.inventory_id.id),
-                ('product_id', '=', line.product_id.id),
-                ('id', '!=', line.id)
-            ]
+            # Sans emplacement, le produit ne doit figurer sur aucune autre ligne de l'inventaire
             if line.location_id:
-                domain.append(('location_id', '=', line.location_id.id))
-            if self.search_count(domain) > 0:
+                count = by_location.get((line.inventory_id.id, line.product_id.id, line.location_id.id), 0)
+            else:
+                count = by_product.get((line.inventory_id.id, line.product_id.id), 0)
+            if count > 1:
                 raise UserError(
                     f"Le produit '{line.product_id.display_name}' est déjà présent dans cet inventaire "
                     f"pour cet emplacement."
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Cache des photos par contenu.
+
+Chaque photo téléchargée (Kobo) ou envoyée (mobile) est identifiée par le
+SHA-256 de ses octets d'origine. Ses variantes compressées sont enregistrées
+une seule fois par (empreinte, taille max, qualité) et réutilisées par toutes
+les lignes d'inventaire et tous les ré-imports : une image déjà connue ne
+repasse ni par le réseau (URL source connue) ni par PIL (empreinte connue).
+Le filestore indexant les pièces jointes par contenu, toutes les lignes qui
+reprennent une variante partagent le même fichier.
+
+Le nettoyage automatique (autovacuum) supprime les variantes qu'aucune autre
+pièce jointe ne reprend plus, ainsi que les variantes plus anciennes que
+stockex.photo_cache_retention_days.
+"""
+
+import base64
+import hashlib
+import logging
+from datetime import timedelta
+from io import BytesIO
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def compress_photo(content, max_dimension=1600, quality=90):
+    """Redimensionne une image et la ré-encode en JPEG progressif.
+
+    Returns:
+        octets JPEG de l'image compressée
+    """
+    from PIL import Image
+
+    # Charger l'image
+    img = Image.open(BytesIO(content))
+
+    # Convertir en RGB si nécessaire (pour PNG avec transparence)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    # Redimensionner si l'image est trop grande
+    if max(img.size) > max_dimension:
+        ratio = max_dimension / max(img.size)
+        new_size = tuple(int(dim * ratio) for dim in img.size)
+        # Utiliser LANCZOS pour la meilleure qualité de redimensionnement
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+    # optimize=True pour une compression optimale
+    # progressive=True pour chargement progressif (meilleure expérience)
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def photo_checksum(content):
+    """Empreinte SHA-256 (hexadécimale) des octets d'origine d'une photo."""
+    return hashlib.sha256(content).hexdigest()
+
+
+class StockexPhotoCache(models.Model):
+    """Variante (compressée ou d'origine) d'une photo, identifiée par son contenu."""
+    _name = 'stockex.photo.cache'
+    _description = 'Cache des Photos StockEx'
+    _order = 'id desc'
+
+    checksum = fields.Char(
+        string='Empreinte SHA-256',
+        required=True,
+        readonly=True,
+        index=True,
+        help='SHA-256 des octets d\'origine de la photo'
+    )
+    max_size = fields.Integer(
+        string='Taille Max (px)',
+        readonly=True,
+        help='Dimension maximale de la variante (0 = photo d\'origine)'
+    )
+    quality = fields.Integer(
+        string='Qualité JPEG (%)',
+        readonly=True,
+        help='Qualité JPEG de la variante (0 = photo d\'origine)'
+    )
+    source_url = fields.Char(
+        string='URL Source',
+        readonly=True,
+        index=True,
+        help='URL de téléchargement de la photo d\'origine (Kobo)'
+    )
+    content = fields.Binary(
+        string='Contenu',
+        attachment=True,
+        readonly=True
+    )
+    file_size = fields.Integer(
+        string='Taille (octets)',
+        readonly=True
+    )
+    original_size = fields.Integer(
+        string='Taille d\'origine (octets)',
+        readonly=True
+    )
+
+    _variant_uniq = models.UniqueIndex("(checksum, max_size, quality)")
+
+    # Réglages par défaut des photos envoyées hors Kobo (mobile)
+    _default_max_size = 1600
+    _default_quality = 90
+
+    # Délai avant qu'une variante non reprise par une ligne puisse être supprimée
+    # (le temps pour la tâche qui l'a créée d'écrire les photos des lignes)
+    _unreferenced_grace_hours = 24
+
+    @api.model
+    def _lookup_urls(self, urls, max_size=0, quality=0):
+        """Variantes déjà connues par URL source.
+
+        Returns:
+            dict {url: octets de la variante}
+        """
+        if not urls:
+            return {}
+        entries = self.sudo().search([
+            ('source_url', 'in', list(set(urls))),
+            ('max_size', '=', max_size),
+            ('quality', '=', quality),
+        ])
+        return {entry.source_url: base64.b64decode(entry.content) for entry in entries if entry.content}
+
+    @api.model
+    def _lookup_checksums(self, checksums, max_size=0, quality=0):
+        """Variantes déjà connues par empreinte des octets d'origine.
+
+        Returns:
+            dict {empreinte: octets de la variante}
+        """
+        if not checksums:
+            return {}
+        entries = self.sudo().search([
+            ('checksum', 'in', list(set(checksums))),
+            ('max_size', '=', max_size),
+            ('quality', '=', quality),
+        ])
+        return {entry.checksum: base64.b64decode(entry.content) for entry in entries if entry.content}
+
+    @api.model
+    def _store(self, variants, max_size=0, quality=0):
+        """Enregistre de nouvelles variantes en une création groupée.
+
+        Args:
+            variants: dicts {checksum, content, original_size, source_url (optionnel)} ;
+                les empreintes déjà enregistrées pour ce réglage sont ignorées
+        """
+        known = set(self._lookup_checksums([variant['checksum'] for variant in variants], max_size, quality))
+        vals_list = []
+        for variant in variants:
+            if variant['checksum'] in known:
+                continue
+            known.add(variant['checksum'])
+            vals_list.append({
+                'checksum': variant['checksum'],
+                'max_size': max_size,
+                'quality': quality,
+                'source_url': variant.get('source_url'),
+                'content': base64.b64encode(variant['content']),
+                'file_size': len(variant['content']),
+                'original_size': variant.get('original_size', len(variant['content'])),
+            })
+        # Création par paquets avec repli unitaire : une variante enregistrée
+        # entre-temps par une autre tâche (index unique) n'annule pas le paquet
+        created, errors = self.env['stockex.import.engine'].sudo()._create_batched(self._name, vals_list)
+        if errors:
+            _logger.info(f"📷 {len(errors)} variante(s) déjà enregistrée(s) par une autre tâche")
+        return len(created)
+
+    @api.model
+    def _get_variant(self, content, max_size=None, quality=None):
+        """Variante compressée d'une photo reçue (ex: envoi mobile), compressée au plus une fois.
+
+        Args:
+            content: octets d'origine
+            max_size, quality: réglages de la variante (défaut : _default_max_size, _default_quality)
+
+        Returns:
+            octets de la variante (photo d'origine si la compression échoue)
+        """
+        max_size = max_size or self._default_max_size
+        quality = quality or self._default_quality
+        checksum = photo_checksum(content)
+        cached = self._lookup_checksums([checksum], max_size, quality)
+        if checksum in cached:
+            return cached[checksum]
+        try:
+            variant = compress_photo(content, max_size, quality)
+        except Exception as e:
+            # Garder la photo d'origine en cas d'erreur
+            _logger.warning(f"⚠️ Impossible de compresser la photo {checksum[:12]}: {e}")
+            return content
+        self._store([{'checksum': checksum, 'content': variant, 'original_size': len(content)}], max_size, quality)
+        return variant
+
+    @api.autovacuum
+    def _gc_photo_cache(self):
+        """Supprime les variantes orphelines ou trop anciennes.
+
+        Une variante est orpheline quand aucune autre pièce jointe (photo de
+        ligne d'inventaire, etc.) n'a la même empreinte de contenu que la
+        sienne. Toute variante plus ancienne que stockex.photo_cache_retention_days
+        (180 jours) est supprimée, reprise ou non : elle sera recréée au besoin.
+        """
+        days = int(self.env['ir.config_parameter'].sudo().get_param('stockex.photo_cache_retention_days', '180') or 180)
+        now = fields.Datetime.now()
+        self.env['ir.attachment'].flush_model(['res_model', 'res_field', 'res_id', 'checksum'])
+        self.flush_model(['create_date'])
+        self.env.cr.execute("""
+            SELECT cache.id
+            FROM stockex_photo_cache cache
+            LEFT JOIN ir_attachment own
+                ON own.res_model = %s AND own.res_field = 'content' AND own.res_id = cache.id
+            WHERE cache.create_date < %s
+               OR (cache.create_date < %s AND (
+                    own.id IS NULL
+                    OR NOT EXISTS (
+                        SELECT 1 FROM ir_attachment ref
+                        WHERE ref.checksum = own.checksum AND ref.id != own.id
+                    )
+               ))
+        """, [self._name, now - timedelta(days=days), now - timedelta(hours=self._unreferenced_grace_hours)])
+        old = self.sudo().browse([row[0] for row in self.env.cr.fetchall()])
+        if old:
+            old.unlink()
+            _logger.info(f"🧹 {len(old)} variante(s) de photo supprimée(s) du cache")
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Instantané par (produit, société) du dernier coût et de la rotation.
+
+Les vues d'analyse (stockex_stock_analysis, stockex_depreciation_report,
+stockex_stock_variance_report) joignent cette table au lieu de réévaluer
+pour chaque quant les sous-requêtes « dernière couche de valorisation » et
+« dernier mouvement réalisé ».
+"""
+
+import logging
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+class ProductSnapshot(models.Model):
+    """Dernier coût unitaire, dernier mouvement et décote par produit/société."""
+    _name = 'stockex.product.snapshot'
+    _description = 'Instantané Coût et Rotation Produit'
+    _rec_name = 'product_id'
+
+    product_id = fields.Many2one(
+        comodel_name='product.product',
+        string='Produit',
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+        index=True
+    )
+    company_id = fields.Many2one(
+        comodel_name='res.company',
+        string='Société',
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+        index=True
+    )
+    unit_cost = fields.Float(
+        string='Dernier Coût Unitaire',
+        digits='Product Price',
+        readonly=True,
+        help='Coût unitaire de la dernière couche de valorisation'
+    )
+    standard_price = fields.Float(
+        string='Coût Standard',
+        digits='Product Price',
+        readonly=True,
+        help='Coût standard du produit pour la société'
+    )
+    last_move_date = fields.Date(
+        string='Dernier Mouvement',
+        readonly=True
+    )
+    rotation_status = fields.Selection(
+        selection=[
+            ('active', 'Stock Actif'),
+            ('slow', 'Rotation Lente'),
+            ('dead', 'Stock Mort'),
+        ],
+        string='Statut Rotation',
+        readonly=True
+    )
+    depreciation_rate = fields.Float(
+        string='Taux Décote (%)',
+        readonly=True
+    )
+
+    _product_company_uniq = models.UniqueIndex("(product_id, company_id)")
+
+    def init(self):
+        """Construit l'instantané à l'installation (table vide uniquement)."""
+        self.env.cr.execute("SELECT 1 FROM stockex_product_snapshot LIMIT 1")
+        if not self.env.cr.fetchone():
+            self._refresh()
+
+    @api.model
+    def _refresh(self, keys=None):
+        """Recalcule l'instantané.
+
+        Args:
+            keys: liste de tuples (product_id, company_id) à rafraîchir;
+                None = reconstruction complète (quants + lignes d'inventaire)
+
+        Une seule requête INSERT ... SELECT ... ON CONFLICT, quel que soit le
+        nombre de produits.
+        """
+        cr = self.env.cr
+        engine = self.env['stockex.depreciation.engine']
+
+        params = []
+        if keys is None:
+            keys_sql = """
+                SELECT product_id, company_id FROM stock_quant
+                UNION
+                SELECT line.product_id, inv.company_id
+                FROM stockex_stock_inventory_line line
+                JOIN stockex_stock_inventory inv ON inv.id = line.inventory_id
+            """
+        else:
+            keys = list({(p, c) for p, c in keys if p and c})
+            if not keys:
+                return 0
+            keys_sql = "SELECT DISTINCT * FROM unnest(%s::int[], %s::int[]) AS k(product_id, company_id)"
+            params += [[k[0] for k in keys], [k[1] for k in keys]]
+
+        if keys is None:
+            # Reconstruction complète : une agrégation groupée de stock_move
+            last_moves_sql = f"""LEFT JOIN {engine._sql_last_moves(by_company=True)} lm
+                ON lm.product_id = k.product_id AND lm.company_id = k.company_id"""
+        else:
+            # Rafraîchissement ciblé (validation de mouvements) : seuls les
+            # mouvements des couples demandés sont lus
+            last_moves_sql = """LEFT JOIN LATERAL (
+                SELECT MAX(sm.date) AS last_move_date FROM stock_move sm
+                WHERE sm.state = 'done' AND sm.product_id = k.product_id AND sm.company_id = k.company_id
+            ) lm ON TRUE"""
+
+        cr.execute("SELECT to_regclass('stock_valuation_layer')")
+        if cr.fetchone()[0]:
+            unit_cost_sql = """(
+                SELECT svl.unit_cost FROM stock_valuation_layer svl
+                WHERE svl.product_id = k.product_id AND svl.company_id = k.company_id
+                ORDER BY svl.create_date DESC, svl.id DESC
+                LIMIT 1
+            )"""
+        else:
+            unit_cost_sql = "NULL::numeric"
+
+        query = f"""
+            INSERT INTO stockex_product_snapshot (
+                product_id, company_id, unit_cost, standard_price,
+                last_move_date, rotation_status, depreciation_rate,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT
+                k.product_id,
+                k.company_id,
+                COALESCE({unit_cost_sql}, 0.0),
+                COALESCE((pp.standard_price ->> k.company_id::text)::numeric, 0.0),
+                lm.last_move_date::date,
+                rot.bucket,
+                rot.depreciation_rate,
+                %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC')
+            FROM ({keys_sql}) k
+            JOIN product_product pp ON pp.id = k.product_id
+            {last_moves_sql}
+            CROSS JOIN {engine._sql_params('dep')}
+            CROSS JOIN LATERAL (SELECT CURRENT_DATE - lm.last_move_date::date AS days_since_move) age
+            CROSS JOIN LATERAL (
+                SELECT b.bucket, {engine._sql_rate('b.bucket', 'dep')} AS depreciation_rate
+                FROM (SELECT {engine._sql_bucket('age.days_since_move', 'dep')} AS bucket) b
+            ) rot
+            WHERE k.product_id IS NOT NULL AND k.company_id IS NOT NULL
+            ON CONFLICT (product_id, company_id) DO UPDATE SET
+                unit_cost = EXCLUDED.unit_cost,
+                standard_price = EXCLUDED.standard_price,
+                last_move_date = EXCLUDED.last_move_date,
+                rotation_status = EXCLUDED.rotation_status,
+                depreciation_rate = EXCLUDED.depreciation_rate,
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+        """
+        # Paramètres d'audit (SELECT) puis, le cas échéant, ceux des clés (FROM)
+        uid = self.env.uid
+        cr.execute(query, [uid, uid] + params)
+        count = cr.rowcount
+        self.invalidate_model()
+        return count
+
+    @api.model
+    def _refresh_from_moves(self, moves):
+        """Rafraîchit l'instantané des couples (produit, société) de mouvements réalisés."""
+        keys = [(move.product_id.id, move.company_id.id) for move in moves if move.state == 'done']
+        if keys:
+            self._refresh(keys)
+
+    @api.model
+    def _cron_rebuild(self):
+        """Reconstruction complète (planifiée): purge puis recalcul de tous les couples."""
+        self.env.cr.execute("DELETE FROM stockex_product_snapshot")
+        count = self._refresh()
+        _logger.info("📸 Instantané produits reconstruit: %d ligne(s)", count)
+        return True
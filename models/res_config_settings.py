@@ -261,6 +261,46 @@ class ResConfigSettings(models.TransientModel):
         help='Pourcentage de décote pour les produits en stock mort (ex: 100% = valeur nulle)'
     )
 
+    # Validation des gros inventaires
+    stockex_validation_batch_size = fields.Integer(
+        string='Taille des lots de validation',
+        default=500,
+        config_parameter='stockex.validation_batch_size',
+        help='Nombre de mouvements de stock créés et validés ensemble lors de la validation d\'un inventaire'
+    )
+    stockex_job_max_parallel = fields.Integer(
+        string='Tâches de fond simultanées',
+        default=4,
+        config_parameter='stockex.job_max_parallel',
+        help='Nombre maximal de tâches de fond (validation, import, synchro Kobo) exécutées en même temps, tous workers confondus. '
+             'En mode multi-processus, prévoir au moins autant de workers cron (--max-cron-threads)'
+    )
+    stockex_job_threads_per_worker = fields.Integer(
+        string='Tâches de fond par processus',
+        default=0,
+        config_parameter='stockex.job_threads_per_worker',
+        help='Nombre maximal de tâches de fond exécutées dans un même processus Odoo (0 = automatique : '
+             'une par worker cron en mode multi-processus). Les tâches d\'un même processus partagent le GIL Python'
+    )
+    stockex_dashboard_cache_ttl = fields.Integer(
+        string='Durée du cache du dashboard (s)',
+        default=300,
+        config_parameter='stockex.dashboard_cache_ttl',
+        help='Durée de conservation des agrégats du dashboard. 0 = pas de cache. Le cache est vidé à chaque validation ou annulation d\'inventaire.'
+    )
+    stockex_import_batch_size = fields.Integer(
+        string='Taille des lots d\'import',
+        default=1000,
+        config_parameter='stockex.import_batch_size',
+        help='Nombre de produits, quants ou lignes d\'inventaire créés ensemble par les assistants d\'import Excel/CSV'
+    )
+    stockex_import_shard_count = fields.Integer(
+        string='Lots de l\'import parallèle',
+        default=8,
+        config_parameter='stockex.import_shard_count',
+        help='Nombre de tâches de fond par défaut pour l\'import parallèle du stock initial'
+    )
+
     # Notifications Telegram
     stockex_notify_by_telegram = fields.Boolean(
         string='📱 Activer Notifications Telegram',
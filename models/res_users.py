@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Utilisateurs : résolution en cache des utilisateurs de l'API REST (jetons JWT).
+"""
+
+from odoo import models, tools
+
+
+class ResUsers(models.Model):
+    _inherit = 'res.users'
+
+    @tools.ormcache('user_id')
+    def _stockex_api_user_active(self, user_id):
+        """Vrai si l'utilisateur existe et est actif.
+
+        Résultat en cache par worker : l'authentification d'un appel API ne
+        relit pas l'utilisateur. Le cache est invalidé dans tous les workers
+        dès qu'un utilisateur est désactivé, réactivé ou supprimé.
+        """
+        user = self.sudo().with_context(active_test=False).browse(user_id).exists()
+        return bool(user.active)
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'active' in vals:
+            self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
@@ -55,6 +55,10 @@ class StockInventoryAccounting(models.Model):
                 lines_by_category[category] = []
             lines_by_category[category].append(line)
         
+        # Prix de valorisation des lignes sans prix capturé, résolus en une passe
+        unpriced_lines = self.line_ids.filtered(lambda l: l.difference != 0 and not (l.standard_price and l.standard_price > 0))
+        valuation_prices = self._get_valuation_prices(unpriced_lines.product_id, company=self.company_id, date=self.date)
+        
         # Créer une écriture comptable par catégorie
         for category, lines in lines_by_category.items():
             # Vérifier que les comptes sont configurés
@@ -80,7 +84,7 @@ class StockInventoryAccounting(models.Model):
                     unit_price = line.standard_price
                 else:
                     # Utiliser la méthode de valorisation via l'inventaire
-                    unit_price = line.inventory_id._get_product_valuation_price(line.product_id)
+                    unit_price = valuation_prices.get(line.product_id.id, 0.0)
                 
                 value_diff = line.difference * unit_price
                 
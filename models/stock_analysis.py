@@ -92,9 +92,16 @@ class StockAnalysis(models.Model):
             return
         tools.drop_view_if_exists(self.env.cr, self._table)
         
+        # Coût, rotation et décote: instantané stockex.product.snapshot
+        # (catégories définies par le moteur de décote)
+        engine = self.env['stockex.depreciation.engine']
+        rotation_sql = {
+            'dep_params': engine._sql_params('dep'),
+        }
+        
         if svl_present:
             query = """
-        CREATE OR REPLACE VIEW %s AS (
+        CREATE OR REPLACE VIEW {table} AS (
             SELECT 
                 ROW_NUMBER() OVER (ORDER BY sq.id, inv.id) as id,
                 
@@ -121,31 +128,27 @@ class StockAnalysis(models.Model):
                 0.0 as quantity_incoming,
                 0.0 as quantity_outgoing,
                 
-                -- Valorisation (via SVL)
-                COALESCE((SELECT unit_cost FROM stock_valuation_layer svl WHERE svl.product_id = sq.product_id ORDER BY create_date DESC LIMIT 1), 0.0) as standard_price,
-                COALESCE((SELECT unit_cost FROM stock_valuation_layer svl WHERE svl.product_id = sq.product_id ORDER BY create_date DESC LIMIT 1), 0.0) as economic_price,
-                COALESCE(sq.quantity, 0.0) * COALESCE((SELECT unit_cost FROM stock_valuation_layer svl WHERE svl.product_id = sq.product_id ORDER BY create_date DESC LIMIT 1), 0.0) as value_on_hand,
-                (COALESCE(sq.quantity, 0.0) - COALESCE(sq.reserved_quantity, 0.0)) * COALESCE((SELECT unit_cost FROM stock_valuation_layer svl WHERE svl.product_id = sq.product_id ORDER BY create_date DESC LIMIT 1), 0.0) as value_available,
-                COALESCE(sq.reserved_quantity, 0.0) * COALESCE((SELECT unit_cost FROM stock_valuation_layer svl WHERE svl.product_id = sq.product_id ORDER BY create_date DESC LIMIT 1), 0.0) as value_reserved,
+                -- Valorisation (dernière couche SVL, via l'instantané)
+                COALESCE(snap.unit_cost, 0.0) as standard_price,
+                COALESCE(snap.unit_cost, 0.0) as economic_price,
+                COALESCE(sq.quantity, 0.0) * COALESCE(snap.unit_cost, 0.0) as value_on_hand,
+                (COALESCE(sq.quantity, 0.0) - COALESCE(sq.reserved_quantity, 0.0)) * COALESCE(snap.unit_cost, 0.0) as value_available,
+                COALESCE(sq.reserved_quantity, 0.0) * COALESCE(snap.unit_cost, 0.0) as value_reserved,
                 
                 -- Rotation et décote
-                (SELECT MAX(sm.date) FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done') as last_move_date,
-                COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) as days_since_last_move,
-                CASE WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) < 365 THEN 'active'
-                     WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) BETWEEN 365 AND 1095 THEN 'slow'
-                     ELSE 'dead' END as rotation_status,
-                CASE WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) < 365 THEN 0.0
-                     WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) BETWEEN 365 AND 1095 THEN 40.0
-                     ELSE 100.0 END as depreciation_rate,
-                COALESCE(sq.quantity, 0.0) * COALESCE((SELECT unit_cost FROM stock_valuation_layer svl WHERE svl.product_id = sq.product_id ORDER BY create_date DESC LIMIT 1), 0.0) * (1 - (CASE WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) < 365 THEN 0.0 WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) BETWEEN 365 AND 1095 THEN 0.4 ELSE 1.0 END)) as depreciated_value,
+                snap.last_move_date as last_move_date,
+                COALESCE(CURRENT_DATE - snap.last_move_date, 9999) as days_since_last_move,
+                rot.bucket as rotation_status,
+                rot.depreciation_rate as depreciation_rate,
+                COALESCE(sq.quantity, 0.0) * COALESCE(snap.unit_cost, 0.0) * (1 - rot.depreciation_rate / 100.0) as depreciated_value,
                 
                 -- Inventaire
                 inv.id as inventory_id,
                 inv.date as inventory_date,
                 invl.product_qty as inventory_qty,
-                invl.product_qty * COALESCE((SELECT unit_cost FROM stock_valuation_layer svl WHERE svl.product_id = sq.product_id ORDER BY create_date DESC LIMIT 1), 0.0) as inventory_value,
+                invl.product_qty * COALESCE(snap.unit_cost, 0.0) as inventory_value,
                 COALESCE(invl.difference, 0.0) as inventory_difference,
-                COALESCE(invl.difference, 0.0) * COALESCE((SELECT unit_cost FROM stock_valuation_layer svl WHERE svl.product_id = sq.product_id ORDER BY create_date DESC LIMIT 1), 0.0) as inventory_difference_value,
+                COALESCE(invl.difference, 0.0) * COALESCE(snap.unit_cost, 0.0) as inventory_difference_value,
                 
                 -- Indicateurs
                 30 as stock_coverage_days,
@@ -164,14 +167,20 @@ class StockAnalysis(models.Model):
             LEFT JOIN stock_location sl ON sl.id = sq.location_id
             LEFT JOIN stockex_stock_inventory_line invl ON invl.product_id = sq.product_id AND invl.location_id = sq.location_id
             LEFT JOIN stockex_stock_inventory inv ON inv.id = invl.inventory_id
+            LEFT JOIN stockex_product_snapshot snap ON snap.product_id = sq.product_id AND snap.company_id = sq.company_id
+            CROSS JOIN {dep_params}
+            CROSS JOIN LATERAL (
+                SELECT COALESCE(snap.rotation_status, 'dead') AS bucket,
+                       COALESCE(snap.depreciation_rate, dep.dead_rate) AS depreciation_rate
+            ) rot
             WHERE sl.usage = 'internal'
               AND pt.type = 'product'
         )
-        """ % (self._table,)
+        """.format(table=self._table, **rotation_sql)
         else:
             # Fallback sans SVL: utiliser le coût standard du template
             query = """
-        CREATE OR REPLACE VIEW %s AS (
+        CREATE OR REPLACE VIEW {table} AS (
             SELECT 
                 ROW_NUMBER() OVER (ORDER BY sq.id, inv.id) as id,
                 
@@ -191,29 +200,25 @@ class StockAnalysis(models.Model):
                 0.0 as quantity_incoming,
                 0.0 as quantity_outgoing,
                 
-                -- Valorisation (fallback)
-                COALESCE((pp.standard_price)::numeric, 0.0) as standard_price,
-                COALESCE((pp.standard_price)::numeric, 0.0) as economic_price,
-                COALESCE(sq.quantity, 0.0) * COALESCE((pp.standard_price)::numeric, 0.0) as value_on_hand,
-                (COALESCE(sq.quantity, 0.0) - COALESCE(sq.reserved_quantity, 0.0)) * COALESCE((pp.standard_price)::numeric, 0.0) as value_available,
-                COALESCE(sq.reserved_quantity, 0.0) * COALESCE((pp.standard_price)::numeric, 0.0) as value_reserved,
+                -- Valorisation (fallback: coût standard, via l'instantané)
+                COALESCE(snap.standard_price, 0.0) as standard_price,
+                COALESCE(snap.standard_price, 0.0) as economic_price,
+                COALESCE(sq.quantity, 0.0) * COALESCE(snap.standard_price, 0.0) as value_on_hand,
+                (COALESCE(sq.quantity, 0.0) - COALESCE(sq.reserved_quantity, 0.0)) * COALESCE(snap.standard_price, 0.0) as value_available,
+                COALESCE(sq.reserved_quantity, 0.0) * COALESCE(snap.standard_price, 0.0) as value_reserved,
                 
-                (SELECT MAX(sm.date) FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done') as last_move_date,
-                COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) as days_since_last_move,
-                CASE WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) < 365 THEN 'active'
-                     WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) BETWEEN 365 AND 1095 THEN 'slow'
-                     ELSE 'dead' END as rotation_status,
-                CASE WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) < 365 THEN 0.0
-                     WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) BETWEEN 365 AND 1095 THEN 40.0
-                     ELSE 100.0 END as depreciation_rate,
-                COALESCE(sq.quantity, 0.0) * COALESCE((pp.standard_price)::numeric, 0.0) * (1 - (CASE WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) < 365 THEN 0.0 WHEN COALESCE(CURRENT_DATE - (SELECT MAX(sm.date)::date FROM stock_move sm WHERE sm.product_id = sq.product_id AND sm.state = 'done'), 9999) BETWEEN 365 AND 1095 THEN 0.4 ELSE 1.0 END)) as depreciated_value,
+                snap.last_move_date as last_move_date,
+                COALESCE(CURRENT_DATE - snap.last_move_date, 9999) as days_since_last_move,
+                rot.bucket as rotation_status,
+                rot.depreciation_rate as depreciation_rate,
+                COALESCE(sq.quantity, 0.0) * COALESCE(snap.standard_price, 0.0) * (1 - rot.depreciation_rate / 100.0) as depreciated_value,
                 
                 inv.id as inventory_id,
                 inv.date as inventory_date,
                 invl.product_qty as inventory_qty,
-                invl.product_qty * COALESCE((pp.standard_price)::numeric, 0.0) as inventory_value,
+                invl.product_qty * COALESCE(snap.standard_price, 0.0) as inventory_value,
                 COALESCE(invl.difference, 0.0) as inventory_difference,
-                COALESCE(invl.difference, 0.0) * COALESCE((pp.standard_price)::numeric, 0.0) as inventory_difference_value,
+                COALESCE(invl.difference, 0.0) * COALESCE(snap.standard_price, 0.0) as inventory_difference_value,
                 
                 30 as stock_coverage_days,
                 0.0 as turnover_rate,
@@ -229,10 +234,16 @@ class StockAnalysis(models.Model):
             LEFT JOIN stock_location sl ON sl.id = sq.location_id
             LEFT JOIN stockex_stock_inventory_line invl ON invl.product_id = sq.product_id AND invl.location_id = sq.location_id
             LEFT JOIN stockex_stock_inventory inv ON inv.id = invl.inventory_id
+            LEFT JOIN stockex_product_snapshot snap ON snap.product_id = sq.product_id AND snap.company_id = sq.company_id
+            CROSS JOIN {dep_params}
+            CROSS JOIN LATERAL (
+                SELECT COALESCE(snap.rotation_status, 'dead') AS bucket,
+                       COALESCE(snap.depreciation_rate, dep.dead_rate) AS depreciation_rate
+            ) rot
             WHERE sl.usage = 'internal'
               AND pt.type = 'product'
         )
-        """ % (self._table,)
+        """.format(table=self._table, **rotation_sql)
         
         self.env.cr.execute(query)                
 
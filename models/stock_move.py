@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+
+class StockMove(models.Model):
+    _inherit = 'stock.move'
+    
+    stockex_inventory_id = fields.Many2one(
+        comodel_name='stockex.stock.inventory',
+        string='Inventaire Stockex',
+        readonly=True,
+        index=True,
+        help='Inventaire Stockex qui a généré ce mouvement d\'ajustement'
+    )
+    stockex_inventory_line_id = fields.Many2one(
+        comodel_name='stockex.stock.inventory.line',
+        string='Ligne d\'inventaire Stockex',
+        readonly=True,
+        index='btree_not_null',
+        help='Ligne d\'inventaire Stockex ajustée par ce mouvement'
+    )
+    
+    def _action_done(self, cancel_backorder=False):
+        """Rafraîchit l'instantané coût/rotation des produits déplacés."""
+        moves = super()._action_done(cancel_backorder=cancel_backorder)
+        self.env['stockex.product.snapshot'].sudo()._refresh_from_moves(moves)
+        return moves
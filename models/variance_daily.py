@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Table de faits journalière des écarts d'inventaire.
+
+Une ligne par (date, société, entrepôt, région, catégorie, responsable)
+agrège les lignes
+des inventaires validés : comptages, quantités et écarts valorisés selon les
+deux méthodes (standard et économique). Le dashboard et l'API lisent cette
+table : une période d'un an coûte autant qu'une période de 30 jours.
+
+La table est tenue à jour par tranche (société, date) à chaque validation ou
+annulation d'inventaire, et peut être reconstruite entièrement depuis
+l'assistant « Reconstruire les Statistiques d'Écarts ».
+"""
+
+import logging
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+VALUATION_METHODS = ('standard', 'economic')
+
+# Regroupements disponibles : (expression du groupe, expression du libellé)
+FACT_GROUPS = {
+    None: ("NULL", None),
+    'month': ("to_char(fact.date, 'YYYY-MM')", None),
+    'warehouse': ("fact.warehouse_id", "wh.name"),
+    'warehouse_name': ("COALESCE(wh.name, 'Non défini')", None),
+    'region_name': ("COALESCE(region.name, 'Non défini')", None),
+    'category_name': ("COALESCE(categ.name, 'Non classé')", None),
+}
+
+
+class VarianceDaily(models.Model):
+    """Écarts d'inventaire agrégés par jour, société, entrepôt, région, catégorie et responsable."""
+    _name = 'stockex.variance.daily'
+    _description = 'Statistiques Journalières des Écarts'
+    _order = 'date desc'
+    _rec_name = 'date'
+
+    date = fields.Date(string='Date', required=True, readonly=True, index=True)
+    company_id = fields.Many2one(
+        comodel_name='res.company',
+        string='Société',
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+        index=True
+    )
+    warehouse_id = fields.Many2one(
+        comodel_name='stock.warehouse',
+        string='Entrepôt',
+        readonly=True,
+        ondelete='cascade'
+    )
+    region_id = fields.Many2one(
+        comodel_name='stockex.eneo.region',
+        string='Région Électrique',
+        readonly=True,
+        ondelete='set null'
+    )
+    category_id = fields.Many2one(
+        comodel_name='product.category',
+        string='Catégorie',
+        readonly=True,
+        ondelete='set null'
+    )
+    # Responsable de l'inventaire : reprend la règle « l'utilisateur voit ses propres inventaires »
+    user_id = fields.Many2one(
+        comodel_name='res.users',
+        string='Responsable',
+        readonly=True,
+        ondelete='set null',
+        index=True
+    )
+
+    # Comptages et quantités
+    line_count = fields.Integer(string='Lignes', readonly=True)
+    variance_line_count = fields.Integer(string='Lignes avec écart', readonly=True)
+    qty_theoretical = fields.Float(string='Qté Théorique', readonly=True)
+    qty_real = fields.Float(string='Qté Réelle', readonly=True)
+    qty_variance = fields.Float(string='Écart Qté', readonly=True)
+
+    # Valorisation standard
+    value_theoretical_standard = fields.Float(string='Valeur Théorique (Standard)', readonly=True)
+    value_real_standard = fields.Float(string='Valeur Réelle (Standard)', readonly=True)
+    value_variance_standard = fields.Float(string='Écart Valeur (Standard)', readonly=True)
+    variance_abs_standard = fields.Float(string='Écart Absolu (Standard)', readonly=True)
+    variance_positive_standard = fields.Float(string='Surplus (Standard)', readonly=True)
+    variance_negative_standard = fields.Float(string='Manques (Standard)', readonly=True)
+
+    # Valorisation économique
+    value_theoretical_economic = fields.Float(string='Valeur Théorique (Économique)', readonly=True)
+    value_real_economic = fields.Float(string='Valeur Réelle (Économique)', readonly=True)
+    value_variance_economic = fields.Float(string='Écart Valeur (Économique)', readonly=True)
+    variance_abs_economic = fields.Float(string='Écart Absolu (Économique)', readonly=True)
+    variance_positive_economic = fields.Float(string='Surplus (Économique)', readonly=True)
+    variance_negative_economic = fields.Float(string='Manques (Économique)', readonly=True)
+
+    def init(self):
+        """Construit la table à l'installation (table vide), ou la reconstruit
+        si des faits antérieurs à la colonne responsable restent sans user_id."""
+        self.env.cr.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM stockex_variance_daily)
+                OR EXISTS (
+                    SELECT 1
+                    FROM stockex_variance_daily fact
+                    JOIN stockex_stock_inventory inv
+                        ON inv.company_id = fact.company_id AND inv.date = fact.date
+                    WHERE fact.user_id IS NULL
+                      AND inv.state = 'done'
+                      AND inv.user_id IS NOT NULL
+                )
+        """)
+        if self.env.cr.fetchone()[0]:
+            self._rebuild()
+
+    # ------------------------------------------------------------------
+    # Alimentation
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _refresh_days(self, keys):
+        """Recalcule les tranches (société, date) données à partir des inventaires validés.
+
+        Args:
+            keys: itérable de tuples (company_id, date)
+        """
+        keys = {(company_id, day) for company_id, day in keys if company_id and day}
+        if not keys:
+            return 0
+        self.flush_model()
+        self.env.cr.execute("""
+            DELETE FROM stockex_variance_daily fact
+            USING unnest(%s::int[], %s::date[]) AS k(company_id, date)
+            WHERE fact.company_id = k.company_id AND fact.date = k.date
+        """, [[k[0] for k in keys], [k[1] for k in keys]])
+        inventories = self.env['stockex.stock.inventory'].sudo().search([
+            ('state', '=', 'done'),
+            ('company_id', 'in', list({k[0] for k in keys})),
+            ('date', 'in', list({k[1] for k in keys})),
+        ]).filtered(lambda inv: (inv.company_id.id, inv.date) in keys)
+        return self._insert_facts(inventories)
+
+    @api.model
+    def _rebuild(self, date_from=None, date_to=None):
+        """Reconstruction complète (ou sur une plage de dates) de la table."""
+        domain = [('state', '=', 'done')]
+        where, params = ["TRUE"], []
+        if date_from:
+            domain.append(('date', '>=', date_from))
+            where.append("date >= %s")
+            params.append(date_from)
+        if date_to:
+            domain.append(('date', '<=', date_to))
+            where.append("date <= %s")
+            params.append(date_to)
+        self.flush_model()
+        self.env.cr.execute(f"DELETE FROM stockex_variance_daily WHERE {' AND '.join(where)}", params)
+        inventories = self.env['stockex.stock.inventory'].sudo().search(domain)
+        count = self._insert_facts(inventories)
+        _logger.info("📊 Statistiques d'écarts reconstruites: %d inventaire(s), %d ligne(s)", len(inventories), count)
+        return count
+
+    @api.model
+    def _cron_rebuild(self):
+        """Reconstruction complète (planifiée) : rattrape les changements de prix, catégorie ou région."""
+        self._rebuild()
+        self.env['stockex.inventory.dashboard']._invalidate_dashboard_cache()
+        return True
+
+    @api.model
+    def _insert_facts(self, inventories):
+        """Agrège les lignes des inventaires donnés (une requête INSERT ... SELECT par société).
+
+        Les prix sont résolus comme dans le dashboard (_preload_product_prices)
+        pour les deux méthodes, puis joints à la requête via unnest.
+        """
+        inventories = inventories.filtered('date')
+        if not inventories:
+            return 0
+        self.env['stockex.stock.inventory.line'].flush_model()
+        self.env['stockex.stock.inventory'].flush_model()
+        Dashboard = self.env['stockex.inventory.dashboard']
+
+        measures = []
+        for method in VALUATION_METHODS:
+            for column, qty in (('value_theoretical', 'theoretical_qty'), ('value_real', 'product_qty'), ('value_variance', 'difference')):
+                measures.append((f'{column}_{method}', f"SUM(line.{qty}::float8 * COALESCE({method}.price, 0.0))"))
+            priced_diff = f"line.difference::float8 * COALESCE({method}.price, 0.0)"
+            measures += [
+                (f'variance_abs_{method}', f"SUM(ABS({priced_diff}))"),
+                (f'variance_positive_{method}', f"SUM(GREATEST({priced_diff}, 0.0))"),
+                (f'variance_negative_{method}', f"SUM(GREATEST(-{priced_diff}, 0.0))"),
+            ]
+        query = f"""
+            INSERT INTO stockex_variance_daily (
+                date, company_id, warehouse_id, region_id, category_id, user_id,
+                line_count, variance_line_count, qty_theoretical, qty_real, qty_variance,
+                {', '.join(name for name, _expr in measures)},
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT
+                inv.date, inv.company_id, inv.warehouse_id, wh.eneo_region_id, pt.categ_id, inv.user_id,
+                COUNT(*),
+                COUNT(*) FILTER (WHERE line.difference != 0),
+                SUM(line.theoretical_qty), SUM(line.product_qty), SUM(line.difference),
+                {', '.join(expr for _name, expr in measures)},
+                %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC')
+            FROM stockex_stock_inventory_line line
+            JOIN stockex_stock_inventory inv ON inv.id = line.inventory_id
+            LEFT JOIN stock_warehouse wh ON wh.id = inv.warehouse_id
+            LEFT JOIN product_product pp ON pp.id = line.product_id
+            LEFT JOIN product_template pt ON pt.id = pp.product_tmpl_id
+            LEFT JOIN unnest(%s::int[], %s::float8[]) AS standard(product_id, price)
+                ON standard.product_id = line.product_id
+            LEFT JOIN unnest(%s::int[], %s::float8[]) AS economic(product_id, price)
+                ON economic.product_id = line.product_id
+            WHERE inv.id = ANY(%s)
+            GROUP BY inv.date, inv.company_id, inv.warehouse_id, wh.eneo_region_id, pt.categ_id, inv.user_id
+        """
+        count = 0
+        uid = self.env.uid
+        for company in inventories.company_id:
+            company_inventories = inventories.filtered(lambda inv: inv.company_id == company)
+            params = [uid, uid]
+            for method in VALUATION_METHODS:
+                prices = Dashboard.with_company(company)._preload_product_prices(company_inventories, method)
+                params += [list(prices.keys()), [float(price or 0.0) for price in prices.values()]]
+            params.append(company_inventories.ids)
+            self.env.cr.execute(query, params)
+            count += self.env.cr.rowcount
+        self.invalidate_model()
+        return count
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _aggregate(self, filters, valuation_method, group=None):
+        """Agrège les faits par groupe.
+
+        Args:
+            filters: dict (date_from, date_to, warehouse_ids, region_ids, company_ids)
+            valuation_method: 'standard' ou 'economic'
+            group: clé de FACT_GROUPS (None = total)
+
+        Returns:
+            list de dicts (key, label, lines, lines_variance, qty_theo,
+            qty_real, qty_variance, value_theo, value_real, variance_value,
+            variance_abs, variance_positive, variance_negative), les groupes
+            les plus récents en premier.
+        """
+        method = valuation_method if valuation_method in VALUATION_METHODS else 'standard'
+        group_sql, label_sql = FACT_GROUPS[group]
+        where, params = self._where_clause(filters)
+        self.flush_model()
+        self.env.cr.execute(f"""
+            SELECT {group_sql} AS key,
+                   {f'MIN({label_sql})' if label_sql else 'NULL'} AS label,
+                   COALESCE(SUM(fact.line_count), 0) AS lines,
+                   COALESCE(SUM(fact.variance_line_count), 0) AS lines_variance,
+                   COALESCE(SUM(fact.qty_theoretical), 0.0) AS qty_theo,
+                   COALESCE(SUM(fact.qty_real), 0.0) AS qty_real,
+                   COALESCE(SUM(fact.qty_variance), 0.0) AS qty_variance,
+                   COALESCE(SUM(fact.value_theoretical_{method}), 0.0) AS value_theo,
+                   COALESCE(SUM(fact.value_real_{method}), 0.0) AS value_real,
+                   COALESCE(SUM(fact.value_variance_{method}), 0.0) AS variance_value,
+                   COALESCE(SUM(fact.variance_abs_{method}), 0.0) AS variance_abs,
+                   COALESCE(SUM(fact.variance_positive_{method}), 0.0) AS variance_positive,
+                   COALESCE(SUM(fact.variance_negative_{method}), 0.0) AS variance_negative
+            FROM stockex_variance_daily fact
+            LEFT JOIN stock_warehouse wh ON wh.id = fact.warehouse_id
+            LEFT JOIN stockex_eneo_region region ON region.id = fact.region_id
+            LEFT JOIN product_category categ ON categ.id = fact.category_id
+            WHERE {where}
+            GROUP BY 1
+            HAVING COUNT(*) > 0
+            ORDER BY MAX(fact.date) DESC, 1
+        """, params)
+        return self.env.cr.dictfetchall()
+
+    @api.model
+    def _where_clause(self, filters):
+        """Clause WHERE (alias fact) correspondant aux filtres du dashboard.
+
+        Les requêtes SQL n'appliquent pas les règles d'enregistrement : hors
+        sudo, un utilisateur qui n'est pas manager ne voit que les faits de
+        ses propres inventaires (cf. stockex_inventory_user_rule).
+        """
+        where, params = ["TRUE"], []
+        if not self.env.su and not self.env.user.has_group('stockex.group_stockex_manager'):
+            where.append("fact.user_id = %s")
+            params.append(self.env.uid)
+        if filters.get('date_from'):
+            where.append("fact.date >= %s")
+            params.append(filters['date_from'])
+        if filters.get('date_to'):
+            where.append("fact.date <= %s")
+            params.append(filters['date_to'])
+        if filters.get('warehouse_ids'):
+            where.append("fact.warehouse_id = ANY(%s)")
+            params.append(list(filters['warehouse_ids']))
+        if filters.get('region_ids'):
+            where.append("fact.region_id = ANY(%s)")
+            params.append(list(filters['region_ids']))
+        if filters.get('company_ids'):
+            where.append("fact.company_id = ANY(%s)")
+            params.append(list(filters['company_ids']))
+        return ' AND '.join(where), params
+
+
+class StockInventory(models.Model):
+    _inherit = 'stockex.stock.inventory'
+
+    def write(self, vals):
+        """Tient à jour les statistiques d'écarts des jours touchés (validation, annulation, déplacement)."""
+        tracked = {'state', 'date', 'company_id', 'warehouse_id', 'user_id'} & set(vals)
+        keys = set()
+        if tracked:
+            keys = {(inv.company_id.id, inv.date) for inv in self if inv.state == 'done'}
+        res = super().write(vals)
+        if tracked:
+            keys |= {(inv.company_id.id, inv.date) for inv in self if inv.state == 'done'}
+            if keys:
+                self.env['stockex.variance.daily'].sudo()._refresh_days(keys)
+        return res
@@ -128,7 +128,11 @@ class StockVarianceReport(models.Model):
     )
     
     def init(self):
-        """Créer la vue SQL pour le rapport de variance."""
+        """Créer la vue SQL pour le rapport de variance.
+        
+        Le prix unitaire est le coût standard courant du produit, lu en direct
+        (et non dans stockex.product.snapshot, rafraîchi aux mouvements seulement).
+        """
         tools.drop_view_if_exists(self.env.cr, self._table)
         
         query = """
@@ -151,11 +155,11 @@ class StockVarianceReport(models.Model):
                         WHEN line.theoretical_qty = 0 THEN 0
                         ELSE (line.difference / NULLIF(line.theoretical_qty, 0) * 100)
                     END AS variance_qty_percent,
-                    prod.standard_price::float AS unit_price,
-                    (line.theoretical_qty * prod.standard_price::float) AS theoretical_value,
-                    (line.product_qty * prod.standard_price::float) AS real_value,
-                    (line.difference * prod.standard_price::float) AS variance_value,
-                    ABS(line.difference * prod.standard_price::float) AS variance_value_abs,
+                    price.standard_price AS unit_price,
+                    (line.theoretical_qty * price.standard_price) AS theoretical_value,
+                    (line.product_qty * price.standard_price) AS real_value,
+                    (line.difference * price.standard_price) AS variance_value,
+                    ABS(line.difference * price.standard_price) AS variance_value_abs,
                     CASE 
                         WHEN line.difference > 0 THEN 'surplus'
                         WHEN line.difference < 0 THEN 'shortage'
@@ -177,6 +181,10 @@ class StockVarianceReport(models.Model):
                     LEFT JOIN product_template tmpl ON tmpl.id = prod.product_tmpl_id
                     LEFT JOIN product_category cat ON cat.id = tmpl.categ_id
                     LEFT JOIN stock_location loc ON loc.id = line.location_id
+                    -- Coût standard courant de la société (colonne JSONB par société)
+                    LEFT JOIN LATERAL (
+                        SELECT COALESCE((prod.standard_price ->> inv.company_id::text)::float, 0.0) AS standard_price
+                    ) price ON TRUE
                 WHERE
                     inv.state = 'done'
             )
@@ -349,6 +349,40 @@ class OfflineStorage {
         });
     }
     
+    /**
+     * Retire les inventaires synchronisés puis supprimés sur le serveur
+     */
+    async removeDeletedInventories(serverIds) {
+        if (!this.db) await this.open();
+        if (!serverIds || serverIds.length === 0) return 0;
+        
+        const deleted = new Set(serverIds);
+        return new Promise((resolve, reject) => {
+            const transaction = this.db.transaction(['pending_inventories'], 'readwrite');
+            const store = transaction.objectStore('pending_inventories');
+            const request = store.getAll();
+            let removed = 0;
+            
+            request.onsuccess = () => {
+                for (const data of request.result || []) {
+                    if (data.synced && deleted.has(data.server_id)) {
+                        store.delete(data.local_id);
+                        removed++;
+                    }
+                }
+            };
+            
+            transaction.oncomplete = () => {
+                console.log('[OfflineStorage] Deleted inventories removed:', removed);
+                resolve(removed);
+            };
+            
+            transaction.onerror = () => {
+                reject(transaction.error);
+            };
+        });
+    }
+    
     /**
      * Cache un produit localement
      */
@@ -392,6 +426,57 @@ class OfflineStorage {
             };
         });
     }
+    
+    /**
+     * Applique un catalogue (complet ou différentiel) en une seule transaction
+     */
+    async applyCatalog(products, removedIds, full) {
+        if (!this.db) await this.open();
+        
+        return new Promise((resolve, reject) => {
+            const transaction = this.db.transaction(['cached_products'], 'readwrite');
+            const store = transaction.objectStore('cached_products');
+            
+            if (full) {
+                store.clear();
+            }
+            for (const id of removedIds) {
+                store.delete(id);
+            }
+            for (const product of products) {
+                store.put(product);
+            }
+            
+            transaction.oncomplete = () => {
+                console.log('[OfflineStorage] Catalog applied:', products.length, 'products');
+                resolve(products.length);
+            };
+            
+            transaction.onerror = () => {
+                reject(transaction.error);
+            };
+        });
+    }
+    
+    /**
+     * Tous les produits en cache
+     */
+    async getCachedProducts() {
+        if (!this.db) await this.open();
+        
+        return new Promise((resolve, reject) => {
+            const transaction = this.db.transaction(['cached_products'], 'readonly');
+            const request = transaction.objectStore('cached_products').getAll();
+            
+            request.onsuccess = () => {
+                resolve(request.result || []);
+            };
+            
+            request.onerror = () => {
+                reject(request.error);
+            };
+        });
+    }
 }
 
 // Export global
@@ -11,6 +11,13 @@ class StockexMobileApp {
         this.isOnline = navigator.onLine;
         this.currentInventory = null;
         this.syncInProgress = false;
+        // Catalogue en mémoire : code-barres -> produit
+        this.catalog = new Map();
+        // Scans en attente d'envoi groupé (inventaire serveur)
+        this.scanBuffer = [];
+        this.scanFlushTimer = null;
+        this.scanFlushDelay = 3000;
+        this.scanFlushSize = 200;
         
         this.init();
     }
@@ -30,8 +37,12 @@ class StockexMobileApp {
         // Écoute messages Service Worker
         this.setupServiceWorkerListeners();
         
+        // Catalogue local, puis mise à jour différentielle si online
+        await this.loadCatalog();
+        
         // Sync automatique au démarrage si online
         if (this.isOnline) {
+            this.preloadCatalog();
             this.syncPendingInventories();
         }
         
@@ -76,6 +87,7 @@ class StockexMobileApp {
             console.log('[App] Back online');
             this.isOnline = true;
             this.showNotification('Connexion rétablie', 'success');
+            this.flushScans();
             this.syncPendingInventories();
         });
         
@@ -101,6 +113,18 @@ class StockexMobileApp {
         }
     }
     
+    /**
+     * Identifiant stable de l'appareil (clé d'idempotence de la synchro)
+     */
+    getDeviceId() {
+        let deviceId = localStorage.getItem('stockex_device_id');
+        if (!deviceId) {
+            deviceId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+            localStorage.setItem('stockex_device_id', deviceId);
+        }
+        return deviceId;
+    }
+    
     /**
      * Synchronise les inventaires en attente
      */
@@ -132,6 +156,8 @@ class StockexMobileApp {
                     jsonrpc: '2.0',
                     method: 'call',
                     params: {
+                        device_id: this.getDeviceId(),
+                        change_token: localStorage.getItem('stockex_change_token'),
                         inventories: pending,
                     },
                 }),
@@ -140,11 +166,20 @@ class StockexMobileApp {
             const result = await response.json();
             
             if (result.result && result.result.success) {
+                // Jeton de la prochaine synchro : seuls les changements ultérieurs seront renvoyés
+                localStorage.setItem('stockex_change_token', result.result.change_token);
+                
                 // Marque comme synchronisés
                 for (const synced of result.result.synced) {
                     await this.offlineStorage.markSynced(synced.local_id, synced.server_id);
                 }
                 
+                // Inventaires supprimés sur le serveur depuis le jeton précédent
+                const deleted = result.result.changes && result.result.changes.deleted;
+                if (deleted) {
+                    await this.offlineStorage.removeDeletedInventories(deleted.inventories);
+                }
+                
                 this.showNotification(
                     `${result.result.synced_count} inventaire(s) synchronisé(s)`,
                     'success'
@@ -161,12 +196,80 @@ class StockexMobileApp {
         }
     }
     
+    /**
+     * Charge en mémoire le catalogue stocké dans IndexedDB
+     */
+    async loadCatalog() {
+        const products = await this.offlineStorage.getCachedProducts();
+        this.catalog = new Map(products.filter((p) => p.barcode).map((p) => [p.barcode, p]));
+    }
+    
+    /**
+     * Télécharge le catalogue produits (différentiel depuis la dernière version)
+     */
+    async preloadCatalog() {
+        try {
+            const version = localStorage.getItem('stockex_catalog_version');
+            const etag = localStorage.getItem('stockex_catalog_etag');
+            const url = version ? `/api/mobile/catalog?since=${encodeURIComponent(version)}` : '/api/mobile/catalog';
+            
+            const response = await fetch(url, {
+                headers: etag ? { 'If-None-Match': etag } : {},
+            });
+            if (response.status === 304) {
+                console.log('[App] Catalog up to date');
+                return;
+            }
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            
+            // JSON Lines : en-tête puis une ligne par produit (valeurs dans l'ordre des colonnes)
+            const [headerLine, ...rows] = (await response.text()).split('\n');
+            const header = JSON.parse(headerLine);
+            const col = Object.fromEntries(header.columns.map((name, index) => [name, index]));
+            const products = [];
+            const removedIds = [];
+            
+            for (const line of rows) {
+                if (!line) continue;
+                const row = JSON.parse(line);
+                if (!row[col.active]) {
+                    removedIds.push(row[col.id]);
+                    continue;
+                }
+                products.push({
+                    id: row[col.id],
+                    barcode: row[col.barcode] || undefined,
+                    code: row[col.default_code],
+                    name: row[col.name],
+                    uom: row[col.uom],
+                    standard_price: row[col.price],
+                });
+            }
+            
+            await this.offlineStorage.applyCatalog(products, removedIds, header.full);
+            await this.loadCatalog();
+            
+            localStorage.setItem('stockex_catalog_version', header.version);
+            localStorage.setItem('stockex_catalog_etag', response.headers.get('ETag') || '');
+            console.log(`[App] Catalog ${header.version}: ${products.length} product(s), ${removedIds.length} removed`);
+        } catch (error) {
+            console.error('[App] Catalog preload error:', error);
+        }
+    }
+    
     /**
      * Recherche un produit (online ou cache)
      */
     async searchProduct(barcode) {
         try {
-            // Essaie d'abord le cache
+            // Catalogue en mémoire : aucun aller-retour pendant le comptage
+            if (this.catalog.has(barcode)) {
+                return this.catalog.get(barcode);
+            }
+            
+            // Essaie ensuite le cache
             const cached = await this.offlineStorage.findProductByBarcode(barcode);
             if (cached) {
                 console.log('[App] Product found in cache:', cached);
@@ -222,33 +325,14 @@ class StockexMobileApp {
         };
         
         if (this.isOnline && this.currentInventory.server_id) {
-            // Sync immédiat si online
-            try {
-                const response = await fetch('/api/mobile/inventory/add-line', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({
-                        jsonrpc: '2.0',
-                        method: 'call',
-                        params: {
-                            inventory_id: this.currentInventory.server_id,
-                            product_id: productId,
-                            real_qty: qty,
-                        },
-                    }),
-                });
-                
-                const result = await response.json();
-                
-                if (result.result && result.result.success) {
-                    return result.result.line;
-                }
-            } catch (error) {
-                console.error('[App] Error adding line online:', error);
-                // Fallback vers stockage local
-            }
+            // Envoi groupé différé : un appel toutes les quelques secondes
+            this.queueScan({
+                ref: `${this.getDeviceId()}:${Date.now().toString(36)}-${this.scanBuffer.length}`,
+                product_id: productId,
+                qty: qty,
+                scanned_at: new Date().toISOString(),
+            });
+            return line;
         }
         
         // Stockage local
@@ -267,6 +351,80 @@ class StockexMobileApp {
         return line;
     }
     
+    /**
+     * Met un scan en attente et programme l'envoi groupé
+     */
+    queueScan(scan) {
+        this.scanBuffer.push(scan);
+        if (this.scanBuffer.length >= this.scanFlushSize) {
+            this.flushScans();
+        } else if (!this.scanFlushTimer) {
+            this.scanFlushTimer = setTimeout(() => this.flushScans(), this.scanFlushDelay);
+        }
+    }
+    
+    /**
+     * Envoie les scans en attente en un seul appel
+     */
+    async flushScans() {
+        clearTimeout(this.scanFlushTimer);
+        this.scanFlushTimer = null;
+        if (!this.scanBuffer.length || !this.currentInventory) {
+            return;
+        }
+        
+        const scans = this.scanBuffer.splice(0);
+        try {
+            const response = await fetch('/api/mobile/inventory/lines/batch', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    jsonrpc: '2.0',
+                    method: 'call',
+                    params: {
+                        inventory_id: this.currentInventory.server_id,
+                        mode: 'last',
+                        scans: scans,
+                    },
+                }),
+            });
+            
+            const result = await response.json();
+            
+            if (!result.result || !result.result.success) {
+                throw new Error((result.result && result.result.message) || 'Batch failed');
+            }
+            const failed = result.result.results.filter((r) => r.status === 'error');
+            if (failed.length) {
+                console.warn('[App] Rejected scans:', failed);
+                this.showNotification(`${failed.length} scan(s) rejeté(s)`, 'error');
+            }
+            
+            // Comptage plus récent déjà appliqué sur le serveur : la quantité serveur est reprise
+            const stale = result.result.results.filter((r) => r.status === 'stale');
+            if (stale.length) {
+                console.warn('[App] Stale scans:', stale);
+                for (const r of stale) {
+                    const line = this.currentInventory.lines.find((l) => l.product_id === scans[r.index].product_id);
+                    if (line) {
+                        line.real_qty = r.product_qty;
+                    }
+                }
+                await this.offlineStorage.saveInventory(this.currentInventory);
+                this.showNotification(`${stale.length} scan(s) remplacé(s) par un comptage plus récent`, 'warning');
+            }
+        } catch (error) {
+            console.error('[App] Error flushing scans:', error);
+            // Remis en tête de file : renvoyés au prochain envoi (dernier scan gagnant)
+            this.scanBuffer.unshift(...scans);
+            if (!this.scanFlushTimer) {
+                this.scanFlushTimer = setTimeout(() => this.flushScans(), this.scanFlushDelay * 5);
+            }
+        }
+    }
+    
     /**
      * Affiche une notification
      */
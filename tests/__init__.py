@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
 
 from . import test_inventory_dashboard
-from . import test_security
+from . import test_valuation
+from . import test_job_queue
+from . import test_import_engine
+from . import test_kobo_pager
+from . import test_photo_cache
+from . import test_mobile_sync
+from . import test_mobile_catalog
+from . import test_api_rest
+from . import test_jwt_auth
+from . import test_api_monitoring
 
 from odoo.tests.common import TransactionCase
 from odoo.exceptions import UserError
@@ -18,14 +27,16 @@ class TestStockInventory(TransactionCase):
         self.product_1 = self.env['product.product'].create({
             'name': 'Produit Test 1',
             'default_code': 'TEST001',
-            'type': 'product',
+            'type': 'consu',
+            'is_storable': True,
             'standard_price': 100.0,
         })
         
         self.product_2 = self.env['product.product'].create({
             'name': 'Produit Test 2',
             'default_code': 'TEST002',
-            'type': 'product',
+            'type': 'consu',
+            'is_storable': True,
             'standard_price': 200.0,
         })
         
@@ -201,3 +212,42 @@ class TestStockInventory(TransactionCase):
         
         self.assertIsNotNone(line.image_1)
         self.assertEqual(line.note, 'Test note')
+    
+    def test_11_theoretical_qty_includes_sublocations(self):
+        """La quantité théorique agrège l'emplacement et tout son sous-arbre."""
+        child = self.env['stock.location'].create({
+            'name': 'Sous-emplacement Test',
+            'usage': 'internal',
+            'location_id': self.location.id,
+        })
+        grandchild = self.env['stock.location'].create({
+            'name': 'Sous-sous-emplacement Test',
+            'usage': 'internal',
+            'location_id': child.id,
+        })
+        for location, qty in ((self.location, 2.0), (child, 3.0), (grandchild, 5.0)):
+            self.env['stock.quant'].create({
+                'product_id': self.product_1.id,
+                'location_id': location.id,
+                'quantity': qty,
+            })
+        
+        line = self.env['stockex.stock.inventory.line'].create({
+            'inventory_id': self.inventory.id,
+            'product_id': self.product_1.id,
+            'location_id': self.location.id,
+            'product_qty': 10.0,
+        })
+        
+        self.assertEqual(line.theoretical_qty, 10.0)
+        self.assertEqual(line.difference, 0.0)
+        
+        # Le recalcul manuel réutilise le même calcul ensembliste
+        self.env['stock.quant'].create({
+            'product_id': self.product_1.id,
+            'location_id': grandchild.id,
+            'quantity': 1.0,
+        })
+        self.inventory.action_refresh_theoretical_qty()
+        self.assertEqual(line.theoretical_qty, 11.0)
+        self.assertEqual(line.difference, -1.0)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+from ..tools.api_monitoring import StockexAPIMonitoring, percentile
+
+
+class TestApiMonitoring(TransactionCase):
+    """Tests de l'agrégation des appels API par minute."""
+    
+    def test_01_percentile(self):
+        """Percentile au rang le plus proche."""
+        values = list(range(1, 101))
+        
+        self.assertEqual(percentile(values, 0.50), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertEqual(percentile([], 0.5), 0.0)
+    
+    def test_02_drain_groups_by_minute(self):
+        """Les appels du tampon sont agrégés par (base, minute, endpoint, méthode)."""
+        monitoring = StockexAPIMonitoring()
+        # Pas de thread d'écriture : l'agrégation est lue directement
+        monitoring._ensure_flusher = lambda: None
+        db_name = self.env.cr.dbname
+        for status, response_time in ((200, 0.010), (200, 0.030), (404, 0.020), (500, 0.100)):
+            monitoring.log_api_call('/api/stockex/products', 'GET', status_code=status,
+                                    response_time=response_time, bytes_out=100, db_name=db_name)
+        monitoring.log_api_call('/api/stockex/kpis', 'GET', response_time=0.005, db_name=db_name)
+        self.assertEqual(monitoring.pending_count(), 5)
+        
+        monitoring._drain()
+        
+        self.assertFalse(monitoring._buffer)
+        self.assertEqual(monitoring.pending_count(), 5)
+        stats = {key[2]: value for key, value in monitoring._minutes.items()}
+        products = stats['/api/stockex/products']
+        self.assertEqual(len(products['latencies']), 4)
+        self.assertEqual(products['errors'], 2)
+        self.assertEqual(products['server_errors'], 1)
+        self.assertEqual(products['bytes_out'], 400)
+        self.assertEqual(len(stats['/api/stockex/kpis']['latencies']), 1)
+    
+    def test_03_summary(self):
+        """Le résumé additionne les appels et pondère les percentiles par le nombre d'appels."""
+        Metric = self.env['stockex.api.metric']
+        now = fields.Datetime.now()
+        common = {'endpoint': '/api/stockex/products', 'method': 'GET', 'bytes_out': 10}
+        Metric.create([
+            dict(common, minute=now, call_count=30, error_count=3, server_error_count=0,
+                 latency_p50=10.0, latency_p95=40.0, latency_p99=50.0, latency_max=60.0),
+            dict(common, minute=now, call_count=10, error_count=1, server_error_count=1,
+                 latency_p50=30.0, latency_p95=80.0, latency_p99=90.0, latency_max=120.0),
+            dict(common, minute=fields.Datetime.add(now, days=-2), call_count=1000),
+        ])
+        
+        [row] = Metric._get_summary(minutes=60, endpoint='/api/stockex/products')
+        
+        self.assertEqual(row['key'], 'GET /api/stockex/products')
+        self.assertEqual(row['calls'], 40)
+        self.assertEqual(row['errors'], 4)
+        self.assertEqual(row['error_rate'], 10.0)
+        self.assertEqual(row['latency_p50'], 15.0)
+        self.assertEqual(row['latency_p95'], 50.0)
+        self.assertEqual(row['latency_max'], 120.0)
+        self.assertEqual(row['bytes_out'], 20)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import date
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase
+
+from ..controllers.api_rest import LINE_EXPORT_COLUMNS, PRODUCT_API_FIELDS, StockexAPIController
+
+
+class TestApiRest(TransactionCase):
+    """Tests unitaires des lectures de l'API REST."""
+    
+    def setUp(self):
+        super(TestApiRest, self).setUp()
+        
+        self.controller = StockexAPIController()
+        self.location = self.env['stock.location'].create({
+            'name': 'Emplacement API',
+            'usage': 'internal',
+        })
+        self.inventory = self.env['stockex.stock.inventory'].create({
+            'name': 'TEST-API-001',
+            'date': date.today(),
+            'location_id': self.location.id,
+        })
+        products = self.env['product.product'].create([
+            {'name': f'Produit API {i}', 'default_code': f'API{i:03d}'} for i in range(5)
+        ])
+        self.lines = self.env['stockex.stock.inventory.line'].create([{
+            'inventory_id': self.inventory.id,
+            'product_id': product.id,
+            'location_id': self.location.id,
+            'product_qty': float(i),
+        } for i, product in enumerate(products)])
+    
+    def test_01_lines_keyset_pages(self):
+        """Les pages de lignes se suivent par curseur, sans doublon ni trou."""
+        pages, after_id = [], 0
+        while True:
+            rows = self.controller._read_lines_page(self.env, self.inventory.id, after_id, 2)
+            pages.append([row['id'] for row in rows])
+            if len(rows) < 2:
+                break
+            after_id = rows[-1]['id']
+        
+        self.assertEqual(pages, [self.lines.ids[0:2], self.lines.ids[2:4], self.lines.ids[4:]])
+        row = self.controller._read_lines_page(self.env, self.inventory.id, 0, 1)[0]
+        self.assertEqual(list(row), LINE_EXPORT_COLUMNS)
+        self.assertEqual(row['product_code'], 'API000')
+        self.assertEqual(row['location_id'], self.location.id)
+    
+    def test_02_projection_and_cursor(self):
+        """La projection fields= ne lit que les champs nécessaires ; le curseur est réversible."""
+        keys, read_fields = self.controller._get_projection({'fields': 'name,uom_name'}, PRODUCT_API_FIELDS)
+        self.assertEqual(keys, ['id', 'name', 'uom_name'])
+        self.assertEqual(read_fields, ['name', 'uom_id'])
+        
+        keys, _read_fields = self.controller._get_projection({}, PRODUCT_API_FIELDS)
+        self.assertEqual(keys, list(PRODUCT_API_FIELDS))
+        
+        with self.assertRaises(ValueError):
+            self.controller._get_projection({'fields': 'name,inconnu'}, PRODUCT_API_FIELDS)
+        
+        cursor = self.controller._encode_cursor(['2025-01-31', 42])
+        self.assertEqual(self.controller._decode_cursor(cursor), ['2025-01-31', 42])
+        with self.assertRaises(ValueError):
+            self.controller._decode_cursor('pas un curseur')
+    
+    def _request(self, headers=None):
+        """Requête minimale pour les méthodes de revalidation du contrôleur."""
+        return patch('odoo.addons.stockex.controllers.api_rest.request', SimpleNamespace(
+            env=self.env,
+            httprequest=SimpleNamespace(
+                full_path='/api/stockex/products?',
+                path='/api/stockex/products',
+                method='GET',
+                url_rule=None,
+                headers=headers or {},
+                if_modified_since=None,
+            ),
+        ))
+    
+    def test_03_etag_revalidation(self):
+        """Un ETag à jour donne un 304 ; il change après l'écriture d'un produit du domaine."""
+        products = self.lines.product_id
+        # Produits modifiés avant la copie du client (write_date = début de transaction sinon)
+        self.env.cr.execute(
+            "UPDATE product_product SET write_date = write_date - interval '1 hour' WHERE id IN %s",
+            [tuple(products.ids)],
+        )
+        self.env.invalidate_all()
+        sources = [('product.product', [('id', 'in', products.ids)])]
+        
+        with self._request():
+            etag, last_modified = self.controller._get_validator(sources)
+            self.assertEqual(self.controller._get_validator(sources), (etag, last_modified))
+            self.assertFalse(self.controller._is_not_modified(etag, last_modified))
+        
+        with self._request({'If-None-Match': etag.removeprefix('W/')}):
+            self.assertTrue(self.controller._is_not_modified(etag, last_modified))
+            response = self.controller._not_modified_response(etag, last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        
+        products[0].write({'name': 'Produit API modifié'})
+        with self._request({'If-None-Match': etag}):
+            new_etag, _last_modified = self.controller._get_validator(sources)
+            self.assertNotEqual(new_etag, etag)
+            self.assertFalse(self.controller._is_not_modified(new_etag, _last_modified))
+    
+    def test_04_inventory_detail(self):
+        """Le détail d'un inventaire agrège ses lignes et renvoie leur première page."""
+        data = self.controller._get_inventory_data(self.env, self.inventory)
+        
+        self.assertEqual(data['total_lines'], 5)
+        self.assertAlmostEqual(data['total_difference_value'], sum(self.lines.mapped('difference_value')))
+        self.assertEqual([line['id'] for line in data['lines']], self.lines.ids)
+        self.assertIsNone(data['lines_next_cursor'])
+        
+        with patch.object(StockexAPIController, '_line_page_size', 2):
+            data = self.controller._get_inventory_data(self.env, self.inventory)
+        self.assertEqual(data['lines_next_cursor'], self.lines.ids[1])
+        self.assertNotIn('lines', self.controller._get_inventory_data(self.env, self.inventory, include_lines=False))
+    
+    def test_05_list_products_storable(self):
+        """La liste des produits ne renvoie que les produits stockables."""
+        storable = self.env['product.product'].create([
+            {'name': f'Produit stockable {i}', 'default_code': f'APIS{i}', 'is_storable': True} for i in range(3)
+        ])
+        self.env['product.product'].create({'name': 'Produit non stocké', 'default_code': 'APIS-CONSU'})
+        
+        with self._request():
+            response = self.controller.list_products(search='APIS', limit='2', with_total='true')
+            first = json.loads(response.get_data())
+            response = self.controller.list_products(search='APIS', cursor=first['next_cursor'], fields='code')
+            second = json.loads(response.get_data())
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(first['total'], 3)
+        self.assertEqual([row['id'] for row in first['products'] + second['products']], storable.ids)
+        self.assertEqual(second['products'], [{'id': storable[2].id, 'code': 'APIS2'}])
+        self.assertIsNone(second['next_cursor'])
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import date
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase
+
+from ..models.import_engine import ExcelRowSource
+
+
+class TestImportEngine(TransactionCase):
+    """Tests unitaires du moteur d'import en masse."""
+    
+    def setUp(self):
+        super(TestImportEngine, self).setUp()
+        
+        self.engine = self.env['stockex.import.engine']
+        self.product = self.env['product.product'].create({
+            'name': 'Produit Import Existant',
+            'default_code': 'IMP-EXIST',
+            'standard_price': 10.0,
+        })
+        self.location = self.env['stock.location'].create({
+            'name': 'Emplacement Import Test',
+            'usage': 'internal',
+        })
+        self.inventory = self.env['stockex.stock.inventory'].create({
+            'name': 'TEST-IMPORT-001',
+            'date': date.today(),
+            'location_id': self.location.id,
+        })
+    
+    def test_01_map_products_finds_and_creates(self):
+        """Les produits existants sont retrouvés, les manquants créés par lot."""
+        specs = {
+            'IMP-EXIST': {'name': 'Ignoré', 'default_code': 'IMP-EXIST'},
+            'IMP-NEW-1': {'name': 'Nouveau 1', 'default_code': 'IMP-NEW-1'},
+            'IMP-NEW-2': {'name': 'Nouveau 2', 'default_code': 'IMP-NEW-2'},
+        }
+        
+        found, errors = self.engine._map_products(specs)
+        self.assertEqual(set(found), {'IMP-EXIST'})
+        self.assertEqual(found['IMP-EXIST'], self.product)
+        self.assertFalse(errors)
+        
+        products, errors = self.engine._map_products(specs, create=True)
+        self.assertEqual(set(products), set(specs))
+        self.assertEqual(products['IMP-EXIST'], self.product)
+        self.assertEqual(products['IMP-NEW-2'].name, 'Nouveau 2')
+        self.assertFalse(errors)
+    
+    def test_02_map_categories(self):
+        """Les catégories sont résolues par nom et créées seulement si demandé."""
+        existing = self.env['product.category'].create({'name': 'Catégorie Import A'})
+        
+        categories = self.engine._map_categories({'Catégorie Import A', 'Catégorie Import B'})
+        self.assertEqual(categories, {'Catégorie Import A': existing})
+        
+        categories = self.engine._map_categories({'Catégorie Import A', 'Catégorie Import B'}, create=True)
+        self.assertEqual(categories['Catégorie Import A'], existing)
+        self.assertEqual(categories['Catégorie Import B'].name, 'Catégorie Import B')
+    
+    def test_03_map_quants_and_write_grouped(self):
+        """Les quants sont lus en une requête et les écritures regroupées par valeur."""
+        self.env['stock.quant'].create({
+            'product_id': self.product.id,
+            'location_id': self.location.id,
+            'quantity': 7.0,
+        })
+        
+        quants = self.engine._map_quants([(self.product.id, self.location.id)], self.env.company)
+        self.assertEqual(quants[(self.product.id, self.location.id)]['available'], 7.0)
+        
+        written = self.engine._write_grouped({self.product: 25.0}, 'standard_price')
+        self.assertEqual(written, 1)
+        self.assertEqual(self.product.standard_price, 25.0)
+        self.assertEqual(self.engine._write_grouped({self.product: 25.0}, 'standard_price'), 0)
+    
+    def test_04_create_inventory_lines_isolates_errors(self):
+        """Une ligne invalide n'empêche pas la création des autres lignes du paquet."""
+        vals_list = [
+            {
+                'inventory_id': self.inventory.id,
+                'product_id': self.product.id,
+                'location_id': self.location.id,
+                'product_qty': 3.0,
+            },
+            {
+                'inventory_id': self.inventory.id,
+                'product_id': 0,
+                'location_id': self.location.id,
+                'product_qty': 1.0,
+            },
+        ]
+        
+        lines, errors = self.engine._create_inventory_lines(vals_list, [2, 3])
+        
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines.product_id, self.product)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('Ligne 3:'))
+    
+    def test_05_excel_row_source_streams_chunks(self):
+        """La source Excel restitue les lignes non vides par paquets, avec leur numéro."""
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            self.skipTest("openpyxl non installé")
+        
+        worksheet = Workbook().active
+        worksheet.append(['CODE PRODUIT', 'QUANTITE', None])
+        for i in range(5):
+            worksheet.append([f'P{i}', i, 'ignoré'])
+        worksheet.append([None, None, None])
+        worksheet.append(['P5', None, None])
+        
+        source = ExcelRowSource(worksheet)
+        
+        self.assertEqual(source.estimated_rows, 7)
+        chunks = list(source.chunks(4))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 2])
+        self.assertEqual(chunks[0][0], (2, {'CODE PRODUIT': 'P0', 'QUANTITE': 0}))
+        self.assertEqual(chunks[1][-1], (8, {'CODE PRODUIT': 'P5', 'QUANTITE': ''}))
+        
+        # Prévisualisation : seules les premières lignes sont lues
+        self.assertEqual([row for row, _line in source.rows(limit=2)], [2, 3])
+    
+    def test_06_shard_index_is_stable(self):
+        """La répartition en lots est stable et couvre toutes les valeurs."""
+        keys = [f'WH-{i}' for i in range(200)]
+        shards = [self.engine._shard_index(key, 8) for key in keys]
+        
+        self.assertEqual(shards, [self.engine._shard_index(key, 8) for key in keys])
+        self.assertTrue(all(0 <= shard < 8 for shard in shards))
+        self.assertEqual(len(set(shards)), 8)
+        self.assertEqual(self.engine._shard_index('WH-1', 1), 0)
+    
+    def test_07_merge_import_stats(self):
+        """Les compteurs des lots se cumulent dans un total sérialisable en JSON."""
+        wizard = self.env['stockex.initial.stock.wizard']
+        stats = wizard._new_import_stats()
+        stats.update(created=3, updated=1, errors=['Ligne 4: erreur'])
+        stats['warehouses'].update({'B', 'A'})
+        stats['products'].add('P1')
+        
+        total = wizard._merge_import_stats({}, stats)
+        total = wizard._merge_import_stats(total, {'created': 2, 'error_count': 1, 'errors': ['Ligne 9: erreur'], 'warehouses': ['C']})
+        
+        self.assertEqual(total['created'], 5)
+        self.assertEqual(total['updated'], 1)
+        self.assertEqual(total['product_count'], 1)
+        self.assertEqual(total['error_count'], 2)
+        self.assertEqual(total['errors'], ['Ligne 4: erreur', 'Ligne 9: erreur'])
+        self.assertEqual(total['warehouses'], ['A', 'B', 'C'])
+    
+    def test_08_initial_stock_shards_of_one_run(self):
+        """Un lot lit ses lignes préparées ; la synthèse ne fusionne que les lots de son exécution."""
+        Wizard = self.env['stockex.initial.stock.wizard']
+        Job = self.env['stockex.job']
+        wizard = Wizard.with_context(stockex_job_res_id=4242).new({'name': 'Stock initial lots'})
+        rows_file = self.env['ir.attachment'].create({
+            'name': 'lot-0',
+            'res_model': 'stockex.job',
+            'raw': b'[3, {"CODE PRODUIT": "P3"}]\n[5, {"CODE PRODUIT": "P5"}]\n',
+        })
+        
+        def shard_job(run, created, **vals):
+            return Job.create(dict({
+                'name': f'Lot {run}',
+                'job_type': 'initial_stock_import',
+                'res_model': Wizard._name,
+                'res_id': 4242,
+                'method': '_job_import_initial_stock_shard',
+                'args': json.dumps({'shard': 0, 'shard_count': 1, 'run': run, 'rows_file': rows_file.id}),
+                'state': 'done',
+                'result': json.dumps({'created': created}),
+            }, **vals))
+        
+        job = shard_job('run-b', 0, state='running', result=False, checkpoint=3)
+        with patch.object(type(wizard), '_create_initial_stock_rows', autospec=True) as create_rows, \
+                patch.object(type(wizard), '_get_inventory_adjustment_location', return_value=None), \
+                patch.object(self.env.cr, 'commit'):
+            wizard._job_import_initial_stock_shard(job, 0, 1, 'run-b', rows_file.id)
+        self.assertEqual(create_rows.call_args[0][1], [(5, {'CODE PRODUIT': 'P5'})])
+        self.assertEqual(job.checkpoint, 5)
+        
+        shard_job('run-a', 7)
+        job.state = 'done'
+        job.result = json.dumps({'created': 2})
+        with patch.object(type(wizard), '_finish_initial_stock_import', autospec=True, return_value=2) as finish, \
+                patch.object(type(wizard), '_send_notifications'):
+            wizard._job_finish_initial_stock(job, {'product_count': 1}, 'run-b')
+        self.assertEqual(finish.call_args[0][1]['created'], 2)
+        self.assertEqual(finish.call_args[0][1]['product_count'], 1)
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
-from odoo.tests.common import TransactionCase
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase, new_test_user
 from odoo.exceptions import UserError
 from datetime import datetime, timedelta
 from odoo import fields
@@ -21,14 +23,16 @@ class TestInventoryDashboard(TransactionCase):
         # Créer des produits de test
         self.product1 = self.env['product.product'].create({
             'name': 'Produit Test Dashboard 1',
-            'type': 'product',
+            'type': 'consu',
+            'is_storable': True,
             'default_code': 'PTDB1',
             'standard_price': 1000.0,
         })
         
         self.product2 = self.env['product.product'].create({
             'name': 'Produit Test Dashboard 2',
-            'type': 'product',
+            'type': 'consu',
+            'is_storable': True,
             'default_code': 'PTDB2',
             'standard_price': 2000.0,
         })
@@ -301,3 +305,171 @@ class TestInventoryDashboard(TransactionCase):
         ])
         self.assertEqual(len(remaining_variances), 0,
                         "Les variances devraient être supprimées en cascade")
+
+
+class TestDashboardCache(TransactionCase):
+    """Tests unitaires pour le cache des agrégats du dashboard."""
+    
+    def setUp(self):
+        super(TestDashboardCache, self).setUp()
+        
+        self.Dashboard = self.env['stockex.inventory.dashboard']
+        self.env['ir.config_parameter'].sudo().set_param('stockex.dashboard_cache_ttl', '300')
+        self.Dashboard._invalidate_dashboard_cache()
+        
+        self.product = self.env['product.product'].create({
+            'name': 'Produit Cache Dashboard',
+            'type': 'consu',
+            'is_storable': True,
+            'standard_price': 10.0,
+        })
+        self.location = self.env['stock.location'].create({
+            'name': 'Emplacement Cache Dashboard',
+            'usage': 'internal',
+        })
+        self.inventory = self.env['stockex.stock.inventory'].create({
+            'name': 'INV-TEST-CACHE-001',
+            'date': fields.Date.today(),
+            'location_id': self.location.id,
+            'state': 'done',
+        })
+        self.env['stockex.stock.inventory.line'].create({
+            'inventory_id': self.inventory.id,
+            'product_id': self.product.id,
+            'location_id': self.location.id,
+            'product_qty': 5.0,
+        })
+        # Inventaire créé directement validé : alimenter sa tranche de faits
+        self.env['stockex.variance.daily']._refresh_days([(self.inventory.company_id.id, self.inventory.date)])
+    
+    def test_01_result_is_cached(self):
+        """Un deuxième appel avec les mêmes filtres renvoie une copie du résultat en cache."""
+        first = self.Dashboard.get_dashboard_data(period='30d')
+        total = first['kpis']['total_inventories']
+        first['kpis']['total_inventories'] = -1
+        
+        with patch.object(type(self.Dashboard), '_compute_kpis') as compute_kpis:
+            second = self.Dashboard.get_dashboard_data(period='30d')
+        
+        compute_kpis.assert_not_called()
+        self.assertEqual(second['kpis']['total_inventories'], total)
+        with patch.object(type(self.Dashboard), '_compute_kpis', return_value={}) as compute_kpis:
+            self.Dashboard.get_dashboard_data(period='ytd')
+        compute_kpis.assert_called_once()
+    
+    def test_02_state_change_invalidates(self):
+        """Valider, annuler ou remettre en brouillon un inventaire invalide le cache."""
+        version = self.Dashboard._get_cache_version()
+        first = self.Dashboard.get_dashboard_data(period='30d')
+        
+        self.inventory.write({'state': 'cancel'})
+        second = self.Dashboard.get_dashboard_data(period='30d')
+        
+        self.assertEqual(second['kpis']['total_inventories'], first['kpis']['total_inventories'] - 1)
+        self.assertGreater(self.Dashboard._get_cache_version(), version)
+        
+        version = self.Dashboard._get_cache_version()
+        self.inventory.write({'state': 'draft'})
+        self.assertGreater(self.Dashboard._get_cache_version(), version)
+    
+    def test_03_ttl_zero_disables_cache(self):
+        """Une durée de 0 désactive le cache."""
+        self.env['ir.config_parameter'].sudo().set_param('stockex.dashboard_cache_ttl', '0')
+        
+        self.Dashboard.get_dashboard_data(period='30d')
+        with patch.object(type(self.Dashboard), '_compute_kpis', return_value={}) as compute_kpis:
+            self.Dashboard.get_dashboard_data(period='30d')
+        
+        compute_kpis.assert_called_once()
+    
+    def test_04_charts_read_fact_table(self):
+        """Les graphiques lisent les faits journaliers, tenus à jour lors d'un changement de date."""
+        # Déplacer l'inventaire validé sur une date isolée : la tranche est recalculée
+        self.inventory.write({'date': '2001-03-15'})
+        filters = self.Dashboard._get_dashboard_filters(
+            fields.Date.to_date('2001-03-01'), fields.Date.to_date('2001-03-31')
+        )
+        
+        evolution = self.Dashboard._chart_evolution(filters, 'standard')
+        self.assertEqual(evolution['labels'], [self.inventory.date.strftime('%B %Y')])
+        self.assertAlmostEqual(evolution['datasets'][0]['data'][0], 50.0)
+        
+        categories = self.Dashboard._chart_category_distribution(filters, 'standard')
+        self.assertEqual(categories['labels'], [self.product.categ_id.name])
+        self.assertAlmostEqual(categories['datasets'][0]['data'][0], 50.0)
+        
+        distribution = self.Dashboard._chart_warehouse_distribution(filters, 'standard')
+        self.assertEqual(distribution['labels'], ['Non défini'])
+        self.assertEqual(distribution['warehouse_ids'], [False])
+        self.assertAlmostEqual(distribution['datasets'][1]['data'][0], 50.0)
+    
+    def test_05_fact_table_refresh(self):
+        """Les faits suivent la validation et l'annulation, et se reconstruisent à l'identique."""
+        Fact = self.env['stockex.variance.daily']
+        domain = [('date', '=', self.inventory.date), ('company_id', '=', self.inventory.company_id.id)]
+        before = sum(Fact.search(domain).mapped('line_count'))
+        self.assertGreaterEqual(before, 1)
+        
+        self.inventory.write({'state': 'cancel'})
+        self.assertEqual(sum(Fact.search(domain).mapped('line_count')), before - 1)
+        
+        self.inventory.write({'state': 'done'})
+        Fact._rebuild(date_from=self.inventory.date, date_to=self.inventory.date)
+        facts = Fact.search(domain)
+        self.assertEqual(sum(facts.mapped('line_count')), before)
+    
+    def test_06_api_kpis_aggregate_stock(self):
+        """Les KPIs de l'API agrègent les quants en SQL, par entrepôt, avec un cache court."""
+        self.env['ir.config_parameter'].sudo().set_param('stockex.valuation_rule', 'standard')
+        warehouse = self.env['stock.warehouse'].create({'name': 'Entrepôt KPI API', 'code': 'KPIAPI'})
+        self.env['stock.quant'].create([
+            {'product_id': self.product.id, 'location_id': warehouse.lot_stock_id.id, 'quantity': 3.0},
+            {'product_id': self.product.id, 'location_id': self.location.id, 'quantity': 4.0},
+        ])
+        
+        totals = self.Dashboard._compute_stock_totals(self.env.companies.ids, warehouse)
+        self.assertEqual(totals, {'products': 1, 'quantity': 3.0, 'value': 30.0})
+        
+        kpis = self.Dashboard.get_api_kpis(warehouse_id=warehouse.id)
+        self.assertEqual(kpis['total_products'], 1)
+        self.assertEqual(kpis['current_stock_value'], 30.0)
+        self.assertEqual(kpis['total_inventories'], 0)
+        with patch.object(type(self.Dashboard), '_compute_stock_totals', return_value=totals) as compute_totals:
+            self.assertEqual(kpis, self.Dashboard.get_api_kpis(warehouse_id=warehouse.id))
+            compute_totals.assert_not_called()
+            self.Dashboard.get_api_kpis(warehouse_id=warehouse.id, cache_version='autre')
+            compute_totals.assert_called_once()
+    
+    def test_07_cache_is_per_user(self):
+        """Le résultat mis en cache pour un utilisateur n'est pas servi à un autre."""
+        user = new_test_user(self.env, login='dashboard_cache_user', groups='stockex.group_stockex_user')
+        self.Dashboard.get_dashboard_data(period='30d')
+        
+        with patch.object(type(self.Dashboard), '_compute_kpis', return_value={}) as compute_kpis:
+            self.Dashboard.with_user(user).get_dashboard_data(period='30d')
+        
+        compute_kpis.assert_called_once()
+    
+    def test_08_facts_follow_inventory_rules(self):
+        """Un utilisateur non manager ne voit que les écarts de ses propres inventaires."""
+        user = new_test_user(self.env, login='dashboard_fact_user', groups='stockex.group_stockex_user')
+        Fact = self.env['stockex.variance.daily']
+        filters = self.Dashboard._get_dashboard_filters(self.inventory.date, self.inventory.date)
+        self.assertTrue(Fact._aggregate(filters, 'standard'))
+        
+        self.assertFalse(Fact.with_user(user)._aggregate(filters, 'standard'))
+        self.assertFalse(Fact.with_user(user).search([]))
+        
+        self.inventory.write({'user_id': user.id})
+        totals = Fact.with_user(user)._aggregate(filters, 'standard')
+        self.assertEqual(totals[0]['lines'], 1)
+        self.assertEqual(Fact.with_user(user).search([]).user_id, user)
+    
+    def test_09_api_kpis_follow_inventory_rules(self):
+        """Les écarts des KPIs de l'API se limitent aux inventaires visibles par l'utilisateur."""
+        user = new_test_user(self.env, login='api_kpis_user', groups='stockex.group_stockex_user')
+        self.assertGreaterEqual(self.Dashboard.get_api_kpis()['variance']['lines'], 1)
+        
+        kpis = self.Dashboard.with_user(user).get_api_kpis()
+        self.assertEqual(kpis['variance']['lines'], 0)
+        self.assertEqual(kpis['total_inventories'], 0)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+import os
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests.common import TransactionCase
+
+
+class TestJobQueue(TransactionCase):
+    """Tests unitaires pour la file de tâches de fond."""
+    
+    def setUp(self):
+        super(TestJobQueue, self).setUp()
+        
+        self.Job = self.env['stockex.job']
+        self.inventory = self.env['stockex.stock.inventory'].create({
+            'name': 'TEST-JOB-001',
+            'date': date.today(),
+        })
+    
+    def test_01_enqueue(self):
+        """La mise en file enregistre une tâche en attente sur l'enregistrement."""
+        job = self.Job._enqueue(
+            self.inventory, '_job_validate',
+            job_type='inventory_validation', total=10,
+        )
+        
+        self.assertEqual(job.state, 'pending')
+        self.assertEqual(job.res_model, 'stockex.stock.inventory')
+        self.assertEqual(job.res_id, self.inventory.id)
+        self.assertEqual(job.progress_total, 10)
+        self.assertEqual(self.Job._find_active(self.inventory, '_job_validate'), job)
+    
+    def test_02_enqueue_rejects_arbitrary_methods(self):
+        """Seules les méthodes préfixées _job_ peuvent être mises en file."""
+        with self.assertRaises(UserError):
+            self.Job._enqueue(self.inventory, 'unlink', job_type='cleanup')
+    
+    def test_03_claim_respects_priority_and_limit(self):
+        """La réservation prend les tâches les plus prioritaires, dans la limite demandée."""
+        low = self.Job._enqueue(self.inventory, '_job_validate', job_type='inventory_validation', priority=20)
+        high = self.Job._enqueue(self.inventory, '_job_validate', job_type='inventory_validation', priority=1)
+        self.Job.search([('id', 'not in', (low | high).ids), ('state', '=', 'pending')]).write({'state': 'cancelled'})
+        
+        claimed = self.Job._claim_jobs(1)
+        
+        self.assertEqual(claimed, [high.id])
+        self.assertEqual(high.state, 'running')
+        self.assertEqual(high.attempts, 1)
+        self.assertEqual(low.state, 'pending')
+    
+    def test_04_stale_jobs_are_requeued(self):
+        """Une tâche en cours sans signe de vie est remise en attente, ou échoue à la dernière tentative."""
+        stale = self.Job._enqueue(self.inventory, '_job_validate', job_type='inventory_validation')
+        exhausted = self.Job._enqueue(self.inventory, '_job_validate', job_type='inventory_validation', max_attempts=1)
+        old = fields.Datetime.now() - timedelta(hours=1)
+        (stale | exhausted).write({'state': 'running', 'attempts': 1, 'heartbeat': old})
+        
+        self.Job._requeue_stale_jobs(15)
+        
+        self.assertEqual(stale.state, 'pending')
+        self.assertEqual(exhausted.state, 'failed')
+    
+    def test_05_progress(self):
+        """La progression est calculée à partir des compteurs de la tâche."""
+        job = self.Job._enqueue(self.inventory, '_job_validate', job_type='inventory_validation', total=200)
+        job._update_progress(done=50, checkpoint=50)
+        
+        self.assertAlmostEqual(job.progress, 25.0)
+        self.assertEqual(job.checkpoint, 50)
+        self.assertTrue(job.heartbeat)
+    
+    def test_06_line_adjustment_tracking(self):
+        """Les lignes ajustées sont liées à leur mouvement et alimentent la progression."""
+        product = self.env['product.product'].create({'name': 'Produit Tâche', 'type': 'consu', 'is_storable': True})
+        location = self.env['stock.location'].create({'name': 'Emplacement Tâche', 'usage': 'internal'})
+        lines = self.env['stockex.stock.inventory.line'].create([{
+            'inventory_id': self.inventory.id,
+            'product_id': product.id,
+            'location_id': location.id,
+            'product_qty': qty,
+        } for qty in (1.0, 2.0)])
+        move = self.env['stock.move'].create({
+            'name': 'Ajustement test',
+            'product_id': product.id,
+            'product_uom': product.uom_id.id,
+            'product_uom_qty': 1.0,
+            'location_id': self.env.ref('stock.location_inventory').id,
+            'location_dest_id': location.id,
+            'stockex_inventory_id': self.inventory.id,
+            'stockex_inventory_line_id': lines[0].id,
+        })
+        
+        lines._mark_adjusted(move)
+        
+        self.assertEqual(lines[0].adjustment_state, 'done')
+        self.assertEqual(lines[0].adjustment_move_id, move)
+        self.assertEqual(lines[1].adjustment_state, 'pending')
+        self.assertAlmostEqual(self.inventory.validation_progress, 50.0)
+        
+        self.inventory.validation_cursor = lines[0].id
+        self.inventory._reset_adjustment_tracking()
+        
+        self.assertEqual(lines[0].adjustment_state, 'pending')
+        self.assertFalse(lines[0].adjustment_move_id)
+        self.assertEqual(self.inventory.validation_cursor, 0)
+        self.assertAlmostEqual(self.inventory.validation_progress, 0.0)
+    
+    def test_07_wizard_job_survives_wizard_deletion(self):
+        """Une tâche posée sur un assistant reconstruit celui-ci depuis ses arguments."""
+        Wizard = self.env['stockex.stock.data.cleanup.wizard']
+        wizard = Wizard.create({'delete_inventories': True, 'confirmation_text': 'SUPPRIMER'})
+        wizard_id = wizard.id
+        job = self.Job._enqueue(wizard, '_job_cleanup', job_type='cleanup')
+        wizard.unlink()
+        
+        rebuilt = job._build_wizard(Wizard, json.loads(job.args)['_wizard'])
+        
+        self.assertTrue(rebuilt.delete_inventories)
+        self.assertFalse(rebuilt.delete_products)
+        self.assertEqual(self.Job._get_res_id(rebuilt), wizard_id)
+        self.assertEqual(self.Job._find_active(rebuilt, '_job_cleanup'), job)
+    
+    def test_08_wizard_file_copied_to_job(self):
+        """Le fichier d'un assistant est copié dans une pièce jointe de la tâche."""
+        Wizard = self.env['stockex.import.excel.wizard']
+        wizard = Wizard.create({
+            'name': 'Import Tâche',
+            'file': base64.b64encode(b'contenu-excel'),
+            'filename': 'import.xlsx',
+        })
+        job = self.Job._enqueue(wizard, '_job_import', job_type='excel_import')
+        other = self.Job._enqueue(wizard, '_job_import', job_type='excel_import')
+        snapshot = json.loads(job.args)['_wizard']
+        attachment = self.env['ir.attachment'].browse(snapshot['files']['file'])
+        
+        self.assertEqual(attachment.raw, b'contenu-excel')
+        self.assertEqual((attachment.res_model, attachment.res_id), ('stockex.job', job.id))
+        self.assertEqual(json.loads(other.args)['_wizard']['files'], snapshot['files'])
+        
+        rebuilt = job._build_wizard(Wizard, snapshot)
+        path, tmp_path = self.env['stockex.import.engine']._binary_to_path(rebuilt, 'file')
+        try:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'contenu-excel')
+        finally:
+            if tmp_path:
+                os.unlink(tmp_path)
+    
+    def test_09_runner_params_per_worker(self):
+        """Une tâche par processus en mode multi-processus, sauf paramétrage explicite."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        ICP.set_param('stockex.job_max_parallel', '6')
+        ICP.set_param('stockex.job_threads_per_worker', '0')
+        with patch('odoo.addons.stockex.models.job_queue.config', {'workers': 4}):
+            self.assertEqual(self.Job._get_runner_params()['threads_per_worker'], 1)
+        with patch('odoo.addons.stockex.models.job_queue.config', {'workers': 0}):
+            self.assertEqual(self.Job._get_runner_params()['threads_per_worker'], 6)
+        
+        ICP.set_param('stockex.job_threads_per_worker', '2')
+        with patch('odoo.addons.stockex.models.job_queue.config', {'workers': 4}):
+            self.assertEqual(self.Job._get_runner_params()['threads_per_worker'], 2)
+    
+    def test_10_gc_old_jobs_and_inputs(self):
+        """Les tâches finies anciennes sont supprimées ; un fichier encore utilisé est conservé."""
+        Wizard = self.env['stockex.import.excel.wizard']
+        wizard = Wizard.create({
+            'name': 'Import Nettoyage',
+            'file': base64.b64encode(b'contenu-excel'),
+            'filename': 'import.xlsx',
+        })
+        old_done = self.Job._enqueue(wizard, '_job_import', job_type='excel_import')
+        pending = self.Job._enqueue(wizard, '_job_import', job_type='excel_import')
+        recent = self.Job._enqueue(self.inventory, '_job_validate', job_type='inventory_validation')
+        old_failed = self.Job._enqueue(self.inventory, '_job_validate', job_type='inventory_validation')
+        long_ago = fields.Datetime.now() - timedelta(days=31)
+        (old_done | old_failed).write({'state': 'done', 'date_finished': long_ago})
+        old_failed.state = 'failed'
+        recent.write({'state': 'done', 'date_finished': fields.Datetime.now()})
+        attachment = self.env['ir.attachment'].browse(old_done._get_input_files()['file'])
+        
+        self.Job._gc_jobs()
+        
+        self.assertFalse((old_done | old_failed).exists())
+        self.assertEqual((pending | recent).exists(), pending | recent)
+        self.assertTrue(attachment.exists())
+        self.assertEqual(attachment.res_id, pending.id)
+        
+        pending.write({'state': 'cancelled', 'date_finished': long_ago})
+        self.Job._gc_jobs()
+        self.assertFalse(attachment.exists())
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.stockex.tools import jwt_auth
+from odoo.addons.stockex.tools.jwt_auth import StockexJWTAuth
+
+
+class TestJWTAuth(TransactionCase):
+    """Tests unitaires du cache de vérification des jetons JWT."""
+    
+    def setUp(self):
+        super(TestJWTAuth, self).setUp()
+        
+        if not jwt_auth.JWT_AVAILABLE:
+            self.skipTest("PyJWT non installé")
+        self.auth = StockexJWTAuth()
+        self.user = self.env['res.users'].create({
+            'name': 'Utilisateur API',
+            'login': 'stockex_api_user',
+        })
+    
+    def test_01_verified_token_is_cached(self):
+        """Un jeton vérifié n'est plus décodé jusqu'à son expiration."""
+        token = self.auth.generate_token(self.user.id)
+        
+        with patch.object(jwt_auth.jwt, 'decode', wraps=jwt_auth.jwt.decode) as decode:
+            first = self.auth.verify_token(token)
+            second = self.auth.verify_token(token)
+        
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(first['user_id'], self.user.id)
+        self.assertIsNone(self.auth.verify_token(token + 'x'))
+    
+    def test_02_cached_token_expires(self):
+        """L'entrée en cache expire avec le jeton."""
+        token = jwt_auth.jwt.encode(
+            {'user_id': self.user.id, 'exp': datetime.utcnow() + timedelta(hours=1)},
+            self.auth._get_secret_key(), algorithm='HS256',
+        )
+        self.assertTrue(self.auth.verify_token(token))
+        
+        payload, _expires_at = self.auth._token_cache[('default', token)]
+        self.auth._token_cache[('default', token)] = (payload, 0)
+        self.assertIsNone(self.auth.verify_token(token))
+    
+    def test_03_secret_per_database(self):
+        """La clé est propre à chaque base et calculée une seule fois."""
+        self.assertNotEqual(self.auth._get_secret_key('base_a'), self.auth._get_secret_key('base_b'))
+        self.assertIs(self.auth._get_secret_key('base_a'), self.auth._get_secret_key('base_a'))
+    
+    def test_04_user_cache_invalidated_on_deactivation(self):
+        """Un utilisateur désactivé n'est plus accepté malgré le cache."""
+        Users = self.env['res.users']
+        self.assertTrue(Users._stockex_api_user_active(self.user.id))
+        
+        self.user.active = False
+        self.assertFalse(Users._stockex_api_user_active(self.user.id))
+        self.assertFalse(Users._stockex_api_user_active(0))
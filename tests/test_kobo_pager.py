@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from odoo.exceptions import UserError
+from odoo.tests.common import TransactionCase
+
+from ..models.kobo_config import fetch_photo, try_compress_photo
+
+
+class StubKoboHandler(BaseHTTPRequestHandler):
+    """Serveur Kobo minimal : /api/v2/assets/<uid>/data/ paginé par start/limit."""
+    
+    submissions = [{'_id': i, 'code': f'P{i}'} for i in range(1, 8)]
+    with_next = True
+    requests_log = []
+    photo = b''
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.requests_log.append((url.path, params, self.headers.get('Authorization')))
+        
+        if url.path == '/media/photo.png':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.end_headers()
+            self.wfile.write(self.photo)
+            return
+        
+        if url.path != '/api/v2/assets/FORM1/data/':
+            self.send_response(404)
+            self.end_headers()
+            return
+        
+        query = json.loads(params.get('query', '{}'))
+        after = query.get('_id', {}).get('$gt', 0)
+        matching = sorted(
+            (s for s in self.submissions if s['_id'] > after),
+            key=lambda s: s['_id'],
+        )
+        start = int(params.get('start', 0))
+        limit = int(params.get('limit', 100))
+        page = matching[start:start + limit]
+        next_url = None
+        if self.with_next and start + limit < len(matching):
+            next_params = dict(params, start=start + limit)
+            next_url = f"http://{self.headers['Host']}{url.path}?{urlencode(next_params)}"
+        
+        body = json.dumps({'count': len(matching), 'next': next_url, 'results': page}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+class TestKoboPager(TransactionCase):
+    """Tests de la lecture paginée des soumissions Kobo contre un serveur local."""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from PIL import Image
+        output = BytesIO()
+        Image.new('RGBA', (400, 200), (255, 0, 0, 128)).save(output, format='PNG')
+        StubKoboHandler.photo = output.getvalue()
+        
+        cls.server = HTTPServer(('127.0.0.1', 0), StubKoboHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+    
+    def setUp(self):
+        super(TestKoboPager, self).setUp()
+        
+        StubKoboHandler.with_next = True
+        StubKoboHandler.requests_log = []
+        self.config = self.env['stockex.kobo.config'].create({
+            'name': 'Kobo Test',
+            'kobo_url': f'http://127.0.0.1:{self.server.server_port}/',
+            'api_token': 'TOKEN',
+            'form_id': 'FORM1',
+        })
+    
+    def test_01_pages_follow_next(self):
+        """Les pages sont lues en suivant « next », triées par _id croissant."""
+        pager = self.config._get_submission_pager(page_size=3)
+        
+        pages = [[s['_id'] for s in page] for page in pager.pages()]
+        
+        self.assertEqual(pages, [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertTrue(all(auth == 'Token TOKEN' for _path, _params, auth in StubKoboHandler.requests_log))
+        self.assertEqual(json.loads(StubKoboHandler.requests_log[0][1]['sort']), {'_id': 1})
+    
+    def test_02_pages_resume_after_cursor(self):
+        """Seules les soumissions d'_id supérieur au curseur sont demandées."""
+        pager = self.config._get_submission_pager(page_size=3)
+        
+        pages = [[s['_id'] for s in page] for page in pager.pages(start_after=5)]
+        
+        self.assertEqual(pages, [[6, 7]])
+        self.assertEqual(pager.count(start_after=5), 2)
+    
+    def test_03_pages_without_next_use_start(self):
+        """Sans lien « next », la pagination se poursuit par start/limit."""
+        StubKoboHandler.with_next = False
+        pager = self.config._get_submission_pager(page_size=3)
+        
+        pages = [[s['_id'] for s in page] for page in pager.pages()]
+        
+        self.assertEqual(pages, [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertEqual([params.get('start') for _path, params, _auth in StubKoboHandler.requests_log], [None, '3', '6'])
+    
+    def test_04_http_error(self):
+        """Une réponse en erreur est remontée en UserError."""
+        self.config.form_id = 'UNKNOWN'
+        pager = self.config._get_submission_pager()
+        
+        with self.assertRaises(UserError):
+            list(pager.pages())
+    
+    def test_05_fetch_photo_compresses(self):
+        """Une photo téléchargée est redimensionnée et ré-encodée en JPEG."""
+        session = self.config._get_kobo_session(pool_size=2)
+        url = f'http://127.0.0.1:{self.server.server_port}/media/photo.png'
+        
+        content = fetch_photo(session, url)
+        compressed = try_compress_photo(content, 'photo.png', max_dimension=100)
+        
+        self.assertEqual(content, StubKoboHandler.photo)
+        self.assertTrue(compressed.startswith(b'\xff\xd8'))
+        self.assertIsNone(try_compress_photo(content, 'document.pdf'))
+        self.assertIsNone(fetch_photo(session, url.replace('photo', 'absente')))
+    
+    def test_06_write_line_photos(self):
+        """Les photos sont écrites sur les lignes par une création groupée de pièces jointes."""
+        product = self.env['product.product'].create({'name': 'Produit Photo', 'default_code': 'KOBO-PHOTO'})
+        location = self.env['stock.location'].create({'name': 'Emplacement Photo', 'usage': 'internal'})
+        inventory = self.env['stockex.stock.inventory'].create({'name': 'TEST-KOBO-PHOTO', 'date': date.today()})
+        line = self.env['stockex.stock.inventory.line'].create({
+            'inventory_id': inventory.id,
+            'product_id': product.id,
+            'location_id': location.id,
+            'product_qty': 1.0,
+        })
+        photos = [
+            {'line_id': line.id, 'field': 'image_1', 'filename': 'a.jpg', 'url': 'x'},
+            {'line_id': line.id, 'field': 'image_2', 'filename': 'b.jpg', 'url': 'y'},
+        ]
+        
+        written = self.config._write_line_photos(photos, [b'photo-1', None])
+        
+        self.assertEqual(written, 1)
+        self.assertEqual(base64.b64decode(line.image_1), b'photo-1')
+        self.assertFalse(line.image_2)
+    
+    def test_07_get_photos_uses_cache(self):
+        """Une photo déjà connue n'est ni retéléchargée ni recompressée."""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self.config.compress_photos = True
+        url = f'http://127.0.0.1:{self.server.server_port}/media/photo.png'
+        photos = [{'line_id': 0, 'field': 'image_1', 'filename': 'photo.png', 'url': url}]
+        session = self.config._get_kobo_session(pool_size=2)
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = self.config._get_photos(photos, session, executor)
+            downloads = len(StubKoboHandler.requests_log)
+            second = self.config._get_photos(photos, session, executor)
+            # Même image sous une autre URL : téléchargée, mais variante reprise par empreinte
+            other = [dict(photos[0], url=url + '?copie=1')]
+            third = self.config._get_photos(other, session, executor)
+        
+        self.assertEqual(downloads, 1)
+        self.assertEqual(len(StubKoboHandler.requests_log), 2)
+        self.assertEqual(first, second)
+        self.assertEqual(first, third)
+        self.assertEqual(self.env['stockex.photo.cache'].search_count([('source_url', '=', url)]), 1)
+    
+    def test_08_resumed_import_reuses_inventory(self):
+        """Un import « Nouvelles soumissions » interrompu reprend au curseur, dans son inventaire."""
+        inventory = self.env['stockex.stock.inventory'].create({'name': 'TEST-KOBO-REPRISE', 'date': date.today()})
+        self.config.write({'last_submission_id': 5, 'import_inventory_id': inventory.id})
+        wizard = self.env['stockex.import.kobo.wizard'].create({
+            'name': 'Reprise Kobo',
+            'config_id': self.config.id,
+            'import_mode': 'new_only',
+        })
+        
+        with patch.object(self.env.cr, 'commit'):
+            action = wizard.action_import()
+        
+        self.assertEqual(action['res_id'], inventory.id)
+        self.assertEqual(self.config.last_submission_id, 7)
+        self.assertFalse(self.config.import_inventory_id)
+        query = json.loads(StubKoboHandler.requests_log[0][1]['query'])
+        self.assertEqual(query['_id'], {'$gt': 5})
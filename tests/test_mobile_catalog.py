@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase
+
+from ..models.mobile_catalog import CATALOG_COLUMNS
+
+
+class TestMobileCatalog(TransactionCase):
+    """Tests unitaires du catalogue produits hors ligne."""
+    
+    def setUp(self):
+        super(TestMobileCatalog, self).setUp()
+        
+        self.Catalog = self.env['stockex.mobile.catalog']
+        self.company = self.env.company
+        self.product = self.env['product.product'].create({
+            'name': 'Produit Catalogue',
+            'default_code': 'CAT-001',
+            'barcode': 'CAT0000000017',
+            'standard_price': 12.5,
+        })
+    
+    def _read(self, content):
+        lines = gzip.decompress(content).decode('utf-8').split('\n')
+        header = json.loads(lines[0])
+        rows = [dict(zip(header['columns'], json.loads(line))) for line in lines[1:]]
+        return header, rows
+    
+    def test_01_full_export(self):
+        """L'export complet contient les produits actifs, en colonnes."""
+        version, etag, content = self.Catalog._export(self.company)
+        header, rows = self._read(content)
+        
+        self.assertTrue(header['full'])
+        self.assertEqual(header['version'], version)
+        self.assertEqual(header['columns'], CATALOG_COLUMNS)
+        self.assertEqual(header['count'], len(rows))
+        row = next(row for row in rows if row['id'] == self.product.id)
+        self.assertEqual(row['barcode'], 'CAT0000000017')
+        self.assertEqual(row['price'], 12.5)
+        
+        # Même version : contenu et ETag identiques
+        self.assertEqual(self.Catalog._export(self.company), (version, etag, content))
+    
+    def test_02_diff_since_version(self):
+        """Le différentiel ne contient que les produits modifiés, archivés compris."""
+        other = self.env['product.product'].create({'name': 'Produit Stable', 'default_code': 'CAT-002'})
+        # Produit modifié bien avant la version connue du client
+        self.env.cr.execute(
+            "UPDATE product_product SET write_date = write_date - interval '1 hour' WHERE id = %s", [other.id]
+        )
+        self.env.cr.execute(
+            "UPDATE product_template SET write_date = write_date - interval '1 hour' WHERE id = %s",
+            [other.product_tmpl_id.id],
+        )
+        self.env.invalidate_all()
+        version = self.Catalog._get_version(self.company)
+        
+        self.product.write({'active': False})
+        _version, _etag, content = self.Catalog._export(self.company, since=version)
+        header, rows = self._read(content)
+        
+        self.assertFalse(header['full'])
+        self.assertEqual(header['since'], version)
+        ids = [row['id'] for row in rows]
+        self.assertIn(self.product.id, ids)
+        self.assertNotIn(other.id, ids)
+        self.assertFalse(next(row for row in rows if row['id'] == self.product.id)['active'])
+        
+        # Version invalide : export complet, sans les produits archivés
+        header, rows = self._read(self.Catalog._export(self.company, since='invalide')[2])
+        self.assertTrue(header['full'])
+        self.assertNotIn(self.product.id, [row['id'] for row in rows])
+        self.assertIn(other.id, [row['id'] for row in rows])
+    
+    def test_03_etag_without_export(self):
+        """L'ETag se calcule depuis la seule version ; l'export réutilise la version lue."""
+        version = self.Catalog._get_version(self.company)
+        etag = self.Catalog._get_etag(self.company, None, version)
+        
+        with patch.object(type(self.Catalog), '_get_version', side_effect=AssertionError('version relue')):
+            self.assertEqual(self.Catalog._export(self.company, version=version)[:2], (version, etag))
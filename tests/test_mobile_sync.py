@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+
+class TestMobileSync(TransactionCase):
+    """Tests unitaires de la synchronisation différentielle mobile."""
+    
+    def setUp(self):
+        super(TestMobileSync, self).setUp()
+        
+        self.Sync = self.env['stockex.mobile.sync']
+        self.product = self.env['product.product'].create({
+            'name': 'Produit Mobile',
+            'default_code': 'MOB-001',
+        })
+        self.location = self.env['stock.location'].create({
+            'name': 'Emplacement Mobile',
+            'usage': 'internal',
+        })
+        self.operations = [
+            {'op': 'inventory', 'seq': 1, 'local_id': 'inv-1', 'location_id': self.location.id},
+            {'op': 'line', 'seq': 2, 'local_id': 'line-1', 'inventory_local_id': 'inv-1',
+             'product_id': self.product.id, 'product_qty': 5},
+        ]
+    
+    def test_01_retry_is_idempotent(self):
+        """Un renvoi des mêmes opérations ne duplique ni inventaire ni ligne."""
+        first = self.Sync._apply_operations('device-A', self.operations)
+        second = self.Sync._apply_operations('device-A', self.operations)
+        
+        inventory = self.env['stockex.stock.inventory'].search([('mobile_ref', '=', 'device-A:inv-1')])
+        self.assertEqual(len(inventory), 1)
+        self.assertEqual(len(inventory.line_ids), 1)
+        self.assertEqual(first['last_seq'], 2)
+        self.assertEqual(
+            [(applied['local_id'], applied['server_id']) for applied in first['applied']],
+            [(applied['local_id'], applied['server_id']) for applied in second['applied']],
+        )
+        self.assertFalse(second['errors'])
+    
+    def test_02_sequence_orders_updates(self):
+        """Les nouvelles opérations mettent à jour, les anciennes ne sont pas rejouées."""
+        self.Sync._apply_operations('device-A', self.operations)
+        update = dict(self.operations[1], seq=3, product_qty=8)
+        self.Sync._apply_operations('device-A', [update])
+        stale = dict(self.operations[1], seq=2, product_qty=1)
+        self.Sync._apply_operations('device-A', [stale])
+        
+        line = self.env['stockex.stock.inventory.line'].search([('mobile_ref', '=', 'device-A:line-1')])
+        self.assertEqual(line.product_qty, 8)
+        
+        # Même identifiant local sur un autre appareil : enregistrements distincts
+        self.Sync._apply_operations('device-B', self.operations)
+        self.assertEqual(self.env['stockex.stock.inventory'].search_count([('mobile_ref', 'like', ':inv-1')]), 2)
+    
+    def test_03_changes_since_token(self):
+        """Seuls les enregistrements modifiés depuis le jeton sont renvoyés."""
+        self.Sync._apply_operations('device-A', self.operations)
+        
+        changes = self.Sync._get_changes('device-A')
+        self.assertIn('inv-1', [inventory['local_id'] for inventory in changes['inventories']])
+        self.assertIn('line-1', [line['local_id'] for line in changes['lines']])
+        
+        future = fields.Datetime.to_string(fields.Datetime.add(fields.Datetime.now(), hours=1))
+        changes = self.Sync._get_changes('device-A', future)
+        self.assertFalse(changes['inventories'])
+        self.assertFalse(changes['lines'])
+    
+    def test_04_batch_scans_last_write_wins(self):
+        """Un paquet de scans est résolu en une passe par (produit, emplacement)."""
+        inventory = self.env['stockex.stock.inventory'].create({
+            'name': 'TEST-SCANS',
+            'location_id': self.location.id,
+        })
+        other = self.env['product.product'].create({'name': 'Produit Scan', 'default_code': 'MOB-002'})
+        scans = [
+            {'ref': 'a', 'product_id': self.product.id, 'qty': 3, 'scanned_at': '2030-01-01T10:00:05Z'},
+            {'ref': 'b', 'product_id': self.product.id, 'qty': 7, 'scanned_at': '2030-01-01T10:00:01Z'},
+            {'ref': 'c', 'product_id': other.id, 'qty': 2},
+            {'ref': 'd', 'product_id': 0, 'qty': 1},
+            {'ref': 'e', 'qty': 1},
+        ]
+        
+        result = self.Sync._upsert_scans(inventory, scans)
+        
+        statuses = {item['ref']: item['status'] for item in result['results']}
+        self.assertEqual(statuses, {'a': 'created', 'b': 'merged', 'c': 'created', 'd': 'error', 'e': 'error'})
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(len(inventory.line_ids), 2)
+        line = inventory.line_ids.filtered(lambda l: l.product_id == self.product)
+        self.assertEqual(line.product_qty, 3)
+        self.assertEqual(line.location_id, self.location)
+        
+        # Scan antérieur au dernier scan appliqué à la ligne : ignoré
+        result = self.Sync._upsert_scans(inventory, [
+            {'ref': 'f', 'product_id': self.product.id, 'qty': 9, 'scanned_at': '2000-01-01T00:00:00Z'},
+        ])
+        self.assertEqual(result['results'][0]['status'], 'stale')
+        self.assertEqual(line.product_qty, 3)
+    
+    def test_05_batch_scans_sum(self):
+        """En mode cumul, les quantités scannées s'ajoutent à la ligne existante."""
+        inventory = self.env['stockex.stock.inventory'].create({
+            'name': 'TEST-SCANS-SUM',
+            'location_id': self.location.id,
+        })
+        scans = [{'product_id': self.product.id, 'qty': 1}, {'product_id': self.product.id, 'qty': 2}]
+        
+        self.Sync._upsert_scans(inventory, scans, mode='sum')
+        result = self.Sync._upsert_scans(inventory, scans, mode='sum')
+        
+        self.assertEqual(result['updated'], 1)
+        self.assertEqual([item['status'] for item in result['results']], ['updated', 'updated'])
+        self.assertEqual(inventory.line_ids.product_qty, 6)
+    
+    def test_06_changes_report_deletions(self):
+        """Les suppressions depuis le jeton sont renvoyées ; un jeton expiré force une resynchronisation."""
+        self.Sync._apply_operations('device-A', self.operations)
+        inventory = self.env['stockex.stock.inventory'].search([('mobile_ref', '=', 'device-A:inv-1')])
+        line_id, inventory_id = inventory.line_ids.id, inventory.id
+        token = fields.Datetime.to_string(fields.Datetime.now())
+        
+        inventory.line_ids.unlink()
+        changes = self.Sync._get_changes('device-A', token)
+        self.assertEqual(changes['deleted'], {'inventories': [], 'lines': [line_id]})
+        self.assertFalse(changes['reset'])
+        
+        inventory.unlink()
+        changes = self.Sync._get_changes('device-A', token)
+        self.assertEqual(changes['deleted']['inventories'], [inventory_id])
+        
+        expired = fields.Datetime.to_string(fields.Datetime.subtract(fields.Datetime.now(), days=60))
+        changes = self.Sync._get_changes('device-A', expired)
+        self.assertTrue(changes['reset'])
+        self.assertEqual(changes['deleted'], {'inventories': [], 'lines': []})
+    
+    def test_07_batch_scans_device_clock_and_refs(self):
+        """Les scans sont comparés entre heures d'appareil ; un renvoi en cumul n'est pas recompté."""
+        inventory = self.env['stockex.stock.inventory'].create({
+            'name': 'TEST-SCANS-REF',
+            'location_id': self.location.id,
+        })
+        # Horloge de l'appareil en retard sur le serveur : le scan suivant reste appliqué
+        self.Sync._upsert_scans(inventory, [
+            {'product_id': self.product.id, 'qty': 2, 'scanned_at': '2000-01-01T10:00:00Z'},
+        ])
+        result = self.Sync._upsert_scans(inventory, [
+            {'product_id': self.product.id, 'qty': 4, 'scanned_at': '2000-01-01T10:00:10Z'},
+        ])
+        self.assertEqual(result['results'][0]['status'], 'updated')
+        self.assertEqual(inventory.line_ids.product_qty, 4)
+        self.assertEqual(inventory.line_ids.mobile_scanned_at, fields.Datetime.to_datetime('2000-01-01 10:00:10'))
+        
+        scans = [
+            {'ref': 'dev:1', 'product_id': self.product.id, 'qty': 1},
+            {'ref': 'dev:2', 'product_id': self.product.id, 'qty': 2},
+        ]
+        self.Sync._upsert_scans(inventory, scans, mode='sum')
+        result = self.Sync._upsert_scans(inventory, scans + [{'ref': 'dev:3', 'product_id': self.product.id, 'qty': 5}], mode='sum')
+        
+        self.assertEqual([item['status'] for item in result['results']], ['duplicate', 'duplicate', 'updated'])
+        self.assertEqual(inventory.line_ids.product_qty, 12)
+    
+    def test_08_retry_recreates_missing_line(self):
+        """Une opération déjà vue dont la ligne manque est rejouée, jamais ignorée en silence."""
+        self.Sync._apply_operations('device-A', self.operations)
+        Line = self.env['stockex.stock.inventory.line']
+        Line.search([('mobile_ref', '=', 'device-A:line-1')]).unlink()
+        
+        result = self.Sync._apply_operations('device-A', self.operations)
+        
+        line = Line.search([('mobile_ref', '=', 'device-A:line-1')])
+        self.assertEqual(line.product_qty, 5)
+        self.assertIn(('line', 'line-1', line.id), [(a['op'], a['local_id'], a['server_id']) for a in result['applied']])
+        self.assertFalse(result['errors'])
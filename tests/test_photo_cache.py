@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+from io import BytesIO
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+from ..models import photo_cache
+from ..models.photo_cache import photo_checksum
+
+
+class TestPhotoCache(TransactionCase):
+    """Tests unitaires du cache des photos par contenu."""
+    
+    def setUp(self):
+        super(TestPhotoCache, self).setUp()
+        
+        from PIL import Image
+        self.Cache = self.env['stockex.photo.cache']
+        output = BytesIO()
+        Image.new('RGB', (300, 300), (0, 128, 255)).save(output, format='PNG')
+        self.photo = output.getvalue()
+    
+    def test_01_store_and_lookup(self):
+        """Une variante est enregistrée une fois par (empreinte, taille, qualité)."""
+        checksum = photo_checksum(b'original')
+        variant = {'checksum': checksum, 'content': b'variante', 'source_url': 'https://kobo/a.jpg'}
+        
+        self.assertEqual(self.Cache._store([variant, dict(variant)], 800, 80), 1)
+        self.assertEqual(self.Cache._store([variant], 800, 80), 0)
+        self.assertEqual(self.Cache._store([variant], 1600, 90), 1)
+        
+        self.assertEqual(self.Cache._lookup_checksums([checksum], 800, 80), {checksum: b'variante'})
+        self.assertEqual(self.Cache._lookup_urls(['https://kobo/a.jpg'], 800, 80), {'https://kobo/a.jpg': b'variante'})
+        self.assertEqual(self.Cache._lookup_checksums([checksum], 400, 80), {})
+    
+    def test_02_get_variant_compresses_once(self):
+        """Une photo déjà reçue reprend sa variante sans nouvelle compression."""
+        first = self.Cache._get_variant(self.photo, 100, 80)
+        self.assertTrue(first.startswith(b'\xff\xd8'))
+        
+        with patch.object(photo_cache, 'compress_photo', side_effect=AssertionError('recompression')):
+            self.assertEqual(self.Cache._get_variant(self.photo, 100, 80), first)
+    
+    def test_03_gc_removes_unreferenced_and_expired(self):
+        """Le nettoyage garde les variantes reprises par une ligne, dans la limite de la rétention."""
+        self.env['ir.config_parameter'].sudo().set_param('stockex.photo_cache_retention_days', '30')
+        variants = [
+            {'checksum': photo_checksum(name), 'content': name + b'-variante'}
+            for name in (b'reprise', b'orpheline', b'recente')
+        ]
+        self.Cache._store(variants, 800, 80)
+        used, orphan, recent = (self.Cache.search([('checksum', '=', v['checksum'])]) for v in variants)
+        self.env['ir.attachment'].create({'name': 'ligne.jpg', 'raw': b'reprise-variante', 'res_model': 'res.partner'})
+        self.env.cr.execute(
+            "UPDATE stockex_photo_cache SET create_date = %s WHERE id IN %s",
+            [fields.Datetime.now() - timedelta(days=2), (used.id, orphan.id)],
+        )
+        self.Cache.invalidate_model()
+        
+        self.Cache._gc_photo_cache()
+        self.assertEqual((used | orphan | recent).exists(), used | recent)
+        
+        self.env.cr.execute(
+            "UPDATE stockex_photo_cache SET create_date = %s WHERE id = %s",
+            [fields.Datetime.now() - timedelta(days=31), used.id],
+        )
+        self.Cache._gc_photo_cache()
+        self.assertFalse(used.exists())
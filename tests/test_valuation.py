@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests.common import TransactionCase
+from datetime import date
+
+
+class TestInventoryValuation(TransactionCase):
+    """Tests unitaires pour la valorisation en masse des inventaires."""
+    
+    def setUp(self):
+        super(TestInventoryValuation, self).setUp()
+        
+        self.env['ir.config_parameter'].sudo().set_param('stockex.valuation_rule', 'standard')
+        self.env['ir.config_parameter'].sudo().set_param('stockex.apply_depreciation', 'False')
+        
+        self.product_1 = self.env['product.product'].create({
+            'name': 'Produit Valorisation 1',
+            'default_code': 'VAL001',
+            'type': 'consu',
+            'is_storable': True,
+            'standard_price': 150.0,
+        })
+        self.product_2 = self.env['product.product'].create({
+            'name': 'Produit Valorisation 2',
+            'default_code': 'VAL002',
+            'type': 'consu',
+            'is_storable': True,
+            'standard_price': 300.0,
+        })
+        self.location = self.env['stock.location'].create({
+            'name': 'Emplacement Valorisation',
+            'usage': 'internal',
+        })
+        self.inventory = self.env['stockex.stock.inventory'].create({
+            'name': 'TEST-VAL-001',
+            'date': date.today(),
+            'location_id': self.location.id,
+        })
+    
+    def test_01_bulk_prices_match_single_product(self):
+        """Le résolveur en masse renvoie les mêmes prix que l'appel unitaire."""
+        products = self.product_1 | self.product_2
+        prices = self.inventory._get_valuation_prices(
+            products, company=self.inventory.company_id, date=self.inventory.date
+        )
+        
+        self.assertEqual(set(prices), set(products.ids))
+        for product in products:
+            self.assertAlmostEqual(
+                prices[product.id],
+                self.inventory._get_product_valuation_price(product),
+            )
+    
+    def test_02_standard_price_fallback(self):
+        """Sans couche de valorisation, le coût standard de la société est utilisé."""
+        prices = self.inventory._get_valuation_prices(self.product_1, company=self.inventory.company_id)
+        self.assertAlmostEqual(prices[self.product_1.id], 150.0)
+    
+    def test_03_empty_recordset(self):
+        """Un recordset vide ne déclenche aucune requête et renvoie un dict vide."""
+        prices = self.inventory._get_valuation_prices(self.env['product.product'])
+        self.assertEqual(prices, {})
+    
+    def test_04_totals_use_bulk_prices(self):
+        """Les totaux de l'inventaire sont valorisés avec les prix résolus en masse."""
+        self.env['stockex.stock.inventory.line'].create([{
+            'inventory_id': self.inventory.id,
+            'product_id': self.product_1.id,
+            'location_id': self.location.id,
+            'product_qty': 2.0,
+        }, {
+            'inventory_id': self.inventory.id,
+            'product_id': self.product_2.id,
+            'location_id': self.location.id,
+            'product_qty': 3.0,
+        }])
+        
+        self.assertAlmostEqual(self.inventory.total_value_real, 2 * 150.0 + 3 * 300.0)
+        line = self.inventory.line_ids.filtered(lambda l: l.product_id == self.product_2)
+        self.assertAlmostEqual(line.standard_price, 300.0)
+    
+    def test_05_depreciation_buckets(self):
+        """Les catégories de rotation respectent les seuils configurés."""
+        engine = self.env['stockex.depreciation.engine']
+        params = {'active_days': 365, 'slow_days': 1095, 'slow_rate': 40.0, 'dead_rate': 100.0}
+        
+        self.assertEqual(engine._get_bucket(0, params), 'active')
+        self.assertEqual(engine._get_bucket(365, params), 'active')
+        self.assertEqual(engine._get_bucket(366, params), 'slow')
+        self.assertEqual(engine._get_bucket(1095, params), 'slow')
+        self.assertEqual(engine._get_bucket(1096, params), 'dead')
+        self.assertEqual(engine._get_bucket(None, params), 'dead')
+        self.assertEqual(engine._get_rate('slow', params), 40.0)
+    
+    def test_06_depreciation_coefficients_batch(self):
+        """Les produits sans mouvement sont décotés comme stock mort, en une seule passe."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        ICP.set_param('stockex.depreciation_dead_rate', '80.0')
+        
+        coefficients = self.env['stockex.depreciation.engine']._get_coefficients(self.product_1 | self.product_2)
+        
+        self.assertAlmostEqual(coefficients[self.product_1.id], 0.2)
+        self.assertAlmostEqual(coefficients[self.product_2.id], 0.2)
+        self.assertAlmostEqual(self.inventory._get_depreciation_coefficient(self.product_1), 0.2)
+    
+    def test_07_product_snapshot_refresh(self):
+        """L'instantané coût/rotation est rafraîchi pour les couples demandés."""
+        Snapshot = self.env['stockex.product.snapshot']
+        company = self.inventory.company_id
+        
+        Snapshot._refresh([(self.product_1.id, company.id)])
+        
+        snapshot = Snapshot.search([('product_id', '=', self.product_1.id), ('company_id', '=', company.id)])
+        self.assertEqual(len(snapshot), 1)
+        self.assertAlmostEqual(snapshot.standard_price, 150.0)
+        self.assertEqual(snapshot.rotation_status, 'dead')
+        
+        # Un second rafraîchissement met à jour la ligne existante (pas de doublon)
+        Snapshot._refresh([(self.product_1.id, company.id)])
+        self.assertEqual(Snapshot.search_count([('product_id', '=', self.product_1.id)]), 1)
+    
+    def test_08_depreciation_params_parsing(self):
+        """Les seuils saisis en décimal sont acceptés, les valeurs invalides reprennent le défaut."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        ICP.set_param('stockex.depreciation_active_days', ' 180.0 ')
+        ICP.set_param('stockex.depreciation_slow_rate', 'abc')
+        
+        params = self.env['stockex.depreciation.engine']._get_params()
+        
+        self.assertEqual(params['active_days'], 180)
+        self.assertIsInstance(params['active_days'], int)
+        self.assertEqual(params['slow_rate'], 40.0)
+        
+        # Les vues et l'instantané produit lisent les mêmes valeurs en SQL
+        engine = self.env['stockex.depreciation.engine']
+        ICP.set_param('stockex.depreciation_slow_days', '730.9')
+        self.env.flush_all()
+        self.env.cr.execute(f"SELECT active_days, slow_days, slow_rate, dead_rate FROM {engine._sql_params()}")
+        self.assertEqual(self.env.cr.dictfetchone(), engine._get_params())
+        self.env['stockex.product.snapshot']._refresh([(self.product_1.id, self.env.company.id)])
+    
+    def test_09_variance_report_uses_live_cost(self):
+        """Le rapport de variance valorise au coût standard courant, même sans mouvement."""
+        inventory = self.env['stockex.stock.inventory'].create({
+            'name': 'TEST-VAL-VARIANCE',
+            'date': date.today(),
+            'location_id': self.location.id,
+            'state': 'done',
+        })
+        self.env['stockex.stock.inventory.line'].create({
+            'inventory_id': inventory.id,
+            'product_id': self.product_1.id,
+            'location_id': self.location.id,
+            'product_qty': 2.0,
+        })
+        Report = self.env['stockex.stock.variance.report']
+        
+        self.env.flush_all()
+        report = Report.search([('inventory_id', '=', inventory.id)])
+        self.assertEqual(report.unit_price, 150.0)
+        self.assertAlmostEqual(report.real_value, 300.0)
+        
+        self.product_1.standard_price = 200.0
+        self.env.flush_all()
+        report.invalidate_recordset()
+        self.assertEqual(report.unit_price, 200.0)
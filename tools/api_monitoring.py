@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Monitoring des appels à l'API REST Stockex
+==========================================
+Chaque appel est ajouté sans attente à un tampon circulaire en mémoire : le
+chemin de la requête ne fait ni écriture en base ni attente de verrou. Un
+thread du worker vide périodiquement le tampon, agrège les appels par
+(endpoint, méthode, minute) et enregistre les minutes terminées dans
+stockex.api.metric (nombre d'appels, latences p50/p95/p99, erreurs, octets
+envoyés), en une création groupée par base.
+"""
+
+import atexit
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from odoo import api, SUPERUSER_ID
+from odoo.http import request
+from odoo.modules.registry import Registry
+
+_logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, ratio):
+    """Percentile (rang le plus proche) d'une liste triée, 0 si vide."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(ratio * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class StockexAPIMonitoring:
+    """Collecte des appels API en mémoire et écriture différée des agrégats par minute."""
+    
+    # Appels conservés en attente d'agrégation (les plus anciens sont perdus au-delà)
+    buffer_size = 20000
+    # Intervalle d'écriture des minutes terminées (secondes)
+    flush_interval = 15
+    
+    def __init__(self):
+        self._buffer = deque(maxlen=self.buffer_size)
+        # Agrégats en cours : {(base, minute epoch, endpoint, méthode): statistiques}
+        self._minutes = {}
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush, True)
+    
+    def log_api_call(self, endpoint, method, user_id=None, ip_address=None, status_code=200,
+                     response_time=0.0, request_data=None, bytes_out=0, db_name=None):
+        """
+        Enregistre un appel API (ajout au tampon, sans accès à la base).
+        
+        Args:
+            endpoint (str): Route appelée (motif de la route, ex: /api/stockex/inventories/<int:inventory_id>)
+            method (str): Méthode HTTP
+            status_code (int): Code de retour HTTP
+            response_time (float): Durée de traitement en secondes
+            bytes_out (int): Taille du corps envoyé
+            db_name (str): Base de données (défaut: base de la requête courante)
+        
+        user_id, ip_address et request_data sont acceptés pour compatibilité
+        mais ne sont pas conservés : seules les mesures agrégées sont écrites.
+        """
+        if db_name is None:
+            try:
+                db_name = request.db
+            except (RuntimeError, AttributeError):
+                db_name = None
+        if not db_name:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self._dropped += 1
+        self._buffer.append((db_name, time.time(), endpoint, method, status_code, response_time, bytes_out or 0))
+        self._ensure_flusher()
+    
+    def pending_count(self):
+        """Appels de ce worker pas encore écrits en base."""
+        return len(self._buffer) + sum(len(stats['latencies']) for stats in list(self._minutes.values()))
+    
+    def _ensure_flusher(self):
+        """Démarre le thread d'écriture du processus courant (workers créés par fork)."""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='stockex-api-monitoring', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                _logger.error(f"❌ Écriture des métriques API en échec: {e}", exc_info=True)
+    
+    def _drain(self):
+        """Agrège les appels du tampon par (base, minute, endpoint, méthode)."""
+        while True:
+            try:
+                db_name, timestamp, endpoint, method, status_code, response_time, bytes_out = self._buffer.popleft()
+            except IndexError:
+                break
+            key = (db_name, int(timestamp // 60) * 60, endpoint, method)
+            stats = self._minutes.get(key)
+            if stats is None:
+                stats = self._minutes[key] = {'latencies': [], 'errors': 0, 'server_errors': 0, 'bytes_out': 0}
+            stats['latencies'].append(response_time * 1000.0)
+            if status_code >= 400:
+                stats['errors'] += 1
+            if status_code >= 500:
+                stats['server_errors'] += 1
+            stats['bytes_out'] += bytes_out
+    
+    def flush(self, force=False):
+        """
+        Écrit les minutes terminées (toutes si force), une création groupée par base.
+        
+        Returns:
+            int: Nombre de lignes d'agrégats écrites
+        """
+        with self._lock:
+            self._drain()
+            current_minute = int(time.time() // 60) * 60
+            vals_by_db = {}
+            for key in [key for key in self._minutes if force or key[1] < current_minute]:
+                db_name, minute, endpoint, method = key
+                stats = self._minutes.pop(key)
+                latencies = sorted(stats['latencies'])
+                vals_by_db.setdefault(db_name, []).append({
+                    'minute': datetime.fromtimestamp(minute, timezone.utc).replace(tzinfo=None),
+                    'endpoint': endpoint,
+                    'method': method,
+                    'call_count': len(latencies),
+                    'error_count': stats['errors'],
+                    'server_error_count': stats['server_errors'],
+                    'latency_p50': percentile(latencies, 0.50),
+                    'latency_p95': percentile(latencies, 0.95),
+                    'latency_p99': percentile(latencies, 0.99),
+                    'latency_max': latencies[-1] if latencies else 0.0,
+                    'bytes_out': stats['bytes_out'],
+                    'worker_pid': os.getpid(),
+                })
+            dropped, self._dropped = self._dropped, 0
+        
+        if dropped:
+            _logger.warning(f"⚠️ {dropped} appel(s) API non mesuré(s) : tampon de monitoring plein")
+        written = 0
+        for db_name, vals_list in vals_by_db.items():
+            try:
+                with Registry(db_name).cursor() as cr:
+                    env = api.Environment(cr, SUPERUSER_ID, {})
+                    env['stockex.api.metric'].create(vals_list)
+                written += len(vals_list)
+            except Exception as e:
+                _logger.warning(f"⚠️ Métriques API non enregistrées ({db_name}): {e}")
+        return written
+
+
+# Instance globale
+stockex_api_monitoring = StockexAPIMonitoring()
@@ -14,9 +14,11 @@ except ImportError:
 
 import hashlib
 import logging
+import time
 from datetime import datetime, timedelta
 from odoo import http
 from odoo.http import request
+from odoo.tools.lru import LRU
 
 _logger = logging.getLogger(__name__)
 
@@ -27,34 +29,44 @@ if not JWT_AVAILABLE:
 class StockexJWTAuth:
     """Gestionnaire d'authentification JWT pour Stockex."""
     
+    # Nombre de jetons vérifiés conservés par worker
+    token_cache_size = 1024
+    
     def __init__(self, secret_key=None):
         """
         Initialise le gestionnaire JWT.
         
         Args:
-            secret_key (str): Clé secrète pour signer les tokens. Si None, utilise la config Odoo.
+            secret_key (str): Clé secrète pour signer les tokens. Si None, une clé est dérivée par base de données.
         """
         self.secret_key = secret_key
-        self._secret_initialized = False
+        # Clé dérivée de chaque base, calculée une seule fois
+        self._secrets = {}
+        # Jetons déjà vérifiés : {(base, jeton): (payload, expiration epoch)}
+        self._token_cache = LRU(self.token_cache_size)
     
-    def _get_odoo_secret(self):
-        """Récupère la clé secrète depuis la configuration Odoo."""
-        # Utilise un hash du mot de passe master Odoo comme clé secrète
+    def _get_db_name(self):
+        """Base de données de la requête courante ('default' hors requête)."""
         try:
             if request and hasattr(request, 'env') and hasattr(request.env, 'cr'):
-                db_name = request.env.cr.dbname
-            else:
-                db_name = 'default'
+                return request.env.cr.dbname
         except (RuntimeError, AttributeError):
-            db_name = 'default'
+            pass
+        return 'default'
+    
+    def _get_odoo_secret(self, db_name):
+        """Clé secrète dérivée du nom de la base."""
         return hashlib.sha256(f"stockex_jwt_{db_name}".encode()).hexdigest()
     
-    def _ensure_secret_key(self):
-        """Initialise la clé secrète si nécessaire."""
-        if not self._secret_initialized:
-            if not self.secret_key:
-                self.secret_key = self._get_odoo_secret()
-            self._secret_initialized = True
+    def _get_secret_key(self, db_name=None):
+        """Clé secrète de la base (clé explicite si fournie au constructeur)."""
+        if self.secret_key:
+            return self.secret_key
+        db_name = db_name or self._get_db_name()
+        secret = self._secrets.get(db_name)
+        if secret is None:
+            secret = self._secrets[db_name] = self._get_odoo_secret(db_name)
+        return secret
     
     def generate_token(self, user_id, expires_in_hours=24):
         """
@@ -71,8 +83,6 @@ class StockexJWTAuth:
             _logger.error("PyJWT n'est pas installé. Impossible de générer un token.")
             return None
         
-        self._ensure_secret_key()
-            
         try:
             payload = {
                 'user_id': user_id,
@@ -81,7 +91,7 @@ class StockexJWTAuth:
                 'iss': 'stockex_api'
             }
             
-            token = jwt.encode(payload, self.secret_key, algorithm='HS256')
+            token = jwt.encode(payload, self._get_secret_key(), algorithm='HS256')
             return token
         except Exception as e:
             _logger.error(f"Erreur génération token JWT: {str(e)}")
@@ -91,6 +101,9 @@ class StockexJWTAuth:
         """
         Vérifie la validité d'un token JWT.
         
+        Un jeton déjà vérifié est servi depuis le cache du worker jusqu'à son
+        expiration, sans nouveau décodage ni vérification de signature.
+        
         Args:
             token (str): Token JWT à vérifier
             
@@ -101,17 +114,33 @@ class StockexJWTAuth:
             _logger.error("PyJWT n'est pas installé. Impossible de vérifier le token.")
             return None
         
-        self._ensure_secret_key()
-            
+        db_name = self._get_db_name()
+        cache_key = (db_name, token)
+        cached = self._token_cache.get(cache_key)
+        if cached:
+            payload, expires_at = cached
+            if expires_at > time.time():
+                return dict(payload)
+            try:
+                del self._token_cache[cache_key]
+            except KeyError:
+                pass
+            _logger.warning("Token JWT expiré")
+            return None
+        
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=['HS256'])
-            return payload
+            payload = jwt.decode(token, self._get_secret_key(db_name), algorithms=['HS256'])
         except jwt.ExpiredSignatureError:
             _logger.warning("Token JWT expiré")
             return None
         except jwt.InvalidTokenError as e:
             _logger.warning(f"Token JWT invalide: {str(e)}")
             return None
+        
+        # Seuls les jetons à expiration sont mis en cache (l'entrée expire avec eux)
+        if payload.get('exp'):
+            self._token_cache[cache_key] = (payload, float(payload['exp']))
+        return dict(payload)
     
     def get_user_from_token(self, token):
         """
@@ -132,8 +161,9 @@ class StockexJWTAuth:
             return None
             
         try:
-            user = request.env['res.users'].sudo().browse(user_id)
-            return user if user.exists() else None
+            # Existence et état actif en cache par worker (invalidé à la désactivation)
+            users = request.env['res.users'].sudo()
+            return users.browse(user_id) if users._stockex_api_user_active(user_id) else None
         except Exception as e:
             _logger.error(f"Erreur récupération utilisateur: {str(e)}")
             return None
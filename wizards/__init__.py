@@ -13,3 +13,4 @@ from . import import_flexible_inventory_wizard
 from . import stock_accounts_config_wizard
 from . import warehouse_valuation_export_wizard
 from . import stock_valuation_date_wizard
+from . import variance_daily_rebuild_wizard
@@ -1,8 +1,7 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api
 from odoo.exceptions import UserError
-import base64
-import io
+import itertools
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -69,77 +68,28 @@ class ImportExcelWizard(models.TransientModel):
         required=True
     )
     
-    def _parse_excel(self):
-        """Parse le fichier Excel et retourne les lignes."""
+    def _open_excel(self):
+        """Ouvre le fichier Excel en flux (voir stockex.import.engine._open_excel)."""
         self.ensure_one()
         
         if not self.file:
             raise UserError("Veuillez sélectionner un fichier Excel.")
         
-        try:
-            # Importer openpyxl
-            try:
-                from openpyxl import load_workbook
-            except ImportError:
-                raise UserError(
-                    "Le module 'openpyxl' n'est pas installé.\n"
-                    "Installez-le avec: pip install openpyxl"
-                )
-            
-            # Décoder le fichier
-            file_content = base64.b64decode(self.file)
-            excel_file = io.BytesIO(file_content)
-            
-            # Charger le workbook
-            wb = load_workbook(excel_file, read_only=True, data_only=True)
-            
-            # Déterminer quelle feuille utiliser
-            if self.auto_detect_sheet or not self.sheet_name:
-                # Utiliser la première feuille disponible
-                sheet_to_use = wb.sheetnames[0]
-                _logger.info(f"📄 Utilisation automatique de la feuille: {sheet_to_use}")
-            else:
-                # Vérifier que la feuille spécifiée existe
-                if self.sheet_name not in wb.sheetnames:
-                    raise UserError(
-                        f"La feuille '{self.sheet_name}' n'existe pas dans le fichier.\n"
-                        f"Feuilles disponibles : {', '.join(wb.sheetnames)}\n\n"
-                        f"💡 Conseil: Cochez 'Détecter automatiquement' pour utiliser la première feuille."
-                    )
-                sheet_to_use = self.sheet_name
-            
-            ws = wb[sheet_to_use]
-            _logger.info(f"✅ Lecture de la feuille: {sheet_to_use}")
-            
-            # Lire les en-têtes (première ligne)
-            headers = []
-            for cell in ws[1]:
-                headers.append(cell.value)
-            
-            # Lire les données
-            lines = []
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                if not any(row):  # Ignorer les lignes vides
-                    continue
-                
-                row_dict = {}
-                for idx, value in enumerate(row):
-                    if idx < len(headers):
-                        row_dict[headers[idx]] = value if value is not None else ''
-                
-                lines.append(row_dict)
-            
-            wb.close()
-            return lines
-            
-        except Exception as e:
-            raise UserError(f"Erreur lors de la lecture du fichier Excel : {str(e)}")
+        # Déterminer quelle feuille utiliser : la première si détection automatique
+        sheet_name = False if self.auto_detect_sheet else self.sheet_name
+        return self.env['stockex.import.engine']._open_excel(
+            self, 'file', sheet_name=sheet_name, strict=True, first_sheet=True,
+        )
 
     def action_preview(self):
         """Prévisualise l'import sans créer de données."""
         self.ensure_one()
         
-        lines = self._parse_excel()
+        # Lire uniquement les premières lignes, le total vient des dimensions de la feuille
+        preview_rows = self.env['stockex.import.engine']._preview_rows
+        with self._open_excel() as source:
+            lines = [line for _row, line in source.rows(limit=preview_rows)]
+            total_lines = max(source.estimated_rows, len(lines))
         
         if not lines:
             raise UserError("Le fichier Excel ne contient aucune ligne de données.")
@@ -150,9 +100,12 @@ class ImportExcelWizard(models.TransientModel):
         
         message = f"📊 Aperçu de l'import\n\n"
         message += f"Feuille : {self.sheet_name}\n"
-        message += f"Total de lignes : {len(lines)}\n"
+        message += f"Total de lignes : {total_lines}\n"
         message += f"Produits uniques : {products_count}\n"
-        message += f"Emplacements uniques : {locations_count}\n\n"
+        message += f"Emplacements uniques : {locations_count}\n"
+        if total_lines > len(lines):
+            message += f"(analyse des {len(lines)} premières lignes)\n"
+        message += "\n"
         
         # Afficher les 5 premières lignes
         message += "Aperçu des 5 premières lignes :\n"
@@ -172,15 +125,107 @@ class ImportExcelWizard(models.TransientModel):
             }
         }
 
+    def action_import_background(self):
+        """Confie l'import à la file de tâches StockEx (gros fichiers)."""
+        self.ensure_one()
+        if not self.file:
+            raise UserError("Veuillez sélectionner un fichier Excel.")
+        job = self.env['stockex.job']._enqueue(
+            self, '_job_import',
+            job_type='excel_import',
+            name=f'Import Excel - {self.filename or self.name}',
+            max_attempts=1,
+        )
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': '⏳ Import planifié',
+                'message': f"L'import de {self.filename or 'ce fichier'} sera exécuté en arrière-plan (tâche #{job.id}).",
+                'type': 'info',
+                'sticky': False,
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }
+    
+    def _job_import(self, job):
+        """Tâche de fond : import du fichier copié avec la tâche (assistant reconstruit, voir stockex.job)."""
+        self.ensure_one()
+        self.action_import()
+    
+    def _get_geolocation_vals(self, line, row_number):
+        """Valeurs de géolocalisation d'un entrepôt à créer, lues dans la ligne Excel."""
+        vals = {}
+        try:
+            lat = line.get('LATITUDE', '') or line.get('Latitude', '')
+            lon = line.get('LONGITUDE', '') or line.get('Longitude', '')
+            if lat and lon:
+                vals['latitude'] = float(str(lat).replace(',', '.'))
+                vals['longitude'] = float(str(lon).replace(',', '.'))
+            
+            # Autres infos de géolocalisation
+            if line.get('VILLE') or line.get('Ville'):
+                vals['city'] = str(line.get('VILLE') or line.get('Ville', '')).strip()
+            if line.get('ADRESSE') or line.get('Adresse'):
+                vals['address'] = str(line.get('ADRESSE') or line.get('Adresse', '')).strip()
+            if line.get('TELEPHONE') or line.get('Téléphone'):
+                vals['phone'] = str(line.get('TELEPHONE') or line.get('Téléphone', '')).strip()
+            if line.get('EMAIL') or line.get('Email'):
+                vals['email'] = str(line.get('EMAIL') or line.get('Email', '')).strip()
+        except Exception as e:
+            _logger.warning(f"Erreur géolocalisation ligne {row_number}: {e}")
+        return vals
+
     def action_import(self):
-        """Importe les données et crée l'inventaire."""
+        """Importe les données et crée l'inventaire.
+        
+        Le fichier est lu en flux et importé par paquets de
+        stockex.import_batch_size lignes (voir _import_rows).
+        """
         self.ensure_one()
+        engine = self.env['stockex.import.engine']
         
-        lines = self._parse_excel()
+        with self._open_excel() as source:
+            chunks = source.chunks(engine._get_batch_size())
+            first_chunk = next(chunks, None)
+            if not first_chunk:
+                raise UserError("Le fichier Excel ne contient aucune ligne de données.")
+            
+            inventory = self._create_import_inventory()
+            
+            # Les lignes sont lues et importées paquet par paquet (mémoire bornée)
+            imported = 0
+            skipped = 0
+            errors_detail = []
+            for chunk in itertools.chain([first_chunk], chunks):
+                chunk_imported, chunk_skipped, chunk_errors = self._import_rows(inventory, chunk)
+                imported += chunk_imported
+                skipped += chunk_skipped
+                errors_detail += chunk_errors
+                _logger.info(f"📊 Import Excel: {imported} ligne(s) importée(s), {skipped} ignorée(s)")
         
-        if not lines:
-            raise UserError("Le fichier Excel ne contient aucune ligne de données.")
+        # Message de confirmation
+        message = f"Import terminé avec succès !\n\n"
+        message += f"✅ Lignes importées : {imported}\n"
+        message += f"⚠️  Lignes ignorées : {skipped}\n"
+        if errors_detail[:5]:
+            message += f"\nPremières erreurs :\n" + "\n".join(errors_detail[:5])
         
+        inventory.write({
+            'description': inventory.description + f"\n\n{message}"
+        })
+        
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'stockex.stock.inventory',
+            'res_id': inventory.id,
+            'view_mode': 'form',
+            'target': 'current',
+            'context': {'form_view_initial_mode': 'edit'}
+        }
+    
+    def _create_import_inventory(self):
+        """Crée l'inventaire brouillon qui reçoit les lignes importées."""
         # Générer un nom unique avec timestamp si nécessaire
         from datetime import datetime
         inventory_name = self.name
@@ -193,7 +238,7 @@ class ImportExcelWizard(models.TransientModel):
             inventory_name = f"{self.name} ({timestamp})"
         
         # Créer l'inventaire
-        inventory = self.env['stockex.stock.inventory'].create({
+        return self.env['stockex.stock.inventory'].create({
             'name': inventory_name,
             'date': self.date,
             'company_id': self.company_id.id,
@@ -201,243 +246,198 @@ class ImportExcelWizard(models.TransientModel):
             'state': 'draft',
             'description': f'Import Excel - {self.filename}'
         })
+    
+    def _import_rows(self, inventory, lines):
+        """Importe un paquet de lignes Excel dans l'inventaire.
+        
+        Le paquet est analysé en une passe, puis produits, catégories,
+        entrepôts et quants sont résolus en masse par le moteur
+        stockex.import.engine et les lignes créées par paquets.
+        
+        Args:
+            lines: liste de couples (numéro de ligne Excel, dict de la ligne)
         
-        # Caches pour éviter les recherches répétées
-        products_cache = {}
-        warehouses_cache = {}
-        parent_warehouses_cache = {}
-        categories_cache = {}
+        Returns:
+            tuple (lignes importées, lignes ignorées, messages d'erreur)
+        """
+        engine = self.env['stockex.import.engine']
+        company = self.company_id
         
         imported = 0
         skipped = 0
         errors_detail = []
         
-        for i, line in enumerate(lines):
+        # 1) Une passe sur le fichier : valeurs nettoyées et données de référence à résoudre
+        rows = []
+        category_keys = {}
+        parent_specs = {}
+        warehouse_specs = {}
+        product_rows = {}
+        for row_number, line in lines:
+            # Extraire les données
+            product_code = str(line.get('CODE PRODUIT', '')).strip()
+            product_name = str(line.get('PRODUIT', '')).strip()
+            location_code = str(line.get('CODE ENTREPOT', '')).strip()
+            location_name = str(line.get('ENTREPOT', '')).strip()
+            parent_location_code = str(line.get('CODE ENTREPOT PARENT', '')).strip()
+            parent_location_name = str(line.get('ENTREPOT PARENT', '')).strip()
+            category_code = str(line.get('CODE CATEGORIE', '')).strip()
+            category_name = str(line.get('CATEGORIE', '')).strip()
+            
+            # Nettoyer la quantité (format anglais: virgule=milliers, point=décimales)
+            quantity_raw = (line.get('QUANTITE') or line.get('QTE') or
+                           line.get('Quantite') or line.get('Quantité') or
+                           line.get('QUANTITY') or line.get('Qte') or '0')
+            quantity_str = str(quantity_raw).strip()
+            
+            # Enlever espaces et virgules (milliers), garder le point (décimal)
+            quantity_str = quantity_str.replace(' ', '').replace(',', '')
             try:
-                # Extraire les données
-                product_code = str(line.get('CODE PRODUIT', '')).strip()
-                product_name = str(line.get('PRODUIT', '')).strip()
-                location_code = str(line.get('CODE ENTREPOT', '')).strip()
-                location_name = str(line.get('ENTREPOT', '')).strip()
-                parent_location_code = str(line.get('CODE ENTREPOT PARENT', '')).strip()
-                parent_location_name = str(line.get('ENTREPOT PARENT', '')).strip()
-                category_code = str(line.get('CODE CATEGORIE', '')).strip()
-                category_name = str(line.get('CATEGORIE', '')).strip()
-                
-                # Nettoyer la quantité (format anglais: virgule=milliers, point=décimales)
-                quantity_raw = (line.get('QUANTITE') or line.get('QTE') or 
-                               line.get('Quantite') or line.get('Quantité') or 
-                               line.get('QUANTITY') or line.get('Qte') or '0')
-                quantity_str = str(quantity_raw).strip()
-                
-                # Enlever espaces et virgules (milliers), garder le point (décimal)
-                quantity_str = quantity_str.replace(' ', '').replace(',', '')
-                try:
-                    quantity = float(quantity_str) if quantity_str and quantity_str not in ['', '-', 'None', '0'] else 0.0
-                except Exception as e:
-                    _logger.warning(f"Erreur parsing quantité ligne {i+2}: '{quantity_raw}' -> '{quantity_str}' : {e}")
-                    quantity = 0.0
-                
-                # Nettoyer le prix (format anglais: virgule=milliers, point=décimales)
-                price_str = str(line.get('COUT UNITAIRE', '0') or line.get('COUT', '0'))
-                price_str = price_str.replace(' ', '').replace(',', '')  # Enlever virgules (milliers)
-                try:
-                    standard_price = float(price_str) if price_str and price_str not in ['', '-', 'None'] else 0.0
-                except:
-                    standard_price = 0.0
-                
-                if not product_code or not location_code:
-                    skipped += 1
-                    continue
-                
-                # Rechercher ou créer la catégorie de produit
-                category_id = None
-                if category_code and category_code not in categories_cache:
-                    category = self.env['product.category'].search([
-                        '|',
-                        ('name', '=', category_name),
-                        ('name', '=', category_code)
-                    ], limit=1)
-                    
-                    if not category and self.create_missing_products:
-                        category = self.env['product.category'].create({
-                            'name': category_name or category_code,
-                        })
-                    
-                    categories_cache[category_code] = category.id if category else False
-                
-                category_id = categories_cache.get(category_code) if category_code else None
-                
-                # Rechercher ou créer l'entrepôt parent
-                parent_warehouse_id = None
-                if parent_location_code and parent_location_code not in parent_warehouses_cache:
-                    parent_warehouse = self.env['stock.warehouse'].search([
-                        '|',
-                        ('code', '=', parent_location_code),
-                        ('name', '=', str(line.get('ENTREPOT PARENT', '')).strip())
-                    ], limit=1)
-                    
-                    if not parent_warehouse and self.create_missing_locations:
-                        # Créer l'entrepôt parent
-                        parent_warehouse = self.env['stock.warehouse'].create({
-                            'name': parent_location_name or parent_location_code,
-                            'code': parent_location_code[:5].upper(),  # Code court pour l'entrepôt
-                            'company_id': self.company_id.id,
-                        })
-                    
-                    parent_warehouses_cache[parent_location_code] = parent_warehouse.id if parent_warehouse else False
-                
-                parent_warehouse_id = parent_warehouses_cache.get(parent_location_code)
-                
-                # Rechercher ou créer l'entrepôt
-                if location_code not in warehouses_cache:
-                    warehouse = self.env['stock.warehouse'].search([
-                        '|',
-                        ('code', '=', location_code),
-                        ('name', '=', str(line.get('ENTREPOT', '')).strip())
-                    ], limit=1)
-                    
-                    if not warehouse and self.create_missing_locations:
-                        # Préparer les valeurs pour l'entrepôt
-                        warehouse_vals = {
-                            'name': location_name or location_code,
-                            'code': location_code[:5].upper(),  # Code court pour l'entrepôt
-                            'company_id': self.company_id.id,
-                            'parent_id': parent_warehouse_id if parent_warehouse_id else False,
-                        }
-                        
-                        # Ajouter la géolocalisation si demandé
-                        if self.import_geolocation:
-                            try:
-                                lat = line.get('LATITUDE', '') or line.get('Latitude', '')
-                                lon = line.get('LONGITUDE', '') or line.get('Longitude', '')
-                                if lat and lon:
-                                    warehouse_vals['latitude'] = float(str(lat).replace(',', '.'))
-                                    warehouse_vals['longitude'] = float(str(lon).replace(',', '.'))
-                                
-                                # Autres infos de géolocalisation
-                                if line.get('VILLE') or line.get('Ville'):
-                                    warehouse_vals['city'] = str(line.get('VILLE') or line.get('Ville', '')).strip()
-                                if line.get('ADRESSE') or line.get('Adresse'):
-                                    warehouse_vals['address'] = str(line.get('ADRESSE') or line.get('Adresse', '')).strip()
-                                if line.get('TELEPHONE') or line.get('Téléphone'):
-                                    warehouse_vals['phone'] = str(line.get('TELEPHONE') or line.get('Téléphone', '')).strip()
-                                if line.get('EMAIL') or line.get('Email'):
-                                    warehouse_vals['email'] = str(line.get('EMAIL') or line.get('Email', '')).strip()
-                            except Exception as e:
-                                _logger.warning(f"Erreur géolocalisation ligne {i+2}: {e}")
-                        
-                        warehouse = self.env['stock.warehouse'].create(warehouse_vals)
-                    
-                    # Stocker l'emplacement de stock de l'entrepôt (lot_stock_id)
-                    warehouses_cache[location_code] = warehouse.lot_stock_id.id if warehouse else False
-                
-                location_id = warehouses_cache.get(location_code)
-                if not location_id:
-                    skipped += 1
-                    errors_detail.append(f"Ligne {i+2}: Entrepôt '{location_code}' non trouvé")
-                    continue
-                
-                # Rechercher ou créer le produit
-                if product_code not in products_cache:
-                    product = self.env['product.product'].search([
-                        ('default_code', '=', product_code)
-                    ], limit=1)
-                    
-                    if not product and self.create_missing_products:
-                        uom_name = str(line.get('UDM', 'PC')).strip()
-                        
-                        # Rechercher l'UdM
-                        uom = self.env['uom.uom'].search([
-                            ('name', 'ilike', uom_name)
-                        ], limit=1)
-                        
-                        if not uom:
-                            uom = self.env.ref('uom.product_uom_unit')
-                        
-                        product = self.env['product.product'].create({
-                            'name': product_name or product_code,
-                            'default_code': product_code,
-                            'type': 'product',
-                            'categ_id': category_id if category_id else self.env.ref('product.product_category_all').id,
-                            'uom_id': uom.id,
-                            'uom_po_id': uom.id,
-                            'standard_price': standard_price,
-                        })
-                    
-                    products_cache[product_code] = product.id if product else False
-                
-                product_id = products_cache.get(product_code)
-                if not product_id:
-                    skipped += 1
-                    errors_detail.append(f"Ligne {i+2}: Produit '{product_code}' non trouvé")
-                    continue
-                
-                # Récupérer le prix du produit existant si pas fourni dans Excel
-                product_obj = self.env['product.product'].browse(product_id)
-                if standard_price <= 0:
-                    standard_price = product_obj.standard_price
-                
-                # Mettre à jour le prix si demandé ET si prix fourni dans Excel
-                elif self.update_product_prices and standard_price > 0:
-                    if product_obj.standard_price != standard_price:
-                        product_obj.write({'standard_price': standard_price})
-                
-                # Récupérer la quantité théorique depuis les quants
-                StockQuant = self.env['stock.quant']
-                quant = StockQuant.search([
-                    ('product_id', '=', product_id),
-                    ('location_id', '=', location_id),
-                    ('company_id', '=', self.company_id.id),
-                ], limit=1)
-                
-                theoretical_qty = 0.0
-                if quant:
-                    theoretical_qty = quant.quantity - quant.reserved_quantity
-                
-                # Log pour debug
-                _logger.info(
-                    f"Import ligne {i+2}: Produit={product_code}, "
-                    f"Qté théo={theoretical_qty}, Qté réelle={quantity}, Prix={standard_price}"
-                )
-                
-                # Créer la ligne d'inventaire avec quantité théorique ET prix unitaire
-                self.env['stockex.stock.inventory.line'].create({
-                    'inventory_id': inventory.id,
-                    'product_id': product_id,
-                    'location_id': location_id,
-                    'product_qty': quantity,
-                    'theoretical_qty': theoretical_qty,
-                    'standard_price': standard_price,
-                })
-                
-                imported += 1
-                
-                # Commit par batch tous les 500 enregistrements
-                if imported % 500 == 0:
-                    self.env.cr.commit()
-                    
+                quantity = float(quantity_str) if quantity_str and quantity_str not in ['', '-', 'None', '0'] else 0.0
             except Exception as e:
+                _logger.warning(f"Erreur parsing quantité ligne {row_number}: '{quantity_raw}' -> '{quantity_str}' : {e}")
+                quantity = 0.0
+            
+            # Nettoyer le prix (format anglais: virgule=milliers, point=décimales)
+            price_str = str(line.get('COUT UNITAIRE', '0') or line.get('COUT', '0'))
+            price_str = price_str.replace(' ', '').replace(',', '')  # Enlever virgules (milliers)
+            try:
+                standard_price = float(price_str) if price_str and price_str not in ['', '-', 'None'] else 0.0
+            except:
+                standard_price = 0.0
+            
+            if not product_code or not location_code:
                 skipped += 1
-                errors_detail.append(f"Ligne {i+2}: {str(e)}")
-                _logger.error(f"Erreur ligne {i+2}: {str(e)}")
+                continue
+            
+            if category_code:
+                category_keys.setdefault(category_code, (category_name, category_code))
+            
+            if parent_location_code and parent_location_code not in parent_specs:
+                parent_specs[parent_location_code] = {
+                    'name': parent_location_name,
+                    'code': parent_location_code,
+                    'vals': {
+                        'name': parent_location_name or parent_location_code,
+                        'code': parent_location_code[:5].upper(),  # Code court pour l'entrepôt
+                        'company_id': company.id,
+                    },
+                }
+            
+            if location_code not in warehouse_specs:
+                warehouse_vals = {
+                    'name': location_name or location_code,
+                    'code': location_code[:5].upper(),  # Code court pour l'entrepôt
+                    'company_id': company.id,
+                }
+                # Ajouter la géolocalisation si demandé
+                if self.import_geolocation:
+                    warehouse_vals.update(self._get_geolocation_vals(line, row_number))
+                warehouse_specs[location_code] = {
+                    'name': location_name,
+                    'code': location_code,
+                    'parent': parent_location_code,
+                    'vals': warehouse_vals,
+                }
+            
+            product_rows.setdefault(product_code, {
+                'name': product_name or product_code,
+                'uom': str(line.get('UDM', 'PC')).strip(),
+                'category': category_code,
+                'price': standard_price,
+            })
+            
+            rows.append({
+                'row': row_number,
+                'product_code': product_code,
+                'location_code': location_code,
+                'quantity': quantity,
+                'price': standard_price,
+            })
         
-        # Message de confirmation
-        message = f"Import terminé avec succès !\n\n"
-        message += f"✅ Lignes importées : {imported}\n"
-        message += f"⚠️  Lignes ignorées : {skipped}\n"
-        if errors_detail[:5]:
-            message += f"\nPremières erreurs :\n" + "\n".join(errors_detail[:5])
+        # 2) Résolution en masse : catégories (par nom ou code), entrepôts parents puis entrepôts
+        found = engine._map_categories({name for pair in category_keys.values() for name in pair if name})
+        missing = {name or code for name, code in category_keys.values() if not (found.get(name) or found.get(code))}
+        if missing and self.create_missing_products:
+            found.update(engine._map_categories(missing, create=True))
+        categories = {
+            code: found.get(name) or found.get(code) or found.get(name or code)
+            for code, (name, _code) in category_keys.items()
+        }
+        parents = engine._map_warehouses(parent_specs, create=self.create_missing_locations)
+        for spec in warehouse_specs.values():
+            parent = parents.get(spec.pop('parent'))
+            spec['vals']['parent_id'] = parent.id if parent else False
+        warehouses = engine._map_warehouses(warehouse_specs, create=self.create_missing_locations)
         
-        inventory.write({
-            'description': inventory.description + f"\n\n{message}"
-        })
+        # 3) Produits : recherche groupée par code, création des manquants par lots
+        default_category = self.env.ref('product.product_category_all')
+        uoms = {}
+        product_specs = {}
+        for product_code, data in product_rows.items():
+            if data['uom'] not in uoms:
+                # Rechercher l'UdM
+                uoms[data['uom']] = self.env['uom.uom'].search([
+                    ('name', 'ilike', data['uom'])
+                ], limit=1) or self.env.ref('uom.product_uom_unit')
+            uom = uoms[data['uom']]
+            category = categories.get(data['category']) if data['category'] else None
+            product_specs[product_code] = {
+                'name': data['name'],
+                'default_code': product_code,
+                'type': 'product',
+                'categ_id': category.id if category else default_category.id,
+                'uom_id': uom.id,
+                'uom_po_id': uom.id,
+                'standard_price': data['price'],
+            }
+        products, product_errors = engine._map_products(product_specs, create=self.create_missing_products)
         
-        return {
-            'type': 'ir.actions.act_window',
-            'res_model': 'stockex.stock.inventory',
-            'res_id': inventory.id,
-            'view_mode': 'form',
-            'target': 'current',
-            'context': {'form_view_initial_mode': 'edit'}
-        }
+        # Mettre à jour les prix si demandé ET si prix fourni dans Excel (un write par prix)
+        if self.update_product_prices:
+            engine._write_grouped({
+                products[row['product_code']]: row['price']
+                for row in rows
+                if row['price'] > 0 and row['product_code'] in products
+            }, 'standard_price')
+        
+        # 4) Quantités théoriques : quants de tous les couples produit/emplacement en une requête
+        locations = {code: warehouse.lot_stock_id.id for code, warehouse in warehouses.items()}
+        quants = engine._map_quants([
+            (products[row['product_code']].id, locations[row['location_code']])
+            for row in rows
+            if row['product_code'] in products and locations.get(row['location_code'])
+        ], company)
+        
+        # 5) Lignes d'inventaire créées par paquets
+        vals_list = []
+        row_numbers = []
+        for row in rows:
+            location_id = locations.get(row['location_code'])
+            if not location_id:
+                skipped += 1
+                errors_detail.append(f"Ligne {row['row']}: Entrepôt '{row['location_code']}' non trouvé")
+                continue
+            
+            product = products.get(row['product_code'])
+            if not product:
+                skipped += 1
+                reason = product_errors.get(row['product_code']) or 'non trouvé'
+                errors_detail.append(f"Ligne {row['row']}: Produit '{row['product_code']}' {reason}")
+                continue
+            
+            quant = quants.get((product.id, location_id))
+            vals_list.append({
+                'inventory_id': inventory.id,
+                'product_id': product.id,
+                'location_id': location_id,
+                'product_qty': row['quantity'],
+                'theoretical_qty': quant['available'] if quant else 0.0,
+            })
+            row_numbers.append(row['row'])
+        
+        created_lines, line_errors = engine._create_inventory_lines(vals_list, row_numbers)
+        imported = len(created_lines)
+        skipped += len(line_errors)
+        errors_detail += line_errors
+        return imported, skipped, errors_detail
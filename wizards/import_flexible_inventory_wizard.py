@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import base64
-import io
 import logging
 
 from odoo import models, fields, api
@@ -166,68 +164,32 @@ class ImportFlexibleInventoryWizard(models.TransientModel):
         
         return mapping
 
-    def _parse_excel_file(self, preview_mode=False):
-        """Parse un fichier Excel et retourne les données.
-        
-        Args:
-            preview_mode: Si True, limite la lecture pour économiser la mémoire
-        """
-        try:
-            import openpyxl
-        except ImportError:
-            raise UserError("La bibliothèque openpyxl n'est pas installée.")
-        
+    def _open_excel(self):
+        """Ouvre le fichier Excel en flux (voir stockex.import.engine._open_excel)."""
         if not self.file:
             raise UserError("Veuillez sélectionner un fichier.")
         
+        return self.env['stockex.import.engine']._open_excel(
+            self, 'file', empty_value=None, skip_empty=False,
+        )
+    
+    def _parse_excel_file(self):
+        """Lit les en-têtes et les premières lignes du fichier pour la prévisualisation.
+        
+        Seules les colonnes reconnues sont conservées ; le nombre total de
+        lignes est estimé d'après les dimensions de la feuille.
+        """
+        engine = self.env['stockex.import.engine']
         try:
-            # Décoder le fichier
-            file_data = base64.b64decode(self.file)
-            file_obj = io.BytesIO(file_data)
-            
-            # Ouvrir le workbook en mode read_only pour économiser la mémoire
-            wb = openpyxl.load_workbook(file_obj, data_only=True, read_only=True)
-            ws = wb.active
-            
-            # Lire les en-têtes
-            headers = []
-            first_row = next(ws.iter_rows(min_row=1, max_row=1, values_only=True))
-            headers = list(first_row)
-            
-            # Détecter les colonnes
-            mapping = self._get_column_mapping(headers)
-            
-            # Identifier les colonnes utiles à garder
-            useful_cols = set()
-            for key, col_name in mapping.items():
-                if col_name in headers:
-                    useful_cols.add(headers.index(col_name))
-            
-            # Lire les données (optimisé)
-            data = []
-            max_rows = 100 if preview_mode else None  # Limiter en mode preview
-            
-            for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=1):
-                if preview_mode and idx > max_rows:
-                    break
+            with self._open_excel() as source:
+                headers = source.headers
                 
-                # Ne garder que les colonnes utiles
-                row_data = {}
-                for col_idx, value in enumerate(row):
-                    if col_idx < len(headers) and (not preview_mode or col_idx in useful_cols):
-                        header = headers[col_idx]
-                        if header:
-                            row_data[header] = value
+                # Détecter les colonnes et ne garder que les colonnes utiles
+                mapping = self._get_column_mapping(headers)
+                source.columns = set(mapping.values())
                 
-                data.append(row_data)
-            
-            # Compter le nombre total de lignes si en mode preview
-            total_lines = len(data)
-            if preview_mode:
-                # Estimation du nombre total
-                total_lines = ws.max_row - 1 if ws.max_row else len(data)
-            
-            wb.close()
+                data = [line for _row, line in source.rows(limit=engine._preview_rows)]
+                total_lines = max(source.estimated_rows, len(data))
             
             return {
                 'headers': headers,
@@ -235,7 +197,9 @@ class ImportFlexibleInventoryWizard(models.TransientModel):
                 'data': data,
                 'total_lines': total_lines,
             }
-            
+        
+        except UserError:
+            raise
         except MemoryError:
             raise UserError("Le fichier est trop volumineux. Veuillez réduire sa taille ou contacter l'administrateur.")
         except Exception as e:
@@ -245,8 +209,8 @@ class ImportFlexibleInventoryWizard(models.TransientModel):
         """Prévisualise les données avant import."""
         self.ensure_one()
         
-        # Parser le fichier en mode preview (limité pour économiser la mémoire)
-        parsed = self._parse_excel_file(preview_mode=True)
+        # Lire uniquement les premières lignes (mémoire bornée)
+        parsed = self._parse_excel_file()
         mapping = parsed['mapping']
         data = parsed['data']
         
@@ -404,41 +368,56 @@ class ImportFlexibleInventoryWizard(models.TransientModel):
         import json
         preview = json.loads(self.preview_data)
         mapping = preview['mapping']
-        warehouses = preview.get('warehouses', [])
-        
-        # Re-parser le fichier complet (car données non stockées en preview)
-        _logger.info("Re-parsing du fichier Excel pour l'import...")
-        parsed = self._parse_excel_file()
-        data = parsed['data']
-        _logger.info(f"Fichier parsé: {len(data)} lignes")
-        
-        created_inventories = []
+        warehouse_column = mapping.get('warehouse')
+        batch_size = self.env['stockex.import.engine']._get_batch_size()
         
-        if self.multi_warehouse_mode == 'global' or not warehouses:
-            # Mode global : 1 seul inventaire
-            inventory = self._create_inventory_from_data(
-                name=self.name,
-                data=data,
-                mapping=mapping,
-            )
-            created_inventories.append(inventory)
-        else:
-            # Mode split : 1 inventaire par entrepôt
-            for warehouse_name in warehouses:
-                # Filtrer les données pour cet entrepôt
-                warehouse_data = [
-                    line for line in data
-                    if line.get(mapping.get('warehouse')) == warehouse_name
-                ]
+        with self._open_excel() as source:
+            # Première passe sur la seule colonne entrepôt : entrepôts présents et fréquences
+            warehouse_counts = {}
+            if warehouse_column:
+                source.columns = {warehouse_column}
+                for _row, line in source.rows():
+                    wh_name = line.get(warehouse_column, 'Stock')
+                    warehouse_counts[wh_name] = warehouse_counts.get(wh_name, 0) + 1
+                source.columns = None
+            warehouses = [wh for wh in warehouse_counts if wh]
+            split = self.multi_warehouse_mode != 'global' and bool(warehouses)
+            
+            # Seconde passe : lignes lues et importées par paquets (mémoire bornée)
+            _logger.info(f"Import du fichier Excel par paquets de {batch_size} lignes...")
+            inventories = {}
+            results = {}
+            for chunk in source.chunks(batch_size):
+                if split:
+                    # Mode split : 1 inventaire par entrepôt
+                    groups = {}
+                    for row_number, line in chunk:
+                        wh_name = line.get(warehouse_column)
+                        if wh_name in warehouse_counts and wh_name:
+                            groups.setdefault(wh_name, []).append((row_number, line))
+                else:
+                    # Mode global : 1 seul inventaire
+                    groups = {None: chunk}
                 
-                if warehouse_data:
-                    inventory = self._create_inventory_from_data(
-                        name=f"{self.name} - {warehouse_name}",
-                        data=warehouse_data,
-                        mapping=mapping,
-                        warehouse_filter=warehouse_name,
-                    )
-                    created_inventories.append(inventory)
+                for wh_name, rows in groups.items():
+                    if wh_name not in inventories:
+                        inventories[wh_name] = self._create_import_inventory(
+                            name=f"{self.name} - {wh_name}" if split else self.name,
+                            mapping=mapping,
+                            warehouse_filter=str(wh_name) if split else None,
+                            warehouse_counts=warehouse_counts,
+                        )
+                        results[wh_name] = [0, []]
+                    created_count, errors = self._import_inventory_rows(inventories[wh_name], rows, mapping)
+                    results[wh_name][0] += created_count
+                    results[wh_name][1] += errors
+        
+        created_inventories = [
+            self._finish_inventory_import(inventory, *results[wh_name])
+            for wh_name, inventory in inventories.items()
+        ]
+        if not created_inventories:
+            raise UserError("Le fichier Excel ne contient aucune ligne de données.")
         
         # Afficher le(s) inventaire(s) créé(s)
         if len(created_inventories) == 1:
@@ -483,8 +462,13 @@ class ImportFlexibleInventoryWizard(models.TransientModel):
         
         return child_location or parent_location
     
-    def _create_inventory_from_data(self, name, data, mapping, warehouse_filter=None):
-        """Crée un inventaire à partir des données parsées."""
+    def _create_import_inventory(self, name, mapping, warehouse_filter=None, warehouse_counts=None):
+        """Crée l'inventaire qui reçoit les lignes importées.
+        
+        Args:
+            warehouse_filter: entrepôt de l'inventaire (mode split)
+            warehouse_counts: dict {entrepôt: nombre de lignes} du fichier
+        """
         # Générer un nom unique
         base_name = name
         counter = 1
@@ -515,11 +499,6 @@ class ImportFlexibleInventoryWizard(models.TransientModel):
             _logger.info(f"📍 Entrepôt manuel sélectionné: {inventory_warehouse.name}")
         elif 'warehouse' in mapping:
             # Déterminer l'entrepôt le plus fréquent dans les données
-            warehouse_counts = {}
-            for line in data:
-                wh_name = line.get(mapping.get('warehouse'), 'Stock')
-                warehouse_counts[wh_name] = warehouse_counts.get(wh_name, 0) + 1
-            
             if warehouse_counts:
                 # Prendre l'entrepôt le plus fréquent
                 main_warehouse_name = max(warehouse_counts, key=warehouse_counts.get)
@@ -546,12 +525,27 @@ class ImportFlexibleInventoryWizard(models.TransientModel):
             inventory_vals['warehouse_id'] = inventory_warehouse.id
             _logger.info(f"📦 Inventaire créé avec entrepôt: {inventory_warehouse.name}")
         
-        inventory = self.env['stockex.stock.inventory'].create(inventory_vals)
+        return self.env['stockex.stock.inventory'].create(inventory_vals)
+    
+    def _import_inventory_rows(self, inventory, data, mapping):
+        """Importe un paquet de lignes dans l'inventaire.
+        
+        Catégories, produits, entrepôts, emplacements et quants sont résolus
+        en masse par stockex.import.engine avant la création des lignes par paquets.
+        
+        Args:
+            data: liste de couples (numéro de ligne Excel, dict de la ligne)
         
-        created_count = 0
+        Returns:
+            tuple (nombre de lignes créées, messages d'erreur)
+        """
+        engine = self.env['stockex.import.engine']
         errors = []
         
-        for i, line in enumerate(data):
+        # 1) Une passe sur les données : valeurs nettoyées et données de référence à résoudre
+        rows = []
+        product_rows = {}
+        for row_number, line in data:
             try:
                 # Extraire les données
                 code = str(line.get(mapping['code'], '')).strip()
@@ -562,181 +556,139 @@ class ImportFlexibleInventoryWizard(models.TransientModel):
                 quantity = float(line.get(mapping.get('quantity'), 0) or 0)
                 price = float(line.get(mapping.get('price'), self.default_price) or self.default_price)
                 category_name = line.get(mapping.get('category'))
-                
-                # Déterminer l'entrepôt : priorité au fichier, puis au champ manuel
-                if 'warehouse' in mapping:
-                    warehouse_name = line.get(mapping.get('warehouse'), 'Stock')
-                elif self.manual_warehouse_id:
-                    warehouse_name = self.manual_warehouse_id.name
-                else:
-                    warehouse_name = 'Stock'
-                
-                # Rechercher ou créer le produit
-                product = self.env['product.product'].search([
-                    ('default_code', '=', code)
-                ], limit=1)
-                
-                # Gérer la catégorie
-                category = None
-                if category_name and self.create_categories:
-                    category = self.env['product.category'].search([
-                        ('name', '=', str(category_name))
-                    ], limit=1)
-                    
-                    if not category:
-                        category = self.env['product.category'].create({
-                            'name': str(category_name)
-                        })
-                
-                if not product and self.create_products:
-                    # Type = consu (Biens/Goods) pour suivi par quantité
-                    product_vals = {
-                        'name': str(name_product),
-                        'default_code': code,
-                        'type': 'consu',  # Type = Biens/Goods
-                        'is_storable': True,  # ✅ Cocher "Suivre l'inventaire"
-                        'standard_price': price,
-                    }
-                    
-                    if category:
-                        product_vals['categ_id'] = category.id
-                    
-                    product = self.env['product.product'].create(product_vals)
-                    _logger.info(f"✅ Produit créé: {code} - {name_product} (type: consu - Biens/Goods)")
-                elif product:
-                    # Mettre à jour la catégorie et le prix si demandé
-                    update_vals = {}
-                    if category and product.categ_id.id != category.id:
-                        update_vals['categ_id'] = category.id
-                    if self.update_prices and price > 0:
-                        update_vals['standard_price'] = price
-                    if update_vals:
-                        product.write(update_vals)
-                        if 'standard_price' in update_vals:
-                            _logger.info(f"✅ Prix mis à jour pour {code}: {price}")
-                
-                if not product:
-                    errors.append(f"Ligne {i+2}: Produit '{code}' non trouvé")
-                    continue
-                
-                # Vérifier et convertir en type 'consu' (Biens/Goods) si nécessaire
-                # Type = consu (Biens/Goods) → Suivi d'inventaire par quantité
-                if product.type != 'consu' or not product.is_storable:
-                    _logger.warning(f"⚠️ Produit {code} n'est pas correctement configuré. Type: {product.type}, Suivre inventaire: {product.is_storable}. Correction...")
-                    product.write({
-                        'type': 'consu',  # Convertir en Biens/Goods
-                        'is_storable': True,  # ✅ Cocher "Suivre l'inventaire"
-                    })
-                    _logger.info(f"✅ Produit {code}: Converti en type Biens/Goods (consu) avec suivi d'inventaire activé")
-                
-                # Gérer l'entrepôt (colonne MAGASIN)
-                warehouse = self.env['stock.warehouse'].search([
-                    '|',
-                    ('name', '=', warehouse_name),
-                    ('code', '=', warehouse_name[:5].upper())
-                ], limit=1)
-                
-                if not warehouse and self.create_warehouses:
-                    try:
-                        # Utiliser un savepoint pour éviter d'annuler toute la transaction
-                        savepoint_name = f'warehouse_create_{i}'
-                        self.env.cr.execute(f'SAVEPOINT {savepoint_name}')
-                        
-                        warehouse = self.env['stock.warehouse'].create({
-                            'name': warehouse_name,
-                            'code': warehouse_name[:5].upper(),
-                        })
-                        
-                        self.env.cr.execute(f'RELEASE SAVEPOINT {savepoint_name}')
-                        _logger.info(
-                            f"✅ Entrepôt créé: {warehouse_name} "
-                            f"(code: {warehouse.code}, stock: {warehouse.lot_stock_id.complete_name})"
-                        )
-                        
-                    except Exception as wh_error:
-                        # Rollback au savepoint pour continuer
-                        self.env.cr.execute(f'ROLLBACK TO SAVEPOINT {savepoint_name}')
-                        _logger.warning(f"⚠️ Erreur création entrepôt {warehouse_name}: {wh_error}")
-                        
-                        # Retry recherche (peut exister avec un code différent)
-                        warehouse = self.env['stock.warehouse'].search([
-                            '|',
-                            ('name', '=', warehouse_name),
-                            ('code', 'ilike', warehouse_name[:5])
-                        ], limit=1)
-                
-                if not warehouse:
-                    errors.append(f"Ligne {i+2}: Entrepôt '{warehouse_name}' non trouvé")
-                    continue
-                
-                # ✅ POINT CLÉ: Utiliser l'emplacement stock de l'entrepôt comme parent
-                parent_location = warehouse.lot_stock_id
-                
-                # Gérer l'emplacement enfant (colonne EMPLACEMENT du fichier Kobo)
-                # Si un emplacement est spécifié, le créer sous l'entrepôt
-                location = parent_location
-                
-                # Chercher l'emplacement dans les différentes colonnes possibles
-                location_name = None
-                for loc_key in ['sub_location', 'aisle', 'rack']:
-                    if loc_key in mapping:
-                        loc_val = line.get(mapping[loc_key])
-                        if loc_val and str(loc_val).strip():
-                            location_name = str(loc_val).strip()
-                            break
-                
-                # Si un emplacement est trouvé, créer/trouver sous l'entrepôt
-                if location_name:
-                    location = self._get_or_create_child_location(
-                        parent_location, 
-                        location_name
-                    )
-                    _logger.info(
-                        f"📏 Ligne {i+2}: {warehouse_name}/{location_name} "
-                        f"(ID: {location.id}, Parent: {parent_location.complete_name})"
-                    )
-                else:
-                    _logger.info(
-                        f"📏 Ligne {i+2}: {warehouse_name}/Stock (pas d'emplacement spécifique)"
-                    )
-                
-                # Récupérer la quantité théorique depuis les quants
-                StockQuant = self.env['stock.quant']
-                quant = StockQuant.search([
-                    ('product_id', '=', product.id),
-                    ('location_id', '=', location.id),
-                    ('company_id', '=', inventory.company_id.id),
-                ], limit=1)
-                
-                theoretical_qty = 0.0
-                if quant:
-                    theoretical_qty = quant.quantity - quant.reserved_quantity
-                
-                # Récupérer le prix du produit si pas fourni dans Excel
-                if price <= 0:
-                    price = product.standard_price
-                
-                # Log pour debug
-                _logger.info(
-                    f"Import ligne {i+2}: Produit={code}, "
-                    f"Qté théo={theoretical_qty}, Qté réelle={quantity}, Prix={price}"
-                )
-                
-                # Créer la ligne d'inventaire avec quantité théorique ET prix unitaire
-                self.env['stockex.stock.inventory.line'].create({
-                    'inventory_id': inventory.id,
-                    'product_id': product.id,
-                    'location_id': location.id,
-                    'product_qty': quantity,
-                    'theoretical_qty': theoretical_qty,
-                    'standard_price': price,
-                })
-                created_count += 1
-                
             except Exception as e:
-                errors.append(f"Ligne {i+2}: {str(e)}")
-                _logger.error(f"Erreur ligne {i+2}: {e}")
+                errors.append(f"Ligne {row_number}: {str(e)}")
+                _logger.error(f"Erreur ligne {row_number}: {e}")
+                continue
+            
+            # Déterminer l'entrepôt : priorité au fichier, puis au champ manuel
+            if 'warehouse' in mapping:
+                warehouse_name = line.get(mapping.get('warehouse'), 'Stock')
+            elif self.manual_warehouse_id:
+                warehouse_name = self.manual_warehouse_id.name
+            else:
+                warehouse_name = 'Stock'
+            
+            # Chercher l'emplacement dans les différentes colonnes possibles
+            location_name = None
+            for loc_key in ['sub_location', 'aisle', 'rack']:
+                if loc_key in mapping:
+                    loc_val = line.get(mapping[loc_key])
+                    if loc_val and str(loc_val).strip():
+                        location_name = str(loc_val).strip()
+                        break
+            
+            product_rows.setdefault(code, {'name': str(name_product), 'price': price})
+            rows.append({
+                'row': row_number,
+                'code': code,
+                'quantity': quantity,
+                'price': price,
+                'category': str(category_name) if category_name and self.create_categories else None,
+                'warehouse': warehouse_name,
+                'location': location_name,
+            })
+        
+        # 2) Catégories et produits : recherche groupée, création des manquants par lots
+        categories = engine._map_categories({row['category'] for row in rows}, create=True)
+        row_categories = {row['code']: categories.get(row['category']) for row in rows if row['category']}
+        
+        product_specs = {}
+        for code, product_data in product_rows.items():
+            # Type = consu (Biens/Goods) pour suivi par quantité
+            product_specs[code] = {
+                'name': product_data['name'],
+                'default_code': code,
+                'type': 'consu',  # Type = Biens/Goods
+                'is_storable': True,  # ✅ Cocher "Suivre l'inventaire"
+                'standard_price': product_data['price'],
+            }
+            if row_categories.get(code):
+                product_specs[code]['categ_id'] = row_categories[code].id
+        existing, _errors = engine._map_products(product_specs)
+        products = dict(existing)
+        created, product_errors = engine._map_products(
+            {code: vals for code, vals in product_specs.items() if code not in existing},
+            create=self.create_products,
+        )
+        products.update(created)
+        
+        # Mettre à jour la catégorie et le prix des produits existants si demandé
+        engine._write_grouped({
+            existing[code]: category.id
+            for code, category in row_categories.items()
+            if category and code in existing
+        }, 'categ_id')
+        if self.update_prices:
+            updated = engine._write_grouped({
+                existing[row['code']]: row['price']
+                for row in rows
+                if row['price'] > 0 and row['code'] in existing
+            }, 'standard_price')
+            if updated:
+                _logger.info(f"✅ Prix mis à jour pour {updated} produit(s)")
+        
+        # Type = consu (Biens/Goods) → Suivi d'inventaire par quantité
+        engine._ensure_storable(self.env['product.product'].concat(*products.values()))
+        
+        # 3) Entrepôts (colonne MAGASIN) puis emplacements enfants (colonne EMPLACEMENT)
+        warehouses = engine._map_warehouses({
+            wh: {'name': wh, 'code': wh[:5].upper(), 'vals': {'name': wh, 'code': wh[:5].upper()}}
+            for wh in {row['warehouse'] for row in rows}
+        }, create=self.create_warehouses)
+        # ✅ POINT CLÉ: Utiliser l'emplacement stock de l'entrepôt comme parent
+        child_locations = engine._map_child_locations([
+            (warehouses[row['warehouse']].lot_stock_id, row['location'])
+            for row in rows
+            if row['location'] and row['warehouse'] in warehouses
+        ], create=self.create_locations)
+        
+        # 4) Lignes d'inventaire : quantités théoriques en une requête, création par paquets
+        resolved = []
+        for row in rows:
+            product = products.get(row['code'])
+            if not product:
+                reason = product_errors.get(row['code']) or 'non trouvé'
+                errors.append(f"Ligne {row['row']}: Produit '{row['code']}' {reason}")
+                continue
+            
+            warehouse = warehouses.get(row['warehouse'])
+            if not warehouse:
+                errors.append(f"Ligne {row['row']}: Entrepôt '{row['warehouse']}' non trouvé")
+                continue
+            
+            parent_location = warehouse.lot_stock_id
+            location = child_locations.get((parent_location.id, row['location'])) or parent_location
+            resolved.append((row, product, location))
+        
+        quants = engine._map_quants(
+            [(product.id, location.id) for _row, product, location in resolved],
+            inventory.company_id,
+        )
+        
+        vals_list = []
+        row_numbers = []
+        for row, product, location in resolved:
+            quant = quants.get((product.id, location.id))
+            # Récupérer le prix du produit si pas fourni dans Excel
+            price = row['price'] if row['price'] > 0 else product.standard_price
+            # Créer la ligne d'inventaire avec quantité théorique ET prix unitaire
+            vals_list.append({
+                'inventory_id': inventory.id,
+                'product_id': product.id,
+                'location_id': location.id,
+                'product_qty': row['quantity'],
+                'theoretical_qty': quant['available'] if quant else 0.0,
+                'standard_price': price,
+            })
+            row_numbers.append(row['row'])
         
+        created_lines, line_errors = engine._create_inventory_lines(vals_list, row_numbers)
+        errors += line_errors
+        return len(created_lines), errors
+    
+    def _finish_inventory_import(self, inventory, created_count, errors):
+        """Publie le récapitulatif de l'import et envoie les notifications."""
         # Message récapitulatif
         message = f"✅ Import terminé : {created_count} ligne(s) créée(s)"
         if errors:
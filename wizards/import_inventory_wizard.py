@@ -234,7 +234,12 @@ class ImportInventoryWizard(models.TransientModel):
         }
 
     def action_import(self):
-        """Lance l'import réel des données."""
+        """Lance l'import réel des données.
+        
+        Le fichier est analysé en une passe, puis produits et entrepôts sont
+        résolus en masse par le moteur stockex.import.engine et les lignes
+        créées par paquets.
+        """
         self.ensure_one()
         
         if not self.preview_done:
@@ -257,144 +262,138 @@ class ImportInventoryWizard(models.TransientModel):
             'description': f'Import CSV - {self.filename}\nLignes importées : {len(lines)}'
         })
         
-        # Dictionnaires de cache
-        warehouses_cache = {}
-        products_cache = {}
-        parent_warehouses_cache = {}
+        engine = self.env['stockex.import.engine']
+        company = self.env.company
         
         imported = 0
         skipped = 0
         errors_detail = []
         
+        # 1) Une passe sur le fichier : valeurs nettoyées et données de référence à résoudre
+        rows = []
+        warehouse_specs = {}
+        product_rows = {}
         for i, line in enumerate(lines):
-            try:
-                # Extraire les données
-                product_code = line.get('product_default_code', '').strip()
-                product_name = line.get('product_id', '').strip()
-                warehouse_name = line.get('wharehouse', '').strip()
-                quantity = self._clean_number(line.get('quantity', '0'))
-                standard_price = self._clean_number(line.get('standard_price', '0'))
-                uom_name = line.get('uom', 'PC').strip()
-                
-                # Vérifier les données obligatoires (accepter quantité 0)
-                if not product_code or not warehouse_name:
-                    skipped += 1
-                    errors_detail.append(f"Ligne {i+2}: Produit ou emplacement manquant")
-                    continue
-                
+            # Extraire les données
+            product_code = line.get('product_default_code', '').strip()
+            product_name = line.get('product_id', '').strip()
+            warehouse_name = line.get('wharehouse', '').strip()
+            quantity = self._clean_number(line.get('quantity', '0'))
+            standard_price = self._clean_number(line.get('standard_price', '0'))
+            uom_name = line.get('uom', 'PC').strip()
+            
+            # Vérifier les données obligatoires (accepter quantité 0)
+            if not product_code or not warehouse_name:
+                skipped += 1
+                errors_detail.append(f"Ligne {i+2}: Produit ou emplacement manquant")
+                continue
+            
+            if warehouse_name not in warehouse_specs:
                 # Récupérer les infos de l'emplacement parent
                 parent_location_code = line.get('wh_type_code', '').strip()
                 parent_location_name = line.get('wh_type_id', '').strip()
                 wh_code = line.get('wh_code', '').strip()
-                
-                # Récupérer ou créer l'entrepôt
-                if warehouse_name not in warehouses_cache:
-                    # Rechercher l'entrepôt par code ou nom
-                    warehouse = self.env['stock.warehouse'].search([
-                        '|',
-                        ('code', '=', wh_code if wh_code else warehouse_name[:5].upper()),
-                        ('name', '=', warehouse_name)
-                    ], limit=1)
-                    
-                    if not warehouse and self.create_missing_locations:
-                        # Créer ou récupérer l'entrepôt parent
-                        parent_warehouse_id = None
-                        if parent_location_code and parent_location_name:
-                            if parent_location_code not in parent_warehouses_cache:
-                                parent_warehouse = self.env['stock.warehouse'].search([
-                                    '|',
-                                    ('code', '=', parent_location_code),
-                                    ('name', '=', parent_location_name)
-                                ], limit=1)
-                                
-                                if not parent_warehouse:
-                                    # Créer l'entrepôt parent
-                                    parent_warehouse = self.env['stock.warehouse'].create({
-                                        'name': parent_location_name,
-                                        'code': parent_location_code[:5].upper(),
-                                        'company_id': self.env.company.id,
-                                    })
-                                
-                                parent_warehouses_cache[parent_location_code] = parent_warehouse.id if parent_warehouse else False
-                            
-                            parent_warehouse_id = parent_warehouses_cache.get(parent_location_code)
-                        
-                        # Créer l'entrepôt
-                        warehouse = self.env['stock.warehouse'].create({
-                            'name': warehouse_name,
-                            'code': wh_code[:5].upper() if wh_code else warehouse_name[:5].upper(),
-                            'company_id': self.env.company.id,
-                            'parent_id': parent_warehouse_id if parent_warehouse_id else False,
-                        })
-                    
-                    # Stocker l'emplacement de stock de l'entrepôt (lot_stock_id)
-                    warehouses_cache[warehouse_name] = warehouse.lot_stock_id.id if warehouse else False
-                
-                location_id = warehouses_cache.get(warehouse_name)
-                if not location_id:
-                    skipped += 1
-                    errors_detail.append(f"Ligne {i+2}: Entrepôt '{warehouse_name}' non trouvé")
-                    continue
-                
-                # Récupérer ou créer le produit
-                if product_code not in products_cache:
-                    product = self.env['product.product'].search([
-                        ('default_code', '=', product_code)
-                    ], limit=1)
-                    
-                    if not product and self.create_missing_products:
-                        # Récupérer ou créer l'UOM (PC → Units)
-                        uom = self._get_or_create_uom(uom_name)
-                        
-                        # Ne pas spécifier le type, laisser la valeur par défaut d'Odoo
-                        product = self.env['product.product'].create({
-                            'name': product_name or product_code,
-                            'default_code': product_code,
-                            # 'type': laissé vide pour utiliser la valeur par défaut
-                            'standard_price': standard_price,
-                            'uom_id': uom.id,
-                            'uom_po_id': uom.id,
-                        })
-                    
-                    products_cache[product_code] = product.id if product else False
-                
-                product_id = products_cache.get(product_code)
-                if not product_id:
-                    skipped += 1
-                    errors_detail.append(f"Ligne {i+2}: Produit '{product_code}' non trouvé")
-                    continue
-                
-                # Mettre à jour le prix SI l'option est cochée (en dehors du cache)
-                if self.update_product_prices and standard_price > 0:
-                    product = self.env['product.product'].browse(product_id)
-                    if product.standard_price != standard_price:
-                        product.write({'standard_price': standard_price})
-                
-                # Créer la ligne d'inventaire
-                # La quantité théorique sera calculée automatiquement par le modèle
-                line = self.env['stockex.stock.inventory.line'].create({
-                    'inventory_id': inventory.id,
-                    'product_id': product_id,
-                    'location_id': location_id,
-                    'product_qty': quantity,  # Quantité inventoriée (du CSV)
-                })
-                
-                # Forcer le recalcul de la quantité théorique
-                line._compute_theoretical_qty()
-                
-                imported += 1
-                
-                # Commit par batch tous les 500 enregistrements pour éviter timeout
-                if imported % 500 == 0:
-                    self.env.cr.commit()
-                    
-            except Exception as e:
+                warehouse_specs[warehouse_name] = {
+                    'name': warehouse_name,
+                    'code': wh_code if wh_code else warehouse_name[:5].upper(),
+                    'parent': (parent_location_code, parent_location_name),
+                    'vals': {
+                        'name': warehouse_name,
+                        'code': wh_code[:5].upper() if wh_code else warehouse_name[:5].upper(),
+                        'company_id': company.id,
+                    },
+                }
+            
+            product_rows.setdefault(product_code, {
+                'name': product_name or product_code,
+                'uom': uom_name,
+                'price': standard_price,
+            })
+            
+            rows.append({
+                'row': i + 2,
+                'product_code': product_code,
+                'warehouse': warehouse_name,
+                'quantity': quantity,
+                'price': standard_price,
+            })
+        
+        # 2) Entrepôts : recherche groupée, puis création des manquants sous leur entrepôt parent
+        warehouses = engine._map_warehouses(warehouse_specs)
+        missing = {key: spec for key, spec in warehouse_specs.items() if key not in warehouses}
+        if missing and self.create_missing_locations:
+            parents = engine._map_warehouses({
+                code: {'name': name, 'code': code, 'vals': {
+                    'name': name,
+                    'code': code[:5].upper(),
+                    'company_id': company.id,
+                }}
+                for code, name in (spec['parent'] for spec in missing.values())
+                if code and name
+            }, create=True)
+            for spec in missing.values():
+                parent = parents.get(spec['parent'][0])
+                spec['vals']['parent_id'] = parent.id if parent else False
+            warehouses.update(engine._map_warehouses(missing, create=True))
+        
+        # 3) Produits : recherche groupée par code, création des manquants par lots
+        uoms = {}
+        product_specs = {}
+        for product_code, data in product_rows.items():
+            if data['uom'] not in uoms:
+                # Récupérer ou créer l'UOM (PC → Units)
+                uoms[data['uom']] = self._get_or_create_uom(data['uom'])
+            uom = uoms[data['uom']]
+            # Ne pas spécifier le type, laisser la valeur par défaut d'Odoo
+            product_specs[product_code] = {
+                'name': data['name'],
+                'default_code': product_code,
+                'standard_price': data['price'],
+                'uom_id': uom.id,
+                'uom_po_id': uom.id,
+            }
+        products, product_errors = engine._map_products(product_specs, create=self.create_missing_products)
+        
+        # Mettre à jour le prix SI l'option est cochée (un write par prix)
+        if self.update_product_prices:
+            engine._write_grouped({
+                products[row['product_code']]: row['price']
+                for row in rows
+                if row['price'] > 0 and row['product_code'] in products
+            }, 'standard_price')
+        
+        # 4) Lignes d'inventaire créées par paquets
+        # La quantité théorique est calculée par le modèle, en une requête par paquet
+        vals_list = []
+        row_numbers = []
+        for row in rows:
+            warehouse = warehouses.get(row['warehouse'])
+            location_id = warehouse.lot_stock_id.id if warehouse else False
+            if not location_id:
+                skipped += 1
+                errors_detail.append(f"Ligne {row['row']}: Entrepôt '{row['warehouse']}' non trouvé")
+                continue
+            
+            product = products.get(row['product_code'])
+            if not product:
                 skipped += 1
-                import traceback
-                error_msg = f"Ligne {i+2}: {str(e)}"
-                errors_detail.append(error_msg)
-                _logger.error(f"{error_msg}\n{traceback.format_exc()}")
+                reason = product_errors.get(row['product_code']) or 'non trouvé'
+                errors_detail.append(f"Ligne {row['row']}: Produit '{row['product_code']}' {reason}")
+                continue
+            
+            vals_list.append({
+                'inventory_id': inventory.id,
+                'product_id': product.id,
+                'location_id': location_id,
+                'product_qty': row['quantity'],  # Quantité inventoriée (du CSV)
+            })
+            row_numbers.append(row['row'])
         
+        created_lines, line_errors = engine._create_inventory_lines(vals_list, row_numbers)
+        imported = len(created_lines)
+        skipped += len(line_errors)
+        errors_detail += line_errors
+
         # Forcer le recalcul de toutes les quantités théoriques en une seule fois
         _logger.info(f"Recalcul des quantités théoriques pour {imported} lignes...")
         inventory.line_ids._compute_theoretical_qty()
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import json
 from datetime import datetime
 from odoo import models, fields, api
 from odoo.exceptions import UserError
@@ -128,142 +127,98 @@ class ImportKoboWizard(models.TransientModel):
             </div>
             """
     
+    def _get_submission_query(self):
+        """Filtre Kobo (hors curseur _id) correspondant au mode d'import."""
+        if self.import_mode == 'date_range' and self.date_from:
+            return {
+                '_submission_time': {
+                    '$gte': self.date_from.strftime('%Y-%m-%d'),
+                    '$lte': (self.date_to or fields.Date.today()).strftime('%Y-%m-%d')
+                }
+            }
+        return {}
+    
+    def _get_submission_cursor(self):
+        """_id à partir duquel lire les soumissions (0 = depuis le début)."""
+        if self.import_mode == 'new_only':
+            return self.config_id.last_submission_id or 0
+        return 0
+    
+    def _get_resumed_inventory(self):
+        """Inventaire brouillon d'un import interrompu, repris en mode « Nouvelles soumissions »."""
+        inventory = self.config_id.import_inventory_id
+        if self.import_mode == 'new_only' and inventory.state == 'draft':
+            return inventory
+        return self.env['stockex.stock.inventory']
+    
     def action_sync_kobo(self):
-        """Synchronise avec Kobo et récupère les soumissions."""
+        """Synchronise avec Kobo et compte les soumissions à importer."""
         self.ensure_one()
         
         if not self.config_id:
             raise UserError("Veuillez sélectionner une configuration Kobo.")
         
         try:
-            import requests
-            
-            headers = {
-                'Authorization': f'Token {self.config_id.api_token}',
-                'Accept': 'application/json'
-            }
-            
-            # Récupérer les soumissions
-            url = f"{self.config_id.kobo_url}/api/v2/assets/{self.config_id.form_id}/data/?format=json"
-            
-            params = {}
-            if self.import_mode == 'new_only' and self.config_id.last_submission_id:
-                params['query'] = json.dumps({'_id': {'$gt': self.config_id.last_submission_id}})
-            elif self.import_mode == 'date_range' and self.date_from:
-                params['query'] = json.dumps({
-                    '_submission_time': {
-                        '$gte': self.date_from.strftime('%Y-%m-%d'),
-                        '$lte': (self.date_to or fields.Date.today()).strftime('%Y-%m-%d')
-                    }
-                })
-            
-            response = requests.get(url, headers=headers, params=params, timeout=30)
-            
-            if response.status_code == 200:
-                # Tolérance aux réponses non-JSON (HTML du DRF)
-                try:
-                    data = response.json()
-                except Exception:
-                    ct = response.headers.get('Content-Type') or 'n/a'
-                    preview = (response.text or '')[:300].strip()
-                    raise UserError(
-                        "Réponse non-JSON de l'API Kobo.\n"
-                        f"Content-Type: {ct}\n"
-                        f"URL testée: {url}\n"
-                        "Vérifiez l'UID, le token et que l'API renvoie bien du JSON (?format=json).\n"
-                        f"Aperçu: {preview}"
-                    )
-                submissions = data.get('results', [])
-                
-                return {
-                    'type': 'ir.actions.client',
-                    'tag': 'display_notification',
-                    'params': {
-                        'title': '✅ Synchronisation Réussie',
-                        'message': f"{len(submissions)} soumission(s) trouvée(s)",
-                        'type': 'success',
-                        'sticky': False,
-                    }
-                }
-            else:
-                raise UserError(
-                    f"Erreur lors de la synchronisation:\n"
-                    f"Code: {response.status_code}\n"
-                    f"Message: {response.text}"
-                )
-                
-        except ImportError:
-            raise UserError(
-                "Le module 'requests' n'est pas installé.\n"
-                "Installez-le avec : pip3 install requests"
-            )
+            pager = self.config_id._get_submission_pager()
+            count = pager.count(self._get_submission_cursor(), self._get_submission_query())
+        except UserError:
+            raise
         except Exception as e:
             raise UserError(f"Erreur lors de la synchronisation:\n{str(e)}")
+        
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': '✅ Synchronisation Réussie',
+                'message': f"{count} soumission(s) trouvée(s)",
+                'type': 'success',
+                'sticky': False,
+            }
+        }
     
     def action_import(self):
-        """Importe les données depuis Kobo et crée l'inventaire."""
+        """Importe les données depuis Kobo et crée l'inventaire.
+        
+        Les soumissions sont lues page par page (voir KoboSubmissionPager) et
+        chaque page est importée puis validée (commit) avec le plus grand _id
+        lu comme curseur last_submission_id : après une interruption, un import
+        « Nouvelles soumissions » reprend à la page suivante au lieu de tout relire,
+        dans l'inventaire de l'import interrompu (import_inventory_id).
+        """
         self.ensure_one()
         
         if not self.config_id:
             raise UserError("Veuillez sélectionner une configuration Kobo.")
         
         try:
-            import requests
-            
-            headers = {
-                'Authorization': f'Token {self.config_id.api_token}',
-                'Accept': 'application/json'
-            }
-            
-            # Récupérer les soumissions
-            url = f"{self.config_id.kobo_url}/api/v2/assets/{self.config_id.form_id}/data/?format=json"
-            
-            params = {}
-            if self.import_mode == 'new_only' and self.config_id.last_submission_id:
-                params['query'] = json.dumps({'_id': {'$gt': self.config_id.last_submission_id}})
-            elif self.import_mode == 'date_range' and self.date_from:
-                params['query'] = json.dumps({
-                    '_submission_time': {
-                        '$gte': self.date_from.strftime('%Y-%m-%d'),
-                        '$lte': (self.date_to or fields.Date.today()).strftime('%Y-%m-%d')
-                    }
-                })
-            
-            response = requests.get(url, headers=headers, params=params, timeout=30)
-            
-            if response.status_code != 200:
-                raise UserError(
-                    f"Erreur lors de la récupération des données:\n"
-                    f"Code: {response.status_code}\n"
-                    f"Message: {response.text}"
-                )
-            
-            try:
-                data = response.json()
-            except Exception:
-                ct = response.headers.get('Content-Type') or 'n/a'
-                preview = (response.text or '')[:300].strip()
-                raise UserError(
-                    "Réponse non-JSON de l'API Kobo.\n"
-                    f"Content-Type: {ct}\n"
-                    "Vérifiez l'UID, le token et que l'API renvoie bien du JSON (?format=json).\n"
-                    f"Aperçu: {preview}"
-                )
-            submissions = data.get('results', [])
+            pager = self.config_id._get_submission_pager()
+            inventory = self._get_resumed_inventory()
+            if inventory:
+                _logger.info(f"♻️ Reprise de l'import Kobo dans l'inventaire {inventory.name}")
+            state = self._new_submission_import_state()
             
-            if not submissions:
-                raise UserError("Aucune soumission à importer.")
-            
-            # Créer l'inventaire
-            inventory = self._create_inventory_from_submissions(submissions)
-            
-            # Mettre à jour la configuration
-            if submissions:
+            for submissions in pager.pages(self._get_submission_cursor(), self._get_submission_query()):
+                # Créer l'inventaire à la première page reçue
+                if not inventory:
+                    inventory = self._create_kobo_inventory()
+                self._import_submissions(inventory, submissions, state)
+                
+                # Mettre à jour le curseur de la configuration avec la page
                 last_id = max(s.get('_id', 0) for s in submissions)
                 self.config_id.write({
                     'last_sync': fields.Datetime.now(),
-                    'last_submission_id': last_id,
+                    'last_submission_id': max(last_id, self.config_id.last_submission_id),
+                    'import_inventory_id': inventory.id,
                 })
+                self.env.cr.commit()
+                _logger.info(f"💾 Page Kobo importée: {state['total']} soumission(s) - curseur _id {last_id}")
+            
+            if not inventory:
+                raise UserError("Aucune soumission à importer.")
+            self.config_id.import_inventory_id = False
+            
+            self._post_submission_import_summary(inventory, state)
             
             # Auto-validation si demandé
             if self.auto_validate and inventory.line_ids:
@@ -278,147 +233,95 @@ class ImportKoboWizard(models.TransientModel):
                 'target': 'current',
             }
             
-        except ImportError:
-            raise UserError(
-                "Le module 'requests' n'est pas installé.\n"
-                "Installez-le avec : pip3 install requests"
-            )
+        except UserError:
+            raise
         except Exception as e:
             _logger.error(f"Erreur import Kobo: {e}", exc_info=True)
             raise UserError(f"Erreur lors de l'import:\n{str(e)}")
     
-    def _download_kobo_attachment(self, submission, attachment_filename):
-        """Télécharge une pièce jointe depuis Kobo avec authentification.
+    def _get_kobo_attachment_url(self, submission, attachment_filename):
+        """URL de téléchargement d'une pièce jointe de la soumission.
         
         Args:
             submission: Dictionnaire de la soumission Kobo (contient _attachments)
             attachment_filename: Nom du fichier de la pièce jointe (ex: 1762608570518.jpg)
             
         Returns:
-            tuple: (file_content (bytes), filename (str)) ou (None, None) si erreur
+            str: URL de téléchargement, ou None si la pièce jointe est introuvable
         """
         if not attachment_filename:
-            return None, None
-            
-        try:
-            import requests
-            import base64
-            from PIL import Image
-            from io import BytesIO
-            
-            # Chercher l'attachment correspondant dans _attachments
-            attachments = submission.get('_attachments', [])
-            target_attachment = None
-            
-            _logger.info(f"Recherche attachment '{attachment_filename}' parmi {len(attachments)} attachments")
-            
-            for att in attachments:
-                basename = att.get('media_file_basename', '')
-                fullname = att.get('filename', '')
-                _logger.debug(f"Checking: basename={basename}, fullname={fullname}")
-                # Matcher par media_file_basename (nom de fichier uniquement)
-                if basename == attachment_filename:
-                    target_attachment = att
-                    _logger.info(f"Match trouvé par basename: {basename}")
-                    break
-                # Fallback: matcher si le filename complet contient notre nom
-                if attachment_filename in fullname:
-                    target_attachment = att
-                    _logger.info(f"Match trouvé par fullname: {fullname}")
-                    break
-            
-            if not target_attachment:
-                _logger.warning(f"Attachment {attachment_filename} non trouvé dans _attachments")
-                return None, None
-            
-            # Récupérer l'URL de téléchargement
-            download_url = target_attachment.get('download_medium_url') or target_attachment.get('download_url')
-            if not download_url:
-                _logger.warning(f"Pas d'URL de téléchargement pour {attachment_filename}")
-                return None, None
-            
-            # Headers d'authentification
-            headers = {
-                'Authorization': f'Token {self.config_id.api_token}',
-            }
-            
-            # Télécharger le fichier
-            file_response = requests.get(download_url, headers=headers, timeout=60)
-            
-            if file_response.status_code == 200:
-                # Compresser l'image si c'est une image et si la compression est activée
-                file_content = file_response.content
-                if self.config_id.compress_photos and attachment_filename.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
-                    try:
-                        # Charger l'image
-                        img = Image.open(BytesIO(file_content))
-                        
-                        # Convertir en RGB si nécessaire (pour PNG avec transparence)
-                        if img.mode in ('RGBA', 'LA', 'P'):
-                            background = Image.new('RGB', img.size, (255, 255, 255))
-                            if img.mode == 'P':
-                                img = img.convert('RGBA')
-                            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                            img = background
-                        
-                        # Redimensionner si l'image est trop grande
-                        max_dimension = self.config_id.photo_max_size or 1600
-                        if max(img.size) > max_dimension:
-                            ratio = max_dimension / max(img.size)
-                            new_size = tuple(int(dim * ratio) for dim in img.size)
-                            # Utiliser LANCZOS pour la meilleure qualité de redimensionnement
-                            img = img.resize(new_size, Image.Resampling.LANCZOS)
-                        
-                        # Compresser en JPEG avec qualité configurable et optimisations
-                        quality = max(70, min(95, self.config_id.photo_quality or 90))  # Limiter entre 70-95
-                        output = BytesIO()
-                        # optimize=True pour une compression optimale
-                        # progressive=True pour chargement progressif (meilleure expérience)
-                        img.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
-                        file_content = output.getvalue()
-                        
-                        # Changer l'extension en .jpg
-                        attachment_filename = attachment_filename.rsplit('.', 1)[0] + '.jpg'
-                        
-                        original_size = len(file_response.content) / 1024
-                        compressed_size = len(file_content) / 1024
-                        _logger.info(f"Image compressée: {attachment_filename} ({original_size:.1f}KB → {compressed_size:.1f}KB, gain: {100*(1-compressed_size/original_size):.1f}%)")
-                        
-                    except Exception as e:
-                        _logger.warning(f"Impossible de compresser {attachment_filename}: {e}")
-                        # Garder le fichier original en cas d'erreur
-                        file_content = file_response.content
-                
-                return file_content, attachment_filename
-            else:
-                _logger.warning(f"Erreur téléchargement {attachment_filename}: {file_response.status_code}")
-                return None, None
-                
-        except Exception as e:
-            _logger.error(f"Erreur lors du téléchargement de {attachment_filename}: {e}")
-            return None, None
+            return None
+        
+        # Chercher l'attachment correspondant dans _attachments
+        target_attachment = None
+        for att in submission.get('_attachments', []):
+            # Matcher par media_file_basename (nom de fichier uniquement)
+            # Fallback: matcher si le filename complet contient notre nom
+            if att.get('media_file_basename', '') == attachment_filename or attachment_filename in att.get('filename', ''):
+                target_attachment = att
+                break
+        
+        if not target_attachment:
+            _logger.warning(f"Attachment {attachment_filename} non trouvé dans _attachments")
+            return None
+        
+        # Récupérer l'URL de téléchargement
+        download_url = target_attachment.get('download_medium_url') or target_attachment.get('download_url')
+        if not download_url:
+            _logger.warning(f"Pas d'URL de téléchargement pour {attachment_filename}")
+        return download_url
     
     def _create_inventory_from_submissions(self, submissions):
-        """Crée un inventaire à partir des soumissions Kobo."""
-        # Créer l'inventaire
-        inventory = self.env['stockex.stock.inventory'].create({
+        """Crée un inventaire à partir d'une liste de soumissions Kobo."""
+        inventory = self._create_kobo_inventory()
+        state = self._new_submission_import_state()
+        self._import_submissions(inventory, submissions, state)
+        self._post_submission_import_summary(inventory, state)
+        return inventory
+    
+    def _create_kobo_inventory(self):
+        """Crée l'inventaire brouillon qui reçoit les soumissions importées."""
+        return self.env['stockex.stock.inventory'].create({
             'name': self.name,
             'date': self.date,
             'company_id': self.company_id.id,
             'user_id': self.env.user.id,
             'state': 'draft',
-            'description': f'Import Kobo Collect - {len(submissions)} soumissions\nFormulaire: {self.config_id.form_name or self.config_id.form_id}'
+            'description': f'Import Kobo Collect\nFormulaire: {self.config_id.form_name or self.config_id.form_id}'
         })
+    
+    def _new_submission_import_state(self):
+        """Caches et compteurs partagés par les pages d'un même import."""
+        return {
+            'products': {},
+            'locations': {},
+            'categories': {},
+            'total': 0,
+            'imported': 0,
+            'skipped': 0,
+            'errors': [],
+            'photos': [],
+            'photo_count': 0,
+        }
+    
+    def _import_submissions(self, inventory, submissions, state):
+        """Importe une page de soumissions Kobo dans l'inventaire.
         
+        Args:
+            inventory: stockex.stock.inventory cible
+            submissions: soumissions de la page
+            state: caches et compteurs de l'import (voir _new_submission_import_state)
+        """
         # Caches
-        products_cache = {}
-        locations_cache = {}
-        warehouses_cache = {}
-        categories_cache = {}
+        products_cache = state['products']
+        locations_cache = state['locations']
+        categories_cache = state['categories']
         
+        offset = state['total']
+        state['total'] += len(submissions)
         imported = 0
         skipped = 0
-        errors_detail = []
+        errors_detail = state['errors']
         
         # Mapping des champs depuis la configuration
         cfg = self.config_id
@@ -439,7 +342,7 @@ class ImportKoboWizard(models.TransientModel):
         field_submission_time = cfg.mapping_submission_time or '_submission_time'
         field_submission_id = cfg.mapping_submission_id or '_id'
         
-        for i, submission in enumerate(submissions):
+        for i, submission in enumerate(submissions, start=offset):
             try:
                 # Extraire les données selon le mapping
                 product_code = str(submission.get(field_product_code, '')).strip()
@@ -613,34 +516,25 @@ class ImportKoboWizard(models.TransientModel):
                         _logger.warning(f"Impossible de mettre à jour les coordonnées GPS de l'emplacement: {e}")
                 line = self.env['stockex.stock.inventory.line'].create(line_vals)
                 
-                # Télécharger et attacher les photos (si activé)
+                # Photos : téléchargées ensuite en tâche de fond (si activé)
                 photos_attached = []
-                if self.config_id.download_photos:
-                    if photo_url:
-                        file_content, filename = self._download_kobo_attachment(submission, photo_url)
-                        if file_content and filename:
-                            import base64
-                            line.write({'image_1': base64.b64encode(file_content)})
-                            size_kb = len(file_content) / 1024
-                            photos_attached.append(f"✅ Photo produit intégrée ({size_kb:.1f} KB)")
-                        else:
-                            photos_attached.append(f"⚠️ Photo produit non disponible: {photo_url}")
-                    
-                    if label_url:
-                        file_content, filename = self._download_kobo_attachment(submission, label_url)
-                        if file_content and filename:
-                            import base64
-                            line.write({'image_2': base64.b64encode(file_content)})
-                            size_kb = len(file_content) / 1024
-                            photos_attached.append(f"✅ Étiquette intégrée ({size_kb:.1f} KB)")
-                        else:
-                            photos_attached.append(f"⚠️ Étiquette non disponible: {label_url}")
-                else:
-                    # Téléchargement désactivé, stocker juste les URLs
-                    if photo_url:
-                        photos_attached.append(f"🔗 Photo produit: {photo_url}")
-                    if label_url:
-                        photos_attached.append(f"🔗 Étiquette: {label_url}")
+                for field_name, url, label in (('image_1', photo_url, 'Photo produit'), ('image_2', label_url, 'Étiquette')):
+                    if not url:
+                        continue
+                    download_url = self.config_id.download_photos and self._get_kobo_attachment_url(submission, url)
+                    if download_url:
+                        state['photos'].append({
+                            'line_id': line.id,
+                            'field': field_name,
+                            'filename': url,
+                            'url': download_url,
+                        })
+                        photos_attached.append(f"⏳ {label} en cours de téléchargement: {url}")
+                    elif self.config_id.download_photos:
+                        photos_attached.append(f"⚠️ {label} non disponible: {url}")
+                    else:
+                        # Téléchargement désactivé, stocker juste l'URL
+                        photos_attached.append(f"🔗 {label}: {url}")
                 
                 # Ajouter une note avec les informations supplémentaires
                 notes = []
@@ -667,12 +561,28 @@ class ImportKoboWizard(models.TransientModel):
                 errors_detail.append(f"Soumission {i+1}: {str(e)}")
                 _logger.error(f"Erreur import soumission {i+1}: {e}", exc_info=True)
         
+        state['imported'] += imported
+        state['skipped'] += skipped
+        
+        # Photos de la page : mises en file avec les lignes, validées dans la même transaction
+        if state['photos']:
+            self.config_id._enqueue_photo_download(inventory, state['photos'])
+            state['photo_count'] += len(state['photos'])
+            state['photos'] = []
+    
+    def _post_submission_import_summary(self, inventory, state):
+        """Publie le message de résultat de l'import sur l'inventaire."""
+        errors_detail = state['errors']
+        inventory.description = f"Import Kobo Collect - {state['total']} soumissions\nFormulaire: {self.config_id.form_name or self.config_id.form_id}"
+        
         # Message de résultat
         message = f"✅ Import Kobo terminé\n\n"
         message += f"📊 Statistiques:\n"
-        message += f"- Total soumissions: {len(submissions)}\n"
-        message += f"- ✅ Importées: {imported}\n"
-        message += f"- ⚠️ Ignorées: {skipped}\n"
+        message += f"- Total soumissions: {state['total']}\n"
+        message += f"- ✅ Importées: {state['imported']}\n"
+        message += f"- ⚠️ Ignorées: {state['skipped']}\n"
+        if state['photo_count']:
+            message += f"- 📷 Photos en cours de téléchargement: {state['photo_count']}\n"
         
         if errors_detail:
             message += f"\n⚠️ Détails des erreurs (premières 10):\n" + "\n".join(errors_detail[:10])
@@ -680,5 +590,3 @@ class ImportKoboWizard(models.TransientModel):
                 message += f"\n... et {len(errors_detail) - 10} autres erreurs"
         
         inventory.message_post(body=Markup(message))
-        
-        return inventory
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
+import tempfile
+import uuid
 from odoo import models, fields, api
 from odoo.exceptions import UserError
 
@@ -94,6 +97,30 @@ class InitialStockWizard(models.TransientModel):
              'Par défaut, les quantités sont mises à jour directement sans mouvements.'
     )
     
+    # Import parallèle par lots (file de tâches StockEx)
+    parallel_import = fields.Boolean(
+        string='⚡ Import parallèle (tâches de fond)',
+        default=False,
+        help='Crée d\'abord produits, catégories et entrepôts, puis répartit les lignes en lots '
+             'importés en parallèle par la file de tâches StockEx, chacun dans sa propre transaction.\n'
+             'Recommandé pour les très gros fichiers (plusieurs centaines d\'entrepôts).'
+    )
+    
+    shard_by = fields.Selection([
+        ('warehouse', 'Par entrepôt'),
+        ('product', 'Par code produit'),
+    ], string='Répartition des lots', default='warehouse',
+        help='Clé de répartition des lignes entre les lots (hachage). '
+             'Par code produit : lots équilibrés même si un entrepôt concentre les lignes. '
+             'Toujours par code produit lorsque des mouvements de stock sont créés.')
+    
+    shard_count = fields.Integer(
+        string='Nombre de lots',
+        default=lambda self: int(self.env['ir.config_parameter'].sudo().get_param('stockex.import_shard_count', '8') or 8),
+        help='Nombre de tâches de fond créées ; le parallélisme effectif est limité par '
+             'le paramètre « Tâches de fond simultanées »'
+    )
+    
     # Champs pour la prévisualisation
     state = fields.Selection([
         ('step1', 'Import'),
@@ -117,8 +144,12 @@ class InitialStockWizard(models.TransientModel):
         if not self.import_file:
             raise UserError("⚠️ Veuillez sélectionner un fichier Excel.")
         
-        # Parser le fichier
-        lines = self._parse_excel_file()
+        # Lire uniquement les premières lignes, le total vient des dimensions de la feuille
+        preview_rows = self.env['stockex.import.engine']._preview_rows
+        with self._open_excel() as source:
+            _logger.info(f"📄 En-têtes Excel: {source.headers}")
+            lines = [line for _row, line in source.rows(limit=preview_rows)]
+            total_lines = max(source.estimated_rows, len(lines))
         
         if not lines:
             raise UserError("⚠️ Le fichier Excel ne contient aucune donnée.")
@@ -169,13 +200,14 @@ class InitialStockWizard(models.TransientModel):
                     Prévisualisation de l'Import
                 </h2>
                 <p style="margin: 0; font-size: 14px; opacity: 0.9;">Vérifiez les données avant de créer l'inventaire</p>
+                {f'<p style="margin: 5px 0 0 0; font-size: 12px; opacity: 0.8;"><em>Statistiques calculées sur les {len(lines):,} premières lignes</em></p>' if total_lines > len(lines) else ''}
             </div>
             
             <!-- Statistiques principales -->
             <div style="display: grid; grid-template-columns: repeat(4, 1fr); gap: 20px; padding: 30px; background: #f8f9fa;">
                 <div style="background: white; padding: 20px; border-radius: 10px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); border-left: 4px solid #667eea;">
                     <div style="font-size: 32px; color: #667eea; margin-bottom: 8px;">📄</div>
-                    <div style="font-size: 28px; font-weight: bold; color: #2d3748; margin-bottom: 4px;">{len(lines):,}</div>
+                    <div style="font-size: 28px; font-weight: bold; color: #2d3748; margin-bottom: 4px;">{total_lines:,}</div>
                     <div style="font-size: 11px; color: #718096; text-transform: uppercase; letter-spacing: 0.5px;">Lignes totales</div>
                 </div>
                 
@@ -291,7 +323,7 @@ class InitialStockWizard(models.TransientModel):
         self.write({
             'state': 'step2',
             'preview_summary': summary_html,
-            'lines_count': len(lines),
+            'lines_count': total_lines,
             'warehouses_preview': ', '.join(list(warehouses)[:5]),
             'categories_preview': ', '.join(list(categories)[:5]),
         })
@@ -582,13 +614,17 @@ class InitialStockWizard(models.TransientModel):
                 "Le stock initial nécessite des données d'import."
             )
         
-        # Parser les lignes
-        lines = self._parse_excel_file()
+        # Gros fichiers : données de référence en série puis lots en tâches de fond
+        if self.parallel_import:
+            return self._action_create_initial_stock_parallel()
         
+        # Lire le fichier en flux, par paquets de stockex.import_batch_size lignes
         # La méthode _create_initial_stock_quants gère automatiquement
         # l'option create_stock_moves en interne
         _logger.info(f"📦 MODE: {'Avec mouvements de stock' if self.create_stock_moves else 'Quants directs'}")
-        created_count = self._create_initial_stock_quants(lines)
+        batch_size = self.env['stockex.import.engine']._get_batch_size()
+        with self._open_excel() as source:
+            created_count = self._create_initial_stock_quants(source.chunks(batch_size))
         
         if created_count == 0:
             raise UserError(
@@ -598,15 +634,7 @@ class InitialStockWizard(models.TransientModel):
             )
         
         # Créer un message récapitulatif
-        message = f"✅ Stock initial créé avec succès !\n\n"
-        message += f"• {created_count} enregistrement(s) de stock créé(s)\n"
-        if self.force_reset:
-            message += f"• Stocks préalablement réinitialisés (transférés vers 'Ancien stock ENEO')\n"
-        if self.create_stock_moves:
-            message += f"• Mode : Pickings/Mouvements Odoo (valorisation complète)\n"
-        else:
-            message += f"• Mode : Quants directs (rapide)\n"
-        message += f"• Date : {self.date}\n"
+        message = self._get_initial_stock_message(created_count)
         
         # Envoyer les notifications
         try:
@@ -627,56 +655,28 @@ class InitialStockWizard(models.TransientModel):
             }
         }
     
-    def _parse_excel_file(self):
-        """Parse le fichier Excel du stock initial."""
-        try:
-            from openpyxl import load_workbook
-            import base64
-            from io import BytesIO
-        except ImportError:
-            raise UserError(
-                "Le module 'openpyxl' n'est pas installé.\n"
-                "Installez-le avec: pip install openpyxl"
-            )
-        
-        file_content = base64.b64decode(self.import_file)
-        excel_file = BytesIO(file_content)
-        wb = load_workbook(excel_file, read_only=True, data_only=True)
-        
-        # Charger la feuille 'Stock Initial' en priorité, sinon la première feuille active
-        if 'Stock Initial' in wb.sheetnames:
-            ws = wb['Stock Initial']
-            _logger.info("📄 Chargement de la feuille 'Stock Initial'")
+    def _get_initial_stock_message(self, created_count):
+        """Message récapitulatif du stock initial (notifications et logs)."""
+        message = f"✅ Stock initial créé avec succès !\n\n"
+        message += f"• {created_count} enregistrement(s) de stock créé(s)\n"
+        if self.force_reset:
+            message += f"• Stocks préalablement réinitialisés (transférés vers 'Ancien stock ENEO')\n"
+        if self.create_stock_moves:
+            message += f"• Mode : Pickings/Mouvements Odoo (valorisation complète)\n"
         else:
-            ws = wb.active
-            _logger.info(f"📄 Chargement de la feuille active '{ws.title}'")
-        
-        # Lire les en-têtes
-        headers = [cell.value for cell in ws[1]]
-        _logger.info(f"📄 En-têtes Excel: {headers}")
+            message += f"• Mode : Quants directs (rapide)\n"
+        message += f"• Date : {self.date}\n"
+        return message
+    
+    def _open_excel(self):
+        """Ouvre le fichier Excel du stock initial en flux.
         
-        # Lire les données
-        lines = []
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if not any(row):
-                continue
-            
-            row_dict = {}
-            for idx, value in enumerate(row):
-                if idx < len(headers):
-                    row_dict[headers[idx]] = value if value is not None else ''
-            
-            lines.append(row_dict)
-        
-        wb.close()
-        _logger.info(f"📄 {len(lines)} lignes lues depuis Excel")
-        _logger.info(f"📄 En-têtes détectés: {headers}")
-        if len(lines) > 0:
-            _logger.info(f"📄 Première ligne: {lines[0]}")
-            _logger.info(f"📄 Clés disponibles: {list(lines[0].keys())}")
-        else:
-            _logger.warning("⚠️ Aucune ligne de données trouvée dans le fichier Excel")
-        return lines
+        La feuille 'Stock Initial' est lue en priorité, sinon la feuille active
+        (voir stockex.import.engine._open_excel).
+        """
+        return self.env['stockex.import.engine']._open_excel(
+            self, 'import_file', sheet_name='Stock Initial',
+        )
     
     def _get_or_create_warehouse(self, warehouse_name):
         """
@@ -904,280 +904,95 @@ Recherche ou crée un entrepôt.
         
         return uom
     
-    def _create_initial_stock_quants(self, lines):
-        """Crée les quants de stock initial directement (sans inventaire)."""
-        created_count = 0
-        updated_count = 0
-        errors = []
-        created_categories = set()
-        created_warehouses = set()
-        created_products = set()
-        total_lines = len(lines)
-        
-        # Cache pour améliorer les performances
-        warehouse_cache = {}
-        category_cache = {}
-        product_cache = {}
-        
-        _logger.info(f"🔍 Début création stock initial: {total_lines} lignes à traiter")
+    def _create_initial_stock_quants(self, chunks):
+        """Crée les quants de stock initial directement (sans inventaire).
+        
+        Args:
+            chunks: paquets de couples (numéro de ligne Excel, dict de la ligne),
+                lus en flux depuis le fichier (voir _open_excel)
+        
+        Chaque paquet est importé par _create_initial_stock_rows puis validé
+        (commit) : la mémoire reste bornée quelle que soit la taille du fichier.
+        """
+        stats = self._new_import_stats()
+        total_lines = 0
+        
+        _logger.info("🔍 Début création stock initial (lecture du fichier par paquets)")
         if self.incremental_update:
             _logger.info("🔄 Mode incrémental activé : mise à jour des stocks existants autorisée")
         
-        # Récupérer l'emplacement d'inventaire virtuel pour les mouvements
-        inventory_loc = None
-        if self.create_stock_moves:
-            inventory_loc = self.env.ref('stock.location_inventory', raise_if_not_found=False)
-            if not inventory_loc:
-                # Créer l'emplacement d'inventaire virtuel s'il n'existe pas
-                inventory_loc = self.env['stock.location'].create({
-                    'name': 'Inventory adjustment',
-                    'usage': 'inventory',
-                    'company_id': self.company_id.id,
-                })
-            _logger.info("📦 Mode mouvements de stock activé : les mouvements seront créés")
-        
-        for i, line_data in enumerate(lines):
-            # Commit intermédiaire tous les 500 lignes pour éviter les timeouts
-            if i > 0 and i % 500 == 0:
-                # Sauvegarder la progression
-                progress_percent = (i / total_lines) * 100
-                _logger.info(f"💾 Commit intermédiaire: {i}/{total_lines} ({progress_percent:.1f}%) - {created_count} stocks créés")
-                # Commit pour libérer la mémoire
-                self.env.cr.commit()
-                _logger.info(f"✅ Commit réussi, continuation de l'import...")
-            
-            # Afficher la progression (tous les 100 lignes)
-            if i % 100 == 0:
-                progress_percent = (i / total_lines) * 100
-                _logger.info(f"📊 Progression: {i + 1}/{total_lines} ({progress_percent:.1f}%) - {created_count} stocks créés")
-            
-            try:
-                product_code = str(line_data.get('CODE PRODUIT', '')).strip()
-                product_name = str(line_data.get('PRODUIT', '') or line_data.get('NOM PRODUIT', '')).strip()
-                category_name = str(line_data.get('CATEGORIE', '')).strip() if line_data.get('CATEGORIE') else None
-                category_code = str(line_data.get('CODE CATEGORIE', '')).strip() if line_data.get('CODE CATEGORIE') else None
-                warehouse_name = str(line_data.get('ENTREPOT', '') or line_data.get('EMPLACEMENT', '')).strip() if line_data.get('ENTREPOT') or line_data.get('EMPLACEMENT') else None
-                uom_name = str(line_data.get('UDM', '') or line_data.get('UNITE', '') or line_data.get('UM', '')).strip() if (line_data.get('UDM') or line_data.get('UNITE') or line_data.get('UM')) else None
-                
-                # Convertir en float avec gestion des valeurs vides/nulles
-                try:
-                    quantity_str = line_data.get('QUANTITE', '')
-                    quantity = float(quantity_str) if quantity_str and str(quantity_str).strip() else 0.0
-                except (ValueError, TypeError):
-                    quantity = 0.0
-                
-                try:
-                    price_str = line_data.get('PRIX UNITAIRE', '')
-                    price = float(price_str) if price_str and str(price_str).strip() else 0.0
-                except (ValueError, TypeError):
-                    price = 0.0
-                
-                if not product_code:
-                    _logger.warning(f"⚠️ Ligne {i+2}: CODE PRODUIT vide, ignorée")
-                    errors.append(f"Ligne {i+2}: CODE PRODUIT vide")
-                    continue
-                
-                if quantity <= 0:
-                    _logger.warning(f"⚠️ Ligne {i+2}: Quantité nulle ou négative ({quantity}), ignorée")
-                    errors.append(f"Ligne {i+2}: Quantité invalide ({quantity})")
-                    continue
-                
-                # Gérer l'entrepôt (avec cache)
-                if warehouse_name in warehouse_cache:
-                    warehouse = warehouse_cache[warehouse_name]
-                else:
-                    warehouse = self._get_or_create_warehouse(warehouse_name)
-                    if warehouse:
-                        warehouse_cache[warehouse_name] = warehouse
-                
-                if not warehouse:
-                    errors.append(f"Ligne {i+2}: Entrepôt '{warehouse_name}' non trouvé et création désactivée")
-                    continue
-                
-                if warehouse.name not in created_warehouses:
-                    created_warehouses.add(warehouse.name)
-                
-                # Utiliser l'emplacement stock de l'entrepôt
-                location = warehouse.lot_stock_id
-                
-                # Vérifier que l'emplacement est de type internal
-                if not location or location.usage != 'internal':
-                    _logger.error(f"❌ Ligne {i+2}: Emplacement invalide (type: {location.usage if location else 'None'})")
-                    errors.append(f"Ligne {i+2}: Emplacement invalide pour entrepôt '{warehouse.name}'")
-                    continue
-                
-                # Gérer la catégorie (avec cache)
-                category = None
-                if category_name:
-                    cache_key = f"{category_name}|{category_code}"
-                    if cache_key in category_cache:
-                        category = category_cache[cache_key]
-                    else:
-                        category = self._get_or_create_category(category_name, category_code)
-                        if category:
-                            category_cache[cache_key] = category
-                    
-                    if category and category.name not in created_categories:
-                        created_categories.add(category.name)
-                
-                # Rechercher ou créer le produit (avec cache)
-                if product_code in product_cache:
-                    product = product_cache[product_code]
-                else:
-                    product = self.env['product.product'].search([
-                        ('default_code', '=', product_code)
-                    ], limit=1)
-                    if product:
-                        product_cache[product_code] = product
-                
-                if not product:
-                    if not self.create_products:
-                        errors.append(f"Ligne {i+2}: Produit '{product_code}' non trouvé et création désactivée")
-                        continue
-                    
-                    # Créer le nouveau produit (sans prix pour éviter les erreurs de valorisation)
-                    product_vals = {
-                        'name': product_name or product_code,
-                        'default_code': product_code,
-                        # Le prix sera ajouté après création (ligne 1062-1065)
-                    }
-                    # Déterminer le champ de type selon la version (detailed_type vs type)
-                    # detailed_type volontairement non défini pour éviter les erreurs de validation
-                    
-                    if category:
-                        product_vals['categ_id'] = category.id
-                    
-                    # Gérer l'unité de mesure si spécifiée
-                    if uom_name:
-                        uom = self._get_uom_by_name(uom_name)
-                        if uom:
-                            product_vals['uom_id'] = uom.id
-                    
-                    # Créer le template produit, puis récupérer la variante
-                    tmpl_vals = dict(product_vals)
-                    # default_code appartient à la variante, pas au template
-                    default_code_val = tmpl_vals.pop('default_code', None)
-                    try:
-                        tmpl = self.env['product.template'].create(tmpl_vals)
-                    except Exception as e:
-                        if 'product.template.type' in str(e):
-                            tmpl_vals.pop('detailed_type', None)
-                            tmpl_vals.pop('type', None)
-                            tmpl = self.env['product.template'].create(tmpl_vals)
-                        else:
-                            raise
-                    product = tmpl.product_variant_id
-                    if default_code_val:
-                        product.write({'default_code': default_code_val})
-                    product_cache[product_code] = product
-                    created_products.add(product_code)
-                
-                elif category:
-                    # Mettre à jour la catégorie du produit existant si spécifiée
-                    if product.categ_id.id != category.id:
-                        product.write({'categ_id': category.id})
-                
-                # Forcer type produit = consu et suivre l'inventaire
-                pp_fields = self.env['product.product']._fields
-                try:
-                    pp_write = {}
-                    if 'type' in pp_fields and getattr(product, 'type', None) != 'consu':
-                        pp_write['type'] = 'consu'
-                    if 'is_storable' in pp_fields and getattr(product, 'is_storable', None) is False:
-                        pp_write['is_storable'] = True
-                    if pp_write:
-                        product.sudo().write(pp_write)
-                except Exception:
-                    pass
-                
-                # Mettre à jour les prix (coûtant ET vente) si fourni
-                if price > 0:
-                    tmpl_record = product.product_tmpl_id
-                    if tmpl_record:
-                        tmpl_record.write({
-                            'standard_price': price,  # Prix de revient (coût)
-                            'list_price': price,       # Prix de vente (affiché)
-                        })
-                
-                # Convertir en stockable si quantité > 0
-                tmpl = product.product_tmpl_id
-                if quantity and quantity > 0 and tmpl:
-                    tmpl_fields = self.env['product.template']._fields
-                    try:
-                        to_write = {}
-                        if 'detailed_type' in tmpl_fields and getattr(tmpl, 'detailed_type', None) != 'product':
-                            to_write['detailed_type'] = 'consu'
-                        if 'type' in tmpl_fields and getattr(tmpl, 'type', None) != 'product':
-                            to_write['type'] = 'consu'
-                        if to_write:
-                            tmpl.sudo().write(to_write)
-                            # Assurer la propagation au variant si nécessaire
-                            try:
-                                product_fields = self.env['product.product']._fields
-                                if 'type' in product_fields and getattr(product, 'type', None) != 'product':
-                                    product.sudo().write({'type': 'consu'})
-                                if 'is_storable' in product_fields and getattr(product, 'is_storable', None) is False:
-                                    product.sudo().write({'is_storable': True})
-                            except Exception:
-                                pass
-                    except Exception:
-                        pass
-                # Garde: convertir non-stockables ignorés
-                tmpl2 = product.product_tmpl_id
-                if tmpl2:
-                    tmpl_fields2 = self.env['product.template']._fields
-                    current_type = getattr(tmpl2, 'detailed_type', None) if 'detailed_type' in tmpl_fields2 else getattr(tmpl2, 'type', None)
-                    is_storable_flag = getattr(product, 'is_storable', None)
-                    allowed = (current_type == 'product') or (current_type == 'consu' and bool(is_storable_flag))
-                    if not allowed:
-                        errors.append(f"Ligne {i+2}: Produit '{product_code}' non stockable, ignoré")
-                        _logger.error(f"❌ Erreur ligne {i+2}: Produit non stockable (type={current_type}, is_storable={is_storable_flag})")
-                        continue
-                # Créer ou mettre à jour le quant
-                quant = self.env['stock.quant'].search([
-                    ('product_id', '=', product.id),
-                    ('location_id', '=', location.id),
-                    ('company_id', '=', self.company_id.id),
-                ], limit=1)
-                
-                if quant:
-                    # Le quant existe déjà, mettre à jour directement la quantité (sans action_apply_inventory)
-                    old_quantity = quant.quantity
-                    quant.write({'quantity': quantity})
-                    updated_count += 1
-                    
-                    # Créer un mouvement de stock si l'option est activée
-                    if self.create_stock_moves and inventory_loc:
-                        difference = quantity - old_quantity
-                        if difference != 0:
-                            self._create_stock_move(product, location, inventory_loc, abs(difference), difference > 0)
-                else:
-                    # Créer un nouveau quant directement (sans action_apply_inventory)
-                    quant = self.env['stock.quant'].create({
-                        'product_id': product.id,
-                        'location_id': location.id,
-                        'company_id': self.company_id.id,
-                        'quantity': quantity,
-                    })
-                    
-                    # Créer un mouvement de stock si l'option est activée
-                    if self.create_stock_moves and inventory_loc and quantity > 0:
-                        self._create_stock_move(product, location, inventory_loc, quantity, True)
-                
-                created_count += 1
-                
-            except Exception as e:
-                errors.append(f"Ligne {i+2}: {str(e)}")
-                _logger.error(f"❌ Erreur ligne {i+2}: {str(e)}")
+        inventory_loc = self._get_inventory_adjustment_location()
+        
+        for rows in chunks:
+            total_lines += len(rows)
+            self._create_initial_stock_rows(rows, inventory_loc, stats)
+            # Commit intermédiaire après chaque paquet pour éviter les timeouts
+            self.env.cr.commit()
+            _logger.info(f"💾 Commit intermédiaire: {total_lines} lignes lues - {stats['created']} stocks traités")
+        
+        return self._finish_initial_stock_import(self._merge_import_stats({}, stats))
+    
+    def _get_inventory_adjustment_location(self):
+        """Emplacement d'inventaire virtuel des mouvements, ou None sans mouvements."""
+        if not self.create_stock_moves:
+            return None
+        inventory_loc = self.env.ref('stock.location_inventory', raise_if_not_found=False)
+        if not inventory_loc:
+            # Créer l'emplacement d'inventaire virtuel s'il n'existe pas
+            inventory_loc = self.env['stock.location'].create({
+                'name': 'Inventory adjustment',
+                'usage': 'inventory',
+                'company_id': self.company_id.id,
+            })
+        _logger.info("📦 Mode mouvements de stock activé : les mouvements seront créés")
+        return inventory_loc
+    
+    def _new_import_stats(self):
+        """Compteurs d'import remplis par _create_initial_stock_rows."""
+        return {
+            'created': 0,
+            'updated': 0,
+            'errors': [],
+            'categories': set(),
+            'warehouses': set(),
+            'products': set(),
+        }
+    
+    def _merge_import_stats(self, total, stats):
+        """Ajoute des compteurs (d'un paquet ou d'un lot) à un total sérialisable en JSON.
+        
+        Le total garde le nombre de produits créés et les 50 premières erreurs,
+        pour rester de taille bornée dans le résultat des tâches de fond.
+        """
+        total = dict(total or {})
+        total['created'] = total.get('created', 0) + stats.get('created', 0)
+        total['updated'] = total.get('updated', 0) + stats.get('updated', 0)
+        total['product_count'] = total.get('product_count', 0) + stats.get('product_count', len(stats.get('products', ())))
+        total['error_count'] = total.get('error_count', 0) + stats.get('error_count', len(stats.get('errors', ())))
+        total['errors'] = (total.get('errors', []) + list(stats.get('errors', [])))[:50]
+        for key in ('categories', 'warehouses'):
+            total[key] = sorted(set(total.get(key, [])) | set(stats.get(key, [])))
+        return total
+    
+    def _finish_initial_stock_import(self, total):
+        """Termine l'import : progression à 100 %, commit final et récapitulatif dans les logs.
+        
+        Args:
+            total: compteurs cumulés (voir _merge_import_stats)
+        
+        Returns:
+            nombre de stocks traités
+        """
+        created_count = total.get('created', 0)
+        updated_count = total.get('updated', 0)
         
         _logger.info(f"✅ Import terminé: {created_count} stock(s) traité(s) ({created_count - updated_count} créés, {updated_count} mis à jour)")
         
-        # Progression à 100% - Commit final unique
+        # Progression à 100% - Commit final
         self.write({
             'progress': 100.0,
             'progress_message': f'Import terminé : {created_count} stock(s) traité(s)'
         })
-        # Un seul commit à la fin pour éviter de fermer le curseur en cours de traitement
         self.env.cr.commit()
         _logger.info("💾 Commit final effectué")
         
@@ -1185,21 +1000,457 @@ Recherche ou crée un entrepôt.
         message = f"✅ {created_count} stock(s) traité(s)"
         if updated_count > 0:
             message += f" (🔄 {updated_count} mis à jour, ➕ {created_count - updated_count} créés)"
-        if created_products:
-            message += f"\n📦 {len(created_products)} produit(s) créé(s)"
-        if created_warehouses:
-            message += f"\n🏭 {len(created_warehouses)} entrepôt(s): {', '.join(sorted(created_warehouses))}"
-        if created_categories:
-            message += f"\n📁 {len(created_categories)} catégorie(s): {', '.join(sorted(created_categories))}"
-        if errors:
-            message += f"\n⚠️ {len(errors)} ligne(s) ignorée(s)"
-            for error in errors[:20]:
+        if total.get('product_count'):
+            message += f"\n📦 {total['product_count']} produit(s) créé(s)"
+        if total.get('warehouses'):
+            message += f"\n🏭 {len(total['warehouses'])} entrepôt(s): {', '.join(total['warehouses'])}"
+        if total.get('categories'):
+            message += f"\n📁 {len(total['categories'])} catégorie(s): {', '.join(total['categories'])}"
+        if total.get('error_count'):
+            message += f"\n⚠️ {total['error_count']} ligne(s) ignorée(s)"
+            for error in total.get('errors', [])[:20]:
                 _logger.warning(f"  - {error}")
         
         _logger.info(message)
         
         return created_count
     
+    # ------------------------------------------------------------------
+    # Import parallèle par lots (file de tâches StockEx)
+    # ------------------------------------------------------------------
+    
+    def _get_shard_key(self, line_data):
+        """Clé de répartition d'une ligne en lots : entrepôt ou code produit."""
+        if self.shard_by == 'product':
+            return str(line_data.get('CODE PRODUIT', '')).strip()
+        return str(line_data.get('ENTREPOT', '') or line_data.get('EMPLACEMENT', '')).strip()
+    
+    def _action_create_initial_stock_parallel(self):
+        """Import parallèle : données de référence en série, puis lots en tâches de fond.
+        
+        1. Phase série : une lecture du fichier crée une seule fois entrepôts,
+           catégories et produits (et met à jour prix et catégories), ce qui évite
+           les conflits de clés uniques entre lots concurrents.
+        2. Les lignes sont réparties en shard_count lots par hachage de l'entrepôt
+           ou du code produit : deux lots n'écrivent jamais le même quant.
+           Avec création de mouvements, la répartition se fait toujours par
+           produit : la validation des mouvements met à jour l'instantané
+           produit (stockex_product_snapshot, une ligne par produit et société),
+           que des lots par entrepôt se disputeraient.
+           Chaque lot est une tâche stockex.job exécutée dans son propre curseur.
+           Les lignes d'un lot sont écrites pendant la phase série dans une
+           pièce jointe de sa tâche : les lots ne relisent pas le classeur.
+        3. Une tâche de synthèse fusionne les résultats des lots de cette
+           exécution (identifiant run, commun à ses tâches).
+        """
+        self.ensure_one()
+        engine = self.env['stockex.import.engine']
+        Job = self.env['stockex.job']
+        shard_count = max(1, self.shard_count)
+        if self.create_stock_moves and self.shard_by != 'product':
+            self.shard_by = 'product'
+        
+        _logger.info(f"⚡ Import parallèle: préparation des données de référence ({shard_count} lots)")
+        run = uuid.uuid4().hex
+        stats = self._new_import_stats()
+        shard_files = [tempfile.TemporaryFile() for _shard in range(shard_count)]
+        try:
+            with self._open_excel() as source:
+                for rows in source.chunks(engine._get_batch_size()):
+                    self._create_initial_stock_rows(rows, None, stats, with_stock=False)
+                    self.env.cr.commit()
+                    # Répartition des lignes en lots, une seule fois (une ligne JSON par ligne Excel)
+                    for row_number, line_data in rows:
+                        shard = engine._shard_index(self._get_shard_key(line_data), shard_count)
+                        shard_files[shard].write(json.dumps([row_number, line_data], default=str).encode('utf-8') + b'\n')
+            # Les erreurs de lignes sont comptées par les lots, pas par la phase série
+            master = self._merge_import_stats({}, dict(stats, errors=[]))
+            
+            Attachment = self.env['ir.attachment'].sudo()
+            for shard, shard_file in enumerate(shard_files):
+                shard_file.seek(0)
+                attachment = Attachment.create({
+                    'name': f"stockex-job-input:{self._name}:{Job._get_res_id(self)}:{run}:lot-{shard}",
+                    'res_model': Job._name,
+                    'raw': shard_file.read(),
+                })
+                job = Job._enqueue(
+                    self, '_job_import_initial_stock_shard',
+                    job_type='initial_stock_import',
+                    name=f"Stock initial {self.name} - lot {shard + 1}/{shard_count}",
+                    args={'shard': shard, 'shard_count': shard_count, 'run': run, 'rows_file': attachment.id},
+                )
+                attachment.write({'res_id': job.id})
+        finally:
+            for shard_file in shard_files:
+                shard_file.close()
+        Job._enqueue(
+            self, '_job_finish_initial_stock',
+            job_type='initial_stock_import',
+            name=f"Stock initial {self.name} - synthèse",
+            args={'master': master, 'run': run},
+            priority=50,
+        )
+        self.write({'progress_message': f'Import parallèle planifié : {shard_count} lot(s)'})
+        self.env.cr.commit()
+        
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': '⏳ Import parallèle planifié',
+                'message': (
+                    f"{master['product_count']} produit(s) créé(s). Les quants sont importés "
+                    f"en arrière-plan par {shard_count} tâche(s) de fond."
+                ),
+                'type': 'info',
+                'sticky': False,
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }
+    
+    def _job_import_initial_stock_shard(self, job, shard, shard_count, run, rows_file):
+        """Tâche de fond : importe les lignes du lot shard (sur shard_count).
+        
+        Les lignes du lot sont lues dans la pièce jointe rows_file, préparée
+        par la phase série. Les données de référence existent déjà : le lot ne
+        fait que les lire, puis écrit ses quants. Chaque paquet est validé avec un
+        point de contrôle (dernière ligne Excel traitée) et les compteurs du lot
+        sont cumulés dans le résultat de la tâche ; une reprise repart de là.
+        """
+        self.ensure_one()
+        engine = self.env['stockex.import.engine']
+        inventory_loc = self._get_inventory_adjustment_location()
+        total = json.loads(job.result or '{}')
+        checkpoint = job.checkpoint
+        
+        raw = self.env['ir.attachment'].sudo().browse(rows_file).raw or b''
+        lines = [
+            (row_number, line_data)
+            for row_number, line_data in map(json.loads, raw.splitlines())
+            if row_number > checkpoint
+        ]
+        for rows in engine._chunks(lines):
+            stats = self._new_import_stats()
+            self._create_initial_stock_rows(rows, inventory_loc, stats, with_master_data=False)
+            total = self._merge_import_stats(total, stats)
+            total['lines'] = total.get('lines', 0) + len(rows)
+            job.sudo().write({'result': json.dumps(total)})
+            job._update_progress(done=total['lines'], checkpoint=rows[-1][0])
+            self.env.cr.commit()
+        
+        _logger.info(f"✅ Lot {shard + 1}/{shard_count}: {total.get('created', 0)} stock(s) traité(s)")
+    
+    def _job_finish_initial_stock(self, job, master, run):
+        """Tâche de fond : fusionne les résultats des lots de l'exécution run une fois tous terminés."""
+        self.ensure_one()
+        Job = self.env['stockex.job'].sudo()
+        shard_jobs = Job.search([
+            ('res_model', '=', self._name),
+            ('res_id', '=', Job._get_res_id(self)),
+            ('method', '=', '_job_import_initial_stock_shard'),
+            ('args', 'like', f'"run": "{run}"'),
+        ])
+        if any(shard_job.state in ('pending', 'running') for shard_job in shard_jobs):
+            # Lots encore en cours : nouvelle vérification au prochain passage du cron
+            Job._enqueue(
+                self, '_job_finish_initial_stock',
+                job_type='initial_stock_import',
+                name=job.name,
+                args={'master': master, 'run': run},
+                priority=job.priority,
+            )
+            return
+        
+        total = dict(master)
+        for shard_job in shard_jobs:
+            total = self._merge_import_stats(total, json.loads(shard_job.result or '{}'))
+            if shard_job.state != 'done':
+                total['errors'] = [f"{shard_job.name} : {dict(shard_job._fields['state'].selection).get(shard_job.state)}"] + total['errors']
+                total['error_count'] += 1
+        
+        created_count = self._finish_initial_stock_import(total)
+        message = self._get_initial_stock_message(created_count)
+        try:
+            self._send_notifications(created_count, message)
+        except Exception as notif_error:
+            _logger.error(f"❌ Erreur lors de l'envoi des notifications : {str(notif_error)}")
+        _logger.info(message)
+    
+    def _create_initial_stock_rows(self, lines, inventory_loc, stats, with_master_data=True, with_stock=True):
+        """Importe un paquet de lignes du stock initial.
+        
+        Les lignes sont analysées en une passe, puis entrepôts, catégories,
+        produits et quants sont résolus en masse par stockex.import.engine ;
+        les nouveaux quants et les mouvements sont créés par paquets.
+        
+        Args:
+            lines: liste de couples (numéro de ligne Excel, dict de la ligne)
+            inventory_loc: emplacement d'inventaire virtuel (mouvements) ou None
+            stats: compteurs cumulés de l'import, mis à jour sur place
+            with_master_data: créer et mettre à jour entrepôts, catégories et
+                produits (False : données de référence déjà préparées, simple lecture)
+            with_stock: créer ou mettre à jour les quants
+        """
+        engine = self.env['stockex.import.engine']
+        updated_count = 0
+        errors = stats['errors']
+        created_categories = stats['categories']
+        created_warehouses = stats['warehouses']
+        created_products = stats['products']
+        
+        # 1) Une passe sur le paquet : valeurs nettoyées et données de référence à résoudre
+        rows = []
+        for row_number, line_data in lines:
+            product_code = str(line_data.get('CODE PRODUIT', '')).strip()
+            product_name = str(line_data.get('PRODUIT', '') or line_data.get('NOM PRODUIT', '')).strip()
+            category_name = str(line_data.get('CATEGORIE', '')).strip() if line_data.get('CATEGORIE') else None
+            category_code = str(line_data.get('CODE CATEGORIE', '')).strip() if line_data.get('CODE CATEGORIE') else None
+            warehouse_name = str(line_data.get('ENTREPOT', '') or line_data.get('EMPLACEMENT', '')).strip() if line_data.get('ENTREPOT') or line_data.get('EMPLACEMENT') else None
+            uom_name = str(line_data.get('UDM', '') or line_data.get('UNITE', '') or line_data.get('UM', '')).strip() if (line_data.get('UDM') or line_data.get('UNITE') or line_data.get('UM')) else None
+            
+            # Convertir en float avec gestion des valeurs vides/nulles
+            try:
+                quantity_str = line_data.get('QUANTITE', '')
+                quantity = float(quantity_str) if quantity_str and str(quantity_str).strip() else 0.0
+            except (ValueError, TypeError):
+                quantity = 0.0
+            
+            try:
+                price_str = line_data.get('PRIX UNITAIRE', '')
+                price = float(price_str) if price_str and str(price_str).strip() else 0.0
+            except (ValueError, TypeError):
+                price = 0.0
+            
+            if not product_code:
+                _logger.warning(f"⚠️ Ligne {row_number}: CODE PRODUIT vide, ignorée")
+                errors.append(f"Ligne {row_number}: CODE PRODUIT vide")
+                continue
+            
+            if quantity <= 0:
+                _logger.warning(f"⚠️ Ligne {row_number}: Quantité nulle ou négative ({quantity}), ignorée")
+                errors.append(f"Ligne {row_number}: Quantité invalide ({quantity})")
+                continue
+            
+            rows.append({
+                'row': row_number,
+                'product_code': product_code,
+                'product_name': product_name,
+                'category': (category_name, category_code) if category_name else None,
+                'warehouse': warehouse_name,
+                'uom': uom_name,
+                'quantity': quantity,
+                'price': price,
+            })
+        
+        # 2) Entrepôts : recherche groupée par nom, création des manquants avec un code unique
+        warehouse_names = {row['warehouse'] for row in rows}
+        warehouses = engine._map_warehouses(
+            {name: {'name': name} for name in warehouse_names if name},
+            company=self.company_id,
+        )
+        for name in warehouse_names:
+            if name not in warehouses and (with_master_data or not name):
+                warehouses[name] = self._get_or_create_warehouse(name)
+        
+        # 3) Catégories : recherche groupée par nom, création unitaire des manquantes (code éventuel)
+        category_keys = {row['category'] for row in rows if row['category']}
+        found = engine._map_categories({name for name, _code in category_keys})
+        categories = {}
+        for name, code in category_keys:
+            categories[(name, code)] = found.get(name) or (with_master_data and self._get_or_create_category(name, code))
+            if categories[(name, code)]:
+                found[name] = categories[(name, code)]
+                created_categories.add(categories[(name, code)].name)
+        
+        # 4) Produits : recherche groupée par code, création des manquants par lots
+        product_specs = {}
+        uoms = {}
+        for row in rows:
+            if row['product_code'] in product_specs:
+                continue
+            # Créer le nouveau produit (sans prix pour éviter les erreurs de valorisation)
+            product_vals = {
+                'name': row['product_name'] or row['product_code'],
+                'default_code': row['product_code'],
+            }
+            category = categories.get(row['category'])
+            if category:
+                product_vals['categ_id'] = category.id
+            # Gérer l'unité de mesure si spécifiée
+            if row['uom']:
+                if row['uom'] not in uoms:
+                    uoms[row['uom']] = self._get_uom_by_name(row['uom'])
+                if uoms[row['uom']]:
+                    product_vals['uom_id'] = uoms[row['uom']].id
+            product_specs[row['product_code']] = product_vals
+        
+        products, _errors = engine._map_products(product_specs)
+        existing = dict(products)
+        missing = {code: vals for code, vals in product_specs.items() if code not in products}
+        product_errors = {}
+        if missing and self.create_products and with_master_data:
+            created, product_errors = engine._map_products(missing, create=True)
+            products.update(created)
+            created_products.update(created)
+        
+        all_products = self.env['product.product'].concat(*products.values())
+        if with_master_data:
+            # Mettre à jour la catégorie des produits existants si spécifiée
+            engine._write_grouped({
+                existing[row['product_code']]: categories[row['category']].id
+                for row in rows
+                if row['product_code'] in existing and categories.get(row['category'])
+            }, 'categ_id')
+            
+            # Forcer type produit = consu et suivre l'inventaire
+            try:
+                engine._ensure_storable(all_products)
+            except Exception as e:
+                _logger.warning(f"⚠️ Conversion en produits stockables impossible: {e}")
+            
+            # Mettre à jour les prix (coûtant ET vente) si fourni, un write par prix
+            template_prices = {
+                products[row['product_code']].product_tmpl_id: row['price']
+                for row in rows
+                if row['price'] > 0 and row['product_code'] in products
+            }
+            engine._write_grouped(template_prices, 'standard_price')  # Prix de revient (coût)
+            engine._write_grouped(template_prices, 'list_price')  # Prix de vente (affiché)
+        
+        if not with_stock:
+            return
+        
+        # Garde: ignorer les produits non stockables
+        tmpl_fields = self.env['product.template']._fields
+        storable = set()
+        for product in all_products:
+            tmpl = product.product_tmpl_id
+            current_type = tmpl.detailed_type if 'detailed_type' in tmpl_fields else tmpl.type
+            if current_type == 'product' or (current_type == 'consu' and bool(getattr(product, 'is_storable', None))):
+                storable.add(product.id)
+        
+        # 5) Quantités : une valeur par couple produit/emplacement (la dernière ligne l'emporte)
+        targets = {}
+        for row in rows:
+            warehouse = warehouses.get(row['warehouse'])
+            if not warehouse:
+                errors.append(f"Ligne {row['row']}: Entrepôt '{row['warehouse']}' non trouvé et création désactivée")
+                continue
+            created_warehouses.add(warehouse.name)
+            
+            # Utiliser l'emplacement stock de l'entrepôt (de type internal)
+            location = warehouse.lot_stock_id
+            if not location or location.usage != 'internal':
+                _logger.error(f"❌ Ligne {row['row']}: Emplacement invalide (type: {location.usage if location else 'None'})")
+                errors.append(f"Ligne {row['row']}: Emplacement invalide pour entrepôt '{warehouse.name}'")
+                continue
+            
+            product = products.get(row['product_code'])
+            if not product:
+                if row['product_code'] in product_errors:
+                    errors.append(f"Ligne {row['row']}: {product_errors[row['product_code']]}")
+                else:
+                    errors.append(f"Ligne {row['row']}: Produit '{row['product_code']}' non trouvé et création désactivée")
+                continue
+            
+            if product.id not in storable:
+                errors.append(f"Ligne {row['row']}: Produit '{row['product_code']}' non stockable, ignoré")
+                continue
+            
+            targets[(product.id, location.id)] = (product, location, row['quantity'])
+        
+        # 6) Quants existants mis à jour, nouveaux quants créés par paquets
+        quants = engine._map_quants(targets, self.company_id)
+        moves = []
+        existing_quants = {}
+        new_quants = []
+        for key, (product, location, quantity) in targets.items():
+            quant = quants.get(key)
+            if quant:
+                # Le quant existe déjà, mettre à jour directement la quantité (sans action_apply_inventory)
+                existing_quants[self.env['stock.quant'].browse(quant['id'])] = quantity
+                updated_count += 1
+                difference = quantity - quant['quantity']
+                if difference:
+                    moves.append((product, location, abs(difference), difference > 0))
+            else:
+                # Créer un nouveau quant directement (sans action_apply_inventory)
+                new_quants.append((key, {
+                    'product_id': product.id,
+                    'location_id': location.id,
+                    'company_id': self.company_id.id,
+                    'quantity': quantity,
+                }))
+                moves.append((product, location, quantity, True))
+        
+        engine._write_grouped(existing_quants, 'quantity')
+        _created, quant_errors = engine._create_batched(
+            'stock.quant', [vals for _key, vals in new_quants], [key for key, _vals in new_quants]
+        )
+        product_codes = {product.id: product.default_code for product in all_products}
+        for (product_id, _location_id), error in quant_errors.items():
+            errors.append(f"Produit '{product_codes.get(product_id)}': {error}")
+        created_count = len(targets) - len(quant_errors)
+        
+        # Créer les mouvements de stock si l'option est activée
+        if self.create_stock_moves and inventory_loc:
+            self._create_stock_moves(moves, inventory_loc)
+        
+        stats['created'] += created_count
+        stats['updated'] += updated_count
+    
+    def _create_stock_moves(self, moves, inventory_loc):
+        """Crée et valide les mouvements de stock initial par paquets.
+        
+        Args:
+            moves: liste de tuples (produit, emplacement, quantité, entrée ?)
+            inventory_loc: L'emplacement d'inventaire virtuel
+        """
+        engine = self.env['stockex.import.engine']
+        for batch in engine._chunks(moves):
+            try:
+                with self.env.cr.savepoint():
+                    stock_moves = self.env['stock.move'].create([
+                        self._prepare_stock_move_vals(product, location, inventory_loc, quantity, is_incoming)
+                        for product, location, quantity, is_incoming in batch
+                    ])
+                    stock_moves._action_confirm()
+                    stock_moves._action_assign()
+                    stock_moves._action_done()
+                _logger.info(f"📦 {len(stock_moves)} mouvement(s) de stock créé(s)")
+            except Exception as e:
+                _logger.warning(f"⚠️ Création groupée des mouvements en échec ({e}), reprise unitaire")
+                for product, location, quantity, is_incoming in batch:
+                    self._create_stock_move(product, location, inventory_loc, quantity, is_incoming)
+    
+    def _prepare_stock_move_vals(self, product, location, inventory_loc, quantity, is_incoming):
+        """Valeurs du mouvement d'ajustement de stock initial."""
+        move_vals = {
+            'name': f'Stock Initial - {product.display_name}',
+            'product_id': product.id,
+            'product_uom': product.uom_id.id,
+            'product_uom_qty': quantity,
+            'company_id': self.company_id.id,
+            'date': self.date or fields.Datetime.now(),
+            'origin': f'Stock Initial {self.name}',
+            'reference': f'Ajustement stock initial {self.name}',
+        }
+        
+        # Si c'est une entrée : depuis inventory vers location
+        # Si c'est une sortie : depuis location vers inventory
+        if is_incoming:
+            move_vals.update({
+                'location_id': inventory_loc.id,
+                'location_dest_id': location.id,
+            })
+        else:
+            move_vals.update({
+                'location_id': location.id,
+                'location_dest_id': inventory_loc.id,
+            })
+        return move_vals
+    
     def _create_stock_move(self, product, location, inventory_loc, quantity, is_incoming):
         """Crée un mouvement de stock pour l'import initial.
         
@@ -1211,35 +1462,11 @@ Recherche ou crée un entrepôt.
             is_incoming: True si c'est une entrée de stock, False si c'est une sortie
         """
         try:
-            StockMove = self.env['stock.move']
-            
             # Créer un stock.move pour l'ajustement
-            move_vals = {
-                'name': f'Stock Initial - {product.display_name}',
-                'product_id': product.id,
-                'product_uom': product.uom_id.id,
-                'product_uom_qty': quantity,
-                'company_id': self.company_id.id,
-                'date': self.date or fields.Datetime.now(),
-                'origin': f'Stock Initial {self.name}',
-                'reference': f'Ajustement stock initial {self.name}',
-            }
-            
-            # Si c'est une entrée : depuis inventory vers location
-            # Si c'est une sortie : depuis location vers inventory
-            if is_incoming:
-                move_vals.update({
-                    'location_id': inventory_loc.id,
-                    'location_dest_id': location.id,
-                })
-            else:
-                move_vals.update({
-                    'location_id': location.id,
-                    'location_dest_id': inventory_loc.id,
-                })
+            move_vals = self._prepare_stock_move_vals(product, location, inventory_loc, quantity, is_incoming)
             
             # Créer et valider le mouvement
-            move = StockMove.create(move_vals)
+            move = self.env['stock.move'].create(move_vals)
             move._action_confirm()
             move._action_assign()
             move._action_done()
@@ -51,6 +51,12 @@ class StockDataCleanupWizard(models.TransientModel):
         help='Active toutes les options de suppression'
     )
     
+    run_in_background = fields.Boolean(
+        string='⏳ Exécuter en arrière-plan',
+        default=False,
+        help='Confie le nettoyage à la file de tâches StockEx au lieu de bloquer l\'écran'
+    )
+    
     # Confirmation de sécurité
     confirmation_text = fields.Char(
         string='Confirmation',
@@ -149,6 +155,33 @@ class StockDataCleanupWizard(models.TransientModel):
         self._check_at_least_one_option()
         self._check_confirmation()
         
+        if self.run_in_background:
+            job = self.env['stockex.job']._enqueue(
+                self, '_job_cleanup',
+                job_type='cleanup',
+                name='Nettoyage des données de stock',
+                max_attempts=1,
+            )
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': '⏳ Nettoyage planifié',
+                    'message': f'Le nettoyage sera exécuté en arrière-plan (tâche #{job.id}).',
+                    'type': 'info',
+                    'sticky': False,
+                }
+            }
+        
+        return self._do_cleanup()
+    
+    def _job_cleanup(self, job):
+        """Tâche de fond : nettoyage selon les options copiées avec la tâche (voir stockex.job)."""
+        self.ensure_one()
+        self._do_cleanup()
+    
+    def _do_cleanup(self):
+        """Supprime les données sélectionnées et notifie (Telegram, e-mail)."""
         deleted_counts = {
             'products': 0,
             'categories': 0,
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+
+class VarianceDailyRebuildWizard(models.TransientModel):
+    _name = 'stockex.variance.daily.rebuild.wizard'
+    _description = 'Assistant de Reconstruction des Statistiques d\'Écarts'
+
+    date_from = fields.Date(
+        string='Date Début',
+        help='Laisser vide pour reconstruire depuis le premier inventaire'
+    )
+    date_to = fields.Date(
+        string='Date Fin',
+        help='Laisser vide pour reconstruire jusqu\'au dernier inventaire'
+    )
+    fact_count = fields.Integer(
+        string='Lignes de Statistiques',
+        compute='_compute_fact_count'
+    )
+
+    @api.depends('date_from', 'date_to')
+    def _compute_fact_count(self):
+        """Nombre de lignes de statistiques actuellement couvertes par la plage."""
+        Fact = self.env['stockex.variance.daily'].sudo()
+        for wizard in self:
+            domain = []
+            if wizard.date_from:
+                domain.append(('date', '>=', wizard.date_from))
+            if wizard.date_to:
+                domain.append(('date', '<=', wizard.date_to))
+            wizard.fact_count = Fact.search_count(domain)
+
+    def action_rebuild(self):
+        """Reconstruit la table stockex.variance.daily sur la plage choisie."""
+        self.ensure_one()
+        if self.date_from and self.date_to and self.date_from > self.date_to:
+            raise UserError("La date de début doit être antérieure à la date de fin.")
+
+        count = self.env['stockex.variance.daily'].sudo()._rebuild(self.date_from, self.date_to)
+        self.env['stockex.inventory.dashboard']._invalidate_dashboard_cache()
+        _logger.info(f"📊 Reconstruction des statistiques d'écarts par {self.env.user.name}: {count} ligne(s)")
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': '📊 Statistiques reconstruites',
+                'message': f"{count} ligne(s) de statistiques d'écarts recalculée(s).",
+                'type': 'success',
+                'sticky': False,
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }